@@ -0,0 +1,181 @@
+"""
+Local Docker daemon's stand-in: threaded HTTP server on a unix socket which understands
+the subset of Engine API used by `src.docker_api` (exec's create / start / inspect).
+Exec's commands are run on the host (PATH can be prefixed by the directory with fake
+`pg_dump`, `psql`, etc.), their output is sent as multiplexed stdout / stderr frames.
+"""
+
+import os
+import json
+import shutil
+import struct
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from socketserver import ThreadingUnixStreamServer
+
+FRAME_HEADER = struct.Struct(">BxxxL")
+STDOUT, STDERR = 1, 2
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """Handles Engine API's requests (exec sessions only)"""
+
+    protocol_version = "HTTP/1.1"
+    server: "FakeDockerServer"
+
+    def address_string(self) -> str:
+        return "unix-socket"
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def do_POST(self) -> None:
+        parts = self.path.strip("/").split("/")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or "{}")
+        if len(parts) == 3 and parts[0] == "containers" and parts[2] == "exec":
+            self._create_exec(parts[1], body)
+        elif len(parts) == 3 and parts[0] == "exec" and parts[2] == "start":
+            self._start_exec(parts[1])
+        else:
+            self._send_json(404, {"message": "page not found"})
+
+    def do_GET(self) -> None:
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "exec" and parts[2] == "json":
+            if not (state := self.server.execs.get(parts[1])):
+                self._send_json(404, {"message": f"No such exec instance: {parts[1]}"})
+                return
+
+            self._send_json(
+                200,
+                {"Running": state["running"], "ExitCode": state["exit_code"], "Pid": state["pid"]},
+            )
+        else:
+            self._send_json(404, {"message": "page not found"})
+
+    def _create_exec(self, container: str, config: dict) -> None:
+        if container not in self.server.containers:
+            self._send_json(404, {"message": f"No such container: {container}"})
+            return
+
+        exec_id = os.urandom(16).hex()
+        self.server.execs[exec_id] = {
+            "container": container,
+            "config": config,
+            "running": False,
+            "exit_code": None,
+            "pid": 0,
+        }
+        self._send_json(201, {"Id": exec_id})
+
+    def _start_exec(self, exec_id: str) -> None:
+        if not (state := self.server.execs.get(exec_id)):
+            self._send_json(404, {"message": f"No such exec instance: {exec_id}"})
+            return
+
+        config = state["config"]
+        env = {**os.environ, **dict(item.split("=", 1) for item in config.get("Env", []))}
+        if self.server.bin_dir:
+            env["PATH"] = f"{self.server.bin_dir}{os.pathsep}{env['PATH']}"
+
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            config["Cmd"],
+            stdin=subprocess.PIPE if config.get("AttachStdin") else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=config.get("WorkingDir"),
+        )
+        state.update(running=True, pid=process.pid)
+        self.server.commands.append(config["Cmd"])
+        self.send_response(101)
+        self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Upgrade", "tcp")
+        self.end_headers()
+        self.wfile.flush()
+
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self._send_frames, args=(process, stream, name, lock))
+            for stream, name in ((process.stdout, STDOUT), (process.stderr, STDERR))
+        ]
+        if config.get("AttachStdin"):
+            threads.append(threading.Thread(target=self._feed_stdin, args=(process,), daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads[:2]:
+            thread.join()
+
+        state["exit_code"] = process.wait()
+        state["running"] = False
+        self.close_connection = True
+
+    def _send_frames(self, process, stream, name: int, lock: threading.Lock) -> None:
+        while chunk := stream.read1(64 * 1024):
+            try:
+                with lock:
+                    self.wfile.write(FRAME_HEADER.pack(name, len(chunk)) + chunk)
+                    self.wfile.flush()
+            except OSError:
+                # client closed the session: the command is stopped (as by the real daemon)
+                process.kill()
+                break
+
+    def _feed_stdin(self, process) -> None:
+        try:
+            while chunk := self.rfile.read1(64 * 1024):
+                process.stdin.write(chunk)
+
+        except OSError:
+            pass
+
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def _send_json(self, status: int, content: dict) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeDockerServer(ThreadingUnixStreamServer):
+    """Docker daemon's stand-in which is served in the background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, containers: tuple[str, ...] = ("postgres",), bin_dir: Path | None = None):
+        # short path: unix socket's path is limited by ~100 chars
+        self._socket_dir = tempfile.mkdtemp(prefix="fake-docker-")
+        self.socket_path = os.path.join(self._socket_dir, "docker.sock")
+        super().__init__(self.socket_path, FakeDockerHandler)
+        self.containers = set(containers)
+        self.bin_dir = bin_dir
+        self.execs: dict[str, dict] = {}
+        self.commands: list[list[str]] = []
+        self.connections_count = 0
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-docker", daemon=True)
+
+    def process_request(self, request, client_address) -> None:
+        self.connections_count += 1
+        super().process_request(request, client_address)
+
+    def __enter__(self) -> "FakeDockerServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
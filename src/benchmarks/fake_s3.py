@@ -0,0 +1,265 @@
+"""
+Local S3 stand-in for benchmarks: in-memory objects behind a threaded HTTP server which
+understands the subset of S3 API used by `src.s3` (objects with user metadata, multipart
+uploads, ListParts, ranged / conditional GETs, conditional PUTs, ListObjectsV2, DeleteObjects).
+Requests' signatures are not verified.
+"""
+
+import re
+import uuid
+import hashlib
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+def decode_aws_chunked(body: bytes) -> bytes:
+    """Decodes `aws-chunked` payload (chunks with signatures / trailing checksums)"""
+    result, position = bytearray(), 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if not size:
+            return bytes(result)
+
+        result += body[line_end + 2 : line_end + 2 + size]
+        position = line_end + 2 + size + 2
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """Handles S3 API's requests (path-style addressing: /{bucket}/{key})"""
+
+    protocol_version = "HTTP/1.1"
+    server: "FakeS3Server"
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def do_PUT(self) -> None:
+        key, query = self._parse_path()
+        body = self._read_body()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if "partNumber" in query:
+            upload = self.server.uploads[query["uploadId"]]
+            upload[int(query["partNumber"])] = body
+        else:
+            if not self._check_put_conditions(key):
+                return
+
+            self.server.objects[key] = body
+            self.server.metadata[key] = self._read_metadata()
+
+        self._send(200, headers={"ETag": etag})
+
+    def _check_put_conditions(self, key: str) -> bool:
+        """If-Match / If-None-Match of conditional PUT (412 response if they aren't met)"""
+        data = self.server.objects.get(key)
+        etag = None if data is None else f'"{hashlib.md5(data).hexdigest()}"'
+        if_match, if_none_match = self.headers.get("If-Match"), self.headers.get("If-None-Match")
+        if (if_match and if_match != etag) or (if_none_match == "*" and etag):
+            self._send_xml("<Error><Code>PreconditionFailed</Code></Error>", status=412)
+            return False
+
+        return True
+
+    def do_POST(self) -> None:
+        key, query = self._parse_path()
+        body = self._read_body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.server.uploads[upload_id] = {}
+            self.server.metadata[upload_id] = self._read_metadata()
+            self._send_xml(
+                f"<InitiateMultipartUploadResult><Bucket>{self.server.bucket}</Bucket>"
+                f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"
+                f"</InitiateMultipartUploadResult>"
+            )
+        elif "uploadId" in query:
+            parts = self.server.uploads.pop(query["uploadId"])
+            self.server.objects[key] = b"".join(data for _, data in sorted(parts.items()))
+            self.server.metadata[key] = self.server.metadata.pop(query["uploadId"], {})
+            self._send_xml(
+                f"<CompleteMultipartUploadResult><Key>{escape(key)}</Key>"
+                f'<ETag>"{uuid.uuid4().hex}-{len(parts)}"</ETag></CompleteMultipartUploadResult>'
+            )
+        elif "delete" in query:
+            keys = [unquote(key) for key in re.findall(r"<Key>(.*?)</Key>", body.decode())]
+            for deleted_key in keys:
+                self.server.objects.pop(deleted_key, None)
+
+            self._send_xml("<DeleteResult></DeleteResult>")
+        else:
+            self._send(400)
+
+    def do_DELETE(self) -> None:
+        key, query = self._parse_path()
+        if "uploadId" in query:
+            self.server.uploads.pop(query["uploadId"], None)
+        else:
+            self.server.objects.pop(key, None)
+            self.server.metadata.pop(key, None)
+
+        self._send(204)
+
+    def do_HEAD(self) -> None:
+        key, _ = self._parse_path()
+        if (data := self.server.objects.get(key)) is None:
+            self._send(404)
+            return
+
+        self._send(200, headers=self._object_headers(key, data), content_length=len(data))
+
+    def do_GET(self) -> None:
+        key, query = self._parse_path()
+        if not key:
+            self._list_objects(prefix=query.get("prefix", ""), delimiter=query.get("delimiter"))
+            return
+
+        if "uploadId" in query:
+            self._list_parts(key, upload_id=query["uploadId"])
+            return
+
+        if (data := self.server.objects.get(key)) is None:
+            self._send_xml("<Error><Code>NoSuchKey</Code></Error>", status=404)
+            return
+
+        headers = self._object_headers(key, data)
+        if self.headers.get("If-Match", headers["ETag"]) != headers["ETag"]:
+            self._send_xml("<Error><Code>PreconditionFailed</Code></Error>", status=412)
+            return
+
+        if match := RANGE_PATTERN.match(self.headers.get("Range", "")):
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            self._send(206, body=data[start : end + 1], headers=headers)
+        else:
+            self._send(200, body=data, headers=headers)
+
+    def _list_objects(self, prefix: str, delimiter: str | None) -> None:
+        contents = []
+        for key, data in sorted(self.server.objects.items()):
+            if not key.startswith(prefix):
+                continue
+
+            if delimiter and delimiter in key[len(prefix) :]:
+                continue
+
+            contents.append(
+                f"<Contents><Key>{escape(key)}</Key><Size>{len(data)}</Size>"
+                f"<LastModified>{self.server.started_at}</LastModified></Contents>"
+            )
+
+        self._send_xml(
+            f"<ListBucketResult><Name>{self.server.bucket}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(contents)}</KeyCount><IsTruncated>false</IsTruncated>"
+            f"{''.join(contents)}</ListBucketResult>"
+        )
+
+    def _list_parts(self, key: str, upload_id: str) -> None:
+        if (parts := self.server.uploads.get(upload_id)) is None:
+            self._send_xml("<Error><Code>NoSuchUpload</Code></Error>", status=404)
+            return
+
+        contents = "".join(
+            f"<Part><PartNumber>{number}</PartNumber>"
+            f'<ETag>"{hashlib.md5(data).hexdigest()}"</ETag><Size>{len(data)}</Size></Part>'
+            for number, data in sorted(parts.items())
+        )
+        self._send_xml(
+            f"<ListPartsResult><Bucket>{self.server.bucket}</Bucket><Key>{escape(key)}</Key>"
+            f"<UploadId>{upload_id}</UploadId><IsTruncated>false</IsTruncated>"
+            f"{contents}</ListPartsResult>"
+        )
+
+    def _parse_path(self) -> tuple[str, dict[str, str]]:
+        url = urlsplit(self.path)
+        _, _, key = unquote(url.path).lstrip("/").partition("/")
+        query = {name: values[0] for name, values in parse_qs(url.query, True).items()}
+        return key, query
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", "") or self.headers.get(
+            "x-amz-content-sha256", ""
+        ).startswith("STREAMING-"):
+            return decode_aws_chunked(body)
+
+        return body
+
+    def _read_metadata(self) -> dict[str, str]:
+        return {
+            name.lower().removeprefix("x-amz-meta-"): value
+            for name, value in self.headers.items()
+            if name.lower().startswith("x-amz-meta-")
+        }
+
+    def _object_headers(self, key: str, data: bytes) -> dict[str, str]:
+        metadata = self.server.metadata.get(key, {})
+        return {
+            "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+            "Last-Modified": self.server.last_modified,
+            "Accept-Ranges": "bytes",
+            **{f"x-amz-meta-{name}": value for name, value in metadata.items()},
+        }
+
+    def _send_xml(self, content: str, status: int = 200) -> None:
+        self._send(
+            status,
+            body=f"{XML_HEADER}{content}".encode(),
+            headers={"Content-Type": "application/xml"},
+        )
+
+    def _send(
+        self,
+        status: int,
+        body: bytes = b"",
+        headers: dict[str, str] | None = None,
+        content_length: int | None = None,
+    ) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.send_header(
+            "Content-Length", str(len(body) if content_length is None else content_length)
+        )
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """In-memory S3 (single bucket) which is served in the background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, bucket: str = "benchmarks", host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), FakeS3Handler)
+        self.bucket = bucket
+        self.objects: dict[str, bytes] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        # user metadata (x-amz-meta-* headers) of objects and of started multipart uploads
+        self.metadata: dict[str, dict[str, str]] = {}
+        now = datetime.now(timezone.utc)
+        self.started_at = now.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        self.last_modified = now.strftime("%a, %d %b %Y %H:%M:%S GMT")
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-s3", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeS3Server":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+        self.server_close()
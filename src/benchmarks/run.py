@@ -0,0 +1,472 @@
+"""
+Benchmarks of backup / restore stages (compression, encryption, copying, streaming pipelines,
+catalog's lookups and S3 transfers) on local stand-ins: synthetic dump, fake dump's process
+(`cat`) and in-memory S3 server. Each benchmark runs in a separate process, so its peak RSS
+can be measured. Results can be saved as a baseline and compared with the next runs.
+
+$ python -m src.benchmarks.run --size 64 --output bench_output.txt
+$ python -m src.benchmarks.run --save-baseline bench_baseline.json
+$ python -m src.benchmarks.run --baseline bench_baseline.json --threshold 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import resource
+import tempfile
+import dataclasses
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable
+
+import click
+
+from src import crypto, settings
+from src.benchmarks.fake_s3 import FakeS3Server
+from src.catalog import Catalog, CatalogEntry, find_backup
+from src.compression import compress_path, decompress_path, get_codec
+from src.constants import BackupLocation, COMPRESSIONS
+from src.handlers import BaseHandler
+from src.process import Command, call_with_logging
+from src.pipeline import build_sinks, iter_file
+from src.utils import copy_file
+
+module_logger = logging.getLogger("benchmarks")
+MB = 1024 * 1024
+DB_NAME = "bench-db"
+BLOCK_SIZE = 64 * 1024
+# count of catalog's entries (backups of 100 DBs) and lookups in catalog_lookup benchmark
+CATALOG_ENTRIES = 100_000
+CATALOG_LOOKUPS = 1_000
+BENCHMARKS: dict[str, Callable[["BenchmarkContext"], tuple[Callable[[], object], int]]] = {}
+BENCHMARK_UNITS: dict[str, str] = {}
+
+
+@dataclasses.dataclass
+class BenchmarkContext:
+    """Prepared artifacts (files, S3 objects) and settings for benchmarks' processes"""
+
+    workdir: Path
+    codec: str
+    dump_path: Path
+    compressed_path: Path
+    encrypted_path: Path
+    catalog_path: Path
+    s3_url: str
+    s3_bucket: str
+    s3_key: str
+
+    @property
+    def dump_size(self) -> int:
+        return self.dump_path.stat().st_size
+
+    @property
+    def compressed_size(self) -> int:
+        return self.compressed_path.stat().st_size
+
+    def apply_settings(self, run_dir: Path) -> None:
+        """Points settings to the local stand-ins (is called in benchmark's process)"""
+        settings.TMP_BACKUP_DIR = run_dir / "tmp"
+        settings.TMP_BACKUP_DIR.mkdir(parents=True)
+        settings.LOCAL_PATH = run_dir / "local"
+        settings.CATALOG_PATH = self.catalog_path
+        settings.S3_STORAGE_URL = self.s3_url
+        settings.S3_BUCKET_NAME = self.s3_bucket
+        settings.S3_PATH = "benchmarks"
+        settings.S3_ACCESS_KEY_ID = settings.S3_SECRET_ACCESS_KEY = "benchmarks"
+        settings.S3_REGION_NAME = "us-east-1"
+        os.environ.setdefault("ENCRYPT_PASS", "benchmarks")
+        # fake S3 doesn't support flexible checksums (they aren't required by real S3 either)
+        os.environ["AWS_REQUEST_CHECKSUM_CALCULATION"] = "when_required"
+        os.environ["AWS_RESPONSE_CHECKSUM_VALIDATION"] = "when_required"
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    """Best time of benchmark's runs and peak RSS of benchmark's process"""
+
+    name: str
+    processed: int
+    unit: str
+    seconds: float
+    peak_rss: int
+
+    @property
+    def throughput(self) -> float:
+        """Bytes (or operations) per second"""
+        return self.processed / self.seconds if self.seconds else 0.0
+
+    def format_throughput(self) -> str:
+        if self.unit == "B":
+            return f"{self.throughput / MB:.1f} MB/s"
+
+        return f"{self.throughput:.0f} ops/s"
+
+
+class FakeDumpHandler(BaseHandler):
+    """Handler with fake dump's process (`cat` of synthetic dump) and no-op restore"""
+
+    service = "fake"
+    required_variables = ()
+
+    def _dump_command(self) -> Command:
+        return ["cat", str(self.extra_kwargs["source_path"])]
+
+    def _do_backup(self) -> str:
+        return call_with_logging(self._dump_command(), stdout_path=self.backup_path)
+
+    def _do_restore(self, file_path: Path) -> None:
+        call_with_logging(["cat", self.backup_path], stdout_path=Path(os.devnull))
+
+    def _restore_command(self, header: bytes) -> Command:
+        return ["sh", "-c", "cat > /dev/null"]
+
+
+def benchmark(name: str, unit: str = "B"):
+    """
+    Registers benchmark: function prepares the stage (not measured) and returns
+    measured callable with count of processed bytes (or operations)
+    """
+
+    def decorator(function):
+        BENCHMARKS[name] = function
+        BENCHMARK_UNITS[name] = unit
+        return function
+
+    return decorator
+
+
+def _handler(ctx: BenchmarkContext) -> FakeDumpHandler:
+    return FakeDumpHandler(DB_NAME, compression=ctx.codec, source_path=ctx.dump_path)
+
+
+@benchmark("compress")
+def bench_compress(ctx: BenchmarkContext):
+    result_path = settings.TMP_BACKUP_DIR / "dump.compressed"
+    return lambda: compress_path(ctx.dump_path, result_path, get_codec(ctx.codec)), ctx.dump_size
+
+
+@benchmark("decompress")
+def bench_decompress(ctx: BenchmarkContext):
+    directory = settings.TMP_BACKUP_DIR
+    return (
+        lambda: decompress_path(ctx.compressed_path, directory, dump_name="dump.sql"),
+        ctx.dump_size,
+    )
+
+
+@benchmark("encrypt")
+def bench_encrypt(ctx: BenchmarkContext):
+    result_path = settings.TMP_BACKUP_DIR / "backup.enc"
+    return lambda: crypto.encrypt_path(ctx.compressed_path, result_path), ctx.compressed_size
+
+
+@benchmark("decrypt")
+def bench_decrypt(ctx: BenchmarkContext):
+    result_path = settings.TMP_BACKUP_DIR / "backup.dec"
+    return lambda: crypto.decrypt_path(ctx.encrypted_path, result_path), ctx.compressed_size
+
+
+@benchmark("copy")
+def bench_copy(ctx: BenchmarkContext):
+    return lambda: copy_file(DB_NAME, ctx.compressed_path, settings.LOCAL_PATH), ctx.compressed_size
+
+
+@benchmark("backup")
+def bench_backup(ctx: BenchmarkContext):
+    return _handler(ctx).backup, ctx.dump_size
+
+
+@benchmark("stream_backup")
+def bench_stream_backup(ctx: BenchmarkContext):
+    handler = _handler(ctx)
+    filename = handler.get_stream_filename()
+    return (
+        lambda: handler.backup_stream(build_sinks(DB_NAME, filename, [BackupLocation.LOCAL])),
+        ctx.dump_size,
+    )
+
+
+@benchmark("stream_restore")
+def bench_stream_restore(ctx: BenchmarkContext):
+    handler = _handler(ctx)
+    return lambda: handler.restore_stream(iter_file(ctx.compressed_path)), ctx.dump_size
+
+
+@benchmark("catalog_lookup", unit="op")
+def bench_catalog_lookup(ctx: BenchmarkContext):
+    dates = [datetime(2024, 1, 1).date() + timedelta(days=day) for day in range(365)]
+
+    def lookups() -> None:
+        rng = random.Random(0)
+        for _ in range(CATALOG_LOOKUPS):
+            find_backup(f"db-{rng.randrange(100)}", BackupLocation.LOCAL, rng.choice(dates))
+
+    return lookups, CATALOG_LOOKUPS
+
+
+@benchmark("s3_upload")
+def bench_s3_upload(ctx: BenchmarkContext):
+    from src import s3
+
+    return lambda: s3.upload_file(DB_NAME, ctx.compressed_path), ctx.compressed_size
+
+
+@benchmark("s3_download")
+def bench_s3_download(ctx: BenchmarkContext):
+    from src import s3
+
+    result_path = settings.TMP_BACKUP_DIR / "downloaded"
+    return lambda: s3.download_file(DB_NAME, ctx.s3_key, result_path), ctx.compressed_size
+
+
+@benchmark("s3_stream_backup")
+def bench_s3_stream_backup(ctx: BenchmarkContext):
+    handler = _handler(ctx)
+    filename = handler.get_stream_filename()
+    return (
+        lambda: handler.backup_stream(build_sinks(DB_NAME, filename, [BackupLocation.S3])),
+        ctx.dump_size,
+    )
+
+
+@benchmark("s3_stream_restore")
+def bench_s3_stream_restore(ctx: BenchmarkContext):
+    from src import s3
+
+    handler = _handler(ctx)
+    return lambda: handler.restore_stream(s3.iter_object(DB_NAME, ctx.s3_key)), ctx.dump_size
+
+
+def run_benchmark(name: str, ctx: BenchmarkContext) -> BenchmarkResult:
+    """Runs the single benchmark (is called in the separate process)"""
+    run_dir = Path(tempfile.mkdtemp(prefix=f"{name}-", dir=ctx.workdir))
+    ctx.apply_settings(run_dir)
+    measured, processed = BENCHMARKS[name](ctx)
+    started_at = time.perf_counter()
+    measured()
+    seconds = time.perf_counter() - started_at
+    return BenchmarkResult(
+        name=name,
+        processed=processed,
+        unit=BENCHMARK_UNITS[name],
+        seconds=seconds,
+        peak_rss=peak_rss(),
+    )
+
+
+def peak_rss() -> int:
+    """
+    Peak RSS of the current process (in bytes). VmHWM is used on Linux: ru_maxrss of spawned
+    process includes RSS of its parent (it is kept by the kernel after exec)
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def generate_dump(path: Path, size: int, compressibility: float, seed: int = 0) -> Path:
+    """
+    Generates SQL-like dump: `compressibility` share of each block is repetitive text,
+    the rest is random hex data
+    """
+    rng = random.Random(seed)
+    random_size = int(BLOCK_SIZE * (1 - compressibility)) // 2
+    with open(path, "wb") as file:
+        written, row = 0, 0
+        while written < size:
+            block = bytearray()
+            while len(block) < BLOCK_SIZE - random_size * 2:
+                row += 1
+                block += f"INSERT INTO events VALUES ({row}, 'user_{row % 1000}', 'ok');\n".encode()
+
+            block += rng.randbytes(random_size).hex().encode() + b"\n"
+            file.write(block[: size - written])
+            written += min(len(block), size - written)
+
+    return path
+
+
+def prepare_context(
+    workdir: Path, size: int, compressibility: float, codec: str, server: FakeS3Server
+) -> BenchmarkContext:
+    """Prepares artifacts for all benchmarks (their preparation isn't measured)"""
+    dump_path = generate_dump(workdir / "dump.sql", size, compressibility)
+    compressed_path = compress_path(
+        dump_path, workdir / get_codec(codec).file_name("dump.sql"), get_codec(codec)
+    )
+    encrypted_path = crypto.encrypt_path(compressed_path, workdir / f"{compressed_path.name}.enc")
+    s3_key = f"benchmarks/{compressed_path.name}"
+    server.objects[s3_key] = compressed_path.read_bytes()
+
+    catalog = Catalog(workdir / "catalog.sqlite3")
+    started_at = datetime(2024, 1, 1)
+    catalog.add(
+        *(
+            CatalogEntry(
+                db_name=f"db-{index % 100}",
+                created_at=started_at + timedelta(hours=index // 100 * 6),
+                location=BackupLocation.LOCAL,
+                path=f"/backups/{index}.backup.sql.gz",
+            )
+            for index in range(CATALOG_ENTRIES)
+        )
+    )
+    return BenchmarkContext(
+        workdir=workdir,
+        codec=codec,
+        dump_path=dump_path,
+        compressed_path=compressed_path,
+        encrypted_path=encrypted_path,
+        catalog_path=catalog.path,
+        s3_url=server.url,
+        s3_bucket=server.bucket,
+        s3_key=s3_key,
+    )
+
+
+def compare(result: BenchmarkResult, baseline: dict | None, threshold: float) -> tuple[str, bool]:
+    """Returns difference with baseline's result and regression's flag"""
+    if not baseline:
+        return "", False
+
+    throughput_diff = (result.throughput / baseline["throughput"] - 1) * 100
+    rss_diff = (result.peak_rss / baseline["peak_rss"] - 1) * 100
+    regression = throughput_diff < -threshold or rss_diff > threshold
+    return f"{throughput_diff:+.1f}% / RSS {rss_diff:+.1f}%", regression
+
+
+def format_report(
+    results: list[BenchmarkResult], baseline: dict, threshold: float
+) -> tuple[list[str], list[str]]:
+    """Returns report's lines and names of regressed benchmarks"""
+    lines = [
+        f"{'benchmark':<20} {'throughput':>14} {'time':>9} {'peak RSS':>10}  vs baseline",
+    ]
+    regressions = []
+    for result in results:
+        diff, regression = compare(result, baseline.get(result.name), threshold)
+        if regression:
+            regressions.append(result.name)
+
+        lines.append(
+            f"{result.name:<20} {result.format_throughput():>14} {result.seconds:>8.2f}s "
+            f"{result.peak_rss / MB:>7.1f} MB  "
+            f"{diff}{' REGRESSION' if regression else ''}"
+        )
+
+    return lines, regressions
+
+
+@click.command("benchmarks")
+@click.option("--size", metavar="MB", type=click.IntRange(min=1), default=64, show_default=True)
+@click.option(
+    "--compressibility",
+    type=click.FloatRange(0, 1),
+    default=0.7,
+    show_default=True,
+    help="Share of repetitive (compressible) data in the synthetic dump.",
+)
+@click.option("--codec", type=click.Choice(COMPRESSIONS), default=settings.COMPRESSION)
+@click.option("--repeat", type=click.IntRange(min=1), default=3, show_default=True)
+@click.option(
+    "--only",
+    metavar="BENCHMARKS",
+    default=",".join(BENCHMARKS),
+    show_default=True,
+    callback=lambda _, __, value: [name.strip() for name in value.split(",") if name.strip()],
+    help="Comma separated list of benchmarks.",
+)
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--save-baseline", type=click.Path(dir_okay=False, path_type=Path))
+@click.option(
+    "--threshold",
+    metavar="PERCENT",
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="Allowed throughput's drop (or RSS's growth) against the baseline.",
+)
+@click.option("--output", type=click.Path(dir_okay=False, path_type=Path))
+def cli(
+    size: int,
+    compressibility: float,
+    codec: str,
+    repeat: int,
+    only: list[str],
+    baseline: Path | None,
+    save_baseline: Path | None,
+    threshold: float,
+    output: Path | None,
+):
+    """Runs benchmarks of backup / restore stages on local stand-ins"""
+    if unknown := [name for name in only if name not in BENCHMARKS]:
+        raise click.BadParameter(f"Unknown benchmarks: {unknown}", param_hint="--only")
+
+    os.environ.setdefault("ENCRYPT_PASS", "benchmarks")
+    baseline_results = json.loads(baseline.read_text())["results"] if baseline else {}
+    results: list[BenchmarkResult] = []
+    with (
+        tempfile.TemporaryDirectory(prefix="db-backups-bench-") as workdir,
+        FakeS3Server() as server,
+    ):
+        click.echo(f"Preparing synthetic dump ({size} MB, compressibility {compressibility}) ...")
+        ctx = prepare_context(Path(workdir), size * MB, compressibility, codec, server)
+        # spawned processes: benchmarks don't share memory (peak RSS) and imports' state
+        mp_context = multiprocessing.get_context("spawn")
+        for name in only:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+                    runs.append(executor.submit(run_benchmark, name, ctx).result())
+
+            best = min(runs, key=lambda result: result.seconds)
+            best.peak_rss = max(result.peak_rss for result in runs)
+            results.append(best)
+            click.echo(f"{name}: {best.format_throughput()} ({best.seconds:.2f}s)")
+
+    lines, regressions = format_report(results, baseline_results, threshold)
+    report = "\n".join(
+        [
+            f"db-backups benchmarks | {datetime.now():%Y-%m-%d %H:%M:%S} | size: {size} MB | "
+            f"compressibility: {compressibility} | codec: {codec} | repeat: {repeat}",
+            *lines,
+        ]
+    )
+    click.echo(report)
+    if output:
+        output.write_text(f"{report}\n")
+
+    if save_baseline:
+        params = {"size": size, "compressibility": compressibility, "codec": codec}
+        save_baseline.write_text(
+            json.dumps(
+                {
+                    "params": params,
+                    "results": {
+                        result.name: dataclasses.asdict(result) | {"throughput": result.throughput}
+                        for result in results
+                    },
+                },
+                indent=2,
+            )
+        )
+
+    if regressions:
+        click.echo(f"Regressions (threshold {threshold}%): {regressions}", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,167 @@
+"""
+Startup benchmark of the CLI: each command (`--help`) is run by a fresh interpreter,
+its wall time and the slowest imports (`python -X importtime`) are reported. Heavy modules
+(boto3, sentry_sdk, cryptography, ...) mustn't be imported until they are really used.
+
+$ python -m src.benchmarks.startup
+$ python -m src.benchmarks.startup --repeat 10 --budget 100 --top 15
+"""
+
+import os
+import sys
+import time
+import subprocess
+import dataclasses
+
+import click
+
+from src import settings
+
+# modules which are imported only by the code which really uses them
+HEAVY_MODULES = ("boto3", "botocore", "sentry_sdk", "cryptography")
+
+
+@dataclasses.dataclass
+class ImportTime:
+    """Single line of `python -X importtime` output (times in microseconds)"""
+
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+@dataclasses.dataclass
+class StartupResult:
+    """Best wall time of command's startup and its imports"""
+
+    args: tuple[str, ...]
+    seconds: float
+    imports: list[ImportTime]
+
+    @property
+    def command(self) -> str:
+        return " ".join(self.args)
+
+    @property
+    def heavy_imports(self) -> list[str]:
+        return sorted(
+            {
+                item.name
+                for item in self.imports
+                if item.name.split(".", 1)[0] in HEAVY_MODULES and "." not in item.name
+            }
+        )
+
+    def slowest(self, count: int) -> list[ImportTime]:
+        """Imports of the project's modules and top-level packages with the biggest cost"""
+        top_level = [item for item in self.imports if item.depth == 0 or _is_project(item.name)]
+        return sorted(top_level, key=lambda item: item.cumulative_us, reverse=True)[:count]
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    """
+    Parses stderr of `python -X importtime`
+
+    >>> parse_importtime("import time: self [us] | cumulative | imported package\\n"
+    ...                  "import time:       475 |      54501 |   asyncio")
+    [ImportTime(name='asyncio', self_us=475, cumulative_us=54501, depth=1)]
+    """
+    result = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            continue  # header's line
+
+        stripped = name.lstrip()
+        result.append(
+            ImportTime(
+                name=stripped.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(name) - len(stripped) - 1) // 2,
+            )
+        )
+
+    return result
+
+
+def measure(args: tuple[str, ...], repeat: int) -> StartupResult:
+    """Runs `python -m src.run {args}` several times (the best time is taken)"""
+    command = [sys.executable, "-m", "src.run", *args]
+    env = os.environ | {"PYTHONDONTWRITEBYTECODE": "1"}
+    seconds = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, check=True)
+        seconds.append(time.perf_counter() - started_at)
+
+    # imports are measured separately: importtime's tracing slows down the startup
+    traced = subprocess.run(
+        [sys.executable, "-X", "importtime", *command[1:]],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return StartupResult(args=args, seconds=min(seconds), imports=parse_importtime(traced.stderr))
+
+
+def list_commands() -> list[str]:
+    """Names of CLI's commands (modules in `src/commands`)"""
+    return sorted(
+        file_name.removesuffix(".py")
+        for file_name in os.listdir(settings.SRC_DIR / "commands")
+        if file_name.endswith(".py") and not file_name.startswith("__")
+    )
+
+
+def _is_project(name: str) -> bool:
+    return name.startswith("src.") and name.count(".") <= 2
+
+
+@click.command("startup")
+@click.option("--repeat", type=click.IntRange(min=1), default=5, show_default=True)
+@click.option(
+    "--budget",
+    metavar="MS",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Max startup's time of each command (0 - without limit).",
+)
+@click.option(
+    "--top",
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="Count of the slowest imports which are shown per command.",
+)
+def cli(repeat: int, budget: int, top: int):
+    """Measures startup's time of CLI's commands (exit code 1 on heavy imports / budget)"""
+    failed = []
+    for args in [("--help",), *((command, "--help") for command in list_commands())]:
+        result = measure(args, repeat=repeat)
+        over_budget = budget and result.seconds * 1000 > budget
+        click.echo(
+            f"{result.command:<20} {result.seconds * 1000:>7.1f} ms"
+            f"{' OVER BUDGET' if over_budget else ''}"
+            f"{f' HEAVY IMPORTS: {result.heavy_imports}' if result.heavy_imports else ''}"
+        )
+        for item in result.slowest(top):
+            click.echo(f"    {item.cumulative_us / 1000:>7.1f} ms  {item.name}")
+
+        if over_budget or result.heavy_imports:
+            failed.append(result.command)
+
+    if failed:
+        click.echo(f"Startup's regressions: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,365 @@
+"""
+Indexed catalog of created backups: local SQLite DB (+ manifest object per DB in S3 bucket).
+Allows to find backups (latest one, by date, etc.) without scanning of directories / S3 prefixes.
+"""
+
+import json
+import time
+import random
+import logging
+import sqlite3
+import threading
+import functools
+import dataclasses
+from datetime import date as date_type, datetime, timedelta
+from pathlib import Path
+from typing import Iterable
+
+from src import settings, utils
+from src.constants import BackupLocation
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+BACKUP_TIME_FORMAT = "%Y-%m-%d-%H%M%S"
+# errors of conditional PUT: manifest was changed (or is being changed) by another process
+CONCURRENT_UPDATE_ERRORS = ("PreconditionFailed", "ConditionalRequestConflict")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    db_name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    location TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    compression TEXT,
+    encrypted INTEGER NOT NULL DEFAULT 0,
+    checksum TEXT,
+    UNIQUE (location, path)
+);
+CREATE INDEX IF NOT EXISTS backups_db_name_created_at ON backups (db_name, created_at);
+CREATE INDEX IF NOT EXISTS backups_db_name_location_created_at
+    ON backups (db_name, location, created_at);
+"""
+
+
+@dataclasses.dataclass
+class CatalogEntry:
+    """Single backup placed to the specific location"""
+
+    db_name: str
+    created_at: datetime
+    location: BackupLocation
+    path: str
+    size: int | None = None
+    compression: str | None = None
+    encrypted: bool = False
+    checksum: str | None = None
+
+    @property
+    def file_name(self) -> str:
+        """Name of backup's file (or chunk store's manifest)"""
+        return Path(self.path).name
+
+    def to_dict(self) -> dict:
+        """Serializable representation (for S3 manifest)"""
+        return dataclasses.asdict(self) | {"created_at": self.created_at.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CatalogEntry":
+        """Restores entry from serialized representation (or SQLite's row)"""
+        return cls(
+            db_name=data["db_name"],
+            created_at=datetime.fromisoformat(data["created_at"]),
+            location=BackupLocation(data["location"]),
+            path=data["path"],
+            size=data["size"],
+            compression=data["compression"],
+            encrypted=bool(data["encrypted"]),
+            checksum=data["checksum"],
+        )
+
+
+class Catalog:
+    """
+    SQLite index of backups: each query uses (db_name, [location,] created_at) index,
+    so it takes O(log n) regardless of count of stored backups
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            # WAL allows reading of catalog while another process (backup) writes to it
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def add(self, *entries: CatalogEntry) -> None:
+        """Adds (or replaces) entries for backup's locations"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                """
+                INSERT OR REPLACE INTO backups
+                (db_name, created_at, location, path, size, compression, encrypted, checksum)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        entry.db_name,
+                        entry.created_at.isoformat(),
+                        str(entry.location),
+                        entry.path,
+                        entry.size,
+                        entry.compression,
+                        int(entry.encrypted),
+                        entry.checksum,
+                    )
+                    for entry in entries
+                ],
+            )
+
+    def remove(self, location: BackupLocation, paths: Iterable[str]) -> None:
+        """Removes entries of deleted backups"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM backups WHERE location = ? AND path = ?",
+                [(str(location), path) for path in paths],
+            )
+
+    def list(
+        self,
+        db_name: str | None = None,
+        location: BackupLocation | None = None,
+        date: date_type | None = None,
+        limit: int | None = None,
+    ) -> list[CatalogEntry]:
+        """Returns entries (newest first) filtered by provided params"""
+        conditions, params = [], []
+        if db_name:
+            conditions.append("db_name = ?")
+            params.append(db_name)
+
+        if location:
+            conditions.append("location = ?")
+            params.append(str(location))
+
+        if date:
+            date = date.date() if isinstance(date, datetime) else date
+            conditions.append("created_at >= ? AND created_at < ?")
+            params.extend((date.isoformat(), (date + timedelta(days=1)).isoformat()))
+
+        query = "SELECT * FROM backups"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+
+        query += " ORDER BY created_at DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+
+        return [CatalogEntry.from_dict(dict(row)) for row in rows]
+
+    def latest(
+        self,
+        db_name: str,
+        location: BackupLocation | None = None,
+        date: date_type | None = None,
+    ) -> CatalogEntry | None:
+        """Returns the latest backup of DB (for requested location and date)"""
+        entries = self.list(db_name, location=location, date=date, limit=1)
+        return entries[0] if entries else None
+
+
+@functools.cache
+def get_catalog() -> Catalog:
+    """Shared catalog (placed in CATALOG_PATH)"""
+    return Catalog(settings.CATALOG_PATH)
+
+
+def get_backup_time(file_name: str) -> datetime:
+    """
+    Extracts backup's creation time from its name (see `src.utils.get_filename`)
+
+    >>> get_backup_time("2024-02-21-065213.test-db.backup.sql.gz")
+    datetime.datetime(2024, 2, 21, 6, 52, 13)
+    """
+    try:
+        return datetime.strptime(file_name[: len("YYYY-mm-dd-HHMMSS")], BACKUP_TIME_FORMAT)
+    except ValueError:
+        return datetime.now().replace(microsecond=0)
+
+
+def register_backup(
+    db_name: str,
+    file_name: str,
+    targets: dict[BackupLocation, str],
+    size: int | None = None,
+    compression: str | None = None,
+    encrypted: bool = False,
+    checksum: str | None = None,
+) -> list[CatalogEntry]:
+    """
+    Adds created backup (for each its location) to the local catalog and
+    to the S3 manifest (if backup was uploaded to S3).
+    Catalog's errors don't break backup: restore falls back to scanning of storages.
+
+    :param targets: paths (or S3 keys) of backup for each location
+    """
+    logger = logger_ctx.get(module_logger)
+    entries = [
+        CatalogEntry(
+            db_name=db_name,
+            created_at=get_backup_time(file_name),
+            location=location,
+            path=path,
+            size=size,
+            compression=compression,
+            encrypted=encrypted,
+            checksum=checksum,
+        )
+        for location, path in targets.items()
+    ]
+    try:
+        get_catalog().add(*entries)
+        if s3_entries := [entry for entry in entries if entry.location == BackupLocation.S3]:
+            push_s3_manifest(db_name, s3_entries)
+
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.warning("[%s] Couldn't add backup to the catalog: %r", db_name, exc)
+
+    return entries
+
+
+def unregister_backups(db_name: str, location: BackupLocation, paths: list[str]) -> None:
+    """Removes deleted backups from the local catalog (and from the S3 manifest)"""
+    logger = logger_ctx.get(module_logger)
+    try:
+        if settings.CATALOG_PATH.exists():
+            get_catalog().remove(location, paths)
+
+        if location == BackupLocation.S3:
+            push_s3_manifest(db_name, entries=[], removed_paths=paths)
+
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.warning("[%s] Couldn't remove backups from the catalog: %r", db_name, exc)
+
+
+def find_backup(
+    db_name: str,
+    location: BackupLocation,
+    date: date_type | None = None,
+) -> CatalogEntry | None:
+    """
+    Finds the latest backup in the catalog. For S3: catalog is synced with bucket's manifest
+    (one GET request) if local catalog doesn't contain requested backup.
+    None is returned if catalog doesn't know about requested backup (ex.: it was created
+    before catalog's introducing): callers should fall back to scanning.
+    """
+    logger = logger_ctx.get(module_logger)
+    try:
+        if not settings.CATALOG_PATH.exists() and location != BackupLocation.S3:
+            return None
+
+        catalog = get_catalog()
+        if not (entry := catalog.latest(db_name, location=location, date=date)):
+            if location == BackupLocation.S3 and (remote_entries := pull_s3_manifest(db_name)):
+                catalog.add(*remote_entries)
+                entry = catalog.latest(db_name, location=location, date=date)
+
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.warning("[%s] Couldn't find backup in the catalog: %r", db_name, exc)
+        return None
+
+    logger.debug("[%s] Found backup in the catalog: %s", db_name, entry)
+    return entry
+
+
+def find_backup_size(db_name: str) -> int | None:
+    """Size of the latest DB's backup which is known by the local catalog (None if unknown)"""
+    logger = logger_ctx.get(module_logger)
+    try:
+        if not settings.CATALOG_PATH.exists():
+            return None
+
+        entry = get_catalog().latest(db_name)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.warning("[%s] Couldn't find backup in the catalog: %r", db_name, exc)
+        return None
+
+    return entry.size if entry else None
+
+
+def get_s3_manifest_key(db_name: str) -> str:
+    """Key of S3 object with the list of DB's backups"""
+    s3 = utils.get_s3()
+    return s3.get_key(f"catalog/{db_name}.json")
+
+
+def pull_s3_manifest(db_name: str) -> list[CatalogEntry]:
+    """Reads DB's manifest from S3 bucket (empty list if manifest doesn't exist)"""
+    entries, _ = _read_s3_manifest(db_name)
+    return entries
+
+
+def push_s3_manifest(
+    db_name: str,
+    entries: list[CatalogEntry],
+    removed_paths: Iterable[str] = (),
+) -> None:
+    """
+    Adds entries to (and removes deleted ones from) DB's manifest in S3 bucket.
+    Manifest is replaced only if it wasn't changed since its reading (conditional PUT), so
+    concurrent updates (ex.: backup + retention of another host) are retried instead of lost.
+    """
+    s3 = utils.get_s3()
+    logger = logger_ctx.get(module_logger)
+    client = s3.get_client()
+    removed_paths = set(removed_paths)
+    for attempt in range(1, settings.CATALOG_MANIFEST_ATTEMPTS + 1):
+        known_entries, etag = _read_s3_manifest(db_name)
+        manifest = {entry.path: entry for entry in known_entries}
+        manifest.update({entry.path: entry for entry in entries})
+        for path in removed_paths:
+            manifest.pop(path, None)
+
+        ordered = sorted(manifest.values(), key=lambda entry: entry.created_at)
+        try:
+            client.put_object(
+                Bucket=settings.S3_BUCKET_NAME,
+                Key=get_s3_manifest_key(db_name),
+                Body=json.dumps([entry.to_dict() for entry in ordered]).encode(),
+                ContentType="application/json",
+                # the new manifest mustn't replace the one which is created concurrently
+                **({"IfMatch": etag} if etag else {"IfNoneMatch": "*"}),
+            )
+        except client.exceptions.ClientError as exc:
+            code = exc.response.get("Error", {}).get("Code")
+            last_attempt = attempt == settings.CATALOG_MANIFEST_ATTEMPTS
+            if code not in CONCURRENT_UPDATE_ERRORS or last_attempt:
+                raise
+
+            logger.debug("[%s] S3 manifest is changed concurrently (%s), retrying", db_name, code)
+            time.sleep(random.uniform(0, 0.1 * attempt))
+            continue
+
+        return
+
+
+def _read_s3_manifest(db_name: str) -> tuple[list[CatalogEntry], str | None]:
+    """DB's manifest in S3 bucket and its ETag (None if manifest doesn't exist)"""
+    s3 = utils.get_s3()
+    client = s3.get_client()
+    try:
+        response = client.get_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=get_s3_manifest_key(db_name)
+        )
+    except client.exceptions.NoSuchKey:
+        return [], None
+
+    entries = [CatalogEntry.from_dict(data) for data in json.loads(response["Body"].read())]
+    return entries, response["ETag"]
@@ -0,0 +1,395 @@
+"""
+Deduplicated backup storage: dump's stream is split into content-defined chunks,
+each chunk is stored once (by its SHA-256) and each backup is a small manifest
+with the list of its chunks. Restore reassembles the dump from the manifest.
+"""
+
+import os
+import abc
+import json
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+import dataclasses
+from abc import ABC
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from src import settings, utils
+from src.constants import BackupLocation
+from src.exceptions import BackupError, RestoreBackupError
+from src.pipeline import BackupSink
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+MANIFEST_SUFFIX = ".manifest.json"
+CHUNKS_DIR = "chunks"
+MANIFESTS_DIR = "manifests"
+
+
+class ContentDefinedChunker:
+    """
+    Splits stream into content-defined chunks anchored at line's ends: chunk is cut
+    after a line when crc32(line) falls below threshold which is proportional to line's
+    length (so the average chunk's size doesn't depend on line's length).
+    Inserted/changed rows of a dump move only boundaries of the chunks around them,
+    all other chunks stay the same (and are deduplicated).
+    Lines bigger than max_size (ex.: binary data) are cut by max_size.
+    """
+
+    def __init__(self, avg_size: int, min_size: int | None = None, max_size: int | None = None):
+        self.avg_size = avg_size
+        self.min_size = min_size or avg_size // 4
+        self.max_size = max_size or avg_size * 4
+        # probability of cut after a line = len(line) / avg_size
+        self._threshold_per_byte = (1 << 32) // avg_size
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+        self._tail = b""
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        """Adds data to the chunker and yields completed chunks"""
+        data = self._tail + data
+        start = 0
+        while (end := data.find(b"\n", start) + 1) > 0:
+            yield from self._add_line(data[start:end])
+            start = end
+
+        self._tail = data[start:]
+        while len(self._tail) >= self.max_size:
+            yield from self._add_line(self._tail[: self.max_size])
+            self._tail = self._tail[self.max_size :]
+
+    def flush(self) -> Iterator[bytes]:
+        """Yields the last (incomplete) chunk"""
+        if self._tail:
+            self._pending.append(self._tail)
+            self._pending_size += len(self._tail)
+            self._tail = b""
+
+        if self._pending:
+            yield self._cut()
+
+    def _add_line(self, line: bytes) -> Iterator[bytes]:
+        if self._pending_size + len(line) > self.max_size and self._pending:
+            yield self._cut()
+
+        self._pending.append(line)
+        self._pending_size += len(line)
+        if self._pending_size >= self.max_size or (
+            self._pending_size >= self.min_size
+            and zlib.crc32(line) < len(line) * self._threshold_per_byte
+        ):
+            yield self._cut()
+
+    def _cut(self) -> bytes:
+        chunk = b"".join(self._pending)
+        self._pending.clear()
+        self._pending_size = 0
+        return chunk
+
+
+class ChunkBackend(ABC):
+    """Storage for chunks and manifests (key -> bytes)"""
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        """Checks that object exists"""
+
+    @abc.abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        """Stores object (atomically)"""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes:
+        """Reads stored object"""
+
+    @abc.abstractmethod
+    def list(self, prefix: str) -> list[str]:
+        """Lists keys by prefix"""
+
+
+class LocalChunkBackend(ChunkBackend):
+    """Stores chunks in local directory"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def exists(self, key: str) -> bool:
+        return (self.root / key).exists()
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp_file:
+            tmp_file.write(data)
+
+        os.replace(tmp_file.name, path)
+
+    def get(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+    def list(self, prefix: str) -> list[str]:
+        directory, name_prefix = os.path.split(prefix)
+        if not (self.root / directory).is_dir():
+            return []
+
+        return [
+            os.path.join(directory, name)
+            for name in os.listdir(self.root / directory)
+            if name.startswith(name_prefix)
+        ]
+
+
+class S3ChunkBackend(ChunkBackend):
+    """
+    Stores chunks in S3 bucket (inside S3_PATH/chunk-store). Existence of the chunks which are
+    being written is checked by HEAD requests (the whole store isn't listed), keys which are
+    known to exist are remembered.
+    """
+
+    def __init__(self, prefix: str):
+        s3 = utils.get_s3()
+        self.s3 = s3
+        self.prefix = prefix
+        self._known_keys: set[str] = set()
+        self._lock = threading.Lock()
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            if key in self._known_keys:
+                return True
+
+        client = self.s3.get_client()
+        try:
+            client.head_object(Bucket=settings.S3_BUCKET_NAME, Key=self._full_key(key))
+        except client.exceptions.ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+
+            raise
+
+        with self._lock:
+            self._known_keys.add(key)
+
+        return True
+
+    def put(self, key: str, data: bytes) -> None:
+        self.s3.get_client().put_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=self._full_key(key), Body=data
+        )
+        with self._lock:
+            self._known_keys.add(key)
+
+    def get(self, key: str) -> bytes:
+        response = self.s3.get_client().get_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=self._full_key(key)
+        )
+        return response["Body"].read()
+
+    def list(self, prefix: str) -> list[str]:
+        full_prefix = self._full_key(prefix)
+        return [
+            obj["Key"].removeprefix(f"{self.prefix}/") for obj in self.s3.list_objects(full_prefix)
+        ]
+
+    def _full_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}"
+
+
+@dataclasses.dataclass
+class Manifest:
+    """Description of single backup: ordered list of its chunks"""
+
+    db_name: str
+    backup_name: str
+    created_at: str
+    dump_extension: str
+    chunks: list[tuple[str, int]] = dataclasses.field(default_factory=list)
+    size: int = 0
+    stored_size: int = 0
+    new_chunks: int = 0
+
+    @property
+    def key(self) -> str:
+        """Key of manifest in the chunk store"""
+        return f"{MANIFESTS_DIR}/{self.backup_name}{MANIFEST_SUFFIX}"
+
+    def dumps(self) -> bytes:
+        """Serialized manifest"""
+        return json.dumps(dataclasses.asdict(self)).encode()
+
+    @classmethod
+    def loads(cls, data: bytes) -> "Manifest":
+        """Deserializes manifest"""
+        fields = json.loads(data)
+        fields["chunks"] = [tuple(chunk) for chunk in fields["chunks"]]
+        return cls(**fields)
+
+
+class ChunkStore:
+    """Writes deduplicated backups to the backend and reassembles them back"""
+
+    def __init__(self, backend: ChunkBackend):
+        self.backend = backend
+        self.logger = logger_ctx.get(module_logger)
+
+    @staticmethod
+    def chunk_key(chunk_hash: str) -> str:
+        """Key of chunk in the store (chunks are spread over 256 subdirectories)"""
+        return f"{CHUNKS_DIR}/{chunk_hash[:2]}/{chunk_hash}"
+
+    def store_chunk(self, chunk: bytes, chunk_hash: str | None = None) -> tuple[str, int]:
+        """
+        Stores chunk (if it isn't stored yet)
+        :param chunk_hash: already calculated chunk's hash (it is calculated by default)
+        :return: chunk's hash and size of newly stored data (0 for already stored chunk)
+        """
+        chunk_hash = chunk_hash or hashlib.sha256(chunk).hexdigest()
+        key = self.chunk_key(chunk_hash)
+        if self.backend.exists(key):
+            return chunk_hash, 0
+
+        data = zlib.compress(chunk, settings.CHUNK_STORE_COMPRESSION_LEVEL)
+        self.backend.put(key, data)
+        return chunk_hash, len(data)
+
+    def save_manifest(self, manifest: Manifest) -> None:
+        """Stores manifest (backup becomes visible for restore after that)"""
+        self.backend.put(manifest.key, manifest.dumps())
+
+    def find_manifest(self, db_name: str, date: datetime.date) -> Manifest:
+        """Finds the latest manifest of DB's backup for requested date"""
+        prefix = f"{MANIFESTS_DIR}/{date.strftime(settings.DATE_FORMAT)}"
+        keys = [
+            key
+            for key in self.backend.list(prefix)
+            if key.endswith(f".{db_name}.backup{MANIFEST_SUFFIX}")
+        ]
+        if not keys:
+            raise RestoreBackupError(f"No backups of {db_name} found in chunk store for {date}")
+
+        return Manifest.loads(self.backend.get(max(keys)))
+
+    def iter_chunks(self, manifest: Manifest) -> Iterator[bytes]:
+        """Reads backup's chunks (each chunk's integrity is verified)"""
+        for chunk_hash, size in manifest.chunks:
+            chunk = zlib.decompress(self.backend.get(self.chunk_key(chunk_hash)))
+            if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != chunk_hash:
+                raise RestoreBackupError(f"Chunk {chunk_hash} is corrupted")
+
+            yield chunk
+
+    def restore_to_file(self, manifest: Manifest, file_path: Path) -> Path:
+        """Reassembles backup from chunks"""
+        with open(file_path, "wb") as file:
+            for chunk in self.iter_chunks(manifest):
+                file.write(chunk)
+
+        self.logger.info(
+            "[%s] backup restored from chunk store: %s (%i chunks)",
+            manifest.db_name,
+            file_path,
+            len(manifest.chunks),
+        )
+        return file_path
+
+
+class ChunkStoreSink(BackupSink):
+    """Splits streamed (uncompressed) dump into chunks and stores new ones concurrently"""
+
+    location = BackupLocation.CHUNKS
+
+    def __init__(self, db_name: str, filename: str, store: ChunkStore, dump_extension: str):
+        super().__init__(db_name, filename)
+        self.store = store
+        self.chunker = ContentDefinedChunker(
+            avg_size=settings.CHUNK_AVG_SIZE,
+            min_size=settings.CHUNK_MIN_SIZE,
+            max_size=settings.CHUNK_MAX_SIZE,
+        )
+        self.manifest = Manifest(
+            db_name=db_name,
+            backup_name=filename,
+            created_at=datetime.now().isoformat(),
+            dump_extension=dump_extension,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=settings.CHUNK_STORE_WORKERS)
+        self._slots = threading.BoundedSemaphore(settings.CHUNK_STORE_WORKERS * 2)
+        # only pending futures are kept: the finished ones are dropped by `_on_stored`
+        self._pending: set[Future] = set()
+        self._error: BaseException | None = None
+        self._lock = threading.Lock()
+
+    def write(self, chunk: bytes) -> None:
+        for content_chunk in self.chunker.feed(chunk):
+            self._submit(content_chunk)
+
+    def close(self) -> None:
+        for content_chunk in self.chunker.flush():
+            self._submit(content_chunk)
+
+        self._executor.shutdown()
+        self._raise_error()
+        self.store.save_manifest(self.manifest)
+        self.logger.info(
+            "[%s] backup stored to chunk store: %s | %i chunks (%i new) | %.1f MB -> %.1f MB",
+            self.db_name,
+            self.manifest.key,
+            len(self.manifest.chunks),
+            self.manifest.new_chunks,
+            self.manifest.size / 1024 / 1024,
+            self.manifest.stored_size / 1024 / 1024,
+        )
+
+    def abort(self) -> None:
+        # stored chunks are kept: they are reused by the next backups
+        self._executor.shutdown(cancel_futures=True)
+
+    def _submit(self, content_chunk: bytes) -> None:
+        self._raise_error()
+        chunk_hash = hashlib.sha256(content_chunk).hexdigest()
+        self.manifest.chunks.append((chunk_hash, len(content_chunk)))
+        self.manifest.size += len(content_chunk)
+        self._slots.acquire()  # bounds memory: count of chunks which are waiting for storing
+        future = self._executor.submit(self.store.store_chunk, content_chunk, chunk_hash)
+        with self._lock:
+            self._pending.add(future)
+
+        future.add_done_callback(self._on_stored)
+
+    def _on_stored(self, future: Future) -> None:
+        """Collects stored chunk's stats (the first error is raised by the next `_submit`)"""
+        with self._lock:
+            self._pending.discard(future)
+            if future.cancelled():
+                pass
+            elif exc := future.exception():
+                self._error = self._error or exc
+            else:
+                _, stored_size = future.result()
+                self.manifest.stored_size += stored_size
+                self.manifest.new_chunks += int(stored_size > 0)
+
+        self._slots.release()
+
+    def _raise_error(self) -> None:
+        if self._error:
+            raise self._error
+
+
+def get_chunk_store() -> ChunkStore:
+    """Chunk store with backend from settings (CHUNK_STORE_BACKEND: LOCAL | S3)"""
+    match settings.CHUNK_STORE_BACKEND:
+        case BackupLocation.LOCAL:
+            backend = LocalChunkBackend(settings.CHUNK_STORE_PATH)
+        case BackupLocation.S3:
+            backend = S3ChunkBackend(prefix=os.path.join(settings.S3_PATH or "", "chunk-store"))
+        case _:
+            raise BackupError(f"Unknown chunk store's backend {settings.CHUNK_STORE_BACKEND}")
+
+    return ChunkStore(backend)
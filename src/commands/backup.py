@@ -5,14 +5,32 @@ cli's logic for
 import sys
 import logging
 from functools import partial
+from typing import Type
 
 import click
 
-from src import utils, settings
+from src import catalog, fanout, integrity, metrics, scratch, utils, settings, pipeline, toc
+from src.chunkstore import ChunkStoreSink, Manifest, get_chunk_store
 from src.handlers import HANDLERS, BaseHandler, HANDLERS_HUMAN_READABLE
-from src.constants import BACKUP_LOCATIONS, BackupLocation, BackupHandler
+from src.constants import (
+    BACKUP_LOCATIONS,
+    COMPRESSIONS,
+    CONTAINER_HANDLERS,
+    DUMP_FORMATS,
+    BackupLocation,
+    BackupHandler,
+    Compression,
+)
 from src.run import logger_ctx
-from src.utils import LoggerContext, split_option_values
+from src.exceptions import ScratchSpaceError
+from src.utils import (
+    BackupError,
+    LoggerContext,
+    filter_names,
+    is_pattern,
+    s3_transfer_options,
+    split_option_values,
+)
 
 module_logger = logging.getLogger("backup")
 
@@ -22,6 +40,7 @@ module_logger = logging.getLogger("backup")
     "DB",
     metavar="DB_NAME",
     type=str,
+    default="",
 )
 @click.option(
     "--from",
@@ -63,30 +82,140 @@ module_logger = logging.getLogger("backup")
     "-e",
     "--encrypt",
     is_flag=True,
-    help="Turn ON backup's encryption (with openssl)",
+    help="Turn ON backup's encryption (AES-256-GCM)",
+)
+@click.option(
+    "-s",
+    "--stream",
+    is_flag=True,
+    help=(
+        "Turn ON streaming mode: dump -> compression -> (encryption) -> destinations "
+        "without intermediate files"
+    ),
+)
+@click.option(
+    "--compression",
+    metavar="COMPRESSION",
+    type=click.Choice(COMPRESSIONS),
+    default=settings.COMPRESSION,
+    show_default=True,
+    help=f"Compression's codec for result backup: {COMPRESSIONS}",
+)
+@click.option(
+    "--compression-level",
+    metavar="LEVEL",
+    type=int,
+    default=settings.COMPRESSION_LEVEL,
+    help="Compression's level (codec's default if not set).",
+)
+@click.option(
+    "--compression-threads",
+    metavar="THREADS",
+    type=click.IntRange(min=1),
+    default=settings.COMPRESSION_THREADS,
+    show_default=True,
+    help="Count of compression's threads (for pigz / zstd).",
+)
+@click.option(
+    "--dump-format",
+    "--pg-format",
+    "dump_format",
+    metavar="DUMP_FORMAT",
+    type=click.Choice(DUMP_FORMATS),
+    help=(
+        f"Format of dump: {DUMP_FORMATS}. PG: pg_dump -F (env: PG_DUMP_FORMAT), "
+        f"MySQL: plain - mysqldump, directory - mydumper (env: MYSQL_DUMP_FORMAT)."
+    ),
+)
+@click.option(
+    "-j",
+    "--jobs",
+    metavar="JOBS",
+    type=click.IntRange(min=1),
+    help=(
+        "Count of parallel dump's jobs for DUMP_FORMAT=directory: pg_dump's jobs "
+        "(env: PG_JOBS) or mydumper's threads (env: MYSQL_JOBS)."
+    ),
+)
+@click.option(
+    "-a",
+    "--all",
+    "all_databases",
+    is_flag=True,
+    help="Backup all databases which are found on the server (psql -l / SHOW DATABASES).",
 )
+@click.option(
+    "--exclude",
+    metavar="EXCLUDE",
+    type=str,
+    default="",
+    help="Comma separated list of DB names (or patterns) which should be skipped.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    metavar="WORKERS",
+    type=click.IntRange(min=1),
+    default=settings.BACKUP_WORKERS,
+    show_default=True,
+    help="Count of databases which are backed up concurrently.",
+)
+@click.option(
+    "--per-host-limit",
+    metavar="LIMIT",
+    type=click.IntRange(min=0),
+    default=settings.BACKUP_PER_HOST_LIMIT,
+    show_default=True,
+    help="Max count of concurrent backups for the same DB server (0 - limited by workers).",
+)
+@click.option(
+    "--timeout",
+    metavar="SECONDS",
+    type=click.IntRange(min=0),
+    default=settings.JOB_TIMEOUT,
+    show_default=True,
+    help=(
+        "Max duration of each DB's backup: the job is cancelled and its processes are "
+        "terminated after it (env: JOB_TIMEOUT, 0 - without limit)."
+    ),
+)
+@s3_transfer_options
 @click.option("-v", "--verbose", is_flag=True, flag_value=True, help="Enables verbose mode.")
 @click.option("--no-colors", is_flag=True, help="Disables colorized output.")
+@metrics.track_run("backup")
 def cli(
     db: str,
     backup_handler: BackupHandler,
     docker_container: str | None,
     encrypt: bool,
+    stream: bool,
     destination: tuple[BackupLocation, ...],
     destination_file: str | None,
+    compression: str,
+    compression_level: int | None,
+    compression_threads: int,
+    dump_format: str | None,
+    jobs: int | None,
+    all_databases: bool,
+    exclude: str,
+    workers: int,
+    per_host_limit: int,
+    timeout: int,
     verbose: bool,
     no_colors: bool,
+    **s3_options,
 ):
     """
     Backups DB from specific container (or service)
     and uploads it to S3 and/or to the local storage.
+
+    DB_NAME can be a comma separated list of names or glob-like patterns (ex.: 'prod_*').
     """
 
     logger = LoggerContext(verbose=verbose, skip_colors=no_colors, logger=module_logger)
     logger_ctx.set(logger)
-    logger.info("[%s] BACKUP STARTING ...", db)
 
-    if backup_handler == BackupHandler.PG_CONTAINER and not docker_container:
+    if backup_handler in CONTAINER_HANDLERS and not docker_container:
         logger.critical("Using handler '%s' requires '--docker-container' argument", backup_handler)
         sys.exit(1)
 
@@ -94,32 +223,318 @@ def cli(
         logger.critical("Using destination 'FILE' requires '--file' argument")
         sys.exit(1)
 
+    if BackupLocation.CHUNKS in destination and encrypt:
+        logger.critical("Destination 'CHUNKS' doesn't support '--encrypt' flag")
+        sys.exit(1)
+
     try:
-        handler = HANDLERS[backup_handler]
-        backup_handler: BaseHandler = handler(db, container_name=docker_container, logger=logger)
+        handler_class = HANDLERS[backup_handler]
     except KeyError:
         logger.critical("Unknown handler '%s'", backup_handler)
         sys.exit(1)
 
-    try:
-        backup_full_path = backup_handler.backup()
+    if BackupLocation.S3 in destination or (
+        BackupLocation.CHUNKS in destination and settings.CHUNK_STORE_BACKEND == BackupLocation.S3
+    ):
+        utils.configure_s3_transfer(**s3_options)
 
-        if encrypt:
-            backup_full_path = utils.encrypt_file(db_name=db, file_path=backup_full_path)
+    handler_kwargs = {
+        "container_name": docker_container,
+        "compression": compression,
+        "compression_level": compression_level,
+        "compression_threads": compression_threads,
+        "dump_format": dump_format,
+        "jobs": jobs,
+        "logger": logger,
+    }
+    db_names = [name.strip() for name in db.split(",") if name.strip()]
+    if not db_names and not all_databases:
+        logger.critical("DB_NAME argument is required (or use '--all' flag)")
+        sys.exit(1)
 
-        if BackupLocation.LOCAL in destination:
-            utils.copy_file(db_name=db, src=backup_full_path, dst=settings.LOCAL_PATH)
+    if all_databases or any(is_pattern(name) for name in db_names) or exclude:
+        try:
+            found_db_names = handler_class.discover_databases(**handler_kwargs)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            logger.exception("Couldn't discover databases on the server: %r", exc)
+            sys.exit(2)
 
-        if BackupLocation.FILE in destination:
-            utils.copy_file(db_name=db, src=backup_full_path, dst=destination_file)
+        db_names = filter_names(
+            found_db_names,
+            patterns=db_names or ["*"],
+            exclude=[name.strip() for name in exclude.split(",") if name.strip()],
+        )
+        if not db_names:
+            logger.critical("No databases found for requested names: '%s'", db or "*")
+            sys.exit(1)
 
-        if BackupLocation.S3 in destination:
-            utils.s3_upload(db_name=db, backup_path=backup_full_path)
+    from src.jobs import run_jobs  # asyncio is heavy: it is imported only when jobs are run
 
-    # pylint: disable=broad-exception-caught
-    except Exception as exc:
-        logger.exception("[%s] BACKUP FAILED\n %r", db, exc)
+    def run_backup(db_name: str) -> None:
+        backup_job(
+            db_name,
+            handler_class=handler_class,
+            handler_kwargs=handler_kwargs,
+            destination=destination,
+            destination_file=destination_file,
+            encrypt=encrypt,
+            stream=stream,
+        )
+
+    if len(db_names) == 1:
+        (result,) = run_jobs(db_names, run_backup, timeout=timeout)
+        if not result.success:
+            logger.critical("[%s] BACKUP FAILED\n %s", result.name, result.error)
+            sys.exit(2)
+
+        return
+
+    logger.info("BACKUP STARTING for %i databases: %s", len(db_names), db_names)
+    results = run_jobs(
+        db_names,
+        run_backup,
+        workers=workers,
+        key_func=lambda _: handler_class.concurrency_key(**handler_kwargs),
+        per_key_limit=per_host_limit,
+        timeout=timeout,
+    )
+    for result in results:
+        if result.success:
+            logger.info("[%s] BACKUP SUCCESS (%.1fs)", result.name, result.duration)
+        else:
+            logger.error(
+                "[%s] BACKUP FAILED (%.1fs): %s", result.name, result.duration, result.error
+            )
+
+    if failed := [result.name for result in results if not result.success]:
+        logger.critical("BACKUP FAILED for %i/%i databases: %s", len(failed), len(results), failed)
         sys.exit(2)
 
-    utils.remove_file(backup_full_path)
+    logger.info("BACKUP SUCCESS for all %i databases", len(results))
+
+
+def backup_job(
+    db: str,
+    handler_class: Type[BaseHandler],
+    handler_kwargs: dict,
+    destination: tuple[BackupLocation, ...],
+    destination_file: str | None,
+    encrypt: bool = False,
+    stream: bool = False,
+) -> None:
+    """
+    Runs backup for the single DB in its own scratch workspace (see `src.scratch`): free space
+    for the dump is checked before it is started (backup is streamed if no scratch volume fits
+    the estimated dump's size), the workspace is removed after the backup
+
+    :raise `BackupError`
+    """
+    logger = logger_ctx.get(module_logger)
+    space = scratch.get_scratch_space()
+    fallback = False
+    if stream or set(destination) == {BackupLocation.CHUNKS}:
+        # streamed dump doesn't need scratch space (only small sidecars are written)
+        workspace = space.allocate(db)
+    else:
+        estimate = scratch.estimate_dump_size(db, handler_class, **handler_kwargs)
+        try:
+            workspace = space.allocate(db, required=estimate.required)
+        except ScratchSpaceError as exc:
+            if settings.SCRATCH_FALLBACK != "stream":
+                raise
+
+            logger.warning("[%s] %s: backup will be streamed", db, exc.message)
+            workspace, stream, fallback = space.allocate(db), True, True
+
+    with workspace:
+        handler = handler_class(db, **handler_kwargs)
+        if fallback and not handler.supports_streaming:
+            raise ScratchSpaceError(
+                f"Not enough scratch space for {db} and its dump ({handler.dump_format}) "
+                f"can't be streamed"
+            )
+
+        backup_db(
+            db,
+            handler=handler,
+            destination=destination,
+            destination_file=destination_file,
+            encrypt=encrypt,
+            stream=stream,
+        )
+
+
+def backup_db(
+    db: str,
+    handler: BaseHandler,
+    destination: tuple[BackupLocation, ...],
+    destination_file: str | None,
+    encrypt: bool = False,
+    stream: bool = False,
+) -> None:
+    """
+    Runs backup for the single DB and moves result to requested destinations
+
+    :raise `BackupError`
+    """
+    logger = logger_ctx.get(module_logger)
+    logger.info("[%s] BACKUP STARTING ...", db)
+    if BackupLocation.CHUNKS in destination:
+        manifest = backup_to_chunk_store(db, handler, encrypt=encrypt)
+        catalog.register_backup(
+            db,
+            file_name=manifest.backup_name,
+            targets={BackupLocation.CHUNKS: manifest.key},
+            size=manifest.size,
+            compression=str(Compression.NONE),
+        )
+        destination = tuple(
+            location for location in destination if location != BackupLocation.CHUNKS
+        )
+        if not destination:
+            logger.info("[%s] BACKUP SUCCESS", db)
+            return
+
+    if stream:
+        backup_name = handler.get_stream_filename(encrypt=encrypt)
+        sinks = pipeline.build_sinks(db, backup_name, destination, destination_file)
+        digest_sink = pipeline.DigestSink(db, backup_name)
+        result = handler.backup_stream([*sinks, digest_sink], encrypt=encrypt)
+        catalog.register_backup(
+            db,
+            file_name=backup_name,
+            targets=result.targets,
+            size=result.size,
+            compression=str(handler.codec.name),
+            encrypted=encrypt,
+            checksum=digest_sink.checksum.digest,
+        )
+        deliver_stream_manifest(
+            db, backup_name, digest_sink.checksum, tuple(result.targets), destination_file
+        )
+        if result.errors:
+            raise BackupError(
+                f"Couldn't stream backup to {', '.join(result.errors)}: "
+                f"{'; '.join(repr(exc) for exc in result.errors.values())}"
+            )
+
+        logger.info("[%s] BACKUP SUCCESS", db)
+        return
+
+    backup_full_path, checksum = None, None
+    if BackupLocation.S3 in destination:
+        # backup's file of the previous (interrupted) run is uploaded instead of a new dump
+        file_suffix = handler.compressed_backup_path.name.removeprefix(handler.backup_filename)
+        file_suffix = f"{file_suffix}{'.enc' if encrypt else ''}"
+        if backup_full_path := utils.find_resumable_s3_upload(db, file_suffix=file_suffix):
+            logger.info("[%s] Resuming upload of the previous backup %s", db, backup_full_path)
+
+    if not backup_full_path:
+        backup_full_path = handler.backup(with_toc=not encrypt)
+        checksum = handler.checksum
+        if encrypt:
+            hasher = integrity.Hasher()
+            backup_full_path = utils.encrypt_file(
+                db_name=db, file_path=backup_full_path, hasher=hasher
+            )
+            checksum = hasher.result()
+
+    if encrypt:
+        # dump's TOC would disclose the schema of encrypted backup: it isn't built or stored
+        # (TOC of the resumed backup's previous run is removed)
+        toc.sidecar_path(handler.compressed_backup_path).unlink(missing_ok=True)
+
+    manifest_path = integrity.manifest_path(backup_full_path)
+    if not checksum:
+        # resumed upload (manifest of the previous run) or backup which wasn't hashed on the fly
+        if manifest_path.exists():
+            checksum = integrity.Checksum.load(manifest_path)
+        else:
+            checksum = integrity.file_checksum(backup_full_path)
+
+    checksum.save(manifest_path)
+    sidecars = [
+        path for path in [toc.sidecar_path(backup_full_path), manifest_path] if path.exists()
+    ]
+    result = fanout.fan_out(
+        db,
+        backup_full_path,
+        destination,
+        destination_file,
+        sidecars=sidecars,
+        metadata=checksum.metadata,
+    )
+    if result.targets:
+        catalog.register_backup(
+            db,
+            file_name=backup_full_path.name,
+            targets=result.targets,
+            size=backup_full_path.stat().st_size,
+            compression=str(handler.codec.name),
+            encrypted=encrypt,
+            checksum=checksum.digest,
+        )
+
+    # the file of interrupted S3 upload is kept: the next run resumes the upload
+    if BackupLocation.S3 not in result.errors:
+        for path in (backup_full_path, *sidecars):
+            utils.remove_file(path)
+    else:
+        scratch.keep(backup_full_path, *sidecars)
+
+    if result.errors:
+        raise BackupError(
+            f"Couldn't deliver backup to {', '.join(result.errors)}: "
+            f"{'; '.join(repr(exc) for exc in result.errors.values())}"
+        )
+
     logger.info("[%s] BACKUP SUCCESS", db)
+
+
+def deliver_stream_manifest(
+    db: str,
+    backup_name: str,
+    checksum: integrity.Checksum,
+    destination: tuple[BackupLocation, ...],
+    destination_file: str | None,
+) -> None:
+    """
+    Delivers checksum's manifest of streamed backup (it is known only after the stream's end,
+    so it isn't stored in S3 object's metadata)
+
+    :raise `BackupError`
+    """
+    manifest_path = integrity.manifest_path(scratch.current_dir() / backup_name)
+    checksum.save(manifest_path)
+    try:
+        result = fanout.fan_out(db, manifest_path, destination, destination_file)
+    finally:
+        utils.remove_file(manifest_path)
+
+    if result.errors:
+        raise BackupError(
+            f"Couldn't deliver checksum's manifest to {', '.join(result.errors)}: "
+            f"{'; '.join(repr(exc) for exc in result.errors.values())}"
+        )
+
+
+def backup_to_chunk_store(db: str, handler: BaseHandler, encrypt: bool = False) -> Manifest:
+    """
+    Streams raw (uncompressed) dump to the deduplicated chunk store: only new chunks are stored.
+    Compression and encryption of the whole stream break deduplication, so chunks are
+    compressed separately (by the store itself).
+
+    :return: manifest of stored backup
+    :raise `BackupError`
+    """
+    if encrypt:
+        raise BackupError("Encryption is not supported for CHUNKS destination yet")
+
+    sink = ChunkStoreSink(
+        db,
+        filename=handler.backup_filename,
+        store=get_chunk_store(),
+        dump_extension=handler.dump_extension,
+    )
+    handler.backup_stream([sink], compress=False)
+    return sink.manifest
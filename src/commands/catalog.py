@@ -0,0 +1,88 @@
+"""
+cli's logic for
+> run catalog list|latest|find ...
+"""
+
+import sys
+import datetime
+import logging
+
+import click
+
+from src import catalog
+from src.catalog import CatalogEntry
+from src.constants import BACKUP_LOCATIONS, BackupLocation
+from src.run import logger_ctx
+from src.settings import DATE_FORMAT
+from src.utils import LoggerContext
+
+module_logger = logging.getLogger("catalog")
+
+
+def location_option(function):
+    """Adds '--location' option (filter by backup's location)"""
+    return click.option(
+        "--location",
+        metavar="LOCATION",
+        type=click.Choice(BACKUP_LOCATIONS),
+        help=f"Location of backups: {BACKUP_LOCATIONS}",
+    )(function)
+
+
+def echo_entries(entries: list[CatalogEntry]) -> None:
+    """Prints found backups (one per line)"""
+    for entry in entries:
+        click.echo(
+            f"{entry.created_at:%Y-%m-%d %H:%M:%S} | {entry.db_name} | {entry.location} | "
+            f"{entry.size or 0:>12} | {entry.compression or '-'}"
+            f"{' (encrypted)' if entry.encrypted else ''} | {entry.path}"
+        )
+
+
+@click.group("catalog", short_help="Search backups in the catalog (without storage's scanning)")
+@click.option("-v", "--verbose", is_flag=True, flag_value=True, help="Enables verbose mode.")
+@click.option("--no-colors", is_flag=True, help="Disables colorized output.")
+def cli(verbose: bool, no_colors: bool):
+    """Indexed catalog of created backups (see CATALOG_PATH)"""
+    logger = LoggerContext(verbose=verbose, skip_colors=no_colors, logger=module_logger)
+    logger_ctx.set(logger)
+
+
+@cli.command("list")
+@click.argument("DB", metavar="DB_NAME", type=str, default="")
+@location_option
+@click.option("--limit", metavar="LIMIT", type=click.IntRange(min=1), help="Max count of backups.")
+def list_backups(db: str, location: BackupLocation | None, limit: int | None):
+    """Lists backups (newest first)"""
+    echo_entries(catalog.get_catalog().list(db_name=db, location=location, limit=limit))
+
+
+@cli.command("latest")
+@click.argument("DB", metavar="DB_NAME", type=str)
+@location_option
+def latest_backup(db: str, location: BackupLocation | None):
+    """Shows the latest backup of DB"""
+    if not (entry := catalog.get_catalog().latest(db, location=location)):
+        logger_ctx.get(module_logger).critical("[%s] No backups found in the catalog", db)
+        sys.exit(1)
+
+    echo_entries([entry])
+
+
+@cli.command("find")
+@click.argument("DB", metavar="DB_NAME", type=str)
+@location_option
+@click.option(
+    "--date",
+    metavar="BACKUP_DATE",
+    default=datetime.date.today().strftime(DATE_FORMAT),
+    type=click.DateTime(formats=[DATE_FORMAT]),
+    help=f"Date of backups (in ISO format: {DATE_FORMAT})",
+)
+def find_backups(db: str, location: BackupLocation | None, date: datetime.datetime):
+    """Finds backups of DB for requested date"""
+    if not (entries := catalog.get_catalog().list(db_name=db, location=location, date=date)):
+        logger_ctx.get(module_logger).critical("[%s] No backups found for %s", db, date.date())
+        sys.exit(1)
+
+    echo_entries(entries)
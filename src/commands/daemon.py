@@ -0,0 +1,156 @@
+"""
+cli's logic for
+> run daemon run|check|status ...
+"""
+
+import sys
+import json
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+
+import click
+
+from src import metrics, settings, utils
+from src.commands.backup import backup_job
+from src.exceptions import ScheduleError
+from src.handlers import HANDLERS
+from src.run import logger_ctx
+from src.scheduler import ScheduledJob, Scheduler, load_schedule
+from src.utils import LoggerContext, s3_transfer_options
+
+module_logger = logging.getLogger("daemon")
+
+
+def config_argument(function):
+    """Adds 'CONFIG' argument (path to TOML schedule's config)"""
+    return click.argument(
+        "CONFIG",
+        metavar="CONFIG",
+        type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    )(function)
+
+
+def read_schedule(config: Path) -> list[ScheduledJob]:
+    """Loads jobs from the config (exits with error's message for invalid one)"""
+    try:
+        return load_schedule(config)
+    except ScheduleError as exc:
+        logger_ctx.get(module_logger).critical("Invalid schedule: %s", exc.message)
+        sys.exit(1)
+
+
+def run_backup(job: ScheduledJob) -> None:
+    """Runs backup of the scheduled job (in the daemon's worker thread)"""
+    with metrics.track_job(f"daemon-{job.name}"):
+        backup_job(
+            job.db,
+            handler_class=HANDLERS[job.handler],
+            handler_kwargs={"logger": logger_ctx.get(module_logger), **job.handler_kwargs},
+            destination=job.destination,
+            destination_file=job.destination_file,
+            encrypt=job.encrypt,
+            stream=job.stream,
+        )
+
+
+@click.group("daemon", short_help="Run backups by the schedule (long-running process)")
+@click.option("-v", "--verbose", is_flag=True, flag_value=True, help="Enables verbose mode.")
+@click.option("--no-colors", is_flag=True, help="Disables colorized output.")
+def cli(verbose: bool, no_colors: bool):
+    """Scheduler of backups (cron expressions per DB, see schedule.toml.template)"""
+    logger = LoggerContext(verbose=verbose, skip_colors=no_colors, logger=module_logger)
+    logger_ctx.set(logger)
+
+
+@cli.command("run")
+@config_argument
+@click.option(
+    "-w",
+    "--workers",
+    metavar="WORKERS",
+    type=click.IntRange(min=1),
+    default=settings.BACKUP_WORKERS,
+    show_default=True,
+    help="Count of databases which are backed up concurrently.",
+)
+@click.option(
+    "--per-host-limit",
+    metavar="LIMIT",
+    type=click.IntRange(min=0),
+    default=settings.BACKUP_PER_HOST_LIMIT,
+    show_default=True,
+    help="Max count of concurrent backups for the same DB server (0 - limited by workers).",
+)
+@click.option(
+    "--status-port",
+    metavar="PORT",
+    type=click.IntRange(min=0, max=65535),
+    default=settings.DAEMON_STATUS_PORT,
+    show_default=True,
+    help="Port of HTTP endpoint with jobs' status (env: DAEMON_STATUS_PORT, 0 - disabled).",
+)
+@s3_transfer_options
+def run_daemon(config: Path, workers: int, per_host_limit: int, status_port: int, **s3_options):
+    """Runs backups by the schedule until SIGTERM / SIGINT"""
+    logger = logger_ctx.get(module_logger)
+    jobs = read_schedule(config)
+    if any(job.uses_s3 for job in jobs):
+        s3 = utils.get_s3()
+        # S3 client is created once and is shared by all jobs of the daemon
+        utils.configure_s3_transfer(**s3_options)
+        s3.get_client()
+
+    scheduler = Scheduler(
+        jobs,
+        runner=run_backup,
+        workers=workers,
+        per_host_limit=per_host_limit,
+        status_port=status_port,
+    )
+    try:
+        asyncio.run(scheduler.run())
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.exception("Daemon failed: %r", exc)
+        sys.exit(2)
+
+
+@cli.command("check")
+@config_argument
+def check_schedule(config: Path):
+    """Validates the config and shows the next runs of jobs"""
+    now = datetime.now()
+    for job in read_schedule(config):
+        click.echo(
+            f"{job.schedule.next_after(now):%Y-%m-%d %H:%M} | {job.name} | "
+            f"{job.schedule.expression} | {job.handler} -> {','.join(job.destination)}"
+            f"{f' (jitter: {job.jitter}s)' if job.jitter else ''}"
+        )
+
+
+@cli.command("status")
+@click.option(
+    "--status-file",
+    metavar="PATH",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=settings.DAEMON_STATUS_PATH,
+    show_default=True,
+    help="Status file of the running daemon (env: DAEMON_STATUS_PATH).",
+)
+def show_status(status_file: Path):
+    """Shows status of the daemon's jobs"""
+    try:
+        status = json.loads(status_file.read_text())
+    except (OSError, ValueError) as exc:
+        logger_ctx.get(module_logger).critical("Couldn't read daemon's status: %r", exc)
+        sys.exit(1)
+
+    click.echo(f"Daemon is {status['state']} (started at {status['started_at']})")
+    for job in status["jobs"]:
+        last_result = {True: "success", False: "failed", None: "-"}[job["last_success"]]
+        click.echo(
+            f"{job['name']} | {job['state']} | next: {job['next_run_at'] or '-'} | "
+            f"last: {job['last_started_at'] or '-'} ({last_result}) | "
+            f"runs: {job['runs']}, failures: {job['failures']}, skipped: {job['skipped']}"
+        )
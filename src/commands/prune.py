@@ -0,0 +1,124 @@
+"""
+cli's logic for
+> run prune ...
+"""
+
+import sys
+import logging
+from functools import partial
+
+import click
+
+from src import settings
+from src.constants import BackupLocation
+from src.retention import (
+    RetentionPolicy,
+    delete_backups,
+    list_local_backups,
+    list_s3_backups,
+    select_backups_to_delete,
+)
+from src.run import logger_ctx
+from src.utils import LoggerContext, filter_names, split_option_values
+
+module_logger = logging.getLogger("prune")
+PRUNE_LOCATIONS = (BackupLocation.LOCAL, BackupLocation.S3)
+
+
+@click.command("prune", short_help="Remove old backups (GFS-like retention policy)")
+@click.argument("DB", metavar="DB_NAME", type=str, default="")
+@click.option(
+    "--from",
+    "locations",
+    metavar="LOCATION",
+    required=True,
+    type=str,
+    help=f"Comma separated list of storages for pruning: {tuple(map(str, PRUNE_LOCATIONS))}",
+    callback=partial(split_option_values, result_type=BackupLocation),
+)
+@click.option(
+    "--keep-daily",
+    metavar="DAYS",
+    type=click.IntRange(min=0),
+    default=settings.PRUNE_KEEP_DAILY,
+    show_default=True,
+    help="Keep the newest backup for each of the last N days.",
+)
+@click.option(
+    "--keep-weekly",
+    metavar="WEEKS",
+    type=click.IntRange(min=0),
+    default=settings.PRUNE_KEEP_WEEKLY,
+    show_default=True,
+    help="Keep the newest backup for each of the last N weeks.",
+)
+@click.option(
+    "--keep-monthly",
+    metavar="MONTHS",
+    type=click.IntRange(min=0),
+    default=settings.PRUNE_KEEP_MONTHLY,
+    show_default=True,
+    help="Keep the newest backup for each of the last N months.",
+)
+@click.option("--dry-run", is_flag=True, help="Only show backups which would be removed.")
+@click.option("-v", "--verbose", is_flag=True, flag_value=True, help="Enables verbose mode.")
+@click.option("--no-colors", is_flag=True, help="Disables colorized output.")
+def cli(
+    db: str,
+    locations: list[BackupLocation],
+    keep_daily: int,
+    keep_weekly: int,
+    keep_monthly: int,
+    dry_run: bool,
+    verbose: bool,
+    no_colors: bool,
+):
+    """
+    Removes old backups from LOCAL_PATH and/or S3 bucket (the latest backup of DB is always kept).
+
+    DB_NAME can be a comma separated list of names or glob-like patterns (all DBs by default).
+    """
+    logger = LoggerContext(verbose=verbose, skip_colors=no_colors, logger=module_logger)
+    logger_ctx.set(logger)
+
+    if unsupported := [location for location in locations if location not in PRUNE_LOCATIONS]:
+        logger.critical("Pruning is not supported for locations: %s", unsupported)
+        sys.exit(1)
+
+    policy = RetentionPolicy(daily=keep_daily, weekly=keep_weekly, monthly=keep_monthly)
+    patterns = [name.strip() for name in db.split(",") if name.strip()] or ["*"]
+    try:
+        backups = []
+        if BackupLocation.LOCAL in locations:
+            backups.extend(list_local_backups(settings.LOCAL_PATH))
+
+        if BackupLocation.S3 in locations:
+            backups.extend(list_s3_backups())
+
+        db_names = set(filter_names({backup.db_name for backup in backups}, patterns))
+        backups = [backup for backup in backups if backup.db_name in db_names]
+        to_delete = select_backups_to_delete(backups, policy)
+        for backup in sorted(to_delete, key=lambda backup: (backup.db_name, backup.created_at)):
+            logger.info(
+                "[%s] %s backup %s (%s)",
+                backup.db_name,
+                "would remove" if dry_run else "removing",
+                backup.path,
+                backup.location,
+            )
+
+        if not dry_run:
+            to_delete = delete_backups(to_delete)
+
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.exception("PRUNE FAILED: %r", exc)
+        sys.exit(2)
+
+    logger.info(
+        "PRUNE %s: %i of %i backups %s (%.1f MB)",
+        "DRY RUN" if dry_run else "SUCCESS",
+        len(to_delete),
+        len(backups),
+        "would be removed" if dry_run else "removed",
+        sum(backup.size for backup in to_delete) / 1024 / 1024,
+    )
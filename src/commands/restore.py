@@ -9,12 +9,14 @@ from pathlib import Path
 
 import click
 
-from src import utils, settings
-from src.constants import BACKUP_LOCATIONS, BackupHandler, BackupLocation
-from src.handlers import HANDLERS
+from src import metrics, pipeline, scratch, toc, utils, settings
+from src.chunkstore import get_chunk_store
+from src.constants import BACKUP_LOCATIONS, CONTAINER_HANDLERS, BackupHandler, BackupLocation
+from src.exceptions import RestoreBackupError
+from src.handlers import HANDLERS, BaseHandler
 from src.run import logger_ctx
 from src.settings import DATE_FORMAT
-from src.utils import LoggerContext, validate_envar_option
+from src.utils import LoggerContext, s3_transfer_options, validate_envar_option
 
 module_logger = logging.getLogger("backup")
 
@@ -69,8 +71,74 @@ module_logger = logging.getLogger("backup")
         f"(default: {datetime.date.today().strftime(DATE_FORMAT)})"
     ),
 )
+@click.option(
+    "-j",
+    "--jobs",
+    metavar="JOBS",
+    type=click.IntRange(min=1),
+    help=(
+        "Count of parallel restore's jobs: pg_restore's jobs for custom / directory formats "
+        "(env: PG_JOBS) or myloader's threads for directory format (env: MYSQL_JOBS)."
+    ),
+)
+@click.option(
+    "-t",
+    "--table",
+    "tables",
+    metavar="TABLES",
+    type=str,
+    default="",
+    help="Comma separated list of tables (or patterns, ex.: 'public.users,logs_*') to restore.",
+)
+@click.option(
+    "--exclude-table",
+    "exclude_tables",
+    metavar="TABLES",
+    type=str,
+    default="",
+    help="Comma separated list of tables (or patterns) which should be skipped.",
+)
+@click.option(
+    "-n",
+    "--schema",
+    "schemas",
+    metavar="SCHEMAS",
+    type=str,
+    default="",
+    help="Comma separated list of schemas (or patterns) to restore.",
+)
+@click.option(
+    "--exclude-schema",
+    "exclude_schemas",
+    metavar="SCHEMAS",
+    type=str,
+    default="",
+    help="Comma separated list of schemas (or patterns) which should be skipped.",
+)
+@click.option(
+    "-s",
+    "--stream",
+    is_flag=True,
+    help=(
+        "Turn ON streaming mode: source -> (decryption) -> decompression -> restore's stdin "
+        "without intermediate files"
+    ),
+)
+@click.option(
+    "--timeout",
+    metavar="SECONDS",
+    type=click.IntRange(min=0),
+    default=settings.JOB_TIMEOUT,
+    show_default=True,
+    help=(
+        "Max duration of each DB's restore: the job is cancelled and its processes are "
+        "terminated after it (env: JOB_TIMEOUT, 0 - without limit)."
+    ),
+)
+@s3_transfer_options
 @click.option("-v", "--verbose", is_flag=True, flag_value=True, help="Enables verbose mode.")
 @click.option("--no-colors", is_flag=True, help="Disables colorized output.")
+@metrics.track_run("restore")
 def cli(
     db: str,
     backup_source: BackupLocation,
@@ -78,8 +146,16 @@ def cli(
     docker_container: str | None,
     date: datetime.date,
     source_file: str | None,
+    jobs: int | None,
+    tables: str,
+    exclude_tables: str,
+    schemas: str,
+    exclude_schemas: str,
+    stream: bool,
+    timeout: int,
     verbose: bool,
     no_colors: bool,
+    **s3_options,
 ):
     """
     Prepares provided file (placed on S3 or local storage) and restore it to specified DB
@@ -88,7 +164,7 @@ def cli(
     logger_ctx.set(logger)
     logger.info("[%s] RESTORE STARTING ...", db)
 
-    if handler == BackupHandler.PG_CONTAINER and not docker_container:
+    if handler in CONTAINER_HANDLERS and not docker_container:
         logger.critical("Using handler '%s' requires '--docker-container' argument", handler)
         exit(1)
 
@@ -96,47 +172,177 @@ def cli(
         logger.critical("Using destination 'LOCAL_PATH' requires '--file' argument")
         exit(1)
 
+    restore_filter = toc.TocFilter(
+        tables=split_names(tables),
+        exclude_tables=split_names(exclude_tables),
+        schemas=split_names(schemas),
+        exclude_schemas=split_names(exclude_schemas),
+    )
     try:
         handler_class = HANDLERS[handler]
-        restore_handler = handler_class(db, container_name=docker_container, logger=logger)
+        restore_handler = handler_class(
+            db,
+            container_name=docker_container,
+            jobs=jobs,
+            restore_filter=restore_filter or None,
+            logger=logger,
+        )
     except KeyError:
         logger.critical("Unknown handler '%s'", handler)
         exit(1)
 
-    logger.info("Run restore logic...")
+    if backup_source == BackupLocation.FILE and not Path(source_file).exists():
+        raise click.FileError("Source file does not exist")
+
+    from src.jobs import run_jobs  # asyncio is heavy: it is imported only when jobs are run
+
+    def run_restore(_: str) -> None:
+        logger.info("Run restore logic...")
+        # fetched / decompressed backup's files are removed with the job's workspace
+        with scratch.get_scratch_space().allocate(db):
+            if stream:
+                restore_stream(db, restore_handler, backup_source, source_file, date, s3_options)
+            else:
+                restore_db(db, restore_handler, backup_source, source_file, date, s3_options)
+
+    (result,) = run_jobs([db], run_restore, timeout=timeout)
+    if not result.success:
+        logger.critical("[%s] RESTORE FAILED: %s", db, result.error)
+        sys.exit(2)
+
+    logger.info("[%s] RESTORE SUCCESS", db)
 
+
+def restore_db(
+    db: str,
+    handler: BaseHandler,
+    backup_source: BackupLocation,
+    source_file: str | None,
+    date: datetime.date,
+    s3_options: dict,
+) -> None:
+    """
+    Fetches backup's file from the source (downloads / copies, decrypts) and restores it
+
+    :raise `BackupError`
+    """
     match backup_source:
+        # local backups are read in place (decrypted / decompressed data goes to the workspace)
         case "FILE":
-            source_file = Path(source_file)
-            if not source_file.exists():
-                raise click.FileError("Source file does not exist")
-
-            utils.copy_file(db, src=source_file, dst=settings.TMP_BACKUP_DIR)
-            backup_full_path = settings.TMP_BACKUP_DIR / source_file.name
+            backup_full_path = Path(source_file)
 
         case "LOCAL":
-            backup_full_path = utils.local_file_search_by_date(
+            backup_full_path = utils.find_local_backup(
                 db_name=db,
                 date=date,
                 directory=settings.LOCAL_PATH,
             )
 
         case "S3":
+            utils.configure_s3_transfer(**s3_options)
             backup_full_path = utils.s3_download(db_name=db, date=date)
 
+        case "CHUNKS":
+            if settings.CHUNK_STORE_BACKEND == BackupLocation.S3:
+                utils.configure_s3_transfer(**s3_options)
+
+            chunk_store = get_chunk_store()
+            manifest = chunk_store.find_manifest(db_name=db, date=date)
+            backup_full_path = chunk_store.restore_to_file(
+                manifest,
+                file_path=scratch.current_dir() / f"{db}.backup.{manifest.dump_extension}",
+            )
+
         case _:
-            logger.critical("Unknown source '%s'", backup_source)
-            sys.exit(1)
+            raise RestoreBackupError(f"Unknown source '{backup_source}'")
+
+    toc_path = None
+    if str(backup_full_path).endswith(".enc"):
+        backup_full_path = utils.decrypt_file(
+            db_name=db, file_path=backup_full_path, directory=scratch.current_dir()
+        )
+    elif handler.supports_selective_restore:
+        toc_path = fetch_toc(db, backup_full_path, backup_source, source_file)
+
+    handler.restore(backup_full_path)
+    # stored backup (and its TOC) could be restored in place: only the fetched files are removed
+    for path in filter(None, (backup_full_path, toc_path)):
+        if path.resolve().is_relative_to(scratch.current_dir().resolve()):
+            utils.remove_file(path)
+
 
+def split_names(value: str) -> list[str]:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def fetch_toc(
+    db: str, backup_path: Path, backup_source: BackupLocation, source_file: str | None
+) -> Path | None:
+    """
+    Fetches dump's TOC (sidecar which is stored next to the backup) to the backup's directory.
+    TOC is optional: it is built by the dump itself if the sidecar isn't found.
+    """
+    logger = logger_ctx.get(module_logger)
+    toc_path = toc.sidecar_path(backup_path)
     try:
-        if str(backup_full_path).endswith(".enc"):
-            backup_full_path = utils.decrypt_file(db_name=db, file_path=backup_full_path)
+        match backup_source:
+            case "FILE" | "LOCAL":
+                directory = Path(source_file).parent if source_file else settings.LOCAL_PATH
+                source_path = toc.sidecar_path(directory / backup_path.name)
+                if source_path.exists() and source_path.resolve() != toc_path.resolve():
+                    utils.copy_file_data(source_path, toc_path)
 
-        restore_handler.restore(backup_full_path)
+            case "S3":
+                s3 = utils.get_s3()
+                s3.download_file(db, key=s3.get_key(toc_path.name), file_path=toc_path)
 
-    except Exception as exc:
-        logger.exception("[%s] RESTORE FAILED: %r", db, exc)
-        sys.exit(2)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.debug("[%s] Dump's TOC isn't found: %r", db, exc)
 
-    utils.remove_file(backup_full_path)
-    logger.info("[%s] RESTORE SUCCESS", db)
+    return toc_path if toc_path.exists() else None
+
+
+def restore_stream(
+    db: str,
+    handler: BaseHandler,
+    backup_source: BackupLocation,
+    source_file: str | None,
+    date: datetime.date,
+    s3_options: dict,
+) -> None:
+    """
+    Streams backup from the source directly to the restore command's stdin
+    (without downloading / copying / decrypting / decompressing to the local disk)
+
+    :raise `BackupError`
+    """
+    match backup_source:
+        case "FILE":
+            chunks = pipeline.iter_file(Path(source_file))
+            backup_name = Path(source_file).name
+
+        case "LOCAL":
+            backup_path = utils.find_local_backup(db, date=date, directory=settings.LOCAL_PATH)
+            chunks = pipeline.iter_file(backup_path)
+            backup_name = backup_path.name
+
+        case "S3":
+            s3 = utils.get_s3()
+            utils.configure_s3_transfer(**s3_options)
+            backup_name = utils.find_s3_backup_key(db, date=date)
+            chunks = s3.iter_object(db, key=backup_name)
+
+        case "CHUNKS":
+            if settings.CHUNK_STORE_BACKEND == BackupLocation.S3:
+                utils.configure_s3_transfer(**s3_options)
+
+            chunk_store = get_chunk_store()
+            manifest = chunk_store.find_manifest(db_name=db, date=date)
+            chunks = chunk_store.iter_chunks(manifest)
+            backup_name = manifest.key
+
+        case _:
+            raise RestoreBackupError(f"Unknown source '{backup_source}'")
+
+    logger_ctx.get(module_logger).info("[%s] Streaming backup %s ...", db, backup_name)
+    handler.restore_stream(chunks)
@@ -0,0 +1,120 @@
+"""
+cli's logic for
+> run verify ...
+"""
+
+import sys
+import logging
+from datetime import datetime
+from functools import partial
+
+import click
+
+from src import settings
+from src.constants import BackupLocation
+from src.integrity import verify_backup
+from src.retention import StoredBackup, list_local_backups, list_s3_backups
+from src.run import logger_ctx
+from src.utils import LoggerContext, filter_names, split_option_values
+
+module_logger = logging.getLogger("verify")
+VERIFY_LOCATIONS = (BackupLocation.LOCAL, BackupLocation.S3)
+
+
+def select_backups(
+    backups: list[StoredBackup], patterns: list[str], date: datetime | None, latest: bool
+) -> list[StoredBackup]:
+    """Filters found backups by DB's names (patterns), date of creation and latest flag"""
+    db_names = set(filter_names({backup.db_name for backup in backups}, patterns))
+    backups = [backup for backup in backups if backup.db_name in db_names]
+    if date:
+        backups = [backup for backup in backups if backup.created_at.date() == date.date()]
+
+    backups.sort(key=lambda backup: (backup.db_name, backup.location, backup.created_at))
+    if latest:
+        latest_backups = {(backup.db_name, backup.location): backup for backup in backups}
+        backups = list(latest_backups.values())
+
+    return backups
+
+
+@click.command("verify", short_help="Verify stored backups against their checksums")
+@click.argument("DB", metavar="DB_NAME", type=str, default="")
+@click.option(
+    "--from",
+    "locations",
+    metavar="LOCATION",
+    required=True,
+    type=str,
+    help=f"Comma separated list of storages: {tuple(map(str, VERIFY_LOCATIONS))}",
+    callback=partial(split_option_values, result_type=BackupLocation),
+)
+@click.option(
+    "--date",
+    metavar="DATE",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Verify only backups which were created at this date (YYYY-mm-dd).",
+)
+@click.option("--latest", is_flag=True, help="Verify only the latest backup of each DB.")
+@click.option(
+    "--fast",
+    is_flag=True,
+    help="Checks size, S3 metadata and header only (without reading of the whole backup).",
+)
+@click.option("-v", "--verbose", is_flag=True, flag_value=True, help="Enables verbose mode.")
+@click.option("--no-colors", is_flag=True, help="Disables colorized output.")
+def cli(
+    db: str,
+    locations: list[BackupLocation],
+    date: datetime | None,
+    latest: bool,
+    fast: bool,
+    verbose: bool,
+    no_colors: bool,
+):
+    """
+    Verifies backups from LOCAL_PATH and/or S3 bucket against their checksums
+    (manifest `{backup}.checksum.json` or S3 object's metadata).
+
+    DB_NAME can be a comma separated list of names or glob-like patterns (all DBs by default).
+    """
+    logger = LoggerContext(verbose=verbose, skip_colors=no_colors, logger=module_logger)
+    logger_ctx.set(logger)
+
+    if unsupported := [location for location in locations if location not in VERIFY_LOCATIONS]:
+        logger.critical("Verification is not supported for locations: %s", unsupported)
+        sys.exit(1)
+
+    patterns = [name.strip() for name in db.split(",") if name.strip()] or ["*"]
+    try:
+        backups = []
+        if BackupLocation.LOCAL in locations:
+            backups.extend(list_local_backups(settings.LOCAL_PATH))
+
+        if BackupLocation.S3 in locations:
+            backups.extend(list_s3_backups())
+
+        backups = select_backups(backups, patterns, date=date, latest=latest)
+
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.exception("VERIFY FAILED: %r", exc)
+        sys.exit(2)
+
+    results = [verify_backup(backup, fast=fast) for backup in backups]
+    for result in results:
+        log = logger.error if result.failed else logger.info
+        log(
+            "[%s] %s backup %s (%s): %s",
+            result.backup.db_name,
+            result.status.upper(),
+            result.backup.path,
+            result.backup.location,
+            result.message,
+        )
+
+    failed = sum(result.failed for result in results)
+    if failed:
+        logger.critical("VERIFY FAILED: %i of %i backups are corrupted", failed, len(results))
+        sys.exit(2)
+
+    logger.info("VERIFY SUCCESS: %i backups are checked", len(results))
@@ -0,0 +1,291 @@
+"""
+Pluggable compression codecs (gzip/pigz, zstd, lz4, none) for backup's files and streams.
+Codec of existing backup is detected by magic bytes (not by file's extension).
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import contextlib
+import subprocess
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Callable, Iterator
+
+from src import settings
+from src.constants import Compression
+from src.exceptions import BackupError, RestoreBackupError
+from src.process import Command, Pipeline
+from src.run import logger_ctx
+from src.utils import submit_in_context
+
+if TYPE_CHECKING:
+    from src.integrity import Hasher
+
+module_logger = logging.getLogger(__name__)
+TAR_MAGIC = b"ustar"
+TAR_MAGIC_OFFSET = 257
+
+
+@dataclasses.dataclass(frozen=True)
+class Codec:
+    """Compression codec: builds compress/decompress commands (stdin -> stdout)"""
+
+    name: Compression
+    extension: str
+    magic: bytes
+    compress_args: Callable[[int | None, int], list[str]]
+    decompress_args: Callable[[int], list[str]]
+
+    def compress_command(self, level: int | None = None, threads: int | None = None) -> Command:
+        """Command which compresses stdin to stdout"""
+        return self.compress_args(level, threads or settings.COMPRESSION_THREADS)
+
+    def decompress_command(self, threads: int | None = None) -> Command:
+        """Command which decompresses stdin to stdout"""
+        return self.decompress_args(threads or settings.COMPRESSION_THREADS)
+
+    def file_name(self, name: str) -> str:
+        """Name of compressed file (ex.: backup.sql -> backup.sql.zst)"""
+        return f"{name}.{self.extension}" if self.extension else name
+
+
+def _level(level: int | None) -> list[str]:
+    return [f"-{level}"] if level is not None else []
+
+
+def _gzip_compress(level: int | None, threads: int) -> list[str]:
+    # pigz is a multithreaded drop-in replacement of gzip (with the same output's format)
+    if threads > 1 and shutil.which("pigz"):
+        return ["pigz", "-c", "-p", str(threads), *_level(level)]
+
+    return ["gzip", "-c", *_level(level)]
+
+
+def _gzip_decompress(threads: int) -> list[str]:
+    # pigz uses extra threads for reading/writing/checksum only (decompression isn't parallel)
+    return ["pigz", "-dc"] if threads > 1 and shutil.which("pigz") else ["gzip", "-dc"]
+
+
+CODECS: dict[Compression, Codec] = {
+    Compression.GZIP: Codec(
+        name=Compression.GZIP,
+        extension="gz",
+        magic=b"\x1f\x8b",
+        compress_args=_gzip_compress,
+        decompress_args=_gzip_decompress,
+    ),
+    Compression.ZSTD: Codec(
+        name=Compression.ZSTD,
+        extension="zst",
+        magic=b"\x28\xb5\x2f\xfd",
+        compress_args=lambda level, threads: ["zstd", "-c", "-q", f"-T{threads}", *_level(level)],
+        decompress_args=lambda threads: ["zstd", "-dc", "-q"],
+    ),
+    Compression.LZ4: Codec(
+        name=Compression.LZ4,
+        extension="lz4",
+        magic=b"\x04\x22\x4d\x18",
+        compress_args=lambda level, threads: ["lz4", "-c", "-q", *_level(level)],
+        decompress_args=lambda threads: ["lz4", "-dc", "-q"],
+    ),
+    Compression.NONE: Codec(
+        name=Compression.NONE,
+        extension="",
+        magic=b"",
+        compress_args=lambda level, threads: ["cat"],
+        decompress_args=lambda threads: ["cat"],
+    ),
+}
+
+
+def get_codec(compression: Compression | str | None = None) -> Codec:
+    """Returns codec by name (or default one from settings)"""
+    try:
+        return CODECS[Compression(compression or settings.COMPRESSION)]
+    except ValueError as exc:
+        raise BackupError(f"Unknown compression '{compression}'") from exc
+
+
+def detect_codec(header: bytes) -> Codec:
+    """
+    Detects codec by the first bytes of compressed data (NONE for unknown data)
+
+    >>> detect_codec(b"\\x28\\xb5\\x2f\\xfd...").name
+    <Compression.ZSTD: 'zstd'>
+    >>> detect_codec(b"-- PostgreSQL database dump").name
+    <Compression.NONE: 'none'>
+    """
+    for codec in CODECS.values():
+        if codec.magic and header.startswith(codec.magic):
+            return codec
+
+    return CODECS[Compression.NONE]
+
+
+def detect_file_codec(file_path: Path) -> Codec:
+    """Detects codec of the file (by magic bytes)"""
+    with open(file_path, "rb") as file:
+        return detect_codec(file.read(8))
+
+
+def is_tar(header: bytes) -> bool:
+    """Detects tar's archive by (decompressed) header"""
+    return header[TAR_MAGIC_OFFSET : TAR_MAGIC_OFFSET + len(TAR_MAGIC)] == TAR_MAGIC
+
+
+def compress_path(
+    source_path: Path,
+    result_path: Path,
+    codec: Codec,
+    level: int | None = None,
+    threads: int | None = None,
+    hasher: "Hasher | None" = None,
+    lines_consumer: Callable[[Iterator[bytes]], object] | None = None,
+) -> Path:
+    """
+    Compresses dump's file (without tar's wrapper) or dump's directory (tar | codec)
+
+    :param hasher: calculates checksum of compressed data while it is written to the result
+                   (note: dump isn't read at all by NONE codec, so it isn't hashed)
+    :param lines_consumer: gets dump's lines while they are compressed (ex.: TOC's parser), so
+                           the dump isn't read again (it is called for dump's file only and not
+                           called by NONE codec)
+    :return: path to result (compressed) file
+    """
+    logger = logger_ctx.get(module_logger)
+    logger.debug("Compressing %s -> %s (codec: %s)", source_path, result_path, codec.name)
+    with contextlib.ExitStack() as stack:
+        source = None
+        if source_path.is_dir():
+            stdin = subprocess.DEVNULL
+            commands = [["tar", "-cf", "-", "-C", source_path.parent, source_path.name]]
+            if codec.name != Compression.NONE:
+                commands.append(codec.compress_command(level=level, threads=threads))
+
+        elif codec.name == Compression.NONE:
+            os.replace(source_path, result_path)
+            return result_path
+
+        else:
+            stdin = source = stack.enter_context(open(source_path, "rb"))
+            commands = [codec.compress_command(level=level, threads=threads)]
+            if lines_consumer:
+                stdin = subprocess.PIPE
+
+        stdout = stack.enter_context(open(result_path, "wb"))
+        pipeline = Pipeline(commands, stdin=stdin, stdout=subprocess.PIPE if hasher else stdout)
+        pipeline.start()
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=1))
+        feeding = None
+        if stdin == subprocess.PIPE:
+            feeding = submit_in_context(
+                executor, _feed_lines, source, pipeline.processes[0].stdin, lines_consumer
+            )
+
+        try:
+            if hasher:
+                with pipeline.stdout:
+                    while chunk := pipeline.stdout.read(settings.STREAM_CHUNK_SIZE):
+                        hasher.update(chunk)
+                        stdout.write(chunk)
+
+            if feeding:
+                feeding.result()
+
+        except BaseException:
+            pipeline.kill()
+            raise
+
+        pipeline.wait()
+
+    return result_path
+
+
+def _feed_lines(
+    source: IO[bytes], stdin: IO[bytes], consumer: Callable[[Iterator[bytes]], object]
+) -> None:
+    """Writes source's lines to the compression's stdin and passes them to the consumer"""
+
+    def lines() -> Iterator[bytes]:
+        for line in source:
+            stdin.write(line)
+            yield line
+
+    try:
+        consumer(lines())
+        for _ in lines():
+            pass  # the rest of lines which the consumer didn't read
+
+    except BrokenPipeError:
+        pass  # compression's process has exited: its own error is reported
+
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            stdin.close()
+
+
+def decompress_path(source_path: Path, directory: Path, dump_name: str) -> Path:
+    """
+    Decompresses backup's file (codec is detected by magic bytes). Tar archives
+    (legacy backups or dump's directories) are extracted to the provided directory,
+    other data is written to `directory / dump_name`.
+
+    :return: path to decompressed dump (file or directory)
+    """
+    logger = logger_ctx.get(module_logger)
+    codec = detect_file_codec(source_path)
+    if codec.name == Compression.NONE:
+        with open(source_path, "rb") as file:
+            if not is_tar(file.read(TAR_MAGIC_OFFSET + len(TAR_MAGIC))):
+                logger.debug("File %s seems already decompressed (skip)", source_path)
+                return source_path
+
+    logger.debug("Decompressing %s (detected codec: %s)", source_path, codec.name)
+    with open(source_path, "rb") as stdin:
+        pipeline = Pipeline([codec.decompress_command()], stdin=stdin).start()
+        try:
+            header = pipeline.stdout.read(TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+            if is_tar(header):
+                result_path = _extract_tar(pipeline, header, directory)
+            else:
+                result_path = directory / dump_name
+                with open(result_path, "wb") as result_file:
+                    result_file.write(header)
+                    shutil.copyfileobj(pipeline.stdout, result_file, settings.STREAM_CHUNK_SIZE)
+
+            pipeline.wait()
+
+        except Exception:
+            pipeline.kill()
+            raise
+
+    logger.debug("Decompressed %s -> %s", source_path, result_path)
+    return result_path
+
+
+def _extract_tar(pipeline: Pipeline, header: bytes, directory: Path) -> Path:
+    """Feeds decompressed tar's stream to `tar -x` and returns the extracted top-level entry"""
+    extract_dir = Path(tempfile.mkdtemp(dir=directory))
+    tar_pipeline = Pipeline(
+        [["tar", "-xf", "-", "-C", extract_dir]],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    tar_pipeline.start()
+    try:
+        tar_stdin = tar_pipeline.processes[0].stdin
+        tar_stdin.write(header)
+        shutil.copyfileobj(pipeline.stdout, tar_stdin, settings.STREAM_CHUNK_SIZE)
+        tar_stdin.close()
+        tar_pipeline.wait()
+    except Exception:
+        tar_pipeline.kill()
+        raise
+
+    if not (entries := sorted(extract_dir.iterdir())):
+        raise RestoreBackupError("Backup archive doesn't contain any dump's files")
+
+    return entries[0]
@@ -8,6 +8,7 @@ class BackupLocation(StrEnum):
     S3 = "S3"
     LOCAL = "LOCAL"
     FILE = "FILE"
+    CHUNKS = "CHUNKS"
 
 
 class BackupHandler(StrEnum):
@@ -17,10 +18,38 @@ class BackupHandler(StrEnum):
     """
 
     MYSQL = "MYSQL"
+    MYSQL_CONTAINER = "MYSQL_CONTAINER"
     PG_SERVICE = "PG"
     PG_CONTAINER = "PG_CONTAINER"
 
 
+class Compression(StrEnum):
+    """Compression codecs for backup's files"""
+
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+    NONE = "none"
+
+
+class DumpFormat(StrEnum):
+    """Output formats of dump (pg_dump's -F option)"""
+
+    PLAIN = "plain"
+    CUSTOM = "custom"
+    DIRECTORY = "directory"
+
+
+DUMP_EXTENSIONS: dict[DumpFormat, str] = {
+    DumpFormat.PLAIN: "sql",
+    DumpFormat.CUSTOM: "dump",
+    DumpFormat.DIRECTORY: "dir",
+}
+# handlers which work with DB inside docker container (require --docker-container)
+CONTAINER_HANDLERS = (BackupHandler.PG_CONTAINER, BackupHandler.MYSQL_CONTAINER)
+# first bytes of pg_dump's custom format archive
+PG_CUSTOM_DUMP_MAGIC = b"PGDMP"
+
 ENV_VARS_REQUIRES = {
     "S3": (
         "S3_REGION_NAME",
@@ -34,3 +63,5 @@ ENV_VARS_REQUIRES = {
     "ENCRYPT": ("ENCRYPT_PASS",),
 }
 BACKUP_LOCATIONS = tuple(BackupLocation.__members__.keys())
+DUMP_FORMATS = tuple(str(dump_format) for dump_format in DumpFormat)
+COMPRESSIONS = tuple(str(compression) for compression in Compression)
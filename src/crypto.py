@@ -0,0 +1,270 @@
+"""
+In-process streaming encryption of backups: AES-256-GCM in chunked (authenticated) frames.
+Each frame is verified separately, so corrupted data is detected as soon as its frame is read.
+Legacy backups (encrypted by `openssl enc -aes-256-cbc -pbkdf2`) are still decrypted via openssl.
+
+Format: header | frame | frame | ... | last frame
+ - header: MAGIC | KDF's salt (16) | KDF's iterations (4) | file's salt (16) | chunk's size (4)
+ - frame: is_last flag (1) | ciphertext's length (4) | ciphertext (with 16 bytes GCM's tag)
+Frame's nonce is its number, AAD is header + frame's number + is_last flag (so reordered,
+truncated or appended frames are detected).
+"""
+
+import os
+import struct
+import hashlib
+import logging
+import functools
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from src import settings
+from src.exceptions import EncryptBackupError
+from src.run import logger_ctx
+
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    from src.integrity import Hasher
+
+module_logger = logging.getLogger(__name__)
+MAGIC = b"DBBKENC1"
+# header of files which were encrypted by `openssl enc` (legacy backups)
+OPENSSL_MAGIC = b"Salted__"
+HEADER_FORMAT = f">{len(MAGIC)}s16sI16sI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FRAME_HEADER_FORMAT = ">?I"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+TAG_SIZE = 16
+# KDF's salt is shared by all backups of the process: PBKDF2 is calculated only once
+# (each file gets its own key via HKDF with file's random salt)
+PROCESS_KDF_SALT = os.urandom(16)
+
+
+def get_encrypt_password() -> str:
+    """Password for encryption (ENCRYPT_PASS env variable)"""
+    if not (password := os.getenv("ENCRYPT_PASS")):
+        raise EncryptBackupError("Missing value for env variable ENCRYPT_PASS")
+
+    return password
+
+
+@functools.lru_cache(maxsize=16)
+def derive_master_key(password: str, salt: bytes, iterations: int) -> bytes:
+    """PBKDF2-HMAC-SHA256 (slow by design, that's why its result is cached)"""
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=32)
+
+
+def derive_file_key(master_key: bytes, file_salt: bytes) -> bytes:
+    """Unique key for each file (so frame's numbers can be used as nonces)"""
+    # cryptography is heavy: it is imported only when encryption is really used
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=file_salt, info=b"db-backups").derive(
+        master_key
+    )
+
+
+def new_cipher(master_key: bytes, file_salt: bytes) -> "AESGCM":
+    """AES-GCM cipher with the file's unique key"""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM(derive_file_key(master_key, file_salt))
+
+
+def _nonce(frame_number: int) -> bytes:
+    return frame_number.to_bytes(12, "big")
+
+
+def _aad(header: bytes, frame_number: int, is_last: bool) -> bytes:
+    return header + struct.pack(">Q?", frame_number, is_last)
+
+
+class StreamEncryptor:
+    """Encrypts stream of data chunk by chunk (result is a sequence of authenticated frames)"""
+
+    def __init__(self, password: str | None = None, chunk_size: int | None = None):
+        self.chunk_size = chunk_size or settings.ENCRYPT_CHUNK_SIZE
+        iterations = settings.ENCRYPT_KDF_ITERATIONS
+        file_salt = os.urandom(16)
+        master_key = derive_master_key(
+            password or get_encrypt_password(), PROCESS_KDF_SALT, iterations
+        )
+        self.header = struct.pack(
+            HEADER_FORMAT, MAGIC, PROCESS_KDF_SALT, iterations, file_salt, self.chunk_size
+        )
+        self._cipher = new_cipher(master_key, file_salt)
+        self._buffer = bytearray()
+        self._frame_number = 0
+        self._header_sent = False
+
+    def update(self, data: bytes) -> bytes:
+        """Encrypts data: returns completed frames (incomplete frame's data is buffered)"""
+        self._buffer += data
+        result = bytearray(self._pop_header())
+        while len(self._buffer) > self.chunk_size:
+            result += self._frame(bytes(self._buffer[: self.chunk_size]), is_last=False)
+            del self._buffer[: self.chunk_size]
+
+        return bytes(result)
+
+    def finalize(self) -> bytes:
+        """Returns the last frame"""
+        result = self._pop_header() + self._frame(bytes(self._buffer), is_last=True)
+        self._buffer.clear()
+        return result
+
+    def _pop_header(self) -> bytes:
+        if self._header_sent:
+            return b""
+
+        self._header_sent = True
+        return self.header
+
+    def _frame(self, data: bytes, is_last: bool) -> bytes:
+        aad = _aad(self.header, self._frame_number, is_last)
+        ciphertext = self._cipher.encrypt(_nonce(self._frame_number), data, aad)
+        self._frame_number += 1
+        return struct.pack(FRAME_HEADER_FORMAT, is_last, len(ciphertext)) + ciphertext
+
+
+class StreamDecryptor:
+    """Decrypts (and verifies) stream of frames which was produced by `StreamEncryptor`"""
+
+    def __init__(self, password: str | None = None):
+        self.password = password
+        self.header: bytes | None = None
+        self._cipher: "AESGCM | None" = None
+        self._max_frame_size = 0
+        self._buffer = bytearray()
+        self._frame_number = 0
+        self._finished = False
+
+    def update(self, data: bytes) -> bytes:
+        """
+        Decrypts completed frames
+        :raise `EncryptBackupError` (wrong password or corrupted data)
+        """
+        self._buffer += data
+        if self.header is None:
+            if len(self._buffer) < HEADER_SIZE:
+                return b""
+
+            self._read_header(bytes(self._buffer[:HEADER_SIZE]))
+            del self._buffer[:HEADER_SIZE]
+
+        result = bytearray()
+        while len(self._buffer) >= FRAME_HEADER_SIZE:
+            is_last, size = struct.unpack_from(FRAME_HEADER_FORMAT, self._buffer)
+            if self._finished or size > self._max_frame_size:
+                raise EncryptBackupError(
+                    f"Encrypted data is corrupted (frame #{self._frame_number})"
+                )
+
+            if len(self._buffer) < FRAME_HEADER_SIZE + size:
+                break
+
+            ciphertext = bytes(self._buffer[FRAME_HEADER_SIZE : FRAME_HEADER_SIZE + size])
+            del self._buffer[: FRAME_HEADER_SIZE + size]
+            result += self._decrypt_frame(ciphertext, is_last)
+
+        return bytes(result)
+
+    def finalize(self) -> None:
+        """Checks that the whole stream was read (the last frame was received)"""
+        if not self._finished or self._buffer:
+            raise EncryptBackupError("Encrypted data is truncated (the last frame is missing)")
+
+    def _read_header(self, header: bytes) -> None:
+        magic, kdf_salt, iterations, file_salt, chunk_size = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise EncryptBackupError("Unknown format of encrypted data")
+
+        master_key = derive_master_key(
+            self.password or get_encrypt_password(), kdf_salt, iterations
+        )
+        self.header = header
+        self._cipher = new_cipher(master_key, file_salt)
+        self._max_frame_size = chunk_size + TAG_SIZE
+
+    def _decrypt_frame(self, ciphertext: bytes, is_last: bool) -> bytes:
+        from cryptography.exceptions import InvalidTag
+
+        aad = _aad(self.header, self._frame_number, is_last)
+        try:
+            data = self._cipher.decrypt(_nonce(self._frame_number), ciphertext, aad)
+        except InvalidTag as exc:
+            raise EncryptBackupError(
+                f"Couldn't decrypt frame #{self._frame_number}: wrong ENCRYPT_PASS "
+                f"or corrupted data"
+            ) from exc
+
+        self._frame_number += 1
+        self._finished = is_last
+        return data
+
+
+def is_legacy_encrypted(header: bytes) -> bool:
+    """Detects data which was encrypted by openssl (legacy backups)"""
+    return header.startswith(OPENSSL_MAGIC)
+
+
+def is_encrypted(header: bytes) -> bool:
+    """Detects encrypted data (by magic bytes)"""
+    return header.startswith(MAGIC) or is_legacy_encrypted(header)
+
+
+def decrypt_chunks(chunks: Iterable[bytes], password: str | None = None) -> Iterator[bytes]:
+    """
+    Decrypts stream of chunks (stage of streaming restore)
+    :raise `EncryptBackupError` as soon as a broken frame is received
+    """
+    decryptor = StreamDecryptor(password)
+    for chunk in chunks:
+        if data := decryptor.update(chunk):
+            yield data
+
+    decryptor.finalize()
+
+
+def _transform_file(
+    source_path: Path, result_path: Path, cipher, chunk_size: int, hasher: "Hasher | None" = None
+) -> Path:
+    def write(data: bytes) -> None:
+        result.write(data)
+        if hasher:
+            hasher.update(data)
+
+    try:
+        with open(source_path, "rb") as source, open(result_path, "wb") as result:
+            while chunk := source.read(chunk_size):
+                write(cipher.update(chunk))
+
+            write(cipher.finalize() or b"")
+
+    except Exception:
+        result_path.unlink(missing_ok=True)
+        raise
+
+    return result_path
+
+
+def encrypt_path(source_path: Path, result_path: Path, hasher: "Hasher | None" = None) -> Path:
+    """Encrypts file (chunk by chunk, `hasher` gets checksum of encrypted data)"""
+    logger = logger_ctx.get(module_logger)
+    encryptor = StreamEncryptor()
+    _transform_file(
+        source_path, result_path, encryptor, chunk_size=encryptor.chunk_size, hasher=hasher
+    )
+    logger.debug("Encrypted %s -> %s", source_path, result_path)
+    return result_path
+
+
+def decrypt_path(source_path: Path, result_path: Path) -> Path:
+    """Decrypts file which was encrypted by `encrypt_path` (integrity is verified)"""
+    logger = logger_ctx.get(module_logger)
+    decryptor = StreamDecryptor()
+    _transform_file(source_path, result_path, decryptor, chunk_size=settings.ENCRYPT_CHUNK_SIZE)
+    logger.debug("Decrypted %s -> %s", source_path, result_path)
+    return result_path
@@ -0,0 +1,445 @@
+"""
+Docker Engine API's client (HTTP over the daemon's unix socket) for commands inside containers
+without `docker` CLI's processes. Exec's stdout is streamed to the host's pipeline directly and
+its stdin is fed by the host, so no temporary files are created inside the container.
+`ExecProcess` has the interface of `subprocess.Popen`: exec sessions are regular stages of
+`src.process` pipelines (see `src.process.ContainerCommand`).
+"""
+
+import os
+import json
+import time
+import socket
+import signal
+import struct
+import logging
+import threading
+import functools
+import subprocess
+import http.client
+from pathlib import Path
+from typing import IO, Any
+from urllib.parse import quote
+
+from src import settings
+from src.process import ContainerCommand
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+# header of multiplexed exec's stream: stream's type and size of the frame's payload
+FRAME_HEADER = struct.Struct(">BxxxL")
+STDOUT, STDERR = 1, 2
+# how long the exit code of finished exec is waited for (daemon updates it after the stream's end)
+EXIT_CODE_WAIT = 2.0
+# env of exec's command (it is inherited by its children): allows to find them inside the container
+EXEC_MARKER_ENV = "DB_BACKUPS_EXEC"
+# sends the signal ($1) to processes with exec's marker ($2) in their env
+SIGNAL_SCRIPT = (
+    "for environ in /proc/[0-9]*/environ; do "
+    'if tr "\\0" "\\n" 2>/dev/null < "$environ" | grep -qx "$2"; then '
+    'pid="${environ#/proc/}"; kill -s "$1" "${pid%/environ}" 2>/dev/null; '
+    "fi; done"
+)
+
+
+class DockerAPIError(OSError):
+    """Request to Docker Engine API failed (command couldn't be started)"""
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection via unix socket"""
+
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = connect_socket(self.socket_path, self.timeout)
+
+
+def connect_socket(socket_path: str, timeout: float | None = None) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+
+    return sock
+
+
+class DockerClient:
+    """
+    Client of Docker Engine API. JSON requests reuse persistent (keep-alive) connections,
+    each started exec gets its own connection (it is hijacked for the exec's raw stream).
+    """
+
+    def __init__(self, socket_path: str | None = None, timeout: float | None = None):
+        self.socket_path = socket_path or settings.DOCKER_SOCKET
+        self.timeout = timeout or settings.DOCKER_API_TIMEOUT
+        self.connections_count = 0
+        self._idle: list[UnixHTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def request(self, method: str, path: str, body: dict | None = None) -> Any:
+        """
+        Sends JSON request (stale keep-alive connection is replaced once)
+        :raise `DockerAPIError`
+        """
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        for attempt in range(2):
+            connection, is_new = self._acquire()
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException) as exc:
+                connection.close()
+                if is_new or attempt:
+                    raise DockerAPIError(f"Docker API {method} {path} failed: {exc!r}") from exc
+
+                continue
+
+            self._release(connection, reusable=not response.will_close)
+            if response.status >= 400:
+                raise DockerAPIError(
+                    f"Docker API {method} {path}: {response.status} {_error_message(content)}",
+                    status=response.status,
+                )
+
+            return json.loads(content) if content else None
+
+    def create_exec(
+        self,
+        container: str,
+        argv: list[str],
+        stdin: bool = False,
+        env: dict[str, str] | None = None,
+        cwd: Path | None = None,
+    ) -> str:
+        """Creates exec session (without tty: it would mangle binary output) and returns its ID"""
+        config = {
+            "AttachStdin": stdin,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "Cmd": argv,
+        }
+        if env:
+            config["Env"] = [f"{name}={value}" for name, value in env.items()]
+
+        if cwd:
+            config["WorkingDir"] = str(cwd)
+
+        return self.request("POST", f"/containers/{quote(container)}/exec", config)["Id"]
+
+    def start_exec(self, exec_id: str) -> tuple[socket.socket, IO[bytes]]:
+        """
+        Starts exec session and hijacks its connection
+        :return: socket (for exec's stdin) and its reader (multiplexed stdout / stderr frames)
+        :raise `DockerAPIError`
+        """
+        body = json.dumps({"Detach": False, "Tty": False}).encode()
+        request = (
+            f"POST /exec/{quote(exec_id)}/start HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: Upgrade\r\n"
+            "Upgrade: tcp\r\n\r\n"
+        ).encode()
+        try:
+            sock = connect_socket(self.socket_path, self.timeout)
+        except OSError as exc:
+            raise DockerAPIError(f"Couldn't connect to Docker API: {exc!r}") from exc
+
+        with self._lock:
+            self.connections_count += 1
+
+        reader = sock.makefile("rb")
+        try:
+            sock.sendall(request + body)
+            status_line = reader.readline().decode("latin-1")
+            headers = http.client.parse_headers(reader)
+            status = int(status_line.split()[1])
+            if status not in (101, 200):
+                content = reader.read(int(headers.get("Content-Length") or 0))
+                raise DockerAPIError(
+                    f"Docker API: exec {exec_id} isn't started: {status} {_error_message(content)}",
+                    status=status,
+                )
+
+        except (OSError, ValueError, IndexError, http.client.HTTPException) as exc:
+            reader.close()
+            sock.close()
+            if isinstance(exc, DockerAPIError):
+                raise
+
+            raise DockerAPIError(f"Docker API: exec {exec_id} isn't started: {exc!r}") from exc
+
+        # exec's stream isn't limited by the request's timeout (ex.: long CREATE INDEX)
+        sock.settimeout(None)
+        return sock, reader
+
+    def inspect_exec(self, exec_id: str) -> dict:
+        return self.request("GET", f"/exec/{quote(exec_id)}/json")
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._idle = self._idle, []
+
+        for connection in connections:
+            connection.close()
+
+    def _acquire(self) -> tuple[UnixHTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), False
+
+            self.connections_count += 1
+
+        return UnixHTTPConnection(self.socket_path, timeout=self.timeout), True
+
+    def _release(self, connection: UnixHTTPConnection, reusable: bool) -> None:
+        if not reusable:
+            connection.close()
+            return
+
+        with self._lock:
+            self._idle.append(connection)
+
+
+@functools.cache
+def get_client() -> DockerClient:
+    """Client is created once and is shared by all jobs (connections are reused)"""
+    return DockerClient()
+
+
+def _error_message(content: bytes) -> str:
+    try:
+        return json.loads(content)["message"]
+    except (ValueError, TypeError, KeyError):
+        return content.decode("utf-8", errors="replace").strip()
+
+
+class ExecStdin:
+    """Writable stdin's stream of exec session (closing it sends EOF to the command)"""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._sock.sendall(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class ExecProcess:
+    """
+    Command which is running inside the container (exec session) with the interface
+    of `subprocess.Popen`: stdin / stdout / stderr streams, wait, poll, terminate, kill.
+    Engine API can't send signals to exec's command and exec's Pid (see `inspect_exec`) is
+    the host's one, so signals are sent by `kill` inside the container to the processes which
+    have exec's marker in their env (see `SIGNAL_SCRIPT`).
+    """
+
+    def __init__(
+        self,
+        command: ContainerCommand,
+        stdin: int | IO[bytes] | None = None,
+        stdout: int | IO[bytes] | None = subprocess.PIPE,
+        env: dict[str, str] | None = None,
+        cwd: Path | None = None,
+        client: DockerClient | None = None,
+    ):
+        self.args = command
+        self.returncode: int | None = None
+        self.logger = logger_ctx.get(module_logger)
+        self._client = client or get_client()
+        self._killed = False
+        self._marker = f"{EXEC_MARKER_ENV}={os.urandom(8).hex()}"
+        attach_stdin = stdin not in (None, subprocess.DEVNULL)
+        env = {**(env or {}), EXEC_MARKER_ENV: self._marker.partition("=")[2]}
+        self.exec_id = self._client.create_exec(
+            command.container, command.argv, stdin=attach_stdin, env=env, cwd=cwd
+        )
+        self._sock, self._reader = self._client.start_exec(self.exec_id)
+        self.logger.debug("Exec %s is started in container %s", self.exec_id, command.container)
+
+        self.stdin: ExecStdin | None = None
+        stdin_source: IO[bytes] | None = None
+        if stdin == subprocess.PIPE:
+            self.stdin = ExecStdin(self._sock)
+        elif attach_stdin:
+            # own copy of the stream: the caller closes its one after the start (see `Pipeline`)
+            stdin_source = os.fdopen(os.dup(_fileno(stdin)), "rb")
+        else:
+            ExecStdin(self._sock).close()
+
+        self.stdout: IO[bytes] | None = None
+        self._stdout_fd: int | None = None
+        if stdout == subprocess.PIPE:
+            read_fd, self._stdout_fd = os.pipe()
+            self.stdout = os.fdopen(read_fd, "rb")
+        elif stdout is None:
+            self._stdout_fd = os.dup(1)
+        elif stdout != subprocess.DEVNULL:
+            self._stdout_fd = os.dup(_fileno(stdout))
+
+        stderr_fd, self._stderr_fd = os.pipe()
+        self.stderr: IO[bytes] = os.fdopen(stderr_fd, "rb")
+
+        self._threads = [threading.Thread(target=self._read_frames, daemon=True)]
+        if stdin_source:
+            self._threads.append(
+                threading.Thread(target=self._pump_stdin, args=(stdin_source,), daemon=True)
+            )
+
+        for thread in self._threads:
+            thread.start()
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                raise subprocess.TimeoutExpired(self.args, timeout)
+
+        return self.returncode
+
+    def send_signal(self, signal_number: int) -> None:
+        """
+        Sends the signal to exec's command and closes exec's stream. The command which is still
+        running after JOB_CANCEL_TIMEOUT (since SIGTERM) is killed.
+        """
+        if self.returncode is not None:
+            return
+
+        self._killed = True
+        self._signal_command(signal_number)
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        if signal_number != signal.SIGKILL:
+            timer = threading.Timer(
+                settings.JOB_CANCEL_TIMEOUT, self._signal_command, args=(signal.SIGKILL,)
+            )
+            timer.daemon = True
+            timer.start()
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    def _signal_command(self, signal_number: int) -> None:
+        """Sends the signal to exec's command (and its children) if it is still running"""
+        name = signal.Signals(signal_number).name.removeprefix("SIG")
+        try:
+            if not self._client.inspect_exec(self.exec_id).get("Running"):
+                return
+
+            exec_id = self._client.create_exec(
+                self.args.container, ["sh", "-c", SIGNAL_SCRIPT, "signal", name, self._marker]
+            )
+            sock, reader = self._client.start_exec(exec_id)
+            with sock, reader:
+                reader.read()  # till the end of `kill`'s session
+
+        except (DockerAPIError, OSError) as exc:
+            self.logger.warning("Couldn't send SIG%s to exec %s: %r", name, self.exec_id, exc)
+            return
+
+        self.logger.debug("SIG%s is sent to exec %s", name, self.exec_id)
+
+    def _read_frames(self) -> None:
+        """Demultiplexes exec's stream: stdout / stderr frames are written to their pipes"""
+        try:
+            while header := self._reader.read(FRAME_HEADER.size):
+                if len(header) < FRAME_HEADER.size:
+                    break
+
+                stream, size = FRAME_HEADER.unpack(header)
+                data = self._reader.read(size)
+                fd = self._stdout_fd if stream == STDOUT else self._stderr_fd
+                if fd is not None:
+                    _write_all(fd, data)
+
+        except OSError:
+            # killed session or the consumer of stdout exited (its own error is reported)
+            if not self._killed:
+                self.kill()
+
+        finally:
+            for fd in (self._stdout_fd, self._stderr_fd):
+                if fd is not None:
+                    os.close(fd)
+
+            self._reader.close()
+            self._sock.close()
+            self.returncode = self._exit_code()
+
+    def _pump_stdin(self, source: IO[bytes]) -> None:
+        stdin = ExecStdin(self._sock)
+        try:
+            with source:
+                while chunk := source.read(settings.STREAM_CHUNK_SIZE):
+                    stdin.write(chunk)
+
+        except OSError:
+            pass  # the command exited before the end of its input: its own error is reported
+
+        finally:
+            stdin.close()
+
+    def _exit_code(self) -> int:
+        deadline = time.monotonic() + EXIT_CODE_WAIT
+        while True:
+            try:
+                state = self._client.inspect_exec(self.exec_id)
+            except DockerAPIError as exc:
+                self.logger.debug("Exit code of exec %s isn't received: %r", self.exec_id, exc)
+                return -1
+
+            if not state.get("Running") and state.get("ExitCode") is not None:
+                return state["ExitCode"]
+
+            if self._killed or time.monotonic() > deadline:
+                return -signal.SIGKILL
+
+            time.sleep(0.05)
+
+
+def _fileno(stream: int | IO[bytes]) -> int:
+    return stream if isinstance(stream, int) else stream.fileno()
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
@@ -0,0 +1,165 @@
+"""
+Local cache of backups downloaded from S3: repeated restores of the same snapshot don't download
+it again. Entries are addressed by object's key + ETag (cheap HEAD request), so changed object is
+a miss and its stale entries are removed. Cache's size is capped by S3_CACHE_MAX_SIZE: the least
+recently used entries are evicted. Concurrent processes are synchronized by file locks (flock):
+the same object is downloaded once, entries which are in use aren't evicted.
+"""
+
+import os
+import fcntl
+import hashlib
+import logging
+import functools
+import contextlib
+from pathlib import Path
+from typing import Iterator
+
+from src import s3, settings
+from src.run import logger_ctx
+from src.utils import PARTIAL_FILE_SUFFIX, copy_file_data
+
+module_logger = logging.getLogger(__name__)
+LOCK_SUFFIX = ".lock"
+# lock of the whole cache (eviction)
+CACHE_LOCK_NAME = f"cache{LOCK_SUFFIX}"
+
+
+class DownloadCache:
+    """Size-capped LRU cache of S3 objects (entry's mtime is the time of its last use)"""
+
+    def __init__(self, directory: Path, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logger_ctx.get(module_logger)
+
+    def entry_path(self, key: str, etag: str) -> Path:
+        return self.directory / f"{_digest(key)}-{_digest(etag)[:16]}"
+
+    def fetch(self, db_name: str, key: str, file_path: Path) -> Path:
+        """
+        Puts S3 object to the file: from the cache (hit) or by its downloading to the cache (miss).
+        Result file is a hard link (reflink / copy) of the entry: entries are never changed.
+        """
+        head = s3.get_client().head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+        size, etag = head["ContentLength"], head.get("ETag")
+        if not etag or size > self.max_size:
+            self.logger.debug("[%s] %s isn't cached (size: %i, ETag: %s)", db_name, key, size, etag)
+            return s3.download_file(db_name, key=key, file_path=file_path)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self.entry_path(key, etag)
+        with file_lock(_lock_path(entry)):
+            if entry.exists():
+                os.utime(entry)
+                self.logger.info("[%s] Backup is found in the download cache: %s", db_name, key)
+            else:
+                self._remove_stale(key, entry)
+                self.evict(reserve=size)
+                part_path = entry.with_name(f"{entry.name}{PARTIAL_FILE_SUFFIX}")
+                s3.download_file(db_name, key=key, file_path=part_path)
+                os.replace(part_path, entry)
+                self.logger.debug("[%s] %s is saved to the download cache: %s", db_name, key, entry)
+
+            copy_file_data(entry, file_path, link=True)
+
+        return file_path
+
+    def evict(self, reserve: int = 0) -> list[Path]:
+        """
+        Removes the least recently used entries till cache's size (with reserved space for
+        the new entry) fits S3_CACHE_MAX_SIZE. Entries which are used by other processes are kept.
+        """
+        removed = []
+        with file_lock(self.directory / CACHE_LOCK_NAME):
+            entries = sorted(self._entries(), key=lambda item: item[1].st_mtime)
+            total_size = sum(stat.st_size for _, stat in entries)
+            for path, stat in entries:
+                if total_size + reserve <= self.max_size:
+                    break
+
+                if self._remove(path):
+                    total_size -= stat.st_size
+                    removed.append(path)
+
+        if removed:
+            self.logger.info("Download cache's entries are evicted: %s", list(map(str, removed)))
+
+        return removed
+
+    def _remove_stale(self, key: str, entry: Path) -> None:
+        """Removes entries of the object's previous versions (ETag was changed)"""
+        for path in self.directory.glob(f"{_digest(key)}-*"):
+            if path.suffix != LOCK_SUFFIX and not path.name.startswith(entry.name):
+                self._remove(path)
+
+    def _entries(self) -> Iterator[tuple[Path, os.stat_result]]:
+        """Entries and partial files (ex.: of interrupted downloads) with their stats"""
+        for path in self.directory.iterdir():
+            if path.suffix == LOCK_SUFFIX:
+                continue
+
+            try:
+                yield path, path.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+
+    def _remove(self, path: Path) -> bool:
+        """Removes entry's file if the entry isn't locked by another process"""
+        entry = path.with_name(path.name.split(".")[0])
+        with file_lock(_lock_path(entry), blocking=False) as locked:
+            if not locked:
+                return False
+
+            path.unlink(missing_ok=True)
+            partial_path = entry.with_name(f"{entry.name}{PARTIAL_FILE_SUFFIX}")
+            if not entry.exists() and not partial_path.exists():
+                _lock_path(entry).unlink(missing_ok=True)
+
+        return True
+
+
+@contextlib.contextmanager
+def file_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+    """
+    Exclusive lock (flock) of the lock file: it is released on closing (or process's exit).
+    Lock file can be removed by the lock's holder, so the lock is taken again if the file
+    was replaced while waiting. Non-blocking lock yields False if it is held by another one.
+    """
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                is_actual = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                is_actual = False
+
+            if is_actual:
+                yield True
+                return
+
+        finally:
+            os.close(fd)
+
+
+@functools.cache
+def get_download_cache() -> DownloadCache | None:
+    """Shared download cache (None - it is disabled by empty S3_CACHE_DIR)"""
+    if not settings.S3_CACHE_DIR:
+        return None
+
+    return DownloadCache(Path(settings.S3_CACHE_DIR), max_size=settings.S3_CACHE_MAX_SIZE)
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _lock_path(entry: Path) -> Path:
+    return entry.with_name(f"{entry.name}{LOCK_SUFFIX}")
@@ -0,0 +1,32 @@
+"""
+Custom exceptions for backup/restore logic
+"""
+
+
+class BackupError(Exception):
+    """Simple exception for specifying backup's error"""
+
+    def __init__(self, message: str):
+        super().__init__()
+        self.message = message
+
+    def __str__(self):
+        return f"BackupError: {self.message}"
+
+    __repr__ = __str__
+
+
+class EncryptBackupError(BackupError):
+    """Custom exception for detecting encryption errors"""
+
+
+class RestoreBackupError(BackupError):
+    """Custom exception for restoring logic"""
+
+
+class ScheduleError(BackupError):
+    """Invalid daemon's schedule (config's or cron expression's error)"""
+
+
+class ScratchSpaceError(BackupError):
+    """There isn't enough free space on scratch volumes for job's temporary files"""
@@ -0,0 +1,82 @@
+"""
+Fan-out of the backup's file to its destinations: all destinations are handled
+concurrently, so the file is read from the disk once (the others get it from the page cache).
+Local copies are hard links / reflinks of the temporary file or are made inside the kernel
+(see `utils.copy_file_data`).
+Failed destination doesn't stop the others.
+"""
+
+import logging
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable
+
+from src import settings, utils
+from src.constants import BackupLocation
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class FanOutResult:
+    """Targets of the delivered backup (per destination) and errors of failed destinations"""
+
+    targets: dict[BackupLocation, str] = dataclasses.field(default_factory=dict)
+    errors: dict[BackupLocation, Exception] = dataclasses.field(default_factory=dict)
+
+
+def fan_out(
+    db_name: str,
+    file_path: Path,
+    destination: tuple[BackupLocation, ...],
+    destination_file: str | None = None,
+    sidecars: Iterable[Path] = (),
+    metadata: dict[str, str] | None = None,
+) -> FanOutResult:
+    """
+    Delivers backup's file to all requested destinations concurrently
+
+    :param sidecars: auxiliary files (ex.: dump's TOC) which are delivered next to the backup
+    :param metadata: user metadata of backup's S3 object (ex.: checksum)
+    :return: result with targets of successful destinations and errors of failed ones
+    """
+    logger = logger_ctx.get(module_logger)
+    sidecars = list(sidecars)
+    deliver: dict[BackupLocation, Callable[[Path], str]] = {}
+    if BackupLocation.LOCAL in destination:
+        deliver[BackupLocation.LOCAL] = lambda path: _copy(db_name, path, settings.LOCAL_PATH)
+
+    if BackupLocation.FILE in destination:
+        deliver[BackupLocation.FILE] = lambda path: _copy(db_name, path, destination_file)
+
+    if BackupLocation.S3 in destination:
+        deliver[BackupLocation.S3] = lambda path: utils.s3_upload(
+            db_name, backup_path=path, metadata=metadata if path == file_path else None
+        )
+
+    def task(location: BackupLocation) -> str:
+        target = deliver[location](file_path)
+        for sidecar in sidecars:
+            deliver[location](sidecar)
+
+        return target
+
+    result = FanOutResult()
+    with ThreadPoolExecutor(max_workers=max(len(deliver), 1)) as executor:
+        futures = {
+            location: utils.submit_in_context(executor, task, location) for location in deliver
+        }
+        for location, future in futures.items():
+            try:
+                result.targets[location] = future.result()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.error("[%s] Couldn't deliver backup to %s: %r", db_name, location, exc)
+                result.errors[location] = exc
+
+    return result
+
+
+def _copy(db_name: str, file_path: Path, directory: Path | str | None) -> str:
+    return str(utils.copy_file(db_name=db_name, src=file_path, dst=directory, link=True).resolve())
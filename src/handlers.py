@@ -2,16 +2,37 @@
 Base functionality for backup/restore process (with DB-related specific operations)
 """
 
+import os
 import abc
+import shutil
 import logging
+import tempfile
+import contextlib
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import ClassVar, Type
+from typing import Callable, ClassVar, Iterable, Iterator, Type
 
 import click
 
-from src import settings
-from src.constants import BackupHandler
+from src import integrity, metrics, scratch, settings, toc
+from src.compression import compress_path, decompress_path, get_codec, is_tar
+from src.constants import (
+    BackupHandler,
+    Compression,
+    DumpFormat,
+    DUMP_EXTENSIONS,
+    PG_CUSTOM_DUMP_MAGIC,
+)
+from src.pipeline import (
+    BackupSink,
+    RestorePipeline,
+    StreamResult,
+    get_stage_commands,
+    run_pipeline,
+    run_restore_pipeline,
+)
+from src.process import Command, ContainerCommand
 from src.run import logger_ctx
 from src.utils import (
     check_env_variables,
@@ -19,48 +40,92 @@ from src.utils import (
     BackupError,
     get_filename,
     RestoreBackupError,
-    get_latest_file,
+    submit_in_context,
 )
 
 module_logger = logging.getLogger(__name__)
 
 
+def docker_exec_command(container_name: str, command: list[str]) -> Command:
+    """
+    Command inside the container: exec session via Docker Engine API (see `src.docker_api`)
+    or `docker exec` CLI's process (DOCKER_TRANSPORT=cli)
+    """
+    if settings.DOCKER_TRANSPORT == "cli":
+        # no tty here: it would mangle (binary) stream of command's output
+        return ["docker", "exec", "-i", container_name, *command]
+
+    return ContainerCommand(container_name, command)
+
+
 class BaseHandler(ABC):
     """Base class which allows to define logic for debug/restore process"""
 
     service: ClassVar[str] = NotImplemented
     required_variables: ClassVar[tuple[str, ...]] = NotImplemented
+    password_prefix: ClassVar[str | None] = None
+    # restore of selected tables / schemas (see `src.toc.TocFilter`)
+    supports_selective_restore: ClassVar[bool] = False
+    # formats of dump which can be requested by `dump_format` option
+    dump_formats: ClassVar[tuple[DumpFormat, ...]] = (DumpFormat.PLAIN,)
 
     def __init__(self, db_name: str, **extra_kwargs):
         self.db_name = db_name
+        self.extra_kwargs = extra_kwargs
         self.logger = logger_ctx.get(module_logger)
         self.backup_filename = get_filename(self.db_name)
-        self.backup_path = settings.TMP_BACKUP_DIR / f"{self.db_name}.backup.sql"
-        self.compressed_backup_path = settings.TMP_BACKUP_DIR / f"{self.backup_filename}.tar.gz"
-        self.extra_kwargs = extra_kwargs
+        # temporary files are placed in the job's scratch workspace (see `src.scratch`)
+        self.backup_path = scratch.current_dir() / f"{self.db_name}.backup.{self.dump_extension}"
+        self.codec = get_codec(extra_kwargs.get("compression"))
+        self.compression_level = extra_kwargs.get("compression_level", settings.COMPRESSION_LEVEL)
+        self.compression_threads = extra_kwargs.get("compression_threads")
+        self.compressed_backup_path = scratch.current_dir() / self.codec.file_name(
+            f"{self.backup_filename}.{self.dump_extension}"
+            f"{'.tar' if self.dump_format == DumpFormat.DIRECTORY else ''}"
+        )
+        self.restore_filter: toc.TocFilter | None = extra_kwargs.get("restore_filter")
+        # checksum of the compressed backup (calculated while it is written)
+        self.checksum: integrity.Checksum | None = None
+
+    @property
+    def dump_format(self) -> DumpFormat:
+        """Format of result dump (plain sql by default)"""
+        return DumpFormat.PLAIN
+
+    @property
+    def dump_extension(self) -> str:
+        """Extension of dump's file (or directory) which depends on dump's format"""
+        return DUMP_EXTENSIONS[self.dump_format]
 
-    def backup(self) -> Path:
+    def backup(self, with_toc: bool = True) -> Path:
         """
         Base method for backup process running. Should return path to result backup.
         Child classes should override callable inside method `self._do_backup` for implementing
         DB-specific backup process
 
+        :param with_toc: build dump's TOC (it isn't stored for encrypted backups)
         :return: path to result backup's file
         """
         self.logger.info("[%s] handle backup via %s ... ", self.db_name, self.service)
         check_env_variables(*self.required_variables)
-        backup_stdout = self._do_backup()
+        with metrics.stage("dump", self.db_name) as dump_metrics:
+            backup_stdout = self._do_backup()
+            dump_metrics.bytes_out = metrics.path_size(self.backup_path)
+
         if not self.backup_path.exists():
             raise BackupError(
                 f"Backup wasn't created (result file not found). "
                 f"\n === \nbackup_stdout: \n{backup_stdout}"
             )
 
-        archive_stdout = self._do_zip()
+        toc_parser = self._build_toc() if with_toc else None
+        with metrics.stage("compress", self.db_name, bytes_in=dump_metrics.bytes_out) as stage:
+            self._do_zip(lines_consumer=toc_parser)
+            stage.bytes_out = metrics.path_size(self.compressed_backup_path)
+
         if not self.compressed_backup_path.exists():
             raise BackupError(
-                f"Backup wasn't archived (result file not found). "
-                f"\n === \narchive_stdout: \n{archive_stdout}"
+                f"Backup wasn't compressed (result file {self.compressed_backup_path} not found)"
             )
 
         self._do_clean()
@@ -72,25 +137,133 @@ class BaseHandler(ABC):
         )
         return self.compressed_backup_path
 
+    @classmethod
+    def discover_databases(cls, **extra_kwargs) -> list[str]:
+        """Returns names of all (non-system) databases on the server"""
+        raise NotImplementedError(f"Databases discovering is not supported by {cls.service}")
+
+    @classmethod
+    def concurrency_key(cls, **extra_kwargs) -> str:
+        """Key (ex.: DB server's host) for limiting concurrent jobs on the same server"""
+        return cls.service
+
+    @classmethod
+    def estimate_db_size(cls, db_name: str, **extra_kwargs) -> int | None:
+        """Size of DB on the server in bytes (for scratch space's preflight, see `src.scratch`)"""
+        return None
+
+    @property
+    def supports_streaming(self) -> bool:
+        """Dump can be written to stdout (see `self._dump_command`)"""
+        try:
+            self._dump_command()
+        except (NotImplementedError, BackupError):
+            return False
+
+        return True
+
+    @classmethod
+    def command_env(cls) -> dict[str, str]:
+        """Extra env variables for DB-specific commands (ex.: password for DB's connection)"""
+        return {}
+
+    def get_stream_filename(self, encrypt: bool = False) -> str:
+        """Returns name of result file for streamed backup (compressed dump or encrypted one)"""
+        file_name = self.codec.file_name(f"{self.backup_filename}.{self.dump_extension}")
+        return f"{file_name}{'.enc' if encrypt else ''}"
+
+    def backup_stream(
+        self, sinks: list[BackupSink], encrypt: bool = False, compress: bool = True
+    ) -> StreamResult:
+        """
+        Streams dump's output through compression (and encryption) stages directly to the
+        provided sinks (without any intermediate files).
+        Child classes should override `self._dump_command` (dump to stdout) for supporting it.
+
+        :param sinks: destinations of result backup (see `src.pipeline.build_sinks`)
+        :param encrypt: encrypt result backup (in-process, see `src.crypto`)
+        :param compress: add compression's stage to the pipeline (raw dump is needed for
+                         deduplication in the chunk store)
+        :return: size of result backup (in bytes), targets and errors of its destinations
+        """
+        self.logger.info("[%s] handle streaming backup via %s ... ", self.db_name, self.service)
+        check_env_variables(*self.required_variables)
+        commands = get_stage_commands(
+            self._dump_command(),
+            compress_command=self._compress_command() if compress else None,
+        )
+        with metrics.stage("stream_backup", self.db_name) as stage:
+            result = run_pipeline(
+                self.db_name,
+                commands,
+                sinks,
+                encrypt=encrypt,
+                password_prefix=self.password_prefix,
+                env=self.command_env(),
+            )
+            stage.bytes_out = result.size
+
+        self.logger.info(
+            "[%s] handle streaming backup: success! | %i bytes streamed", self.db_name, result.size
+        )
+        return result
+
     def restore(self, file_path: Path) -> None:
         """
         Base method for restore process running. Should get the path to restoring backup.
         Child classes should override callable inside method `self._do_restore` for implementing
         DB-specific backup process
 
-        File will be un-arhived, if restoring file is an arhive (trying to detect by file's ext)
+        File will be decompressed, if restoring file is compressed (codec is detected by magic)
         File will be decrypted, if restoring file was encrypted (trying to detect by file's ext)
 
         :param file_path: path to restoring backup
         """
         self.logger.info("[%s] handle restore via %s ... ", self.db_name, self.service)
         check_env_variables(*self.required_variables)
+        if self.restore_filter and not self.supports_selective_restore:
+            raise RestoreBackupError(f"Selective restore is not supported by {self.service}")
+
         if not file_path.exists():
             raise RestoreBackupError(f"Backup doesn't exist {file_path}")
 
-        self.backup_path = self._do_unzip(file_path)
-        self._do_restore(file_path)
-        self._do_clean()
+        compressed_size = metrics.path_size(file_path)
+        with metrics.stage("decompress", self.db_name, bytes_in=compressed_size) as stage:
+            self.backup_path = self._do_unzip(file_path)
+            stage.bytes_out = metrics.path_size(self.backup_path)
+
+        with metrics.stage("restore", self.db_name, bytes_in=stage.bytes_out):
+            self._do_restore(file_path)
+
+        # uncompressed stored backup is restored in place: it isn't removed
+        if self.backup_path != file_path:
+            self._do_clean()
+
+    def restore_stream(self, chunks: Iterable[bytes]) -> None:
+        """
+        Streams backup's data (ex.: ranged GETs from S3) through decryption and decompression
+        stages directly to the restore command's stdin (without any intermediate files).
+        Encryption and compression are detected by magic bytes.
+        Child classes should override `self._restore_command` for supporting it.
+
+        :param chunks: backup's data
+        """
+        self.logger.info("[%s] handle streaming restore via %s ... ", self.db_name, self.service)
+        check_env_variables(*self.required_variables)
+        if self.restore_filter:
+            raise RestoreBackupError("Selective restore requires non-streaming mode")
+
+        self._prepare_restore()
+        with metrics.stage("stream_restore", self.db_name) as stage:
+            run_restore_pipeline(
+                self.db_name,
+                stage.count_in(chunks),
+                restore_command=self._restore_command,
+                password_prefix=self.password_prefix,
+                env=self.command_env(),
+            )
+
+        self.logger.info("[%s] handle streaming restore: success!", self.db_name)
 
     @abc.abstractmethod
     def _do_backup(self) -> str:
@@ -100,70 +273,325 @@ class BaseHandler(ABC):
     def _do_restore(self, file_path: Path) -> None:
         ...
 
-    def _do_zip(self) -> str:
-        parent_dir, file_name = self.backup_path.parent, self.backup_path.name
-        command = f"""
-            cd {parent_dir} && tar -cvzf {self.compressed_backup_path} {file_name}
+    def _prepare_restore(self) -> None:
+        """Prepares DB for restoring (ex.: recreates existing DB)"""
+
+    def _build_toc(self) -> Callable[[Iterator[bytes]], object] | None:
+        """
+        Builds dump's TOC for selective restore (saved next to the result backup's file).
+        TOC which is parsed from dump's lines is built while the dump is compressed:
+        parser of the lines is returned for it (see `self._do_zip`).
         """
-        return call_with_logging(command)
+        return None
 
-    def _do_unzip(self, compressed_backup_path: Path) -> Path:
-        if not compressed_backup_path.name.endswith("tar.gz"):
-            self.logger.debug(
-                "[%s] backup file %s seems already unzipped (skip unzip process)",
-                self.db_name,
-                compressed_backup_path,
-            )
-            return compressed_backup_path
+    def _restore_command(self, header: bytes) -> Command:
+        """
+        Command which restores DB from its stdin (is used for streaming restore)
+
+        :param header: the first bytes of (decrypted and decompressed) dump
+        """
+        raise NotImplementedError(f"Streaming restore is not supported by {self.service}")
 
-        current_tmp_dir = compressed_backup_path.parent
-        call_with_logging(f"tar -zxvf {compressed_backup_path} --directory {current_tmp_dir}")
+    def _dump_command(self) -> Command:
+        """Command which writes DB's dump to stdout (is used for streaming backup)"""
+        raise NotImplementedError(f"Streaming backup is not supported by {self.service}")
+
+    def _compress_command(self) -> Command | None:
+        if self.codec.name == Compression.NONE:
+            return None
+
+        return self.codec.compress_command(
+            level=self.compression_level, threads=self.compression_threads
+        )
 
-        if not (result_file := get_latest_file(self.db_name, current_tmp_dir, mask="*.sql")):
-            raise RestoreBackupError("Backup archive doesn't contain any .sql files")
+    def _do_zip(self, lines_consumer: Callable[[Iterator[bytes]], object] | None = None) -> Path:
+        hasher = integrity.Hasher()
+        result_path = compress_path(
+            self.backup_path,
+            self.compressed_backup_path,
+            codec=self.codec,
+            level=self.compression_level,
+            threads=self.compression_threads,
+            hasher=hasher,
+            lines_consumer=lines_consumer,
+        )
+        # NONE codec only moves the dump (without reading it): there is nothing hashed
+        self.checksum = hasher.result() if hasher.size else None
+        return result_path
 
-        return result_file
+    def _do_unzip(self, compressed_backup_path: Path) -> Path:
+        return decompress_path(
+            compressed_backup_path,
+            directory=scratch.current_dir(),
+            dump_name=self.backup_path.name,
+        )
 
-    def _do_clean(self) -> str:
-        return call_with_logging(command=f"rm {self.backup_path}")
+    def _do_clean(self) -> None:
+        if self.backup_path.is_dir():
+            shutil.rmtree(self.backup_path)
+        else:
+            self.backup_path.unlink(missing_ok=True)
 
 
 class MySQLHandler(BaseHandler):
-    """Backup mysql from mysql server (via mysqldump)"""
+    """
+    Backup mysql from mysql server: via mysqldump (plain format) or via mydumper / myloader
+    (directory format: tables are dumped / loaded by parallel threads)
+    """
 
     service = "mysql"
+    dump_formats = (DumpFormat.PLAIN, DumpFormat.DIRECTORY)
     required_variables = (
         "MYSQL_USER",
         "MYSQL_PASSWORD",
         "MYSQL_HOST",
         "MYSQL_PORT",
     )
+    system_databases: ClassVar[tuple[str, ...]] = (
+        "information_schema",
+        "mysql",
+        "performance_schema",
+        "sys",
+    )
+    # consistent snapshot (InnoDB) without locking; rows are streamed instead of buffering
+    dump_options: ClassVar[tuple[str, ...]] = ("--single-transaction", "--quick", "--routines")
+
+    @classmethod
+    def command_env(cls) -> dict[str, str]:
+        # password isn't passed via command line (it is visible in the processes list)
+        return {"MYSQL_PWD": settings.MYSQL_PASSWORD}
+
+    @classmethod
+    def connection_args(cls) -> list[str]:
+        """Common connection's args for mysql's utilities"""
+        return [
+            *("-P", settings.MYSQL_PORT),
+            *("-h", settings.MYSQL_HOST),
+            *("-u", settings.MYSQL_USER),
+        ]
+
+    @classmethod
+    def discover_databases(cls, **extra_kwargs) -> list[str]:
+        command = ["mysql", *cls.connection_args(), "-N", "-B", "-e", "SHOW DATABASES"]
+        output = call_with_logging(command, env=cls.command_env())
+        return cls._filter_databases(output)
+
+    @classmethod
+    def estimate_db_size(cls, db_name: str, **extra_kwargs) -> int | None:
+        command = ["mysql", *cls.connection_args(), "-N", "-B", "-e", cls._size_query(db_name)]
+        return int(call_with_logging(command, env=cls.command_env()).strip())
+
+    @classmethod
+    def _size_query(cls, db_name: str) -> str:
+        return (
+            "SELECT COALESCE(SUM(data_length + index_length), 0) "
+            f"FROM information_schema.tables WHERE table_schema = '{db_name}'"
+        )
+
+    @classmethod
+    def _filter_databases(cls, output: str) -> list[str]:
+        return [
+            db_name
+            for db_name in map(str.strip, output.splitlines())
+            if db_name and db_name not in cls.system_databases
+        ]
+
+    @classmethod
+    def concurrency_key(cls, **extra_kwargs) -> str:
+        return f"{settings.MYSQL_HOST}:{settings.MYSQL_PORT}"
+
+    @property
+    def dump_format(self) -> DumpFormat:
+        dump_format = self.extra_kwargs.get("dump_format") or settings.MYSQL_DUMP_FORMAT
+        if (dump_format := DumpFormat(dump_format)) not in self.dump_formats:
+            raise BackupError(f"Dump's format {dump_format} is not supported by {self.service}")
+
+        return dump_format
+
+    @property
+    def jobs(self) -> int:
+        """Count of parallel threads for mydumper / myloader"""
+        return int(self.extra_kwargs.get("jobs") or settings.MYSQL_JOBS)
 
     def _do_backup(self) -> str:
-        command_kwargs = {
-            "host": settings.MYSQL_HOST,
-            "port": settings.MYSQL_PORT,
-            "user": settings.MYSQL_USER,
-            "password": settings.MYSQL_PASSWORD,
-            "db_name": self.db_name,
-            "backup_path": self.backup_path,
-        }
-        backup_command = """
-            mysqldump -P {port} -h {host} -u {user} -p"{password}" {db_name} > {backup_path}
-        """
+        if self.dump_format == DumpFormat.DIRECTORY:
+            with self._defaults_file() as defaults_file:
+                return call_with_logging(self._mydumper_command(defaults_file))
+
         return call_with_logging(
-            command=backup_command.format(**command_kwargs),
-            password_prefix="-p",
+            self._dump_command(), env=self.command_env(), stdout_path=self.backup_path
+        )
+
+    def _dump_command(self) -> Command:
+        if self.dump_format == DumpFormat.DIRECTORY:
+            raise BackupError("Directory format can't be streamed (use plain one)")
+
+        return [settings.MYSQL_DUMP_BIN, *self.connection_args(), *self.dump_options, self.db_name]
+
+    def _mydumper_command(self, defaults_file: Path) -> list[str]:
+        return [
+            *(settings.MYDUMPER_BIN, f"--defaults-file={defaults_file}"),
+            *("--database", self.db_name, "--outputdir", str(self.backup_path)),
+            *("--threads", str(self.jobs), "--routines"),
+        ]
+
+    def _myloader_command(self, defaults_file: Path) -> list[str]:
+        return [
+            *(settings.MYLOADER_BIN, f"--defaults-file={defaults_file}"),
+            *("--database", self.db_name, "--directory", str(self.backup_path)),
+            *("--threads", str(self.jobs)),
+        ]
+
+    @contextlib.contextmanager
+    def _defaults_file(self) -> Iterator[Path]:
+        """Temporary option file with connection's params (mydumper / myloader's password)"""
+        options = "\n".join(
+            [
+                f"host={settings.MYSQL_HOST}",
+                f"port={settings.MYSQL_PORT}",
+                f"user={settings.MYSQL_USER}",
+                f"password={settings.MYSQL_PASSWORD}",
+            ]
         )
+        # file is created with 0600 permissions (see `tempfile.mkstemp`)
+        fd, path = tempfile.mkstemp(prefix="mysql-", suffix=".cnf")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(
+                    "\n".join(f"[{group}]\n{options}\n" for group in ("mydumper", "myloader"))
+                )
+
+            yield Path(path)
+        finally:
+            os.unlink(path)
 
     def _do_restore(self, file_path: Path) -> None:
-        raise NotImplementedError("Not implemented yet")
+        self._prepare_restore()
+        self._restore_db()
+
+    def _prepare_restore(self) -> None:
+        if self._check_db_exists():
+            msg = (
+                f"There is an existing DB on your mysql server. "
+                f"Do you want to remove already created DB {self.db_name}?"
+            )
+            if click.confirm(msg):
+                self._drop_db()
+            else:
+                raise RestoreBackupError("Couldn't restore logic continue during DB exists")
+
+        self._create_db()
+
+    def _check_db_exists(self) -> bool:
+        self.logger.debug("[%s] check DB exists...", self.db_name)
+        query = f"SELECT 1 FROM information_schema.schemata WHERE schema_name = '{self.db_name}'"
+        result = call_with_logging(self._mysql_command("-e", query), env=self.command_env())
+        if exists := result.strip() != "":
+            self.logger.debug("[%s] Detected existing DB", self.db_name)
+
+        return exists
+
+    def _drop_db(self) -> None:
+        self.logger.info("[%s] Removing existing DB...", self.db_name)
+        command = self._mysql_command("-e", f"DROP DATABASE IF EXISTS `{self.db_name}`")
+        call_with_logging(command, env=self.command_env())
+
+    def _create_db(self) -> None:
+        self.logger.info("[%s] Creating new DB...", self.db_name)
+        command = self._mysql_command("-e", f"CREATE DATABASE `{self.db_name}`")
+        call_with_logging(command, env=self.command_env())
+
+    def _restore_db(self) -> None:
+        self.logger.info("[%s] Restoring DB...", self.db_name)
+        if self.backup_path.is_dir():
+            # mydumper's directory: tables are loaded by parallel threads
+            with self._defaults_file() as defaults_file:
+                call_with_logging(self._myloader_command(defaults_file))
+            return
+
+        call_with_logging(
+            self._restore_command(b""), env=self.command_env(), stdin_path=self.backup_path
+        )
+
+    def _restore_command(self, header: bytes) -> Command:
+        if is_tar(header):
+            raise RestoreBackupError("Directory format (mydumper) can't be restored from stream")
+
+        return self._mysql_command(self.db_name)
+
+    def _mysql_command(self, *args: str) -> Command:
+        """mysql client's command (batch mode, without column names)"""
+        return ["mysql", *self.connection_args(), "-N", "-B", *args]
+
+
+class MySQLDockerHandler(MySQLHandler):
+    """
+    Backups and restores MySQL-database inside docker container
+    (root's password is taken from the container's MYSQL_ROOT_PASSWORD env)
+    """
+
+    service = "mysql-docker"
+    dump_formats = (DumpFormat.PLAIN,)
+    required_variables = ()
+    # password is passed via env inside the container (not via command line)
+    shell_command: ClassVar[str] = 'MYSQL_PWD="$MYSQL_ROOT_PASSWORD" exec "$@"'
+
+    def __init__(self, db_name: str, **extra_kwargs):
+        super().__init__(db_name, **extra_kwargs)
+        self.container_name = self.extra_kwargs.get("container_name")
+        if not self.container_name:
+            raise RuntimeError("container_name is required")
+
+    @classmethod
+    def command_env(cls) -> dict[str, str]:
+        return {}
+
+    @classmethod
+    def discover_databases(cls, **extra_kwargs) -> list[str]:
+        command = cls._wrap_do_in_docker(
+            extra_kwargs["container_name"],
+            ["mysql", "-u", "root", "-N", "-B", "-e", "SHOW DATABASES"],
+        )
+        return cls._filter_databases(call_with_logging(command))
+
+    @classmethod
+    def estimate_db_size(cls, db_name: str, **extra_kwargs) -> int | None:
+        command = cls._wrap_do_in_docker(
+            extra_kwargs["container_name"],
+            ["mysql", "-u", "root", "-N", "-B", "-e", cls._size_query(db_name)],
+        )
+        return int(call_with_logging(command).strip())
+
+    @classmethod
+    def concurrency_key(cls, **extra_kwargs) -> str:
+        return f"container:{extra_kwargs.get('container_name')}"
+
+    def _dump_command(self) -> Command:
+        command = ["mysqldump", "-u", "root", *self.dump_options, self.db_name]
+        return self._wrap_do_in_docker(self.container_name, command)
+
+    def _restore_db(self) -> None:
+        if self.backup_path.is_dir():
+            raise RestoreBackupError("Directory format's dumps are not supported by the handler")
+
+        super()._restore_db()
+
+    def _mysql_command(self, *args: str) -> Command:
+        return self._wrap_do_in_docker(
+            self.container_name, ["mysql", "-u", "root", "-N", "-B", *args]
+        )
+
+    @classmethod
+    def _wrap_do_in_docker(cls, container_name: str, command: list[str]) -> Command:
+        return docker_exec_command(container_name, ["sh", "-c", cls.shell_command, "sh", *command])
 
 
 class PGServiceHandler(BaseHandler):
     """Backup PG database from postgres server (via pg_dump)"""
 
     service = "postgres"
+    supports_selective_restore = True
+    dump_formats = tuple(DumpFormat)
     required_variables = (
         "PG_DUMP_BIN",
         "PG_HOST",
@@ -171,35 +599,91 @@ class PGServiceHandler(BaseHandler):
         "PG_USER",
         "PG_PASSWORD",
     )
+    discover_query: ClassVar[str] = (
+        "SELECT datname FROM pg_database WHERE NOT datistemplate AND datname <> 'postgres'"
+    )
+
+    @classmethod
+    def command_env(cls) -> dict[str, str]:
+        return {"PGPASSWORD": settings.PG_PASSWORD or ""}
+
+    @classmethod
+    def connection_args(cls) -> list[str]:
+        """Common connection's args for PG's utilities"""
+        return [f"-h{settings.PG_HOST}", f"-p{settings.PG_PORT}", f"-U{settings.PG_USER}"]
+
+    @classmethod
+    def discover_databases(cls, **extra_kwargs) -> list[str]:
+        output = call_with_logging(cls._psql_command(cls.discover_query), env=cls.command_env())
+        return [db_name for db_name in map(str.strip, output.splitlines()) if db_name]
+
+    @classmethod
+    def estimate_db_size(cls, db_name: str, **extra_kwargs) -> int | None:
+        query = f"SELECT pg_database_size('{db_name}')"
+        return int(call_with_logging(cls._psql_command(query), env=cls.command_env()).strip())
+
+    @classmethod
+    def concurrency_key(cls, **extra_kwargs) -> str:
+        return f"{settings.PG_HOST}:{settings.PG_PORT}"
+
+    @classmethod
+    def _psql_command(cls, query: str, db_name: str = "postgres") -> list[str]:
+        return ["psql", *cls.connection_args(), "-d", db_name, "-A", "-t", "-c", query]
 
     @property
-    def command_kwargs(self):
-        """Overrided ClassVar-parameters in order to access to self-related params"""
-        return {
-            "pg_dump_bin": settings.PG_DUMP_BIN,
-            "host": settings.PG_HOST,
-            "port": settings.PG_PORT,
-            "user": settings.PG_USER,
-            "password": settings.PG_PASSWORD,
-            "db_name": self.db_name,
-            "backup_path": self.backup_path,
-        }
+    def dump_format(self) -> DumpFormat:
+        return DumpFormat(self.extra_kwargs.get("dump_format") or settings.PG_DUMP_FORMAT)
+
+    @property
+    def jobs(self) -> int:
+        """Count of parallel jobs for pg_dump (directory format only) / pg_restore"""
+        return int(self.extra_kwargs.get("jobs") or settings.PG_JOBS)
 
     def _do_backup(self) -> str:
-        backup_command = """
-            PGPASSWORD="{password}" {pg_dump_bin} -h{host} -p{port} -U{user} \
-            -d {db_name} -f {backup_path}
-        """
-        return call_with_logging(
-            command=backup_command.format(**self.command_kwargs),
-            password_prefix="PGPASSWORD=",
-        )
+        command = [*self._pg_dump_command(), "-f", self.backup_path]
+        if self.dump_format == DumpFormat.DIRECTORY and self.jobs > 1:
+            command.extend(["-j", str(self.jobs)])
+
+        return call_with_logging(command, env=self.command_env())
+
+    def _dump_command(self) -> Command:
+        if self.dump_format == DumpFormat.DIRECTORY:
+            raise BackupError("Directory format can't be streamed (use plain or custom one)")
+
+        return self._pg_dump_command()
+
+    def _pg_dump_command(self) -> list[str]:
+        return [
+            *(settings.PG_DUMP_BIN, *self.connection_args()),
+            *("-d", self.db_name, f"--format={self.dump_format}"),
+        ]
+
+    def _build_toc(self) -> Callable[[Iterator[bytes]], object] | None:
+        toc_path = toc.sidecar_path(self.compressed_backup_path)
+        if self.dump_format == DumpFormat.PLAIN and self.codec.name != Compression.NONE:
+            # plain dump is parsed while it is compressed (it isn't read twice)
+            return lambda lines: toc.parse_plain_toc(lines).save(toc_path)
+
+        with metrics.stage("toc", self.db_name):
+            if self.dump_format == DumpFormat.PLAIN:
+                dump_toc = toc.build_plain_toc(self.backup_path)
+            else:
+                dump_toc = toc.build_archive_toc(self.backup_path)
+
+        dump_toc.save(toc_path)
+        return None
 
     def _do_restore(self, file_path: Path) -> None:
-        #self._restore_db()
-        #return
-        
+        self._prepare_restore()
+        self._restore_db(toc_path=toc.sidecar_path(file_path))
+
+    def _prepare_restore(self) -> None:
         if self._check_db_exists():
+            if self.restore_filter:
+                # selected tables are restored into the existing DB (ex.: after an incident)
+                self.logger.info("[%s] Restoring selected objects into existing DB", self.db_name)
+                return
+
             msg = (
                 f"There is an existing DB on your postgres server. "
                 f"Do you want to remove already created DB {self.db_name}?"
@@ -210,17 +694,11 @@ class PGServiceHandler(BaseHandler):
                 raise RestoreBackupError("Couldn't restore logic continue during DB exists")
 
         self._create_db()
-        self._restore_db()
 
     def _check_db_exists(self):
         self.logger.debug("[%s] check DB exists...", self.db_name)
-        command = """
-            PGPASSWORD="{password}" psql -h{host} -p{port} -U{user} -l | grep {db_name}
-        """
-        result = call_with_logging(
-            command.format(**self.command_kwargs),
-            password_prefix="PGPASSWORD=",
-        )
+        query = f"SELECT 1 FROM pg_database WHERE datname = '{self.db_name}'"
+        result = call_with_logging(self._psql_command(query), env=self.command_env())
         if exists := result.strip() != "":
             self.logger.debug("[%s] Detected existing DB", self.db_name)
 
@@ -228,26 +706,111 @@ class PGServiceHandler(BaseHandler):
 
     def _drop_db(self):
         self.logger.info("[%s] Removing existing DB...", self.db_name)
-        command = """
-            PGPASSWORD="{password}" psql -h{host} -p{port} -U{user} \
-            -c "DROP DATABASE IF EXISTS {db_name}"
-        """
-        call_with_logging(command.format(**self.command_kwargs), password_prefix="PGPASSWORD=")
+        command = self._psql_command(f"DROP DATABASE IF EXISTS {self.db_name}")
+        call_with_logging(command, env=self.command_env())
 
     def _create_db(self):
         self.logger.info("[%s] Creating new DB...", self.db_name)
-        command = """
-            PGPASSWORD="{password}" psql -h{host} -p{port} -U{user} \
-            -c "CREATE DATABASE {db_name}"
-        """
-        call_with_logging(command.format(**self.command_kwargs), password_prefix="PGPASSWORD=")
+        command = self._psql_command(f"CREATE DATABASE {self.db_name}")
+        call_with_logging(command, env=self.command_env())
 
-    def _restore_db(self):
+    def _restore_db(self, toc_path: Path | None = None):
         self.logger.info("[%s] Restoring DB...", self.db_name)
-        command = """
-            PGPASSWORD="{password}" psql -h{host} -p{port} -U{user} {db_name} < {backup_path}
+        if not self._is_archive_dump(self.backup_path):
+            if self.restore_filter or self.jobs > 1:
+                self._restore_plain_entries(toc.load_or_build(self.backup_path, toc_path))
+                return
+
+            command = self._psql_restore_command()
+            call_with_logging(command, env=self.command_env(), stdin_path=self.backup_path)
+            return
+
+        # custom / directory formats: pg_restore allows to restore in parallel jobs
+        command = [*self._pg_restore_command(), "-j", str(self.jobs)]
+        if self.restore_filter:
+            dump_toc = toc.load_or_build(self.backup_path, toc_path)
+            list_path = scratch.current_dir() / f"{self.db_name}.restore.list"
+            entries = self._select_entries(dump_toc)
+            command.extend(["-L", toc.write_archive_list(entries, list_path)])
+
+        call_with_logging([*command, self.backup_path], env=self.command_env())
+
+    def _select_entries(self, dump_toc: toc.Toc) -> list[toc.TocEntry]:
+        if not (entries := dump_toc.select(self.restore_filter)):
+            raise RestoreBackupError(f"No objects match the restore's filter {self.restore_filter}")
+
+        self.logger.info(
+            "[%s] %i of %i dump's objects will be restored",
+            self.db_name,
+            len(entries),
+            len(dump_toc.entries),
+        )
+        return entries
+
+    def _restore_plain_entries(self, dump_toc: toc.Toc) -> None:
+        """
+        Restores plain dump by its TOC: pre-data, then tables' data by parallel sessions,
+        then indexes / constraints concurrently and the rest of post-data
         """
-        call_with_logging(command.format(**self.command_kwargs), password_prefix="PGPASSWORD=")
+        if not dump_toc.entries and not self.restore_filter:
+            # not pg_dump's output (no TOC's comments): it is restored as is
+            command = self._psql_restore_command()
+            call_with_logging(command, env=self.command_env(), stdin_path=self.backup_path)
+            return
+
+        for phase in toc.restore_phases(self._select_entries(dump_toc)):
+            with ThreadPoolExecutor(max_workers=min(self.jobs, len(phase))) as executor:
+                futures = [
+                    submit_in_context(executor, self._restore_batch, dump_toc, batch)
+                    for batch in phase
+                ]
+                for future in futures:
+                    future.result()
+
+    def _restore_batch(self, dump_toc: toc.Toc, batch: list[toc.TocEntry]) -> None:
+        """Restores entries of the plain dump in the single psql's session"""
+        pipeline = RestorePipeline(self.db_name, env=self.command_env())
+        try:
+            pipeline.add_stage(
+                [*self._psql_restore_command(), "--single-transaction"],
+                toc.iter_ranges(self.backup_path, dump_toc, batch),
+                is_last=True,
+            )
+            pipeline.wait()
+        except Exception:
+            pipeline.kill()
+            raise
+
+    def _restore_command(self, header: bytes) -> Command:
+        if not header.startswith(PG_CUSTOM_DUMP_MAGIC):
+            return self._psql_restore_command()
+
+        if self.jobs > 1:
+            # pg_restore requires seekable file for parallel jobs
+            self.logger.warning(
+                "[%s] Parallel pg_restore is not supported for streamed dump (jobs are ignored)",
+                self.db_name,
+            )
+
+        return self._pg_restore_command()
+
+    def _psql_restore_command(self) -> list[str]:
+        return ["psql", *self.connection_args(), "-v", "ON_ERROR_STOP=1", self.db_name]
+
+    def _pg_restore_command(self) -> list[str]:
+        return [
+            *(settings.PG_RESTORE_BIN, *self.connection_args()),
+            *("-d", self.db_name, "--exit-on-error"),
+        ]
+
+    @staticmethod
+    def _is_archive_dump(backup_path: Path) -> bool:
+        """Detects pg_dump's custom / directory formats (which require pg_restore)"""
+        if backup_path.is_dir():
+            return (backup_path / "toc.dat").exists()
+
+        with open(backup_path, "rb") as file:
+            return file.read(len(PG_CUSTOM_DUMP_MAGIC)) == PG_CUSTOM_DUMP_MAGIC
 
 
 class PGDockerHandler(BaseHandler):
@@ -263,25 +826,41 @@ class PGDockerHandler(BaseHandler):
             raise RuntimeError("container_name is required")
 
     def _do_backup(self) -> str:
-        """Allows to backup postgres db from docker-based postgres server"""
-        backup_in_container_path = f"/tmp/{self.backup_path.name}"
+        """
+        Allows to backup postgres db from docker-based postgres server:
+        pg_dump's stdout is streamed to the host's file (without temporary file in the container)
+        """
+        return call_with_logging(self._dump_command(), stdout_path=self.backup_path)
 
-        # 1. do backup inside a docker container
-        backup_command = self._wrap_do_in_docker(
-            f"pg_dump -f {backup_in_container_path} -d {self.db_name} -U postgres"
+    @classmethod
+    def discover_databases(cls, **extra_kwargs) -> list[str]:
+        command = docker_exec_command(
+            extra_kwargs["container_name"],
+            ["psql", "-U", "postgres", "-A", "-t", "-c", PGServiceHandler.discover_query],
         )
-        stdout = call_with_logging(command=backup_command)
-
-        # 2. copy result file from a docker container to the host machine
-        stdout += call_with_logging(
-            f"docker cp {self.container_name}:{backup_in_container_path} {self.backup_path}"
+        output = call_with_logging(command)
+        return [db_name for db_name in map(str.strip, output.splitlines()) if db_name]
+
+    @classmethod
+    def estimate_db_size(cls, db_name: str, **extra_kwargs) -> int | None:
+        command = docker_exec_command(
+            extra_kwargs["container_name"],
+            ["psql", "-U", "postgres", "-A", "-t", "-c", f"SELECT pg_database_size('{db_name}')"],
         )
+        return int(call_with_logging(command).strip())
 
-        # 3. remove tmp file in a docker container
-        call_with_logging(command=self._wrap_do_in_docker(f"rm {backup_in_container_path}"))
-        return stdout
+    @classmethod
+    def concurrency_key(cls, **extra_kwargs) -> str:
+        return f"container:{extra_kwargs.get('container_name')}"
+
+    def _dump_command(self) -> Command:
+        return self._wrap_do_in_docker(["pg_dump", "-d", self.db_name, "-U", "postgres"])
 
     def _do_restore(self, file_path: Path) -> None:
+        self._prepare_restore()
+        self._restore_db()
+
+    def _prepare_restore(self) -> None:
         if self._check_db_exists():
             msg = (
                 f"There is an existing DB on your postgres server. "
@@ -293,13 +872,12 @@ class PGDockerHandler(BaseHandler):
                 raise RestoreBackupError("Couldn't restore logic continue during DB exists")
 
         self._create_db()
-        self._restore_db()
 
     def _check_db_exists(self):
         self.logger.debug("[%s] check DB exists...", self.db_name)
-        command = self._wrap_do_in_docker(f"psql  -l | grep {self.db_name}")
-        result = call_with_logging(command).strip()
-        if exists := result != "0":
+        query = f"SELECT 1 FROM pg_database WHERE datname = '{self.db_name}'"
+        result = call_with_logging(self._wrap_psql_in_docker(query)).strip()
+        if exists := result != "":
             self.logger.debug("[%s] Detected existing DB", self.db_name)
 
         return exists
@@ -316,22 +894,33 @@ class PGDockerHandler(BaseHandler):
 
     def _restore_db(self):
         self.logger.info("[%s] Restoring DB...", self.db_name)
-        backup_path_in_container = f"/tmp/{self.backup_path.name}"
-        call_with_logging(
-            f"docker cp {self.backup_path} {self.container_name}:{backup_path_in_container}"
-        )
-        command = self._wrap_do_in_docker(f"psql {self.db_name} < {backup_path_in_container}")
-        call_with_logging(command)
+        if self.backup_path.is_dir():
+            raise RestoreBackupError("Directory format's dumps are not supported by the handler")
+
+        # dump is passed via stdin of `docker exec -i` (without copying into the container)
+        with open(self.backup_path, "rb") as file:
+            header = file.read(len(PG_CUSTOM_DUMP_MAGIC))
+
+        call_with_logging(self._restore_command(header), stdin_path=self.backup_path)
+
+    def _restore_command(self, header: bytes) -> Command:
+        if header.startswith(PG_CUSTOM_DUMP_MAGIC):
+            command = ["pg_restore", "-U", "postgres", "-d", self.db_name, "--exit-on-error"]
+        else:
+            command = ["psql", "-U", "postgres", "-v", "ON_ERROR_STOP=1", "-d", self.db_name]
+
+        return self._wrap_do_in_docker(command)
 
-    def _wrap_psql_in_docker(self, command) -> str:
-        return self._wrap_do_in_docker(f'psql -c "{command}"')
+    def _wrap_psql_in_docker(self, command: str) -> Command:
+        return self._wrap_do_in_docker(["psql", "-U", "postgres", "-A", "-t", "-c", command])
 
-    def _wrap_do_in_docker(self, command: str) -> str:
-        return f'docker exec -t {self.container_name} sh -c "{command}"'
+    def _wrap_do_in_docker(self, command: list[str]) -> Command:
+        return docker_exec_command(self.container_name, command)
 
 
 HANDLERS: dict[BackupHandler, Type[BaseHandler]] = {
     BackupHandler.MYSQL: MySQLHandler,
+    BackupHandler.MYSQL_CONTAINER: MySQLDockerHandler,
     BackupHandler.PG_SERVICE: PGServiceHandler,
     BackupHandler.PG_CONTAINER: PGDockerHandler,
 }
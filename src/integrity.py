@@ -0,0 +1,257 @@
+"""
+Integrity of backups: checksum is calculated on the fly by the stage which writes backup's
+data (compression, encryption, streaming), so no extra read pass is needed. It is stored
+in the sidecar manifest (`{backup}.checksum.json`), in S3 object's metadata and in the catalog.
+Stored backups are verified against it (see `verify` command).
+"""
+
+import json
+import hashlib
+import logging
+import dataclasses
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from src import crypto, settings, utils
+from src.compression import CODECS, detect_codec
+from src.constants import BackupLocation, Compression
+from src.exceptions import BackupError
+from src.retention import StoredBackup
+from src.run import logger_ctx
+from src.utils import CHECKSUM_SUFFIX
+
+module_logger = logging.getLogger(__name__)
+# S3 object's user metadata (x-amz-meta-*) with backup's checksum
+METADATA_ALGORITHM = "checksum-algorithm"
+METADATA_CHECKSUM = "checksum"
+# first bytes of backup which are read by the fast verification (format's magic)
+HEADER_SIZE = 512
+
+
+@dataclasses.dataclass(frozen=True)
+class Checksum:
+    """Checksum (hex digest) and size of backup's file"""
+
+    algorithm: str
+    digest: str
+    size: int
+
+    @property
+    def metadata(self) -> dict[str, str]:
+        """User metadata of S3 object"""
+        return {METADATA_ALGORITHM: self.algorithm, METADATA_CHECKSUM: self.digest}
+
+    @classmethod
+    def load(cls, path: Path) -> "Checksum":
+        """
+        Loads checksum from the manifest
+        :raise `BackupError`
+        """
+        try:
+            return cls.from_json(Path(path).read_bytes())
+        except OSError as exc:
+            raise BackupError(f"Couldn't read checksum's manifest {path}: {exc!r}") from exc
+
+    @classmethod
+    def from_json(cls, content: bytes | str) -> "Checksum":
+        try:
+            data = json.loads(content)
+            return cls(algorithm=data["algorithm"], digest=data["digest"], size=data["size"])
+        except (ValueError, TypeError, KeyError) as exc:
+            raise BackupError(f"Invalid checksum's manifest: {exc!r}") from exc
+
+    def save(self, path: Path) -> Path:
+        Path(path).write_text(json.dumps(dataclasses.asdict(self)))
+        return path
+
+
+class Hasher:
+    """Calculates checksum of the written data (chunk by chunk)"""
+
+    def __init__(self, algorithm: str | None = None):
+        self.algorithm = algorithm or settings.CHECKSUM_ALGORITHM
+        self._hash = hashlib.new(self.algorithm)
+        self.size = 0
+
+    def update(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def result(self) -> Checksum:
+        return Checksum(algorithm=self.algorithm, digest=self._hash.hexdigest(), size=self.size)
+
+
+def manifest_path(backup_path: Path) -> Path:
+    """Path of the checksum's manifest (sidecar which is stored next to the backup)"""
+    return backup_path.with_name(f"{backup_path.name}{CHECKSUM_SUFFIX}")
+
+
+def file_checksum(file_path: Path, algorithm: str | None = None) -> Checksum:
+    """Reads the file for checksum's calculation (for files which weren't hashed on the fly)"""
+    hasher = Hasher(algorithm)
+    for chunk in iter_file(file_path):
+        hasher.update(chunk)
+
+    return hasher.result()
+
+
+def iter_file(file_path: Path) -> Iterator[bytes]:
+    """Reads the file chunk by chunk"""
+    with open(file_path, "rb") as file:
+        while chunk := file.read(settings.STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+@dataclasses.dataclass
+class VerifyResult:
+    """Result of the backup's verification (unverified - expected checksum isn't found)"""
+
+    backup: StoredBackup
+    status: str
+    message: str = ""
+
+    @property
+    def failed(self) -> bool:
+        return self.status == "failed"
+
+
+def check_header(file_name: str, header: bytes) -> str | None:
+    """
+    Checks format's magic of backup's first bytes (encryption / compression header)
+
+    >>> check_header("2024-02-21-065213.db.backup.sql.zst", b"\\x28\\xb5\\x2f\\xfd...")
+    >>> check_header("2024-02-21-065213.db.backup.sql.zst.enc", b"\\x28\\xb5\\x2f\\xfd...")
+    'unknown encryption header'
+    >>> check_header("2024-02-21-065213.db.backup.sql.gz", b"-- PostgreSQL database dump")
+    "compression header doesn't match extension 'gz'"
+
+    :return: error's message (None for valid header)
+    """
+    if file_name.endswith(".enc"):
+        if not header.startswith(crypto.MAGIC) and not crypto.is_legacy_encrypted(header):
+            return "unknown encryption header"
+
+        return None
+
+    extension = file_name.rsplit(".", 1)[-1]
+    codec = detect_codec(header)
+    is_compressed = extension in {known.extension for known in CODECS.values() if known.extension}
+    if codec.extension != extension and (is_compressed or codec.name != Compression.NONE):
+        return f"compression header doesn't match extension {extension!r}"
+
+    return None
+
+
+def verify_backup(backup: StoredBackup, fast: bool = False) -> VerifyResult:
+    """
+    Verifies stored backup against its checksum (manifest or S3 object's metadata):
+     - fast mode: size (S3 HEAD / stat) + checksum in S3 metadata + ranged read of the header
+     - full mode: the whole backup is read (S3: concurrent ranged GETs) and hashed
+    """
+    logger = logger_ctx.get(module_logger)
+    file_name = Path(backup.path).name
+    try:
+        if backup.location == BackupLocation.S3:
+            storage = _S3Backup(backup)
+        else:
+            storage = _LocalBackup(backup)
+
+        expected = storage.expected_checksum()
+        if error := check_header(file_name, storage.read_header()):
+            return VerifyResult(backup, "failed", error)
+
+        if expected and storage.size != expected.size:
+            return VerifyResult(
+                backup, "failed", f"size mismatch: {storage.size} != {expected.size} (expected)"
+            )
+
+        if fast:
+            if expected and storage.metadata_checksum not in (None, expected.digest):
+                return VerifyResult(backup, "failed", "checksum in S3 metadata mismatch")
+
+            if not expected:
+                return VerifyResult(backup, "unverified", "checksum isn't found: header is valid")
+
+            return VerifyResult(backup, "ok", "size and header are valid (fast mode)")
+
+        hasher = Hasher(expected.algorithm if expected else None)
+        for chunk in storage.iter_content():
+            hasher.update(chunk)
+
+        actual = hasher.result()
+        if not expected:
+            return VerifyResult(
+                backup, "unverified", f"checksum isn't found ({actual.algorithm}: {actual.digest})"
+            )
+
+        if actual.digest != expected.digest:
+            return VerifyResult(backup, "failed", f"{expected.algorithm} checksum mismatch")
+
+        return VerifyResult(backup, "ok", f"{expected.algorithm}: {actual.digest}")
+
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.debug("[%s] verification failed: %r", backup.db_name, exc)
+        return VerifyResult(backup, "failed", f"couldn't read backup: {exc!r}")
+
+
+class _LocalBackup:
+    def __init__(self, backup: StoredBackup):
+        self.path = Path(backup.path)
+        self.size = self.path.stat().st_size
+        self.metadata_checksum = None
+
+    def expected_checksum(self) -> Checksum | None:
+        path = manifest_path(self.path)
+        return Checksum.load(path) if path.exists() else None
+
+    def read_header(self) -> bytes:
+        with open(self.path, "rb") as file:
+            return file.read(HEADER_SIZE)
+
+    def iter_content(self) -> Iterable[bytes]:
+        return iter_file(self.path)
+
+
+class _S3Backup:
+    def __init__(self, backup: StoredBackup):
+        s3 = utils.get_s3()
+        self.s3 = s3
+        self.backup = backup
+        self.head = s3.get_client().head_object(Bucket=settings.S3_BUCKET_NAME, Key=backup.path)
+        self.size = self.head["ContentLength"]
+        self.metadata = self.head.get("Metadata") or {}
+        self.metadata_checksum = self.metadata.get(METADATA_CHECKSUM)
+
+    def expected_checksum(self) -> Checksum | None:
+        manifest_key = f"{self.backup.path}{CHECKSUM_SUFFIX}"
+        if manifest_key in self.backup.sidecars:
+            response = self.s3.get_client().get_object(
+                Bucket=settings.S3_BUCKET_NAME, Key=manifest_key
+            )
+            return Checksum.from_json(response["Body"].read())
+
+        if self.metadata_checksum:
+            return Checksum(
+                algorithm=self.metadata.get(METADATA_ALGORITHM, settings.CHECKSUM_ALGORITHM),
+                digest=self.metadata_checksum,
+                size=self.size,
+            )
+
+        return None
+
+    def read_header(self) -> bytes:
+        if not self.size:
+            return b""
+
+        response = self.s3.get_client().get_object(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=self.backup.path,
+            Range=f"bytes=0-{min(HEADER_SIZE, self.size) - 1}",
+            IfMatch=self.head["ETag"],
+        )
+        return response["Body"].read()
+
+    def iter_content(self) -> Iterable[bytes]:
+        return self.s3.iter_object(
+            self.backup.db_name, self.backup.path, if_match=self.head["ETag"]
+        )
@@ -0,0 +1,213 @@
+"""
+Orchestration of backup/restore jobs: the asyncio event loop runs jobs concurrently
+(blocking handlers and boto3's transfers are executed by the pool of worker threads),
+limits their concurrency (globally and per DB host), enforces job's timeouts and
+cancels running jobs on SIGTERM / SIGINT (their subprocesses are terminated)
+"""
+
+import time
+import signal
+import asyncio
+import logging
+import contextvars
+import dataclasses
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+from src import settings
+from src.process import ProcessScope, process_scope
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+@dataclasses.dataclass
+class JobResult:
+    """Result of single job's running (is used for final report)"""
+
+    name: str
+    success: bool = False
+    duration: float = 0.0
+    error: str | None = None
+    result: Any = None
+
+
+class Orchestrator:
+    """
+    Runs jobs (blocking callables) in worker threads, driven by the event loop.
+    Job is cancelled when its timeout is exceeded or the orchestrator is stopped (SIGTERM):
+    processes of the job are terminated (killed after `cancel_timeout`), waiting jobs are skipped.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        key_func: Callable[[str], str] | None = None,
+        per_key_limit: int = 0,
+        timeout: float | None = None,
+        cancel_timeout: float = settings.JOB_CANCEL_TIMEOUT,
+    ):
+        self.workers = max(workers, 1)
+        self.key_func = key_func or (lambda name: "")
+        self.per_key_limit = per_key_limit if per_key_limit > 0 else self.workers
+        self.timeout = timeout or None
+        self.cancel_timeout = cancel_timeout
+        self.logger = logger_ctx.get(module_logger)
+        self._stopping = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._key_semaphores = defaultdict(lambda: asyncio.Semaphore(self.per_key_limit))
+        self._executor: ThreadPoolExecutor | None = None
+        self._handled_signals: list[int] = []
+
+    async def __aenter__(self) -> "Orchestrator":
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._handled_signals = self._add_signal_handlers(asyncio.get_running_loop())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        loop = asyncio.get_running_loop()
+        for signal_number in self._handled_signals:
+            loop.remove_signal_handler(signal_number)
+
+        # threads of jobs which ignore cancelling (ex.: blocking S3 call) aren't awaited here
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def stop(self, reason: str = "stop") -> None:
+        """Cancels running jobs and skips waiting ones"""
+        if not self._stopping.is_set():
+            self.logger.warning("Stopping jobs (%s) ...", reason)
+            self._stopping.set()
+
+    async def sleep(self, seconds: float) -> bool:
+        """Sleeps (is interrupted by stopping): returns True if the orchestrator is stopped"""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=max(seconds, 0))
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+    async def run(self, names: list[str], func: Callable[[str], Any]) -> list[JobResult]:
+        """
+        Runs func for each name. Exceptions are not propagated:
+        they are collected to the result's list (one result per name, in the same order).
+        """
+        self.logger.debug(
+            "Running %i jobs (workers: %i, per key limit: %i, timeout: %s)",
+            len(names),
+            self.workers,
+            self.per_key_limit,
+            self.timeout,
+        )
+        async with self:
+            return await asyncio.gather(*(self.run_job(name, func) for name in names))
+
+    async def run_job(
+        self,
+        name: str,
+        func: Callable[[str], Any],
+        key: str | None = None,
+        timeout: float | None = None,
+    ) -> JobResult:
+        """
+        Runs func(name) in the worker's thread (inside of `async with orchestrator: ...` block)
+
+        :param key: concurrency key of the job (`key_func(name)` by default)
+        :param timeout: max duration of the job (orchestrator's timeout by default)
+        """
+        timeout = timeout or self.timeout
+        key_semaphore = self._key_semaphores[self.key_func(name) if key is None else key]
+        job_result = JobResult(name=name)
+        async with self._semaphore, key_semaphore:
+            if self._stopping.is_set():
+                job_result.error = "Job is cancelled (not started)"
+                return job_result
+
+            scope = ProcessScope()
+            # job's thread gets copy of current context (logger_ctx's value and process's scope)
+            context = contextvars.copy_context()
+            context.run(process_scope.set, scope)
+            started_at = time.monotonic()
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, context.run, func, name
+            )
+            stopping = asyncio.ensure_future(self._stopping.wait())
+            try:
+                done, _ = await asyncio.wait(
+                    {future, stopping}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if future in done:
+                    job_result.result = future.result()
+                    job_result.success = True
+                else:
+                    reason = "cancelled" if stopping in done else f"timed out ({timeout}s)"
+                    job_result.error = f"Job is {reason}"
+                    await self._cancel(name, future, scope, reason)
+
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.logger.exception("[%s] job failed: %r", name, exc)
+                job_result.error = str(exc)
+            finally:
+                stopping.cancel()
+                job_result.duration = time.monotonic() - started_at
+
+        return job_result
+
+    async def _cancel(
+        self, name: str, future: asyncio.Future, scope: ProcessScope, reason: str
+    ) -> None:
+        self.logger.error("[%s] job is %s: terminating its processes ...", name, reason)
+        scope.terminate()
+        done, _ = await asyncio.wait({future}, timeout=self.cancel_timeout)
+        if not done:
+            self.logger.warning("[%s] job isn't finished after SIGTERM: killing ...", name)
+            scope.terminate(force=True)
+            done, _ = await asyncio.wait({future}, timeout=self.cancel_timeout)
+
+        if done and (exc := future.exception()):
+            self.logger.debug("[%s] cancelled job is finished: %r", name, exc)
+
+    def _add_signal_handlers(self, loop: asyncio.AbstractEventLoop) -> list[int]:
+        handled_signals = []
+        for signal_number in STOP_SIGNALS:
+            try:
+                loop.add_signal_handler(signal_number, self.stop, signal_number.name)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # signals are handled by the main thread's loop only
+                continue
+
+            handled_signals.append(signal_number)
+
+        return handled_signals
+
+
+def run_jobs(
+    names: list[str],
+    func: Callable[[str], Any],
+    workers: int = 1,
+    key_func: Callable[[str], str] | None = None,
+    per_key_limit: int = 0,
+    timeout: float | None = None,
+) -> list[JobResult]:
+    """
+    Runs func for each name with the pool of workers (see `Orchestrator`). Exceptions are not
+    propagated: they are collected to the result's list (one result per name, in the same order).
+
+    :param names: names of jobs (ex.: DB names)
+    :param func: callable which will be called for each name
+    :param workers: count of concurrent workers
+    :param key_func: returns concurrency key for name (ex.: DB host)
+    :param per_key_limit: max count of concurrently running jobs with the same key (0 - no limit)
+    :param timeout: max duration (in seconds) of each job (None / 0 - without limit)
+    :return: list of job's results
+    """
+    orchestrator = Orchestrator(
+        workers=workers, key_func=key_func, per_key_limit=per_key_limit, timeout=timeout
+    )
+    return asyncio.run(orchestrator.run(names, func))
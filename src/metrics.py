@@ -0,0 +1,284 @@
+"""
+Instrumentation of backup / restore runs: wall time, CPU time, bytes in / out, throughput
+and peak RSS of each stage (dump, compress, encrypt, copy, S3 transfers, ...).
+The run's report is saved as JSON (METRICS_REPORT_PATH) and / or as Prometheus metrics
+for node_exporter's textfile collector (METRICS_TEXTFILE_DIR).
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+import functools
+import contextlib
+import contextvars
+import dataclasses
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from src import settings
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+METRIC_PREFIX = "db_backups"
+STAGE_METRICS: dict[str, tuple[str, str]] = {
+    # field: (metric's name, help)
+    "wall_time": ("stage_duration_seconds", "Wall time of the stage"),
+    "cpu_time": ("stage_cpu_seconds", "CPU time (user + system, incl. child processes)"),
+    "bytes_in": ("stage_bytes_in", "Bytes read by the stage"),
+    "bytes_out": ("stage_bytes_out", "Bytes written by the stage"),
+}
+
+
+def _cpu_time() -> float:
+    # process-wide: stages of concurrent jobs share it; children are counted after their exit
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _peak_rss() -> int:
+    """Peak RSS (in bytes) of the process and its (finished) children"""
+    rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def path_size(path: Path) -> int:
+    """Size of file (or directory with its content)"""
+    path = Path(path)
+    if path.is_dir():
+        return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+    return path.stat().st_size if path.exists() else 0
+
+
+@dataclasses.dataclass
+class StageMetrics:
+    """Measurements of the single stage"""
+
+    stage: str
+    db_name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    bytes_in: int | None = None
+    bytes_out: int | None = None
+    peak_rss: int = 0
+    success: bool = True
+
+    @property
+    def throughput(self) -> float | None:
+        """Bytes per second (of the stage's input or output)"""
+        size = self.bytes_in if self.bytes_in is not None else self.bytes_out
+        if size is None or not self.wall_time:
+            return None
+
+        return size / self.wall_time
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self) | {"throughput": self.throughput}
+
+    def count_in(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Counts input's bytes of the stream (ex.: streaming restore) while it is consumed"""
+        self.bytes_in = self.bytes_in or 0
+        for chunk in chunks:
+            self.bytes_in += len(chunk)
+            yield chunk
+
+
+class RunMetrics:
+    """Collects stages' measurements of the current run (thread-safe: jobs run concurrently)"""
+
+    def __init__(self, command: str = ""):
+        self.command = command
+        self.started_at = datetime.now()
+        self.finished_at: datetime | None = None
+        self.success: bool | None = None
+        self.stages: list[StageMetrics] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(
+        self, stage: str, db_name: str, bytes_in: int | None = None
+    ) -> Iterator[StageMetrics]:
+        """Measures the stage (block of code); caller can fill `bytes_in` / `bytes_out`"""
+        metrics = StageMetrics(stage=stage, db_name=db_name, bytes_in=bytes_in)
+        started_at, cpu_started_at = time.perf_counter(), _cpu_time()
+        try:
+            yield metrics
+        except BaseException:
+            metrics.success = False
+            raise
+        finally:
+            metrics.wall_time = time.perf_counter() - started_at
+            metrics.cpu_time = _cpu_time() - cpu_started_at
+            metrics.peak_rss = _peak_rss()
+            with self._lock:
+                self.stages.append(metrics)
+
+            logger_ctx.get(module_logger).debug(
+                "[%s] stage %s: %.2fs (cpu %.2fs) | in: %s | out: %s bytes",
+                db_name,
+                stage,
+                metrics.wall_time,
+                metrics.cpu_time,
+                metrics.bytes_in,
+                metrics.bytes_out,
+            )
+
+    def finish(self, success: bool) -> None:
+        self.finished_at = datetime.now()
+        self.success = success
+
+    def report(self) -> dict:
+        """JSON-serializable report of the run"""
+        finished_at = self.finished_at or datetime.now()
+        return {
+            "command": self.command,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "duration": (finished_at - self.started_at).total_seconds(),
+            "success": self.success,
+            "peak_rss": _peak_rss(),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def prometheus_metrics(self) -> str:
+        """Metrics in Prometheus' text format (stages with the same labels are summed up)"""
+        totals: dict[tuple[str, str], dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for stage in self.stages:
+            for field in STAGE_METRICS:
+                totals[(stage.db_name, stage.stage)][field] += getattr(stage, field) or 0
+
+        labels = f'command="{self.command}"'
+        lines = []
+        for field, (name, help_text) in STAGE_METRICS.items():
+            lines += [
+                f"# HELP {METRIC_PREFIX}_{name} {help_text}",
+                f"# TYPE {METRIC_PREFIX}_{name} gauge",
+            ]
+            for (db_name, stage), values in sorted(totals.items()):
+                lines.append(
+                    f'{METRIC_PREFIX}_{name}{{{labels},db="{db_name}",stage="{stage}"}} '
+                    f"{values[field]:g}"
+                )
+
+        run_values = {
+            "run_success": (int(bool(self.success)), "1 if the last run was successful"),
+            "run_duration_seconds": (self.report()["duration"], "Wall time of the last run"),
+            "run_peak_rss_bytes": (_peak_rss(), "Peak RSS of the last run"),
+            "run_last_timestamp_seconds": (
+                (self.finished_at or datetime.now()).timestamp(),
+                "Finish time of the last run",
+            ),
+        }
+        for name, (value, help_text) in run_values.items():
+            lines += [
+                f"# HELP {METRIC_PREFIX}_{name} {help_text}",
+                f"# TYPE {METRIC_PREFIX}_{name} gauge",
+                f"{METRIC_PREFIX}_{name}{{{labels}}} {value:g}",
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    def save(self) -> None:
+        """Writes the report to configured destinations (nothing is written by default)"""
+        logger = logger_ctx.get(module_logger)
+        try:
+            if settings.METRICS_REPORT_PATH:
+                report_path = Path(settings.METRICS_REPORT_PATH)
+                if report_path.is_dir():
+                    started_at = self.started_at.strftime("%Y-%m-%d-%H%M%S")
+                    report_path = report_path / f"{self.command}-{started_at}.json"
+
+                _write_atomic(report_path, json.dumps(self.report(), indent=2))
+                logger.debug("Metrics report saved to %s", report_path)
+
+            if settings.METRICS_TEXTFILE_DIR:
+                textfile_path = (
+                    Path(settings.METRICS_TEXTFILE_DIR) / f"db_backups_{self.command}.prom"
+                )
+                _write_atomic(textfile_path, self.prometheus_metrics())
+                logger.debug("Prometheus metrics saved to %s", textfile_path)
+
+        except OSError as exc:
+            # metrics mustn't break the backup itself
+            logger.warning("Couldn't save metrics' report: %r", exc)
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    # textfile collector can read the file at any moment: it is replaced atomically
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(content)
+    os.replace(tmp_path, path)
+
+
+run_metrics = RunMetrics()
+# metrics of the job which is tracked separately (ex.: daemon's scheduled backup, see `track_job`)
+job_metrics_ctx: contextvars.ContextVar[RunMetrics | None] = contextvars.ContextVar(
+    "job_metrics", default=None
+)
+
+
+def current_run() -> RunMetrics:
+    """Metrics of the current job (or of the whole run)"""
+    return job_metrics_ctx.get() or run_metrics
+
+
+def stage(stage_name: str, db_name: str, bytes_in: int | None = None):
+    """Measures the stage of the current run (see `RunMetrics.stage`)"""
+    return current_run().stage(stage_name, db_name, bytes_in=bytes_in)
+
+
+@contextlib.contextmanager
+def track_job(command: str) -> Iterator[RunMetrics]:
+    """
+    Own metrics for the job of long-running process (ex.: daemon's scheduled backup):
+    stages of the job are collected by them (not by the run's ones which would grow forever),
+    the report is saved when the job is finished
+    """
+    job_metrics = RunMetrics(command)
+    token = job_metrics_ctx.set(job_metrics)
+    success = False
+    try:
+        yield job_metrics
+        success = True
+    finally:
+        job_metrics_ctx.reset(token)
+        job_metrics.finish(success)
+        job_metrics.save()
+
+
+def track_run(command: str):
+    """
+    Decorator for CLI's commands: starts new run's metrics and saves them when command
+    is finished (`sys.exit` with non-zero code marks the run as failed)
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def inner(*args, **kwargs):
+            global run_metrics  # pylint: disable=global-statement
+            run_metrics = RunMetrics(command)
+            success = False
+            try:
+                result = function(*args, **kwargs)
+                success = True
+                return result
+            except SystemExit as exc:
+                success = exc.code in (0, None)
+                raise
+            finally:
+                run_metrics.finish(success)
+                run_metrics.save()
+
+        return inner
+
+    return decorator
@@ -0,0 +1,528 @@
+"""
+Streaming pipelines (without any full-size intermediate files on the local disk):
+ - backup: dump's stdout -> compress -> encrypt (in-process) -> destinations (sinks)
+ - restore: source's chunks (ex.: S3 ranged GETs) -> decrypt -> decompress -> restore's stdin
+"""
+
+import os
+import abc
+import queue
+import logging
+import itertools
+import threading
+import subprocess
+import dataclasses
+from abc import ABC
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, ClassVar, IO, Iterable, Iterator
+
+from src import crypto, integrity, settings, utils
+from src.compression import TAR_MAGIC_OFFSET, TAR_MAGIC, detect_codec, is_tar
+from src.constants import BackupLocation, Compression
+from src.exceptions import BackupError, RestoreBackupError
+from src.fanout import FanOutResult
+from src.process import Command, OutputReader, Pipeline, ProcessError
+from src.run import logger_ctx
+from src.utils import ENCRYPT_PASS, PARTIAL_FILE_SUFFIX, check_env_variables
+
+module_logger = logging.getLogger(__name__)
+# decryption of legacy backups (new ones are encrypted in-process, see `src.crypto`)
+DECRYPT_COMMAND = ["openssl", "enc", "-aes-256-cbc", "-d", "-pbkdf2", "-pass", ENCRYPT_PASS]
+# extracts the single file (legacy backups: tar.gz archive with sql file) to stdout
+UNTAR_COMMAND = ["tar", "-xOf", "-"]
+
+
+class BackupSink(ABC):
+    """Base class for destination of streamed backup's data"""
+
+    # None - auxiliary sink (ex.: checksum's calculation): the stream fails with it
+    location: ClassVar[BackupLocation | None] = None
+
+    def __init__(self, db_name: str, filename: str):
+        self.db_name = db_name
+        self.filename = filename
+        self.logger = logger_ctx.get(module_logger)
+
+    @property
+    def target(self) -> str | None:
+        """Path (or key) of result backup in the destination (is used by the catalog)"""
+        return None
+
+    @abc.abstractmethod
+    def write(self, chunk: bytes) -> None:
+        """Writes next chunk of backup's data"""
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Finalizes destination (called only after successful pipeline)"""
+
+    @abc.abstractmethod
+    def abort(self) -> None:
+        """Drops partially written data (called after failed pipeline)"""
+
+
+class FileSink(BackupSink):
+    """Writes streamed data to the file in the provided directory (via temporary .part file)"""
+
+    def __init__(
+        self,
+        db_name: str,
+        filename: str,
+        directory: Path | str,
+        location: BackupLocation = BackupLocation.LOCAL,
+    ):
+        super().__init__(db_name, filename)
+        self.location = location
+        if not directory:
+            raise BackupError("Couldn't stream backup: destination path cannot be empty")
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.result_path = self.directory / filename
+        self.part_path = self.directory / f"{filename}{PARTIAL_FILE_SUFFIX}"
+        self._file: IO[bytes] = open(self.part_path, "wb")  # pylint: disable=consider-using-with
+
+    @property
+    def target(self) -> str:
+        return str(self.result_path.resolve())
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+
+    def close(self) -> None:
+        self._file.close()
+        os.replace(self.part_path, self.result_path)
+        self.logger.info("[%s] backup streamed to %s", self.db_name, self.result_path)
+
+    def abort(self) -> None:
+        self._file.close()
+        self.part_path.unlink(missing_ok=True)
+
+
+class S3MultipartSink(BackupSink):
+    """
+    Uploads streamed data to S3 via multipart upload (parts are uploaded concurrently).
+    Only max_concurrency parts (see `src.s3.TransferOptions`) are kept in memory at the same time.
+    """
+
+    location = BackupLocation.S3
+
+    def __init__(self, db_name: str, filename: str):
+        super().__init__(db_name, filename)
+        s3 = utils.get_s3()
+        self.uploader = s3.MultipartUploader(db_name, key=s3.get_key(filename))
+
+    @property
+    def target(self) -> str:
+        return self.uploader.key
+
+    def write(self, chunk: bytes) -> None:
+        self.uploader.write(chunk)
+
+    def close(self) -> None:
+        self.uploader.complete()
+        self.logger.info("[%s] backup streamed to s3: %s", self.db_name, self.uploader.key)
+
+    def abort(self) -> None:
+        self.uploader.abort()
+
+
+class DigestSink(BackupSink):
+    """Calculates checksum of streamed backup (without writing it anywhere)"""
+
+    def __init__(self, db_name: str, filename: str):
+        super().__init__(db_name, filename)
+        self._hasher = integrity.Hasher()
+        self.checksum: integrity.Checksum | None = None
+
+    def write(self, chunk: bytes) -> None:
+        self._hasher.update(chunk)
+
+    def close(self) -> None:
+        self.checksum = self._hasher.result()
+
+    def abort(self) -> None:
+        pass
+
+
+def build_sinks(
+    db_name: str,
+    filename: str,
+    destination: list[BackupLocation],
+    destination_file: str | None = None,
+) -> list[BackupSink]:
+    """Prepares sinks for each requested destination"""
+    sinks: list[BackupSink] = []
+    if BackupLocation.LOCAL in destination:
+        sinks.append(FileSink(db_name, filename, directory=settings.LOCAL_PATH))
+
+    if BackupLocation.FILE in destination:
+        sinks.append(
+            FileSink(db_name, filename, directory=destination_file, location=BackupLocation.FILE)
+        )
+
+    if BackupLocation.S3 in destination:
+        sinks.append(S3MultipartSink(db_name, filename))
+
+    return sinks
+
+
+def get_stage_commands(
+    dump_command: Command,
+    compress_command: Command | None = None,
+) -> list[Command]:
+    """Returns list of commands (pipeline's stages) for streaming backup"""
+    commands = [dump_command]
+    if compress_command:
+        commands.append(compress_command)
+
+    return commands
+
+
+@dataclasses.dataclass
+class StreamResult(FanOutResult):
+    """Streamed backup's size, targets of sinks which got the whole stream and errors of others"""
+
+    size: int = 0
+
+
+class SinkWriter:
+    """
+    Writes chunks to the sink in background (via its own bounded queue): slow sink (ex.: S3)
+    doesn't delay the others, failed sink is aborted without stopping the stream
+    """
+
+    def __init__(self, sink: BackupSink):
+        self.sink = sink
+        self.queue: queue.Queue[bytes | None] = queue.Queue(maxsize=settings.STREAM_QUEUE_SIZE)
+        self.error: Exception | None = None
+        self.cancelled = False
+        self.future: Future | None = None
+
+    def start(self, executor: Executor) -> None:
+        self.future = utils.submit_in_context(executor, self._run)
+
+    def put(self, chunk: bytes) -> None:
+        if not self.error:
+            self.queue.put(chunk)
+
+    def finish(self, cancel: bool = False) -> None:
+        """Closes the sink after written chunks (or aborts it if the stream is cancelled)"""
+        self.cancelled = cancel
+        self.queue.put(None)
+
+    def _run(self) -> None:
+        # chunks are read till the end of the stream (even after failure): writer isn't blocked
+        while (chunk := self.queue.get()) is not None:
+            if not self.error:
+                self._call(self.sink.write, chunk)
+
+        if not self.error and not self.cancelled:
+            self._call(self.sink.close)
+
+        if self.error or self.cancelled:
+            try:
+                self.sink.abort()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.sink.logger.warning("[%s] Couldn't abort %r: %r", self.sink.db_name, self, exc)
+
+    def _call(self, method: Callable, *args) -> None:
+        try:
+            method(*args)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self.sink.logger.error(
+                "[%s] Couldn't stream backup to %s: %r", self.sink.db_name, self.sink.location, exc
+            )
+            self.error = exc
+
+    def __repr__(self) -> str:
+        return f"{type(self.sink).__name__}({self.sink.location})"
+
+
+def run_pipeline(
+    db_name: str,
+    commands: list[Command],
+    sinks: list[BackupSink],
+    encrypt: bool = False,
+    password_prefix: str | None = None,
+    env: dict[str, str] | None = None,
+) -> StreamResult:
+    """
+    Runs chained processes (stdout of each one is stdin for the next one) and writes
+    the last process's output to all sinks (chunk by chunk). Each sink is written by its own
+    worker (see `SinkWriter`): failed destination doesn't stop the others.
+
+    :param db_name: current DB (needed for correct logging process)
+    :param commands: commands (stages) of pipeline
+    :param sinks: destinations for result data
+    :param encrypt: encrypt the last process's output (in-process, see `src.crypto`)
+    :param password_prefix: specified prefix for password replacing (ex.: PG_PASSWORD)
+    :param env: extra env variables for pipeline's processes
+    :return: size of the stream, targets of successful destinations and errors of failed ones
+    :raise `BackupError` (pipeline's failure, failure of all destinations or of auxiliary sink)
+    """
+    logger = logger_ctx.get(module_logger)
+    encryptor = crypto.StreamEncryptor() if encrypt else None
+    pipeline = Pipeline(commands, password_prefix=password_prefix, env=env)
+    writers = [SinkWriter(sink) for sink in sinks]
+    result = StreamResult()
+
+    def write(data: bytes) -> None:
+        _check_writers(writers)
+        for writer in writers:
+            writer.put(data)
+
+        result.size += len(data)
+
+    with ThreadPoolExecutor(max_workers=max(len(writers), 1)) as executor:
+        for writer in writers:
+            writer.start(executor)
+
+        try:
+            pipeline.start()
+            while chunk := pipeline.stdout.read(settings.STREAM_CHUNK_SIZE):
+                if encryptor:
+                    chunk = encryptor.update(chunk)
+
+                if chunk:
+                    write(chunk)
+
+            pipeline.wait()
+            if encryptor:
+                write(encryptor.finalize())
+
+        except BaseException:
+            pipeline.kill()
+            for writer in writers:
+                writer.finish(cancel=True)
+
+            raise
+
+        for writer in writers:
+            writer.finish()
+
+    _check_writers(writers)
+    for writer in writers:
+        if writer.error:
+            result.errors[writer.sink.location] = writer.error
+        elif writer.sink.location:
+            result.targets[writer.sink.location] = writer.sink.target
+
+    logger.debug("[%s] Pipeline finished: %i bytes streamed", db_name, result.size)
+    return result
+
+
+def _check_writers(writers: list[SinkWriter]) -> None:
+    """
+    Stream is stopped if auxiliary sink failed or there is no working destination
+    :raise `BackupError`
+    """
+    failed = [writer for writer in writers if writer.error]
+    if not failed:
+        return
+
+    destinations = [writer for writer in writers if writer.sink.location]
+    if any(not writer.sink.location for writer in failed) or len(failed) == len(destinations):
+        raise BackupError(
+            f"Couldn't stream backup to {', '.join(map(repr, failed))}: "
+            f"{'; '.join(repr(writer.error) for writer in failed)}"
+        ) from failed[0].error
+
+
+def iter_file(file_path: Path) -> Iterator[bytes]:
+    """Reads file chunk by chunk (source for streaming restore)"""
+    with open(file_path, "rb") as file:
+        while chunk := file.read(settings.STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def iter_stream(stream: IO[bytes]) -> Iterator[bytes]:
+    """Reads process's output chunk by chunk"""
+    while chunk := stream.read(settings.STREAM_CHUNK_SIZE):
+        yield chunk
+
+
+def peek(chunks: Iterator[bytes], size: int) -> tuple[bytes, Iterator[bytes]]:
+    """
+    Reads the first bytes of stream (ex.: for detecting format by magic bytes)
+
+    :return: header and the same (full) stream
+    """
+    header = b""
+    for chunk in chunks:
+        header += chunk
+        if len(header) >= size:
+            break
+
+    return header[:size], itertools.chain([header], chunks)
+
+
+class StreamPump(threading.Thread):
+    """Writes chunks (from python's iterator) to the process's stdin in background"""
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes],
+        stdin: IO[bytes],
+        name: str,
+        on_error: Callable[[], None] | None = None,
+    ):
+        super().__init__(name=f"stream-pump-{name}", daemon=True)
+        self.chunks = chunks
+        self.stdin = stdin
+        self.on_error = on_error
+        self.error: Exception | None = None
+
+    def run(self) -> None:
+        try:
+            for chunk in self.chunks:
+                self.stdin.write(chunk)
+
+        except BrokenPipeError:
+            # consumer exited before the end of the stream: its own error will be reported
+            pass
+
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # consumer must not treat broken stream (ex.: corrupted encrypted frame) as its end
+            self.error = exc
+            if self.on_error:
+                self.on_error()
+
+        finally:
+            try:
+                self.stdin.close()
+            except BrokenPipeError:
+                pass
+
+
+class RestorePipeline:
+    """
+    Chain of restore's stages (decrypt -> decompress -> [untar] -> restore command). Each next
+    stage is chosen by the magic bytes of the previous stage's output, so data is fed
+    through python's pumps between stages.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        password_prefix: str | None = None,
+        env: dict[str, str] | None = None,
+    ):
+        self.db_name = db_name
+        self.password_prefix = password_prefix
+        self.env = env
+        self.logger = logger_ctx.get(module_logger)
+        self.stages: list[tuple[Pipeline, StreamPump]] = []
+        self.stdout_reader: OutputReader | None = None
+
+    def add_stage(self, command: Command, chunks: Iterable[bytes], is_last: bool = False):
+        """Spawns stage's process (fed by provided chunks) and returns its output's stream"""
+        stage = Pipeline(
+            [command],
+            password_prefix=self.password_prefix,
+            env=self.env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        ).start()
+        pump = StreamPump(
+            chunks, stage.processes[0].stdin, name=str(len(self.stages)), on_error=stage.kill
+        )
+        pump.start()
+        self.stages.append((stage, pump))
+        if not is_last:
+            return iter_stream(stage.stdout)
+
+        # restore command's output (ex.: psql's messages) is only logged
+        self.stdout_reader = OutputReader(stage.stdout, name="stdout", logger=self.logger)
+        self.stdout_reader.start()
+        return None
+
+    def wait(self) -> None:
+        """
+        Waits for all stages (from the last one to the first one)
+        :raise `ProcessError` (with stderr's tail of failed stages)
+        """
+        errors: list[Exception] = []
+        for stage, pump in reversed(self.stages):
+            pump.join()
+            try:
+                stage.wait()
+            except ProcessError as exc:
+                errors.append(exc)
+
+            if pump.error:
+                errors.append(pump.error)
+
+        if self.stdout_reader:
+            self.stdout_reader.join()
+
+        if errors:
+            tail = [line for error in errors for line in getattr(error, "tail", [])]
+            messages = [str(error).split("\n", maxsplit=1)[0] for error in errors]
+            raise ProcessError(f"Streaming restore failed: {'; '.join(messages)}", tail=tail)
+
+    def kill(self) -> None:
+        """Terminates all running stages"""
+        for stage, _ in self.stages:
+            stage.kill()
+
+
+def run_restore_pipeline(
+    db_name: str,
+    chunks: Iterable[bytes],
+    restore_command: Callable[[bytes], Command],
+    password_prefix: str | None = None,
+    env: dict[str, str] | None = None,
+) -> None:
+    """
+    Streams backup's data through decryption / decompression stages directly to the restore
+    command's stdin. Encryption, codec (and tar's wrapper of legacy backups) are detected
+    by magic bytes. Frames of encrypted backups are verified (and decrypted) in-process,
+    so corrupted data breaks the restore as soon as the broken frame is received.
+
+    :param db_name: current DB (needed for correct logging process)
+    :param chunks: backup's data (ex.: ranged GETs from S3)
+    :param restore_command: returns restore's command for the header of decompressed dump
+                            (ex.: pg_restore for custom format, psql for plain sql)
+    :param password_prefix: specified prefix for password replacing (ex.: PG_PASSWORD)
+    :param env: extra env variables for restore's command
+    :raise `BackupError`
+    """
+    logger = logger_ctx.get(module_logger)
+    pipeline = RestorePipeline(db_name, password_prefix=password_prefix, env=env)
+    stream = iter(chunks)
+    try:
+        header, stream = peek(stream, size=len(crypto.MAGIC))
+        if crypto.is_encrypted(header):
+            if missed_env_var := check_env_variables("ENCRYPT_PASS", raise_exception=False):
+                raise BackupError(f"Missing value for env variable {missed_env_var}")
+
+            if crypto.is_legacy_encrypted(header):
+                stream = pipeline.add_stage(DECRYPT_COMMAND, stream)
+            else:
+                stream = crypto.decrypt_chunks(stream)
+
+            header, stream = peek(stream, size=8)
+
+        if (codec := detect_codec(header)).name != Compression.NONE:
+            logger.debug("[%s] Detected codec of backup: %s", db_name, codec.name)
+            stream = pipeline.add_stage(codec.decompress_command(), stream)
+
+        header, stream = peek(stream, size=TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+        if is_tar(header):
+            stream = pipeline.add_stage(UNTAR_COMMAND, stream)
+            header, stream = peek(stream, size=TAR_MAGIC_OFFSET + len(TAR_MAGIC))
+
+        if not header:
+            pipeline.wait()  # error of the previous stage (ex.: wrong ENCRYPT_PASS) is preferred
+            raise RestoreBackupError("Backup's stream is empty")
+
+        pipeline.add_stage(restore_command(header), stream, is_last=True)
+        pipeline.wait()
+
+    except Exception:
+        pipeline.kill()
+        raise
+
+    logger.debug("[%s] Restore pipeline finished: %i stages", db_name, len(pipeline.stages))
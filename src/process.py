@@ -0,0 +1,360 @@
+"""
+Subprocess execution layer: runs commands (argv lists, shell strings or pipelines),
+consumes stdout/stderr concurrently (no deadlocks on full pipes), streams output lines
+to the logger as they arrive and checks real return codes.
+"""
+
+import os
+import re
+import shlex
+import weakref
+import contextlib
+import logging
+import threading
+import subprocess
+import dataclasses
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import IO, Sequence
+
+from src import settings
+from src.run import logger_ctx
+from src.exceptions import BackupError
+
+module_logger = logging.getLogger(__name__)
+
+
+class ContainerCommand(list):
+    """
+    Command which is executed inside docker container via Docker Engine API (see
+    `src.docker_api`): it looks like `docker exec -i {container} ...` in logs, but no CLI's
+    process is spawned (exec's output / input are streamed via the daemon's socket)
+    """
+
+    def __init__(self, container: str, argv: Sequence[str | Path]):
+        self.container = container
+        self.argv = [str(arg) for arg in argv]
+        super().__init__(["docker", "exec", "-i", container, *self.argv])
+
+
+Command = str | Sequence[str | Path] | ContainerCommand
+
+
+class ProcessError(BackupError):
+    """Command finished with unexpected return code"""
+
+    def __init__(self, message: str, returncode: int | None = None, tail: Sequence[str] = ()):
+        self.returncode = returncode
+        self.tail = list(tail)
+        if self.tail:
+            message += "\n === \n" + "\n".join(self.tail)
+
+        super().__init__(message)
+
+
+@dataclasses.dataclass
+class ProcessResult:
+    """Result of finished command"""
+
+    returncode: int
+    stdout: str
+    stderr_tail: list[str]
+
+
+class OutputReader(threading.Thread):
+    """Reads process's stream line by line: logs each line and keeps the last ones (tail)"""
+
+    def __init__(self, stream: IO[bytes], name: str, logger, capture: bool = False):
+        super().__init__(name=f"output-reader-{name}", daemon=True)
+        self.stream = stream
+        self.logger = logger
+        self.capture = capture
+        self.lines: list[str] = []
+        self.tail: deque[str] = deque(maxlen=settings.PROCESS_OUTPUT_TAIL_LINES)
+
+    def run(self) -> None:
+        for raw_line in iter(self.stream.readline, b""):
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+            if self.capture:
+                self.lines.append(line)
+            self.tail.append(line)
+            self.logger.debug("[%s] %s", self.name.removeprefix("output-reader-"), line)
+
+        self.stream.close()
+
+    @property
+    def output(self) -> str:
+        """Full captured output (for capture=True only)"""
+        return "\n".join(self.lines)
+
+
+class ProcessScope:
+    """
+    Processes spawned by the single job (from any of its threads): allows the orchestrator
+    to terminate them when the job is cancelled (timeout, SIGTERM)
+    """
+
+    def __init__(self):
+        self.processes: weakref.WeakSet[subprocess.Popen] = weakref.WeakSet()
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def add(self, process: subprocess.Popen) -> None:
+        """Registers spawned process (it is killed at once if the scope is already cancelled)"""
+        with self._lock:
+            self.processes.add(process)
+            if self.cancelled:
+                process.kill()
+
+    def terminate(self, force: bool = False) -> None:
+        """Cancels the scope: sends SIGTERM (SIGKILL if force) to all still running processes"""
+        with self._lock:
+            self.cancelled = True
+            for process in list(self.processes):
+                if process.poll() is not None:
+                    continue
+
+                if force:
+                    process.kill()
+                else:
+                    process.terminate()
+
+
+# scope of the current job (is set by `jobs.Orchestrator`, is inherited by job's threads)
+process_scope: ContextVar[ProcessScope | None] = ContextVar("process_scope", default=None)
+
+
+def command_repr(command: Command, password_prefix: str | None = None) -> str:
+    """Human-readable representation of command (with masked password)"""
+    command_str = command if isinstance(command, str) else shlex.join(map(str, command))
+    return replace_password_with_mask(command_str.strip(), prefix=password_prefix)
+
+
+def _popen(
+    command: Command,
+    stdin: int | IO[bytes] | None,
+    stdout: int | IO[bytes] | None,
+    env: dict[str, str] | None = None,
+    cwd: Path | None = None,
+) -> subprocess.Popen:
+    scope = process_scope.get()
+    if scope and scope.cancelled:
+        raise ProcessError(f"Job is cancelled: command {command_repr(command)} isn't started")
+
+    if isinstance(command, ContainerCommand):
+        from src import docker_api  # sockets' client is imported only when containers are used
+
+        process = docker_api.ExecProcess(command, stdin=stdin, stdout=stdout, env=env, cwd=cwd)
+    else:
+        shell = isinstance(command, str)
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            command.strip() if shell else [str(arg) for arg in command],
+            shell=shell,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            env={**os.environ, **env} if env else None,
+            cwd=cwd,
+        )
+
+    if scope:
+        scope.add(process)
+
+    return process
+
+
+def run_command(
+    command: Command,
+    password_prefix: str | None = None,
+    env: dict[str, str] | None = None,
+    stdin_path: Path | None = None,
+    stdout_path: Path | None = None,
+    allowed_codes: Sequence[int] = (0,),
+    cwd: Path | None = None,
+) -> ProcessResult:
+    """
+    Runs command and waits for its finishing.
+    stdout is captured (if stdout_path isn't provided), stderr is streamed to the logger only.
+
+    :param command: argv list (preferred) or shell string
+    :param password_prefix: specified prefix for password replacing (ex.: PG_PASSWORD)
+    :param env: extra env variables for the process (ex.: {"PGPASSWORD": ...})
+    :param stdin_path: file which will be passed to the process's stdin
+    :param stdout_path: file for writing stdout (instead of capturing it)
+    :param allowed_codes: return codes which are not errors (ex.: grep returns 1 for no matches)
+    :param cwd: working directory for the process
+    :raise `ProcessError`
+    """
+    logger = logger_ctx.get(module_logger)
+    logger.debug("Call command [%s] ... ", command_repr(command, password_prefix))
+    with contextlib.ExitStack() as stack:
+        stdin = stack.enter_context(open(stdin_path, "rb")) if stdin_path else subprocess.DEVNULL
+        stdout = stack.enter_context(open(stdout_path, "wb")) if stdout_path else subprocess.PIPE
+        try:
+            process = _popen(command, stdin=stdin, stdout=stdout, env=env, cwd=cwd)
+        except OSError as exc:
+            raise ProcessError(f"Couldn't run command {command_repr(command)}: {exc!r}") from exc
+
+        readers = [OutputReader(process.stderr, name="stderr", logger=logger)]
+        if process.stdout:
+            readers.append(OutputReader(process.stdout, name="stdout", logger=logger, capture=True))
+
+        for reader in readers:
+            reader.start()
+
+        returncode = process.wait()
+        for reader in readers:
+            reader.join()
+
+    stdout_reader = readers[1] if len(readers) > 1 else None
+    result = ProcessResult(
+        returncode=returncode,
+        stdout=stdout_reader.output if stdout_reader else "",
+        stderr_tail=list(readers[0].tail),
+    )
+    if returncode not in allowed_codes:
+        raise ProcessError(
+            f"Command [{command_repr(command, password_prefix)}] failed with code {returncode}",
+            returncode=returncode,
+            tail=result.stderr_tail or (list(stdout_reader.tail) if stdout_reader else []),
+        )
+
+    return result
+
+
+class Pipeline:
+    """
+    Chained processes (stdout of each one is stdin for the next one).
+    Output of the last process is available via `stdout` stream (or is written to `stdout` file).
+    """
+
+    def __init__(
+        self,
+        commands: Sequence[Command],
+        password_prefix: str | None = None,
+        env: dict[str, str] | None = None,
+        stdin: IO[bytes] | int | None = None,
+        stdout: IO[bytes] | int | None = subprocess.PIPE,
+    ):
+        self.commands = list(commands)
+        self.password_prefix = password_prefix
+        self.logger = logger_ctx.get(module_logger)
+        self.processes: list[subprocess.Popen] = []
+        self.readers: list[OutputReader] = []
+        self.env = env
+        self._stdin = stdin
+        self._stdout = stdout
+
+    def __repr__(self) -> str:
+        return " | ".join(command_repr(command, self.password_prefix) for command in self.commands)
+
+    def start(self) -> "Pipeline":
+        """Spawns all pipeline's processes"""
+        self.logger.debug("Call pipeline [%r] ... ", self)
+        stdin = self._stdin
+        try:
+            for index, command in enumerate(self.commands):
+                is_last = index == len(self.commands) - 1
+                process = _popen(
+                    command,
+                    stdin=stdin,
+                    stdout=self._stdout if is_last else subprocess.PIPE,
+                    env=self.env,
+                )
+                if index > 0:
+                    # allows previous process to receive SIGPIPE if the next one exits
+                    stdin.close()
+
+                stdin = process.stdout
+                self.processes.append(process)
+                reader = OutputReader(process.stderr, name=f"stage-{index}", logger=self.logger)
+                reader.start()
+                self.readers.append(reader)
+
+        except OSError as exc:
+            self.kill()
+            raise ProcessError(f"Couldn't run pipeline [{self!r}]: {exc!r}") from exc
+
+        return self
+
+    @property
+    def stdout(self) -> IO[bytes] | None:
+        """Output stream of the last process"""
+        return self.processes[-1].stdout
+
+    def wait(self) -> None:
+        """
+        Waits for all processes and checks their return codes
+        :raise `ProcessError` (with stderr's tail of failed stages)
+        """
+        failed, tail = [], []
+        for index, (command, process, reader) in enumerate(
+            zip(self.commands, self.processes, self.readers)
+        ):
+            if (returncode := process.wait()) != 0:
+                failed.append(f"#{index} [{command_repr(command, self.password_prefix)}]")
+                tail.extend(f"[stage-{index}: {returncode}] {line}" for line in reader.tail)
+
+            reader.join()
+
+        if failed:
+            raise ProcessError(f"Pipeline's stage(s) failed: {', '.join(failed)}", tail=tail)
+
+    def kill(self) -> None:
+        """Terminates all running processes"""
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+
+        for process in self.processes:
+            process.wait()
+
+
+def call_with_logging(
+    command: Command,
+    password_prefix: str | None = None,
+    **run_kwargs,
+) -> str:
+    """
+    Call command, detect error (by return code) and logging
+
+    :param command: command that need to be called (argv list or shell string)
+    :param password_prefix: specified prefix for password replacing (ex.: PG_PASSWORD)
+    :param run_kwargs: extra params for `run_command` (env, stdin_path, allowed_codes, etc.)
+    :return: captured stdout of the command
+    :raise `ProcessError` (`BackupError`'s subclass)
+
+    """
+    return run_command(command, password_prefix=password_prefix, **run_kwargs).stdout
+
+
+def replace_password_with_mask(command: str, prefix: str | None = None, mask: str = "*****") -> str:
+    """
+    Allows to find password in command and replace it with provided mask
+    :param command: source command which can contain password
+    :param prefix: prefix to search password in command
+    :param mask: mask to replace password in command
+
+    >>> replace_password_with_mask("PGPASSWORD=test-password psql ... ", prefix="PGPASSWORD=")
+    'PGPASSWORD=***** psql ...'
+    >>> replace_password_with_mask('PGPASSWORD="test-password" psql ... ', prefix="PGPASSWORD=")
+    'PGPASSWORD="*****" psql ...'
+    >>> replace_password_with_mask('PGPASSWORD=""test-password" psql ... ', prefix="PGPASSWORD=")
+    'PGPASSWORD=""*****" psql ...'
+    >>> replace_password_with_mask('mysqldump -u user -ptest-password ... ', prefix="-p")
+    'mysqldump -u user -p***** ... '
+    >>> replace_password_with_mask('mysqldump -u user -p"test-password" ... ', prefix="-p")
+    'mysqldump -u user -p"*****" ... '
+
+    skip masking (no prefix provided):
+    >>> replace_password_with_mask('mysqldump -u user -p"test-password" ... ')
+    'mysqldump -u user -p"test-password" ... '
+
+    """
+    if prefix:
+        pattern = rf'({prefix}"*)(.*?)(")'  # searches string by prefix
+        if re.search(pattern, command):
+            return re.sub(pattern, rf"\1{mask}\3", command)
+
+    return command
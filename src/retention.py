@@ -0,0 +1,203 @@
+"""
+Retention of backups (GFS-like policy: keep N daily / weekly / monthly backups per DB).
+Backups are found by a single listing pass of the storage and removed in bulk
+(S3: batched DeleteObjects requests).
+"""
+
+import os
+import re
+import logging
+import dataclasses
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Hashable
+
+from src import catalog, settings, utils
+from src.constants import BackupLocation
+from src.run import logger_ctx
+from src.utils import PARTIAL_FILE_SUFFIX, SIDECAR_SUFFIXES, is_sidecar
+
+module_logger = logging.getLogger(__name__)
+# backup's name: {date-time}.{db_name}.backup.{format}[.tar][.{codec}][.enc]
+BACKUP_NAME_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2}-\d{6})\.(.+?)\.backup\.")
+PERIODS: dict[str, Callable[[datetime], Hashable]] = {
+    "daily": lambda created_at: created_at.date(),
+    "weekly": lambda created_at: created_at.isocalendar()[:2],
+    "monthly": lambda created_at: (created_at.year, created_at.month),
+}
+
+
+@dataclasses.dataclass
+class RetentionPolicy:
+    """Count of the latest periods (days, weeks, months) which keep their newest backup"""
+
+    daily: int = dataclasses.field(default_factory=lambda: settings.PRUNE_KEEP_DAILY)
+    weekly: int = dataclasses.field(default_factory=lambda: settings.PRUNE_KEEP_WEEKLY)
+    monthly: int = dataclasses.field(default_factory=lambda: settings.PRUNE_KEEP_MONTHLY)
+
+
+@dataclasses.dataclass
+class StoredBackup:
+    """Backup's file (or S3 object) found in the storage"""
+
+    db_name: str
+    created_at: datetime
+    location: BackupLocation
+    path: str
+    size: int = 0
+    # auxiliary files of the backup (ex.: dump's TOC) which are removed together with it
+    sidecars: list[str] = dataclasses.field(default_factory=list)
+
+
+def parse_backup_name(name: str) -> tuple[datetime, str] | None:
+    """
+    Extracts creation time and DB's name from backup's file name (None for non-backup files)
+
+    >>> parse_backup_name("2024-02-21-065213.test-db.backup.sql.gz")
+    (datetime.datetime(2024, 2, 21, 6, 52, 13), 'test-db')
+    >>> parse_backup_name("2024-02-21-065213.test-db.backup.sql.gz.part") is None
+    True
+    >>> parse_backup_name("2024-02-21-065213.test-db.backup.sql.gz.toc.json") is None
+    True
+    """
+    if name.endswith(PARTIAL_FILE_SUFFIX) or is_sidecar(name):
+        return None
+
+    if not (match := BACKUP_NAME_PATTERN.match(name)):
+        return None
+
+    return datetime.strptime(match.group(1), catalog.BACKUP_TIME_FORMAT), match.group(2)
+
+
+def list_local_backups(directory: Path) -> list[StoredBackup]:
+    """Finds backups in the directory (single scandir's pass, nested directories are skipped)"""
+    backups, sidecars = [], set()
+    if not Path(directory).is_dir():
+        return backups
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and is_sidecar(entry.name):
+                sidecars.add(str(Path(entry.path).resolve()))
+
+            elif entry.is_file() and (parsed := parse_backup_name(entry.name)):
+                created_at, db_name = parsed
+                backups.append(
+                    StoredBackup(
+                        db_name=db_name,
+                        created_at=created_at,
+                        location=BackupLocation.LOCAL,
+                        path=str(Path(entry.path).resolve()),
+                        size=entry.stat().st_size,
+                    )
+                )
+
+    return _attach_sidecars(backups, sidecars)
+
+
+def list_s3_backups() -> list[StoredBackup]:
+    """Finds backups in S3_PATH (single paginated listing, nested "directories" are skipped)"""
+    s3 = utils.get_s3()
+    backups, sidecars = [], set()
+    for obj in s3.list_objects(s3.get_key(""), delimiter="/"):
+        if is_sidecar(obj["Key"]):
+            sidecars.add(obj["Key"])
+
+        elif parsed := parse_backup_name(os.path.basename(obj["Key"])):
+            created_at, db_name = parsed
+            backups.append(
+                StoredBackup(
+                    db_name=db_name,
+                    created_at=created_at,
+                    location=BackupLocation.S3,
+                    path=obj["Key"],
+                    size=obj.get("Size", 0),
+                )
+            )
+
+    return _attach_sidecars(backups, sidecars)
+
+
+def _attach_sidecars(backups: list[StoredBackup], sidecars: set[str]) -> list[StoredBackup]:
+    for backup in backups:
+        backup.sidecars = [
+            f"{backup.path}{suffix}"
+            for suffix in SIDECAR_SUFFIXES
+            if f"{backup.path}{suffix}" in sidecars
+        ]
+
+    return backups
+
+
+def select_backups_to_delete(
+    backups: list[StoredBackup],
+    policy: RetentionPolicy,
+) -> list[StoredBackup]:
+    """
+    Applies policy to backups of each DB (for each location separately): the newest backup
+    of each of the latest N days / weeks / months is kept (the latest backup is always kept).
+
+    :return: backups which aren't kept by any policy's rule
+    """
+    groups: dict[tuple[str, BackupLocation], list[StoredBackup]] = defaultdict(list)
+    for backup in backups:
+        groups[(backup.db_name, backup.location)].append(backup)
+
+    to_delete = []
+    for group in groups.values():
+        group.sort(key=lambda backup: (backup.created_at, backup.path), reverse=True)
+        kept_indexes = {0}
+        for period, get_period_key in PERIODS.items():
+            limit, seen_periods = getattr(policy, period), set()
+            for index, backup in enumerate(group):
+                period_key = get_period_key(backup.created_at)
+                if period_key in seen_periods:
+                    continue
+
+                if len(seen_periods) >= limit:
+                    break
+
+                seen_periods.add(period_key)
+                kept_indexes.add(index)
+
+        to_delete.extend(backup for index, backup in enumerate(group) if index not in kept_indexes)
+
+    return to_delete
+
+
+def delete_backups(backups: list[StoredBackup]) -> list[StoredBackup]:
+    """
+    Removes backups (S3 objects via batched DeleteObjects, local files one by one)
+    and drops them from the catalog. If deletion fails, backups which were already deleted
+    are dropped from the catalog before the error is raised.
+
+    :return: deleted backups
+    """
+    logger = logger_ctx.get(module_logger)
+    deleted: list[StoredBackup] = []
+    try:
+        if s3_backups := [backup for backup in backups if backup.location == BackupLocation.S3]:
+            s3 = utils.get_s3()
+            by_key = {backup.path: backup for backup in s3_backups}
+            keys = [key for backup in s3_backups for key in (backup.path, *backup.sidecars)]
+            for deleted_keys in s3.delete_objects_by_batches(keys):
+                deleted.extend(by_key[key] for key in deleted_keys if key in by_key)
+
+        for backup in backups:
+            if backup.location == BackupLocation.LOCAL:
+                for path in (backup.path, *backup.sidecars):
+                    Path(path).unlink(missing_ok=True)
+
+                deleted.append(backup)
+
+    finally:
+        by_db: dict[tuple[str, BackupLocation], list[str]] = defaultdict(list)
+        for backup in deleted:
+            by_db[(backup.db_name, backup.location)].append(backup.path)
+
+        for (db_name, location), paths in by_db.items():
+            catalog.unregister_backups(db_name, location, paths)
+
+    logger.debug("Deleted %i backups", len(deleted))
+    return deleted
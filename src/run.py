@@ -7,27 +7,38 @@ $ python3 -m src.run --help
 """
 
 import os
+import ast
 import logging
-import logging.config
-from logging import config
 import typing
+import functools
 from contextvars import ContextVar
 from typing import Callable, Optional
 
 import click
-import sentry_sdk
 
 from src import settings
 
 if typing.TYPE_CHECKING:
     from src.utils import LoggerContext
 
-logging.config.dictConfig(settings.LOGGING)
 logger = logging.getLogger(__name__)
 logger_ctx: ContextVar["LoggerContext"] = ContextVar("logger_ctx")
 
-if settings.SENTRY_DSN:
-    sentry_sdk.init(settings.SENTRY_DSN)
+
+@functools.cache
+def setup() -> None:
+    """
+    Configures logging (and sentry) once per process. It is called by the started command
+    (see `LoggerContext`) instead of import time, so `--help` and shell's completion are fast.
+    """
+    import logging.config
+
+    settings.LOG_DIR.mkdir(parents=True, exist_ok=True)
+    logging.config.dictConfig(settings.LOGGING)
+    if settings.SENTRY_DSN:
+        import sentry_sdk  # sentry_sdk is heavy: it is imported only when it is configured
+
+        sentry_sdk.init(settings.SENTRY_DSN)
 
 
 class ComplexCLI(click.Group):
@@ -54,6 +65,38 @@ class ComplexCLI(click.Group):
 
         return mod.cli
 
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        """Lists commands with their short help (command's modules aren't imported for it)"""
+        rows = [(name, self.get_short_help(ctx, name)) for name in self.list_commands(ctx)]
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+    def shell_complete(self, ctx: click.Context, incomplete: str) -> list:
+        """Completes commands' names (without import of their modules) and group's options"""
+        from click.shell_completion import CompletionItem
+
+        results = [
+            CompletionItem(name, help=self.get_short_help(ctx, name))
+            for name in self.list_commands(ctx)
+            if name.startswith(incomplete)
+        ]
+        results.extend(click.Command.shell_complete(self, ctx, incomplete))
+        return results
+
+    def get_short_help(self, ctx: click.Context, cmd_name: str) -> str:
+        """Reads `short_help` of the command's decorator from its source (without import)"""
+        source = (self.cmd_folder / f"{cmd_name}.py").read_text()
+        for node in ast.walk(ast.parse(source)):
+            if isinstance(node, ast.FunctionDef) and node.name == "cli":
+                for decorator in node.decorator_list:
+                    for keyword in getattr(decorator, "keywords", []):
+                        if keyword.arg == "short_help" and isinstance(keyword.value, ast.Constant):
+                            return keyword.value.value
+
+        command = self.get_command(ctx, cmd_name)
+        return command.get_short_help_str() if command else ""
+
 
 @click.command(cls=ComplexCLI)
 def cli():
@@ -0,0 +1,687 @@
+"""
+S3 transport: shared (cached) client, tunable multipart transfers (chunk size, concurrency,
+bandwidth cap, retries) and progress reporting for uploads/downloads.
+"""
+
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import logging
+import itertools
+import threading
+import functools
+import dataclasses
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from operator import itemgetter
+from pathlib import Path
+from typing import Iterator
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from src import settings
+from src.exceptions import BackupError
+from src.run import logger_ctx
+from src.utils import PARTIAL_FILE_SUFFIX, check_env_variables, is_sidecar
+
+module_logger = logging.getLogger(__name__)
+MB = 1024 * 1024
+# max count of keys in single DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+# S3 limits count of parts in multipart upload and their sizes (except the last part)
+MAX_PARTS_COUNT = 10000
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+# streamed upload (size is unknown): part's size is doubled after each 1/10 of max parts count
+PART_SIZE_GROWTH_STEPS = 10
+UPLOAD_STATE_SUFFIX = ".upload.json"
+
+
+@dataclasses.dataclass
+class TransferOptions:
+    """Tunable params of S3 transfers (defaults are taken from settings)"""
+
+    chunk_size: int = dataclasses.field(default_factory=lambda: settings.S3_MULTIPART_CHUNK_SIZE)
+    threshold: int = dataclasses.field(default_factory=lambda: settings.S3_MULTIPART_THRESHOLD)
+    max_concurrency: int = dataclasses.field(default_factory=lambda: settings.S3_MAX_CONCURRENCY)
+    max_bandwidth: int = dataclasses.field(default_factory=lambda: settings.S3_MAX_BANDWIDTH)
+    max_attempts: int = dataclasses.field(default_factory=lambda: settings.S3_MAX_ATTEMPTS)
+    retry_mode: str = dataclasses.field(default_factory=lambda: settings.S3_RETRY_MODE)
+
+
+transfer_options = TransferOptions()
+
+
+def configure(**options) -> TransferOptions:
+    """
+    Overrides transfer's options (ex.: from CLI params). None values are ignored.
+    Cached client is dropped (it will be recreated with new options)
+    """
+    for name, value in options.items():
+        if value is not None:
+            setattr(transfer_options, name, value)
+
+    get_client.cache_clear()
+    return transfer_options
+
+
+@functools.cache
+def get_client():
+    """
+    Creates boto3's S3 client (based on S3_* settings).
+    Client is created once and shared between all jobs (boto3's clients are thread-safe)
+    """
+    check_env_variables(
+        "S3_STORAGE_URL",
+        "S3_ACCESS_KEY_ID",
+        "S3_SECRET_ACCESS_KEY",
+        "S3_REGION_NAME",
+    )
+    session = boto3.session.Session(
+        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+        region_name=settings.S3_REGION_NAME,
+    )
+    config = Config(
+        retries={
+            "max_attempts": transfer_options.max_attempts,
+            "mode": transfer_options.retry_mode,
+        },
+        # each concurrent transfer's thread needs its own connection
+        max_pool_connections=max(10, transfer_options.max_concurrency * 2),
+    )
+    return session.client(service_name="s3", endpoint_url=settings.S3_STORAGE_URL, config=config)
+
+
+def get_transfer_config() -> TransferConfig:
+    """TransferConfig for boto3's managed transfers (upload_file / download_file)"""
+    return TransferConfig(
+        multipart_threshold=transfer_options.threshold,
+        multipart_chunksize=transfer_options.chunk_size,
+        max_concurrency=transfer_options.max_concurrency,
+        max_bandwidth=transfer_options.max_bandwidth or None,
+        use_threads=transfer_options.max_concurrency > 1,
+    )
+
+
+def get_key(file_name: str) -> str:
+    """Full object's key (inside S3_PATH) for the backup's file"""
+    return os.path.join(settings.S3_PATH or "", file_name)
+
+
+class ProgressReporter:
+    """Thread-safe callback for boto3's transfers: logs progress not more often than interval"""
+
+    def __init__(self, db_name: str, operation: str, total_size: int | None = None):
+        self.db_name = db_name
+        self.operation = operation
+        self.total_size = total_size
+        self.transferred = 0
+        self.logger = logger_ctx.get(module_logger)
+        self._lock = threading.Lock()
+        self._started_at = self._reported_at = time.monotonic()
+
+    def __call__(self, bytes_amount: int) -> None:
+        with self._lock:
+            self.transferred += bytes_amount
+            now = time.monotonic()
+            if now - self._reported_at < settings.S3_PROGRESS_INTERVAL:
+                return
+
+            self._reported_at = now
+            self._report(now)
+
+    def finish(self) -> None:
+        """Logs final transfer's stats"""
+        self._report(time.monotonic())
+
+    def _report(self, now: float) -> None:
+        elapsed = max(now - self._started_at, 1e-6)
+        percent = f" ({self.transferred / self.total_size:.0%})" if self.total_size else ""
+        self.logger.info(
+            "[%s] S3 %s: %.1f MB%s | %.1f MB/s",
+            self.db_name,
+            self.operation,
+            self.transferred / MB,
+            percent,
+            self.transferred / MB / elapsed,
+        )
+
+
+class BandwidthLimiter:
+    """Simple limiter (for streamed uploads): sleeps when transfer goes faster than allowed"""
+
+    def __init__(self, max_bandwidth: int):
+        self.max_bandwidth = max_bandwidth
+        self._started_at = time.monotonic()
+        self._transferred = 0
+        self._lock = threading.Lock()
+
+    def consume(self, size: int) -> None:
+        """Registers transferred bytes (blocks while rate exceeds max_bandwidth)"""
+        if not self.max_bandwidth:
+            return
+
+        with self._lock:
+            self._transferred += size
+            expected_time = self._transferred / self.max_bandwidth
+            delay = expected_time - (time.monotonic() - self._started_at)
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MultipartUploader:
+    """
+    Uploads stream of data via multipart upload: parts are uploaded concurrently
+    (max_concurrency) and memory is bounded by (max_concurrency + 1) * part's size.
+    Stream's size is unknown, so part's size grows with count of parts (see PART_SIZE_GROWTH_STEPS):
+    chunk_size's parts are used for small streams, big ones fit MAX_PARTS_COUNT.
+    """
+
+    def __init__(self, db_name: str, key: str):
+        self.db_name = db_name
+        self.key = key
+        self.s3 = get_client()
+        self.logger = logger_ctx.get(module_logger)
+        self.part_size = max(transfer_options.chunk_size, MIN_PART_SIZE)
+        self.progress = ProgressReporter(db_name, operation="upload")
+        self.limiter = BandwidthLimiter(transfer_options.max_bandwidth)
+        self._buffer = bytearray()
+        self._parts: dict[int, str] = {}
+        # only pending futures are kept: the finished ones are dropped by `_on_uploaded`
+        self._pending: set[Future] = set()
+        self._error: BaseException | None = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(transfer_options.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=transfer_options.max_concurrency)
+        self._next_part_number = 1
+        self.upload_id = self.s3.create_multipart_upload(
+            Bucket=settings.S3_BUCKET_NAME, Key=self.key
+        )["UploadId"]
+        self.logger.debug("[%s] S3 multipart upload started: %s", self.db_name, self.key)
+
+    def write(self, chunk: bytes) -> None:
+        """Adds data to the current part (full parts are uploaded in background)"""
+        self._buffer += chunk
+        while len(self._buffer) >= (part_size := self.part_size):
+            self._submit_part(bytes(self._buffer[:part_size]))
+            del self._buffer[:part_size]
+
+    def complete(self) -> None:
+        """Uploads the last part and completes multipart upload"""
+        if self._buffer or self._next_part_number == 1:
+            self._submit_part(bytes(self._buffer))
+            self._buffer.clear()
+
+        self._executor.shutdown()
+        self._raise_error()
+        self.s3.complete_multipart_upload(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": part_number, "ETag": etag}
+                    for part_number, etag in sorted(self._parts.items())
+                ]
+            },
+        )
+        self.progress.finish()
+
+    def abort(self) -> None:
+        """Drops uploaded parts"""
+        self._buffer.clear()
+        self._executor.shutdown(cancel_futures=True)
+        try:
+            self.s3.abort_multipart_upload(
+                Bucket=settings.S3_BUCKET_NAME, Key=self.key, UploadId=self.upload_id
+            )
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self.logger.warning("[%s] Couldn't abort S3 multipart upload: %r", self.db_name, exc)
+
+    def _submit_part(self, data: bytes) -> None:
+        # fail fast: the error of any already finished part stops the whole upload
+        self._raise_error()
+        part_number = self._next_part_number
+        if part_number > MAX_PARTS_COUNT:
+            raise BackupError(f"S3 multipart upload {self.key} exceeds {MAX_PARTS_COUNT} parts")
+
+        self._slots.acquire()  # blocks the reader while all upload's slots are busy
+        self._next_part_number += 1
+        if part_number % (MAX_PARTS_COUNT // PART_SIZE_GROWTH_STEPS) == 0:
+            self.part_size = min(self.part_size * 2, MAX_PART_SIZE)
+            self.logger.debug("[%s] S3 part's size is increased: %i", self.db_name, self.part_size)
+
+        future = self._executor.submit(self._upload_part, part_number, data)
+        with self._lock:
+            self._pending.add(future)
+
+        future.add_done_callback(self._on_uploaded)
+
+    def _on_uploaded(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+            if not future.cancelled() and (exc := future.exception()):
+                self._error = self._error or exc
+
+        self._slots.release()
+
+    def _raise_error(self) -> None:
+        if self._error:
+            raise self._error
+
+    def _upload_part(self, part_number: int, data: bytes) -> None:
+        self.limiter.consume(len(data))
+        response = self.s3.upload_part(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        self._parts[part_number] = response["ETag"]
+        self.progress(len(data))
+        self.logger.debug(
+            "[%s] S3 part #%i uploaded (%i bytes)", self.db_name, part_number, len(data)
+        )
+
+
+@dataclasses.dataclass
+class UploadState:
+    """Persisted state of multipart upload of the file (for resuming it after restart)"""
+
+    db_name: str
+    key: str
+    file_path: str
+    file_size: int
+    file_mtime: float
+    part_size: int
+    upload_id: str
+    created_at: float = dataclasses.field(default_factory=time.time)
+    parts: dict[int, str] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def get_path(key: str) -> Path:
+        key_hash = hashlib.sha1(key.encode()).hexdigest()
+        return settings.S3_RESUME_DIR / f"{key_hash}{UPLOAD_STATE_SUFFIX}"
+
+    @classmethod
+    def load(cls, path: Path) -> "UploadState | None":
+        try:
+            data = json.loads(path.read_text())
+            data["parts"] = {int(number): etag for number, etag in data["parts"].items()}
+            return cls(**data)
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+    @property
+    def parts_count(self) -> int:
+        return max(math.ceil(self.file_size / self.part_size), 1)
+
+    def get_part_size(self, part_number: int) -> int:
+        return min(self.part_size, self.file_size - (part_number - 1) * self.part_size)
+
+    def is_actual(self, file_path: Path) -> bool:
+        """Is state created for the same (unchanged) file"""
+        stat = file_path.stat()
+        return (self.file_path, self.file_size, self.file_mtime) == (
+            str(file_path.resolve()),
+            stat.st_size,
+            stat.st_mtime,
+        )
+
+    def save(self) -> None:
+        # state is replaced atomically: interrupted process can't leave broken state
+        path = self.get_path(self.key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json.dumps(dataclasses.asdict(self)))
+        os.replace(tmp_path, path)
+
+    def remove(self) -> None:
+        self.get_path(self.key).unlink(missing_ok=True)
+
+
+class ResumableUploader:
+    """
+    Uploads file via multipart upload: state (upload id, completed parts with ETags)
+    is persisted after each part, so the next run uploads only missing parts
+    """
+
+    def __init__(
+        self, db_name: str, file_path: Path, key: str, metadata: dict[str, str] | None = None
+    ):
+        self.db_name = db_name
+        self.file_path = file_path
+        self.key = key
+        self.metadata = metadata or {}
+        self.s3 = get_client()
+        self.logger = logger_ctx.get(module_logger)
+        self._lock = threading.Lock()
+
+    def upload(self) -> str:
+        """
+        Uploads missing parts concurrently and completes the upload
+
+        :return: key of uploaded object
+        """
+        state = self._load_state() or self._start()
+        missing = [
+            number for number in range(1, state.parts_count + 1) if number not in state.parts
+        ]
+        if len(missing) < state.parts_count:
+            self.logger.info(
+                "[%s] S3 upload is resumed: %i of %i parts are already uploaded",
+                self.db_name,
+                state.parts_count - len(missing),
+                state.parts_count,
+            )
+
+        progress = ProgressReporter(self.db_name, operation="upload", total_size=state.file_size)
+        progress.transferred = (state.parts_count - len(missing)) * state.part_size
+        limiter = BandwidthLimiter(transfer_options.max_bandwidth)
+        with open(self.file_path, "rb") as file:
+
+            def upload_part(part_number: int) -> None:
+                data = os.pread(file.fileno(), state.part_size, (part_number - 1) * state.part_size)
+                limiter.consume(len(data))
+                response = self.s3.upload_part(
+                    Bucket=settings.S3_BUCKET_NAME,
+                    Key=self.key,
+                    UploadId=state.upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                )
+                with self._lock:
+                    state.parts[part_number] = response["ETag"]
+                    state.save()
+
+                progress(len(data))
+
+            with ThreadPoolExecutor(max_workers=transfer_options.max_concurrency) as executor:
+                # the first failed part stops the upload (completed parts are kept for resuming)
+                for future in [executor.submit(upload_part, number) for number in missing]:
+                    future.result()
+
+        self.s3.complete_multipart_upload(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=self.key,
+            UploadId=state.upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": etag}
+                    for number, etag in sorted(state.parts.items())
+                ]
+            },
+        )
+        state.remove()
+        progress.finish()
+        return self.key
+
+    def _start(self) -> UploadState:
+        file_size = self.file_path.stat().st_size
+        state = UploadState(
+            db_name=self.db_name,
+            key=self.key,
+            file_path=str(self.file_path.resolve()),
+            file_size=file_size,
+            file_mtime=self.file_path.stat().st_mtime,
+            part_size=max(
+                transfer_options.chunk_size, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS_COUNT)
+            ),
+            upload_id=self.s3.create_multipart_upload(
+                Bucket=settings.S3_BUCKET_NAME, Key=self.key, Metadata=self.metadata
+            )["UploadId"],
+        )
+        state.save()
+        return state
+
+    def _load_state(self) -> UploadState | None:
+        """Loads state of interrupted upload (parts are verified by S3's ListParts)"""
+        if not (state := UploadState.load(UploadState.get_path(self.key))):
+            return None
+
+        if not state.is_actual(self.file_path):
+            self.logger.info("[%s] S3 upload's state is outdated: %s", self.db_name, self.key)
+            abort_upload(state)
+            return None
+
+        try:
+            uploaded = {
+                part["PartNumber"]: part
+                for page in self.s3.get_paginator("list_parts").paginate(
+                    Bucket=settings.S3_BUCKET_NAME, Key=self.key, UploadId=state.upload_id
+                )
+                for part in page.get("Parts") or []
+            }
+        except ClientError as exc:
+            self.logger.info("[%s] S3 upload can't be resumed: %r", self.db_name, exc)
+            state.remove()
+            return None
+
+        # parts with unexpected size (ex.: state of another file's upload) are uploaded again
+        state.parts = {
+            number: part["ETag"]
+            for number, part in uploaded.items()
+            if part["Size"] == state.get_part_size(number)
+        }
+        return state
+
+
+def pending_uploads(db_name: str) -> list[UploadState]:
+    """States of DB's interrupted uploads (which can be resumed)"""
+    if not settings.S3_RESUME_DIR.is_dir():
+        return []
+
+    states = (
+        UploadState.load(path) for path in settings.S3_RESUME_DIR.glob(f"*{UPLOAD_STATE_SUFFIX}")
+    )
+    return [state for state in states if state and state.db_name == db_name]
+
+
+def abort_upload(state: UploadState) -> None:
+    """Drops interrupted upload (uploaded parts and local state)"""
+    logger = logger_ctx.get(module_logger)
+    try:
+        get_client().abort_multipart_upload(
+            Bucket=settings.S3_BUCKET_NAME, Key=state.key, UploadId=state.upload_id
+        )
+    except ClientError as exc:
+        logger.warning("[%s] Couldn't abort S3 multipart upload: %r", state.db_name, exc)
+
+    state.remove()
+
+
+def upload_file(
+    db_name: str, file_path: Path, key: str | None = None, metadata: dict[str, str] | None = None
+) -> str:
+    """
+    Uploads file to S3 bucket. Big files are uploaded via resumable multipart upload
+    (parts are uploaded concurrently, interrupted upload is resumed by the next call).
+
+    :param metadata: object's user metadata (ex.: backup's checksum)
+    :return: key of uploaded object
+    """
+    key = key or get_key(file_path.name)
+    file_size = file_path.stat().st_size
+    if file_size >= transfer_options.threshold:
+        return ResumableUploader(db_name, file_path, key=key, metadata=metadata).upload()
+
+    progress = ProgressReporter(db_name, operation="upload", total_size=file_size)
+    get_client().upload_file(
+        Filename=str(file_path),
+        Bucket=settings.S3_BUCKET_NAME,
+        Key=key,
+        Config=get_transfer_config(),
+        Callback=progress,
+        ExtraArgs={"Metadata": metadata} if metadata else None,
+    )
+    progress.finish()
+    return key
+
+
+def download_file(db_name: str, key: str, file_path: Path) -> Path:
+    """
+    Downloads object from S3 bucket. Big objects are downloaded via ranged concurrent GETs
+    to the partial file in S3_RESUME_DIR: interrupted download is continued from the last
+    flushed offset (if the object wasn't changed) by the next call.
+    """
+    s3 = get_client()
+    head = s3.head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+    size, etag = head["ContentLength"], head.get("ETag")
+    if size < transfer_options.threshold:
+        progress = ProgressReporter(db_name, operation="download", total_size=size)
+        s3.download_file(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=key,
+            Filename=str(file_path),
+            Config=get_transfer_config(),
+            Callback=progress,
+        )
+        progress.finish()
+        return file_path
+
+    logger = logger_ctx.get(module_logger)
+    settings.S3_RESUME_DIR.mkdir(parents=True, exist_ok=True)
+    part_path = settings.S3_RESUME_DIR / f"{file_path.name}{PARTIAL_FILE_SUFFIX}"
+    state_path = part_path.with_name(f"{part_path.name}.json")
+    state = {"key": key, "etag": etag, "size": size, "offset": 0}
+    try:
+        saved_state = json.loads(state_path.read_text())
+    except (OSError, ValueError):
+        saved_state = {}
+
+    if part_path.exists() and {**saved_state, "offset": 0} == state:
+        state["offset"] = min(saved_state["offset"], part_path.stat().st_size)
+        logger.info("[%s] S3 download is resumed from %i bytes", db_name, state["offset"])
+
+    with open(part_path, "r+b" if state["offset"] else "wb") as file:
+        file.truncate(state["offset"])
+        file.seek(state["offset"])
+        for chunk in iter_object(db_name, key, start=state["offset"], if_match=etag):
+            file.write(chunk)
+            # offset is saved only for data which is really written to the disk
+            file.flush()
+            os.fsync(file.fileno())
+            state["offset"] += len(chunk)
+            state_path.write_text(json.dumps(state))
+
+    shutil.move(part_path, file_path)
+    state_path.unlink(missing_ok=True)
+    return file_path
+
+
+def iter_object(
+    db_name: str, key: str, start: int = 0, if_match: str | None = None
+) -> Iterator[bytes]:
+    """
+    Streams object's content via ranged GETs: next ranges are prefetched concurrently
+    (max_concurrency), so memory is bounded by max_concurrency * chunk_size
+
+    :param start: offset of the first byte (ex.: for resuming of interrupted download)
+    :param if_match: expected object's ETag (object mustn't be changed during the download)
+    """
+    client = get_client()
+    size = client.head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)["ContentLength"]
+    range_size = transfer_options.chunk_size
+    progress = ProgressReporter(db_name, operation="download", total_size=size)
+    progress.transferred = start
+    limiter = BandwidthLimiter(transfer_options.max_bandwidth)
+    extra_params = {"IfMatch": if_match} if if_match else {}
+
+    def fetch_range(offset: int) -> bytes:
+        end = min(offset + range_size, size) - 1
+        response = client.get_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=key, Range=f"bytes={offset}-{end}", **extra_params
+        )
+        data = response["Body"].read()
+        limiter.consume(len(data))
+        progress(len(data))
+        return data
+
+    offsets = iter(range(start, size, range_size))
+    with ThreadPoolExecutor(max_workers=transfer_options.max_concurrency) as executor:
+        futures = deque(
+            executor.submit(fetch_range, offset)
+            for offset in itertools.islice(offsets, transfer_options.max_concurrency)
+        )
+        while futures:
+            data = futures.popleft().result()
+            if (offset := next(offsets, None)) is not None:
+                futures.append(executor.submit(fetch_range, offset))
+
+            yield data
+
+    progress.finish()
+
+
+def list_objects(prefix: str, delimiter: str | None = None) -> list[dict]:
+    """
+    Lists all objects by prefix (with pagination: more than 1000 objects are supported)
+
+    :param delimiter: skip nested "directories" (ex.: "/" lists only objects placed directly
+                      in the prefix's "directory")
+    """
+    paginator = get_client().get_paginator("list_objects_v2")
+    params = {"Bucket": settings.S3_BUCKET_NAME, "Prefix": prefix}
+    if delimiter:
+        params["Delimiter"] = delimiter
+
+    objects = []
+    for page in paginator.paginate(**params):
+        objects.extend(page.get("Contents") or [])
+
+    return objects
+
+
+def delete_objects(keys: list[str]) -> list[str]:
+    """
+    Deletes objects via batched DeleteObjects requests (up to 1000 keys per request)
+
+    :return: keys of deleted objects
+    :raise `BackupError` (if some objects weren't deleted)
+    """
+    return list(itertools.chain.from_iterable(delete_objects_by_batches(keys)))
+
+
+def delete_objects_by_batches(keys: list[str]) -> Iterator[list[str]]:
+    """
+    Deletes objects by batches (see `delete_objects`): keys deleted by each DeleteObjects request
+    are yielded before the next one, so the caller knows them even if the next request fails
+
+    :raise `BackupError` (after all batches, if some objects weren't deleted)
+    """
+    client = get_client()
+    logger = logger_ctx.get(module_logger)
+    errors = []
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start : start + DELETE_BATCH_SIZE]
+        response = client.delete_objects(
+            Bucket=settings.S3_BUCKET_NAME,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        failed = {error["Key"]: error.get("Message") for error in response.get("Errors") or []}
+        errors.extend(f"{key}: {message}" for key, message in failed.items())
+        logger.debug("S3 objects deleted: %i (failed: %i)", len(batch) - len(failed), len(failed))
+        yield [key for key in batch if key not in failed]
+
+    if errors:
+        raise BackupError(f"Couldn't delete {len(errors)} S3 object(s): {'; '.join(errors)}")
+
+
+def find_latest_key(prefix: str, contains: str = "") -> str:
+    """Finds the latest (by name) object's key with provided prefix (and substring)"""
+    objects = [
+        obj for obj in list_objects(prefix) if contains in obj["Key"] and not is_sidecar(obj["Key"])
+    ]
+    if not objects:
+        raise BackupError(f"No objects in S3 bucket for requested prefix {prefix}")
+
+    return max(objects, key=itemgetter("Key"))["Key"]
@@ -0,0 +1,489 @@
+"""
+Schedule of the long-running daemon: cron expressions per DB (TOML config), jobs' status
+and the scheduler itself (jobs are run by `jobs.Orchestrator` in the same warm process)
+"""
+
+import json
+import random
+import asyncio
+import logging
+import tomllib
+import calendar
+import dataclasses
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable
+
+from src import settings
+from src.constants import (
+    COMPRESSIONS,
+    CONTAINER_HANDLERS,
+    DUMP_FORMATS,
+    BackupHandler,
+    BackupLocation,
+)
+from src.exceptions import ScheduleError
+from src.handlers import HANDLERS
+from src.jobs import JobResult, Orchestrator
+from src.run import logger_ctx
+
+module_logger = logging.getLogger(__name__)
+CRON_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+MONTH_NAMES = {name.lower(): index for index, name in enumerate(calendar.month_abbr) if name}
+WEEKDAY_NAMES = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+# options of the job in schedule's config (names are the same as backup's CLI options)
+JOB_OPTIONS = (
+    "name",
+    "db",
+    "schedule",
+    "from",
+    "to",
+    "file",
+    "docker_container",
+    "encrypt",
+    "stream",
+    "compression",
+    "compression_level",
+    "compression_threads",
+    "dump_format",
+    "jobs",
+    "timeout",
+    "jitter",
+)
+# the next cron's occurrence is searched within this period (ex.: for "0 0 29 2 *")
+MAX_SEARCH_DAYS = 366 * 5
+
+
+def _parse_field(value: str, min_value: int, max_value: int, names: dict[str, int]) -> set[int]:
+    """
+    Parses single field of cron expression (lists, ranges, steps and names are supported)
+
+    >>> sorted(_parse_field("1-10/3,20", 0, 59, {}))
+    [1, 4, 7, 10, 20]
+    >>> sorted(_parse_field("mon-fri", 0, 6, WEEKDAY_NAMES))
+    [1, 2, 3, 4, 5]
+    """
+    result = set()
+    for part in value.lower().split(","):
+        range_part, _, step = part.partition("/")
+        if range_part == "*":
+            start, end = min_value, max_value
+        else:
+            start_value, _, end_value = range_part.partition("-")
+            start = names[start_value] if start_value in names else int(start_value)
+            if end_value:
+                end = names[end_value] if end_value in names else int(end_value)
+            else:
+                # "5/15" means "5-max/15"
+                end = max_value if step else start
+
+        step = int(step) if step else 1
+        if not min_value <= start <= end <= max_value or step < 1:
+            raise ValueError(f"value {part!r} is out of range {min_value}-{max_value}")
+
+        result.update(range(start, end + 1, step))
+
+    return result
+
+
+@dataclasses.dataclass(frozen=True)
+class CronSchedule:
+    """Parsed cron expression: 'minute hour day month weekday' (local time)"""
+
+    expression: str
+    minutes: frozenset[int]
+    hours: frozenset[int]
+    days: frozenset[int]
+    months: frozenset[int]
+    weekdays: frozenset[int]
+    any_day: bool = True
+    any_weekday: bool = True
+
+    @classmethod
+    def parse(cls, expression: str) -> "CronSchedule":
+        """
+        Parses cron expression (or one of aliases: @daily, @hourly, etc.)
+        :raise `ScheduleError`
+        """
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ScheduleError(f"Cron expression {expression!r} must contain 5 fields")
+
+        minute, hour, day, month, weekday = fields
+        try:
+            # both 0 and 7 are Sunday
+            weekdays = {value % 7 for value in _parse_field(weekday, 0, 7, WEEKDAY_NAMES)}
+            return cls(
+                expression=expression,
+                minutes=frozenset(_parse_field(minute, 0, 59, {})),
+                hours=frozenset(_parse_field(hour, 0, 23, {})),
+                days=frozenset(_parse_field(day, 1, 31, {})),
+                months=frozenset(_parse_field(month, 1, 12, MONTH_NAMES)),
+                weekdays=frozenset(weekdays),
+                any_day=day == "*",
+                any_weekday=weekday == "*",
+            )
+        except (KeyError, ValueError) as exc:
+            raise ScheduleError(f"Invalid cron expression {expression!r}: {exc}") from exc
+
+    def match_day(self, moment: datetime) -> bool:
+        """Day matches day's or weekday's field (both are checked if both are restricted)"""
+        day_matched = moment.day in self.days
+        weekday_matched = (moment.weekday() + 1) % 7 in self.weekdays
+        if not self.any_day and not self.any_weekday:
+            return day_matched or weekday_matched
+
+        return day_matched and weekday_matched
+
+    def next_after(self, moment: datetime) -> datetime:
+        """
+        Returns the next moment (after provided one) which matches the schedule
+
+        >>> CronSchedule.parse("30 3 * * mon-fri").next_after(datetime(2024, 3, 1, 12, 0))
+        datetime.datetime(2024, 3, 4, 3, 30)
+        >>> CronSchedule.parse("@hourly").next_after(datetime(2024, 3, 1, 12, 0))
+        datetime.datetime(2024, 3, 1, 13, 0)
+        """
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        deadline = candidate + timedelta(days=MAX_SEARCH_DAYS)
+        while candidate < deadline:
+            if candidate.month not in self.months:
+                month_start = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (month_start + timedelta(days=32)).replace(day=1)
+            elif not self.match_day(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+
+        raise ScheduleError(f"Cron expression {self.expression!r} never matches")
+
+
+@dataclasses.dataclass
+class ScheduledJob:
+    """Backup of the single DB which is run by the schedule"""
+
+    name: str
+    db: str
+    schedule: CronSchedule
+    handler: BackupHandler
+    destination: tuple[BackupLocation, ...]
+    destination_file: str | None = None
+    encrypt: bool = False
+    stream: bool = False
+    timeout: int = settings.JOB_TIMEOUT
+    jitter: int = settings.DAEMON_JITTER
+    handler_kwargs: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    @property
+    def concurrency_key(self) -> str:
+        """Key (ex.: DB server's host) for limiting concurrent jobs on the same server"""
+        return HANDLERS[self.handler].concurrency_key(**self.handler_kwargs)
+
+    @property
+    def uses_s3(self) -> bool:
+        """Backup is delivered to S3 (directly or via the chunk store with S3 backend)"""
+        return BackupLocation.S3 in self.destination or (
+            BackupLocation.CHUNKS in self.destination
+            and settings.CHUNK_STORE_BACKEND == BackupLocation.S3
+        )
+
+
+@dataclasses.dataclass
+class JobStatus:
+    """State and the last results of scheduled job (is exposed by the daemon)"""
+
+    name: str
+    db: str
+    schedule: str
+    state: str = "idle"
+    next_run_at: datetime | None = None
+    last_started_at: datetime | None = None
+    last_finished_at: datetime | None = None
+    last_duration: float | None = None
+    last_success: bool | None = None
+    last_error: str | None = None
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            key: value.isoformat(timespec="seconds") if isinstance(value, datetime) else value
+            for key, value in dataclasses.asdict(self).items()
+        }
+
+
+def parse_job(config: dict[str, Any]) -> ScheduledJob:
+    """
+    Creates scheduled job from the config's section (see `JOB_OPTIONS`)
+    :raise `ScheduleError`
+    """
+    if unknown := sorted(set(config) - set(JOB_OPTIONS)):
+        raise ScheduleError(f"Unknown job's options: {unknown}")
+
+    if missing := [key for key in ("db", "schedule", "from", "to") if not config.get(key)]:
+        raise ScheduleError(f"Job {config.get('name') or config.get('db')!r} requires {missing}")
+
+    name = config.get("name") or config["db"]
+    destination = config["to"]
+    destination = destination.split(",") if isinstance(destination, str) else destination
+    try:
+        handler = BackupHandler(str(config["from"]).upper())
+        destination = tuple(BackupLocation[value.strip().upper()] for value in destination)
+    except (KeyError, ValueError) as exc:
+        raise ScheduleError(f"[{name}] Unknown handler or destination: {exc!r}") from exc
+
+    if handler in CONTAINER_HANDLERS and not config.get("docker_container"):
+        raise ScheduleError(f"[{name}] Handler '{handler}' requires 'docker_container' option")
+
+    if BackupLocation.FILE in destination and not config.get("file"):
+        raise ScheduleError(f"[{name}] Destination 'FILE' requires 'file' option")
+
+    if BackupLocation.CHUNKS in destination and config.get("encrypt"):
+        raise ScheduleError(f"[{name}] Destination 'CHUNKS' doesn't support 'encrypt' option")
+
+    compression = config.get("compression", settings.COMPRESSION)
+    if compression not in COMPRESSIONS:
+        raise ScheduleError(f"[{name}] Unknown compression {compression!r}: {COMPRESSIONS}")
+
+    if (dump_format := config.get("dump_format")) and dump_format not in DUMP_FORMATS:
+        raise ScheduleError(f"[{name}] Unknown dump format {dump_format!r}: {DUMP_FORMATS}")
+
+    handler_formats = tuple(map(str, HANDLERS[handler].dump_formats))
+    if dump_format and dump_format not in handler_formats:
+        raise ScheduleError(
+            f"[{name}] Dump format {dump_format!r} isn't supported by {handler}: {handler_formats}"
+        )
+
+    return ScheduledJob(
+        name=name,
+        db=config["db"],
+        schedule=CronSchedule.parse(config["schedule"]),
+        handler=handler,
+        destination=destination,
+        destination_file=config.get("file"),
+        encrypt=bool(config.get("encrypt", False)),
+        stream=bool(config.get("stream", False)),
+        timeout=int(config.get("timeout", settings.JOB_TIMEOUT)),
+        jitter=int(config.get("jitter", settings.DAEMON_JITTER)),
+        handler_kwargs={
+            "container_name": config.get("docker_container"),
+            "compression": compression,
+            "compression_level": config.get("compression_level", settings.COMPRESSION_LEVEL),
+            "compression_threads": config.get("compression_threads", settings.COMPRESSION_THREADS),
+            "dump_format": dump_format,
+            "jobs": config.get("jobs"),
+        },
+    )
+
+
+def load_schedule(path: Path) -> list[ScheduledJob]:
+    """
+    Loads jobs from TOML config: [defaults] section is applied to each of [[jobs]]
+    :raise `ScheduleError`
+    """
+    try:
+        config = tomllib.loads(Path(path).read_text())
+    except (OSError, tomllib.TOMLDecodeError) as exc:
+        raise ScheduleError(f"Couldn't read schedule's config {path}: {exc!r}") from exc
+
+    defaults = config.get("defaults", {})
+    jobs = [parse_job({**defaults, **job_config}) for job_config in config.get("jobs", [])]
+    if not jobs:
+        raise ScheduleError(f"No jobs found in schedule's config {path}")
+
+    names = Counter(job.name for job in jobs)
+    if duplicates := sorted(name for name, count in names.items() if count > 1):
+        raise ScheduleError(f"Job's names must be unique (use 'name' option): {duplicates}")
+
+    return jobs
+
+
+class Scheduler:
+    """
+    Runs scheduled jobs (with random delay up to job's jitter) by the bounded pool of workers.
+    Job isn't started again while its previous run is active (the run is skipped).
+    Jobs' status is written to the JSON file and is served by HTTP (if status_port is set).
+    """
+
+    def __init__(
+        self,
+        jobs: list[ScheduledJob],
+        runner: Callable[[ScheduledJob], Any],
+        workers: int = 1,
+        per_host_limit: int = 0,
+        status_path: Path | None = settings.DAEMON_STATUS_PATH,
+        status_host: str = settings.DAEMON_STATUS_HOST,
+        status_port: int = settings.DAEMON_STATUS_PORT,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        self.jobs = {job.name: job for job in jobs}
+        self.runner = runner
+        self.status_path = status_path
+        self.status_host = status_host
+        self.status_port = status_port
+        self.now = now
+        self.started_at = now()
+        self.logger = logger_ctx.get(module_logger)
+        self.statuses = {
+            job.name: JobStatus(name=job.name, db=job.db, schedule=job.schedule.expression)
+            for job in jobs
+        }
+        self.orchestrator = Orchestrator(
+            workers=workers,
+            key_func=lambda name: self.jobs[name].concurrency_key,
+            per_key_limit=per_host_limit,
+        )
+        self._tasks: set[asyncio.Task] = set()
+
+    def schedule(self, job: ScheduledJob, after: datetime) -> datetime:
+        """Sets the next run of the job (with random delay up to the job's jitter)"""
+        next_run_at = job.schedule.next_after(after)
+        if job.jitter > 0:
+            next_run_at += timedelta(seconds=random.uniform(0, job.jitter))
+
+        self.statuses[job.name].next_run_at = next_run_at
+        return next_run_at
+
+    def dispatch(self) -> float:
+        """
+        Starts due jobs (skips ones which are still running) and reschedules them
+        :return: seconds till the next due job
+        """
+        now = self.now()
+        for job in self.jobs.values():
+            status = self.statuses[job.name]
+            if status.next_run_at is None:
+                self.schedule(job, after=now)
+                continue
+
+            if status.next_run_at > now:
+                continue
+
+            if status.state == "running":
+                self.logger.warning("[%s] previous run is still active: run is skipped", job.name)
+                status.skipped += 1
+            else:
+                task = asyncio.create_task(self._run_job(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            self.schedule(job, after=now)
+
+        self.write_status()
+        next_run_at = min(status.next_run_at for status in self.statuses.values())
+        return max((next_run_at - self.now()).total_seconds(), 0)
+
+    async def run(self) -> None:
+        """Runs jobs by the schedule until SIGTERM / SIGINT (running jobs are cancelled)"""
+        async with self.orchestrator:
+            server = await self._start_status_server()
+            self.logger.info("Daemon is started: %i job(s) are scheduled", len(self.jobs))
+            try:
+                # clock's jumps (ex.: after suspending) are detected at least once per minute
+                while not await self.orchestrator.sleep(min(self.dispatch(), 60)):
+                    pass
+
+                await asyncio.gather(*self._tasks)
+            finally:
+                if server:
+                    server.close()
+                    await server.wait_closed()
+
+                self.write_status()
+
+        self.logger.info("Daemon is stopped")
+
+    def status_report(self) -> dict[str, Any]:
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "state": "stopping" if self.orchestrator.stopping else "running",
+            "jobs": [status.as_dict() for status in self.statuses.values()],
+        }
+
+    def write_status(self) -> None:
+        """Writes jobs' status to the JSON file (atomically)"""
+        if not self.status_path:
+            return
+
+        tmp_path = self.status_path.with_name(f"{self.status_path.name}.tmp")
+        try:
+            tmp_path.write_text(json.dumps(self.status_report(), indent=2))
+            tmp_path.replace(self.status_path)
+        except OSError as exc:
+            self.logger.warning("Couldn't write daemon's status to %s: %r", self.status_path, exc)
+
+    async def _run_job(self, job: ScheduledJob) -> JobResult:
+        status = self.statuses[job.name]
+        status.state = "running"
+        status.last_started_at = self.now()
+        self.logger.info("[%s] scheduled job is starting ...", job.name)
+        result = await self.orchestrator.run_job(
+            job.name, lambda _: self.runner(job), key=job.concurrency_key, timeout=job.timeout
+        )
+        status.state = "idle"
+        status.last_finished_at = self.now()
+        status.last_duration = round(result.duration, 3)
+        status.last_success = result.success
+        status.last_error = result.error
+        status.runs += 1
+        status.failures += 0 if result.success else 1
+        if result.success:
+            self.logger.info("[%s] BACKUP SUCCESS (%.1fs)", job.name, result.duration)
+        else:
+            self.logger.error("[%s] BACKUP FAILED: %s", job.name, result.error)
+
+        self.write_status()
+        return result
+
+    async def _start_status_server(self) -> asyncio.Server | None:
+        if not self.status_port:
+            return None
+
+        server = await asyncio.start_server(
+            self._handle_status_request, host=self.status_host, port=self.status_port
+        )
+        self.logger.info(
+            "Status is served on http://%s:%i/status", self.status_host, self.status_port
+        )
+        return server
+
+    async def _handle_status_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass  # request's headers are not used
+
+            _, path, *_ = request_line.decode("latin-1").split() or ["", ""]
+            if path in ("/", "/status"):
+                code, body = "200 OK", self.status_report()
+            elif path == "/health":
+                code, body = "200 OK", {"state": self.status_report()["state"]}
+            else:
+                code, body = "404 Not Found", {"error": f"Unknown path {path!r}"}
+
+            content = json.dumps(body).encode()
+            writer.write(
+                f"HTTP/1.1 {code}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode() + content
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError) as exc:
+            self.logger.debug("Bad status request: %r", exc)
+        finally:
+            writer.close()
@@ -0,0 +1,301 @@
+"""
+Scratch space for temporary files of backup / restore jobs (dumps, their compressed / encrypted
+copies, downloaded backups). Each job gets its own workspace: directory on one of SCRATCH_DIRS
+volumes which is picked by free space (vs. estimated dump's size) before the dump is started.
+Workspace is removed after the job, workspaces of crashed (killed) processes are removed
+by the next run.
+"""
+
+import os
+import re
+import time
+import shutil
+import atexit
+import logging
+import tempfile
+import threading
+import functools
+import contextvars
+import dataclasses
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Type
+
+from src import catalog, settings
+from src.exceptions import ScratchSpaceError
+from src.run import logger_ctx
+
+if TYPE_CHECKING:
+    from src.handlers import BaseHandler
+
+module_logger = logging.getLogger(__name__)
+WORKSPACE_PREFIX = "db-backups-"
+# workspace's name: {prefix}{host}-{pid}-{random suffix} (owner is detected by it)
+WORKSPACE_RE = re.compile(rf"^{WORKSPACE_PREFIX}(?P<host>.+)-(?P<pid>\d+)-[a-z0-9_]+$")
+# workspace with files of interrupted S3 upload (they are resumed by the next run)
+KEEP_MARKER = ".keep"
+HOSTNAME = os.uname().nodename
+workspace_ctx: contextvars.ContextVar["Workspace | None"] = contextvars.ContextVar(
+    "workspace", default=None
+)
+
+
+@dataclasses.dataclass
+class SizeEstimate:
+    """Expected size of DB's dump: by the DB server and by the previous backup (catalog)"""
+
+    db_size: int | None = None
+    previous_size: int | None = None
+
+    @property
+    def required(self) -> int:
+        """Scratch space for the dump and its compressed copy (0 - size is unknown)"""
+        return int(max(self.db_size or 0, self.previous_size or 0) * settings.SCRATCH_SIZE_FACTOR)
+
+
+@dataclasses.dataclass
+class Volume:
+    """Scratch volume's free space (bytes)"""
+
+    path: Path
+    free: int
+    # space which is reserved by running jobs of the process
+    reserved: int = 0
+
+    @property
+    def available(self) -> int:
+        return self.free - self.reserved - settings.SCRATCH_RESERVE
+
+
+class Workspace:
+    """
+    Job's directory on the scratch volume. It is the current job's one inside `with workspace:`
+    block (see `current_dir`) and is removed at the block's exit (on errors / cancelling too).
+    """
+
+    def __init__(self, space: "ScratchSpace", name: str, path: Path, volume: Path, required: int):
+        self.space = space
+        self.name = name
+        self.path = path
+        self.volume = volume
+        self.required = required
+        self.removed = False
+        self._kept: set[Path] = set()
+        self._token: contextvars.Token | None = None
+
+    def __enter__(self) -> "Workspace":
+        self._token = workspace_ctx.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        workspace_ctx.reset(self._token)
+        self.cleanup()
+
+    def keep(self, *paths: Path) -> None:
+        """Files which aren't removed with the workspace (ex.: backup of interrupted S3 upload)"""
+        self._kept.update(path.resolve() for path in paths)
+
+    def cleanup(self) -> None:
+        """Removes workspace's files (kept ones stay in the directory till the next runs)"""
+        if self.removed:
+            return
+
+        self.removed = True
+        try:
+            if kept := {path for path in self._kept if path.exists()}:
+                for path in self.path.iterdir():
+                    if path.resolve() not in kept:
+                        _remove(path)
+
+                (self.path / KEEP_MARKER).touch()
+                logger_ctx.get(module_logger).info(
+                    "[%s] Workspace %s is kept for resuming: %s",
+                    self.name,
+                    self.path,
+                    sorted(map(str, kept)),
+                )
+            else:
+                shutil.rmtree(self.path, ignore_errors=True)
+
+        finally:
+            self.space.release(self)
+
+
+class ScratchSpace:
+    """
+    Scratch volumes of the process: workspaces are allocated on the volume with the most
+    available space, their estimated sizes are reserved (for concurrent jobs) till the cleanup
+    """
+
+    def __init__(self, dirs: list[Path]):
+        self.dirs = dirs
+        self.logger = logger_ctx.get(module_logger)
+        self._reserved: dict[Path, int] = defaultdict(int)
+        self._workspaces: set[Path] = set()
+        self._lock = threading.Lock()
+
+    def volumes(self) -> list[Volume]:
+        """Available scratch volumes (unavailable ones are skipped with warning)"""
+        volumes = []
+        for directory in self.dirs:
+            try:
+                directory.mkdir(parents=True, exist_ok=True)
+                usage = shutil.disk_usage(directory)
+            except OSError as exc:
+                self.logger.warning("Scratch volume %s is unavailable: %r", directory, exc)
+                continue
+
+            volumes.append(Volume(directory, free=usage.free, reserved=self._reserved[directory]))
+
+        return volumes
+
+    def allocate(self, name: str, required: int = 0) -> Workspace:
+        """
+        Creates job's workspace on the volume with the most available space
+
+        :param name: name of the job (ex.: DB's name)
+        :param required: estimated size of job's files (0 - unknown: any volume is used)
+        :raise `ScratchSpaceError`
+        """
+        with self._lock:
+            volumes = sorted(self.volumes(), key=lambda volume: volume.available, reverse=True)
+            if not volumes:
+                raise ScratchSpaceError(f"There are no available scratch volumes: {self.dirs}")
+
+            volume = volumes[0]
+            if required and volume.available < required:
+                available = ", ".join(f"{item.path}: {max(item.available, 0)}" for item in volumes)
+                raise ScratchSpaceError(
+                    f"Not enough scratch space for {name}: {required} bytes are required "
+                    f"(available bytes: {available})"
+                )
+
+            path = Path(
+                tempfile.mkdtemp(
+                    prefix=f"{WORKSPACE_PREFIX}{HOSTNAME}-{os.getpid()}-", dir=volume.path
+                )
+            )
+            self._reserved[volume.path] += required
+            self._workspaces.add(path)
+
+        self.logger.debug(
+            "[%s] Workspace %s is allocated (%i bytes are reserved, %i available)",
+            name,
+            path,
+            required,
+            volume.available,
+        )
+        return Workspace(self, name, path=path, volume=volume.path, required=required)
+
+    def release(self, workspace: Workspace) -> None:
+        with self._lock:
+            self._reserved[workspace.volume] -= workspace.required
+            self._workspaces.discard(workspace.path)
+
+    def sweep(self) -> list[Path]:
+        """
+        Removes workspaces of finished (crashed / killed) processes of this host. Workspaces with
+        files of interrupted S3 uploads are kept till S3_RESUME_MAX_AGE.
+        """
+        removed = []
+        for directory in self.dirs:
+            if not directory.is_dir():
+                continue
+
+            for path in directory.glob(f"{WORKSPACE_PREFIX}*"):
+                match = WORKSPACE_RE.match(path.name)
+                if not match or match["host"] != HOSTNAME or not path.is_dir():
+                    continue
+
+                with self._lock:
+                    if path in self._workspaces:
+                        continue
+
+                pid = int(match["pid"])
+                if (pid != os.getpid() and _is_running(pid)) or _is_kept(path):
+                    continue
+
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+
+        if removed:
+            self.logger.info("Stale scratch workspaces are removed: %s", list(map(str, removed)))
+
+        return removed
+
+
+@functools.cache
+def get_scratch_space() -> ScratchSpace:
+    """Shared scratch space (stale workspaces are removed at the first access)"""
+    space = ScratchSpace(settings.SCRATCH_DIRS or [Path(tempfile.gettempdir())])
+    space.sweep()
+    return space
+
+
+@functools.cache
+def process_workspace() -> Workspace:
+    """Workspace for temporary files outside of jobs (it is removed at the process's exit)"""
+    workspace = get_scratch_space().allocate("process")
+    atexit.register(workspace.cleanup)
+    return workspace
+
+
+def current_dir() -> Path:
+    """Directory for temporary files: current job's workspace (or the process's one)"""
+    if workspace := workspace_ctx.get():
+        return workspace.path
+
+    return settings.TMP_BACKUP_DIR
+
+
+def keep(*paths: Path) -> None:
+    """Keeps files after the current job's workspace cleanup (see `Workspace.keep`)"""
+    if workspace := workspace_ctx.get():
+        workspace.keep(*paths)
+
+
+def estimate_dump_size(
+    db_name: str, handler_class: Type["BaseHandler"], **handler_kwargs
+) -> SizeEstimate:
+    """
+    Estimates size of DB's dump before it is started: by the DB server (ex.: pg_database_size)
+    and by the previous backup in the catalog. Unknown size doesn't block the backup.
+    """
+    logger = logger_ctx.get(module_logger)
+    estimate = SizeEstimate(previous_size=catalog.find_backup_size(db_name))
+    try:
+        estimate.db_size = handler_class.estimate_db_size(db_name, **handler_kwargs)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.warning("[%s] Couldn't get DB's size: %r", db_name, exc)
+
+    logger.debug("[%s] Dump's size is estimated: %s", db_name, estimate)
+    return estimate
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # process of another user
+
+    return True
+
+
+def _is_kept(path: Path) -> bool:
+    marker = path / KEEP_MARKER
+    try:
+        age = time.time() - marker.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+    files = [item for item in path.iterdir() if item.name != KEEP_MARKER]
+    return bool(files) and age < settings.S3_RESUME_MAX_AGE * 3600
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
@@ -1,5 +1,4 @@
 import os
-import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv, find_dotenv
@@ -8,8 +7,8 @@ load_dotenv(find_dotenv(filename=os.getenv("ENV_FILE", ".env")))
 
 BASE_DIR = Path(os.path.dirname(os.path.dirname(__file__)))
 SRC_DIR = BASE_DIR / "src"
+# is created by the logging's setup (see `src.run.setup`)
 LOG_DIR = Path(os.getenv("LOG_PATH", BASE_DIR / "logs"))
-LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 SENTRY_DSN = os.getenv("SENTRY_DSN")
@@ -18,23 +17,122 @@ MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
 MYSQL_PORT = os.getenv("MYSQL_PORT", "3306")
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "password")
+MYSQL_DUMP_BIN = os.getenv("MYSQL_DUMP_BIN", "mysqldump")
+MYDUMPER_BIN = os.getenv("MYDUMPER_BIN", "mydumper")
+MYLOADER_BIN = os.getenv("MYLOADER_BIN", "myloader")
+# dump's format: plain (mysqldump) | directory (parallel dump / load via mydumper / myloader)
+MYSQL_DUMP_FORMAT = os.getenv("MYSQL_DUMP_FORMAT", "plain")
+# count of parallel threads for mydumper / myloader (directory format only)
+MYSQL_JOBS = int(os.getenv("MYSQL_JOBS", 4))
 
 PG_USER = os.getenv("PG_USER", "postgres")
 PG_PASSWORD = os.getenv("PG_PASSWORD")
 # common pg_dump's binary or specific /usr/lib/postgresql/{ver}/pg_dump one:
 PG_DUMP_BIN = os.getenv("PG_DUMP_BIN", "pg_dump")
+PG_RESTORE_BIN = os.getenv("PG_RESTORE_BIN", "pg_restore")
+# dump's format: plain (sql) | custom | directory (allows parallel dump via PG_JOBS)
+PG_DUMP_FORMAT = os.getenv("PG_DUMP_FORMAT", "plain")
+# count of parallel jobs for pg_dump (directory format only) and pg_restore
+PG_JOBS = int(os.getenv("PG_JOBS", 1))
 PG_HOST = os.getenv("PG_HOST", "localhost")
 PG_PORT = os.getenv("PG_PORT", "5432")
 
+# commands inside containers (*_CONTAINER handlers): api (Docker Engine API) | cli (docker exec)
+DOCKER_TRANSPORT = os.getenv("DOCKER_TRANSPORT", "api")
+# unix socket of Docker Engine API (DOCKER_HOST=unix://... is used by default)
+DOCKER_SOCKET = os.getenv(
+    "DOCKER_SOCKET", os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock").removeprefix("unix://")
+)
+# timeout (seconds) of Engine API's requests (streams of running commands aren't limited)
+DOCKER_API_TIMEOUT = float(os.getenv("DOCKER_API_TIMEOUT", 60))
+
 S3_REGION_NAME = os.getenv("S3_REGION_NAME")
 S3_STORAGE_URL = os.getenv("S3_STORAGE_URL")
 S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
 S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 S3_PATH = os.getenv("S3_PATH")
+# part's size for multipart uploading (S3 requires at least 5MB for each part except the last)
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", 64 * 1024 * 1024))
+# files bigger than threshold are transferred via multipart upload / ranged GETs
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 64 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 10))
+# max bandwidth (bytes per second) for each transfer (0 - no limit)
+S3_MAX_BANDWIDTH = int(os.getenv("S3_MAX_BANDWIDTH", 0))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))
+# botocore's retry mode: legacy | standard | adaptive
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "adaptive")
+# how often (seconds) transfer's progress is logged
+S3_PROGRESS_INTERVAL = float(os.getenv("S3_PROGRESS_INTERVAL", 10))
 
 LOCAL_PATH = Path(os.getenv("LOCAL_PATH_IN_CONTAINER") or os.getenv("LOCAL_PATH", "./backups"))
-TMP_BACKUP_DIR = Path(tempfile.mkdtemp())
+# TMP_BACKUP_DIR (process's scratch workspace, see `src.scratch`) is created on the first access
+# scratch volumes (comma separated dirs) for jobs' workspaces (system's temp dir by default)
+SCRATCH_DIRS = [
+    Path(path.strip()) for path in os.getenv("SCRATCH_DIRS", "").split(",") if path.strip()
+]
+# free space (bytes) which is kept on each scratch volume
+SCRATCH_RESERVE = int(os.getenv("SCRATCH_RESERVE", 512 * 1024 * 1024))
+# job's required scratch space = estimated dump's size * factor (dump and its compressed copy)
+SCRATCH_SIZE_FACTOR = float(os.getenv("SCRATCH_SIZE_FACTOR", 1.5))
+# no volume fits the dump: stream | fail (backup is streamed without scratch files or fails)
+SCRATCH_FALLBACK = os.getenv("SCRATCH_FALLBACK", "stream")
+# state of interrupted S3 transfers (multipart uploads, partial downloads) for resuming them
+S3_RESUME_DIR = Path(os.getenv("S3_RESUME_DIR", LOCAL_PATH / ".resume"))
+# interrupted uploads older than N hours are aborted instead of resuming
+S3_RESUME_MAX_AGE = float(os.getenv("S3_RESUME_MAX_AGE", 24))
+# local cache of downloaded backups for repeated restores (empty - disabled) and its size's cap
+S3_CACHE_DIR = os.getenv("S3_CACHE_DIR", "")
+S3_CACHE_MAX_SIZE = int(os.getenv("S3_CACHE_MAX_SIZE", 20 * 1024 * 1024 * 1024))
+# default count of concurrent workers (and per DB server limit) for multi-DB backups
+BACKUP_WORKERS = int(os.getenv("BACKUP_WORKERS", 1))
+BACKUP_PER_HOST_LIMIT = int(os.getenv("BACKUP_PER_HOST_LIMIT", 0))
+# count of the last output's lines which are kept for error reports of failed commands
+PROCESS_OUTPUT_TAIL_LINES = int(os.getenv("PROCESS_OUTPUT_TAIL_LINES", 50))
+# compression of backups: gzip (pigz if installed) | zstd | lz4 | none
+COMPRESSION = os.getenv("COMPRESSION", "gzip")
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL")) if os.getenv("COMPRESSION_LEVEL") else None
+COMPRESSION_THREADS = int(os.getenv("COMPRESSION_THREADS", os.cpu_count() or 1))
+# size of chunk which is read from the dump's stream at once (--stream mode)
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 1024 * 1024))
+# max count of chunks which are queued for each destination of streamed backup (slow destination
+# doesn't delay the others till its queue is full)
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 16))
+# checksum of backup's files (hashlib's algorithm: sha256, blake2b, etc.)
+CHECKSUM_ALGORITHM = os.getenv("CHECKSUM_ALGORITHM", "sha256")
+# encryption (AES-GCM): size of plain data in each authenticated frame and PBKDF2's iterations
+ENCRYPT_CHUNK_SIZE = int(os.getenv("ENCRYPT_CHUNK_SIZE", 4 * 1024 * 1024))
+ENCRYPT_KDF_ITERATIONS = int(os.getenv("ENCRYPT_KDF_ITERATIONS", 600_000))
+# run's metrics: JSON report (file or directory) and node_exporter's textfile collector directory
+METRICS_REPORT_PATH = os.getenv("METRICS_REPORT_PATH", "")
+METRICS_TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR", "")
+# deduplicated chunk store (CHUNKS destination): backend (LOCAL | S3) and local directory
+CHUNK_STORE_BACKEND = os.getenv("CHUNK_STORE_BACKEND", "LOCAL")
+CHUNK_STORE_PATH = Path(os.getenv("CHUNK_STORE_PATH", LOCAL_PATH / "chunks"))
+# average / min / max sizes of content-defined chunks
+CHUNK_AVG_SIZE = int(os.getenv("CHUNK_AVG_SIZE", 1024 * 1024))
+CHUNK_MIN_SIZE = int(os.getenv("CHUNK_MIN_SIZE", CHUNK_AVG_SIZE // 4))
+CHUNK_MAX_SIZE = int(os.getenv("CHUNK_MAX_SIZE", CHUNK_AVG_SIZE * 4))
+CHUNK_STORE_COMPRESSION_LEVEL = int(os.getenv("CHUNK_STORE_COMPRESSION_LEVEL", 6))
+CHUNK_STORE_WORKERS = int(os.getenv("CHUNK_STORE_WORKERS", 4))
+# SQLite index of created backups (allows to find backups without scanning of storages)
+CATALOG_PATH = Path(os.getenv("CATALOG_PATH", LOCAL_PATH / "catalog.sqlite3"))
+# attempts to update DB's manifest in S3 bucket (it is changed concurrently by other processes)
+CATALOG_MANIFEST_ATTEMPTS = int(os.getenv("CATALOG_MANIFEST_ATTEMPTS", 5))
+# retention policy (prune command): count of daily / weekly / monthly backups which are kept
+PRUNE_KEEP_DAILY = int(os.getenv("PRUNE_KEEP_DAILY", 7))
+PRUNE_KEEP_WEEKLY = int(os.getenv("PRUNE_KEEP_WEEKLY", 4))
+PRUNE_KEEP_MONTHLY = int(os.getenv("PRUNE_KEEP_MONTHLY", 6))
+# max duration (in seconds) of each backup / restore job (0 - without limit)
+JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", 0))
+# seconds to wait for cancelled job's processes after SIGTERM (then they are killed)
+JOB_CANCEL_TIMEOUT = int(os.getenv("JOB_CANCEL_TIMEOUT", 30))
+# daemon: max random delay (in seconds) of scheduled job's start (spreads jobs on shared DB hosts)
+DAEMON_JITTER = int(os.getenv("DAEMON_JITTER", 0))
+# daemon: JSON file with jobs' status and (optional) HTTP endpoint for it (0 - disabled)
+DAEMON_STATUS_PATH = Path(os.getenv("DAEMON_STATUS_PATH", LOCAL_PATH / "daemon-status.json"))
+DAEMON_STATUS_HOST = os.getenv("DAEMON_STATUS_HOST", "127.0.0.1")
+DAEMON_STATUS_PORT = int(os.getenv("DAEMON_STATUS_PORT", 0))
 
 LOGGING = {
     "version": 1,
@@ -57,3 +155,15 @@ LOGGING = {
 }
 
 DATE_FORMAT = "%Y-%m-%d"
+
+
+def __getattr__(name: str):
+    """Lazy settings: they are calculated on the first access (not at import time)"""
+    if name == "TMP_BACKUP_DIR":
+        from src import scratch  # settings are imported by scratch: it is imported here
+
+        global TMP_BACKUP_DIR  # pylint: disable=global-statement
+        TMP_BACKUP_DIR = scratch.process_workspace().path
+        return TMP_BACKUP_DIR
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,37 @@
+import pytest
+
+from src import s3
+from src.benchmarks.fake_docker import FakeDockerServer
+from src.benchmarks.fake_s3 import FakeS3Server
+
+
+@pytest.fixture
+def fake_s3(monkeypatch, tmp_path):
+    with FakeS3Server() as server:
+        monkeypatch.setattr("src.settings.S3_STORAGE_URL", server.url)
+        monkeypatch.setattr("src.settings.S3_BUCKET_NAME", server.bucket)
+        monkeypatch.setattr("src.settings.S3_ACCESS_KEY_ID", "test")
+        monkeypatch.setattr("src.settings.S3_SECRET_ACCESS_KEY", "test")
+        monkeypatch.setattr("src.settings.S3_REGION_NAME", "us-east-1")
+        monkeypatch.setattr("src.settings.S3_RESUME_DIR", tmp_path / "resume")
+        monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+        monkeypatch.setenv("AWS_RESPONSE_CHECKSUM_VALIDATION", "when_required")
+        monkeypatch.setattr(s3, "transfer_options", s3.TransferOptions(chunk_size=s3.MB))
+        s3.get_client.cache_clear()
+        yield server
+        s3.get_client.cache_clear()
+
+
+@pytest.fixture
+def fake_docker(monkeypatch, tmp_path):
+    from src import docker_api
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    with FakeDockerServer(containers=("postgres",), bin_dir=bin_dir) as server:
+        monkeypatch.setattr("src.settings.DOCKER_SOCKET", server.socket_path)
+        monkeypatch.setattr("src.settings.DOCKER_TRANSPORT", "api")
+        docker_api.get_client.cache_clear()
+        yield server
+        docker_api.get_client().close()
+        docker_api.get_client.cache_clear()
@@ -0,0 +1,59 @@
+import gzip
+
+from src import s3
+from src.benchmarks.run import generate_dump
+from src.benchmarks.startup import measure
+
+
+class TestGenerateDump:
+    def test_size_and_compressibility(self, tmp_path):
+        compressible = generate_dump(tmp_path / "compressible.sql", 1000_000, compressibility=0.9)
+        random = generate_dump(tmp_path / "random.sql", 1000_000, compressibility=0.1)
+
+        assert compressible.stat().st_size == random.stat().st_size == 1000_000
+        ratio = len(gzip.compress(compressible.read_bytes())) / 1000_000
+        assert ratio < len(gzip.compress(random.read_bytes())) / 1000_000
+
+
+class TestFakeS3Server:
+    def test_transfers_via_s3_module(self, fake_s3, tmp_path):
+        source_path = tmp_path / "backup.sql.gz"
+        source_path.write_bytes(b"backup" * 1000_000)
+
+        key = s3.upload_file("test-db", source_path, key="backups/backup.sql.gz")
+        assert fake_s3.objects[key] == source_path.read_bytes()
+
+        uploader = s3.MultipartUploader("test-db", key="backups/streamed.sql.gz")
+        uploader.write(b"x" * (6 * s3.MB))
+        uploader.complete()
+        assert len(fake_s3.objects["backups/streamed.sql.gz"]) == 6 * s3.MB
+
+        result_path = s3.download_file("test-db", key, tmp_path / "downloaded")
+        assert result_path.read_bytes() == source_path.read_bytes()
+        assert b"".join(s3.iter_object("test-db", key)) == source_path.read_bytes()
+
+        assert sorted(obj["Key"] for obj in s3.list_objects("backups/")) == [
+            "backups/backup.sql.gz",
+            "backups/streamed.sql.gz",
+        ]
+        assert s3.delete_objects([key]) == [key]
+        assert list(fake_s3.objects) == ["backups/streamed.sql.gz"]
+
+
+class TestStartup:
+    def test_help_skips_heavy_imports(self):
+        result = measure(("--help",), repeat=1)
+        imported = {item.name for item in result.imports}
+
+        assert not result.heavy_imports
+        # commands' modules aren't imported for the list of commands
+        assert "src.commands.backup" not in imported
+        assert {"asyncio", "sqlite3"}.isdisjoint(imported)
+
+    def test_command_defers_jobs(self):
+        result = measure(("prune", "--help"), repeat=1)
+        imported = {item.name for item in result.imports}
+
+        assert not result.heavy_imports
+        assert "src.commands.prune" in imported
+        assert {"asyncio", "src.jobs"}.isdisjoint(imported)
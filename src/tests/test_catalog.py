@@ -0,0 +1,122 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from src import catalog
+from src.catalog import Catalog, CatalogEntry
+from src.constants import BackupLocation
+from src.utils import find_local_backup
+
+
+def make_entry(db_name: str, created_at: str, location=BackupLocation.LOCAL, **kwargs):
+    created_at = datetime.datetime.fromisoformat(created_at)
+    return CatalogEntry(
+        db_name=db_name,
+        created_at=created_at,
+        location=location,
+        path=kwargs.pop("path", f"/backups/{created_at:%Y-%m-%d-%H%M%S}.{db_name}.backup.sql.gz"),
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def backup_catalog(tmp_path: Path, monkeypatch) -> Catalog:
+    monkeypatch.setattr("src.settings.CATALOG_PATH", tmp_path / "catalog.sqlite3")
+    catalog.get_catalog.cache_clear()
+    yield catalog.get_catalog()
+    catalog.get_catalog.cache_clear()
+
+
+class TestCatalog:
+    def test_latest_backup_by_location_and_date(self, backup_catalog):
+        backup_catalog.add(
+            make_entry("db1", "2024-02-21T06:00:00"),
+            make_entry("db1", "2024-02-21T18:00:00"),
+            make_entry("db1", "2024-02-22T06:00:00"),
+            make_entry("db1", "2024-02-23T06:00:00", location=BackupLocation.S3, path="key"),
+            make_entry("db2", "2024-02-24T06:00:00"),
+        )
+        assert backup_catalog.latest("db1").location == BackupLocation.S3
+        assert backup_catalog.latest("db1", location=BackupLocation.LOCAL).created_at == (
+            datetime.datetime(2024, 2, 22, 6)
+        )
+        found = backup_catalog.latest("db1", date=datetime.date(2024, 2, 21))
+        assert found.created_at == datetime.datetime(2024, 2, 21, 18)
+        assert backup_catalog.latest("db1", date=datetime.date(2024, 2, 20)) is None
+
+    def test_list_filters_and_orders_entries(self, backup_catalog):
+        backup_catalog.add(
+            make_entry("db1", "2024-02-21T06:00:00", size=10, encrypted=True, checksum="abc"),
+            make_entry("db1", "2024-02-22T06:00:00", compression="zstd"),
+            make_entry("db2", "2024-02-22T07:00:00"),
+        )
+        entries = backup_catalog.list(db_name="db1")
+        assert [entry.created_at.day for entry in entries] == [22, 21]
+        assert entries[0].compression == "zstd"
+        assert (entries[1].size, entries[1].encrypted, entries[1].checksum) == (10, True, "abc")
+        assert len(backup_catalog.list(limit=2)) == 2
+
+    def test_same_path_is_replaced(self, backup_catalog):
+        backup_catalog.add(make_entry("db1", "2024-02-21T06:00:00", size=1))
+        backup_catalog.add(make_entry("db1", "2024-02-21T06:00:00", size=2))
+        assert [entry.size for entry in backup_catalog.list()] == [2]
+
+
+class TestLocalFileSearch:
+    def test_registered_backup_is_found_without_scanning(self, tmp_path, backup_catalog):
+        backup_path = tmp_path / "other-dir" / "2024-02-21-060000.db1.backup.sql.gz"
+        backup_path.parent.mkdir()
+        backup_path.write_bytes(b"backup")
+        catalog.register_backup(
+            "db1", backup_path.name, targets={BackupLocation.LOCAL: str(backup_path)}
+        )
+
+        result_path = find_local_backup("db1", datetime.date(2024, 2, 21), directory=tmp_path)
+        # backup is restored in place (without copying)
+        assert result_path == backup_path
+
+    def test_falls_back_to_scanning(self, tmp_path, backup_catalog):
+        backup_catalog.add(make_entry("db1", "2024-02-21T06:00:00", path="/not-existing"))
+        (tmp_path / "2024-02-21-070000.db1.backup.sql.gz").write_bytes(b"scanned")
+
+        result_path = find_local_backup("db1", datetime.date(2024, 2, 21), directory=tmp_path)
+        assert result_path.read_bytes() == b"scanned"
+
+
+class TestS3Manifest:
+    def test_entries_are_added_and_removed(self, fake_s3):
+        first = make_entry("db1", "2024-02-21T06:00:00", location=BackupLocation.S3)
+        second = make_entry("db1", "2024-02-22T06:00:00", location=BackupLocation.S3)
+        catalog.push_s3_manifest("db1", [first])
+        catalog.push_s3_manifest("db1", [second], removed_paths=[first.path])
+        assert catalog.pull_s3_manifest("db1") == [second]
+
+    def test_concurrent_update_isnt_lost(self, fake_s3, monkeypatch):
+        ours = make_entry("db1", "2024-02-21T06:00:00", location=BackupLocation.S3)
+        theirs = make_entry("db1", "2024-02-22T06:00:00", location=BackupLocation.S3)
+        read_manifest, reads = catalog._read_s3_manifest, []
+
+        def read_and_race(db_name):
+            result = read_manifest(db_name)
+            reads.append(result)
+            if len(reads) == 1:
+                # another process updates the manifest between our reading and writing
+                catalog.push_s3_manifest(db_name, [theirs])
+
+            return result
+
+        monkeypatch.setattr(catalog, "_read_s3_manifest", read_and_race)
+        catalog.push_s3_manifest("db1", [ours])
+        # the first attempt is rejected (manifest is created concurrently), then it is retried
+        assert [etag is None for _, etag in reads] == [True, True, False]
+        assert catalog.pull_s3_manifest("db1") == [ours, theirs]
+
+    def test_attempts_are_limited(self, fake_s3, monkeypatch):
+        monkeypatch.setattr("src.settings.CATALOG_MANIFEST_ATTEMPTS", 2)
+        entry = make_entry("db1", "2024-02-21T06:00:00", location=BackupLocation.S3)
+        catalog.push_s3_manifest("db1", [])
+        # manifest's ETag is always stale
+        monkeypatch.setattr(catalog, "_read_s3_manifest", lambda _: ([], '"stale"'))
+        with pytest.raises(Exception, match="PreconditionFailed"):
+            catalog.push_s3_manifest("db1", [entry])
@@ -0,0 +1,156 @@
+import datetime
+import random
+import zlib
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from src.chunkstore import (
+    ChunkStore,
+    ChunkStoreSink,
+    ContentDefinedChunker,
+    LocalChunkBackend,
+    Manifest,
+    S3ChunkBackend,
+)
+from src.commands.backup import cli as backup_cli
+from src.exceptions import RestoreBackupError
+
+
+def make_dump(rows: range, changed_row: int | None = None) -> bytes:
+    lines = [b"-- PostgreSQL database dump\n"]
+    for row in rows:
+        value = "changed" if row == changed_row else f"value-{row}"
+        lines.append(f"INSERT INTO t VALUES ({row}, '{value}');\n".encode())
+
+    return b"".join(lines)
+
+
+def chunk(data: bytes, chunker: ContentDefinedChunker, feed_size: int = 1000) -> list[bytes]:
+    chunks = []
+    for start in range(0, len(data), feed_size):
+        chunks.extend(chunker.feed(data[start : start + feed_size]))
+
+    chunks.extend(chunker.flush())
+    return chunks
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> ChunkStore:
+    return ChunkStore(LocalChunkBackend(tmp_path / "store"))
+
+
+def backup(store: ChunkStore, data: bytes, filename: str) -> Manifest:
+    sink = ChunkStoreSink("test-db", filename=filename, store=store, dump_extension="sql")
+    for start in range(0, len(data), 4096):
+        sink.write(data[start : start + 4096])
+
+    sink.close()
+    return sink.manifest
+
+
+class TestContentDefinedChunker:
+    def test_chunks_are_joined_to_source_data(self):
+        data = make_dump(range(5000))
+        chunks = chunk(data, ContentDefinedChunker(avg_size=4096))
+        assert b"".join(chunks) == data
+        assert len(chunks) > 10
+
+    def test_boundaries_do_not_depend_on_feed_size(self):
+        data = make_dump(range(5000))
+        assert chunk(data, ContentDefinedChunker(avg_size=4096), feed_size=100) == chunk(
+            data, ContentDefinedChunker(avg_size=4096), feed_size=7777
+        )
+
+    def test_changed_row_changes_only_nearby_chunks(self):
+        chunks = chunk(make_dump(range(5000)), ContentDefinedChunker(avg_size=4096))
+        changed_chunks = chunk(
+            make_dump(range(5000), changed_row=2500), ContentDefinedChunker(avg_size=4096)
+        )
+        assert len(set(changed_chunks) - set(chunks)) <= 2
+
+    def test_long_lines_are_cut_by_max_size(self):
+        data = random.Random(1).randbytes(50_000).replace(b"\n", b" ")
+        chunks = chunk(data, ContentDefinedChunker(avg_size=1024, max_size=4096))
+        assert b"".join(chunks) == data
+        assert max(len(content_chunk) for content_chunk in chunks) <= 4096
+
+
+class TestChunkStore:
+    def test_backup_restore_roundtrip(self, tmp_path, store):
+        data = make_dump(range(5000))
+        backup(store, data, filename="2024-01-02-000000.test-db.backup")
+
+        manifest = store.find_manifest("test-db", datetime.date(2024, 1, 2))
+        restored_path = store.restore_to_file(manifest, tmp_path / "restored.sql")
+        assert restored_path.read_bytes() == data
+
+    def test_unchanged_chunks_are_not_stored_again(self, store, monkeypatch):
+        monkeypatch.setattr("src.settings.CHUNK_AVG_SIZE", 4096)
+        monkeypatch.setattr("src.settings.CHUNK_MIN_SIZE", 1024)
+        monkeypatch.setattr("src.settings.CHUNK_MAX_SIZE", 16384)
+        first = backup(store, make_dump(range(5000)), filename="2024-01-01-000000.test-db.backup")
+        second = backup(
+            store,
+            make_dump(range(5000), changed_row=100),
+            filename="2024-01-02-000000.test-db.backup",
+        )
+        assert first.new_chunks == len(first.chunks)
+        assert 0 < second.new_chunks <= 2
+
+    def test_latest_manifest_for_date_is_found(self, store):
+        backup(store, b"first\n", filename="2024-01-02-000000.test-db.backup")
+        backup(store, b"second\n", filename="2024-01-02-120000.test-db.backup")
+        backup(store, b"other\n", filename="2024-01-02-130000.test-db-2.backup")
+
+        manifest = store.find_manifest("test-db", datetime.date(2024, 1, 2))
+        assert manifest.backup_name == "2024-01-02-120000.test-db.backup"
+        with pytest.raises(RestoreBackupError):
+            store.find_manifest("test-db", datetime.date(2024, 1, 3))
+
+    def test_corrupted_chunk_is_detected(self, tmp_path, store):
+        manifest = backup(store, b"data\n", filename="2024-01-02-000000.test-db.backup")
+        chunk_hash, _ = manifest.chunks[0]
+        store.backend.put(store.chunk_key(chunk_hash), zlib.compress(b"broken\n"))
+
+        with pytest.raises(RestoreBackupError):
+            store.restore_to_file(manifest, tmp_path / "restored.sql")
+
+    def test_storing_error_is_raised(self, store, monkeypatch):
+        def broken_put(key: str, data: bytes) -> None:
+            raise OSError("disk is full")
+
+        monkeypatch.setattr(store.backend, "put", broken_put)
+        with pytest.raises(OSError, match="disk is full"):
+            backup(store, make_dump(range(5000)), filename="2024-01-02-000000.test-db.backup")
+
+    def test_s3_store_checks_only_written_chunks(self, fake_s3, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.CHUNK_AVG_SIZE", 4096)
+        monkeypatch.setattr("src.settings.CHUNK_MIN_SIZE", 1024)
+        monkeypatch.setattr("src.settings.CHUNK_MAX_SIZE", 16384)
+        fake_s3.objects["chunk-store/chunks/00/unrelated"] = b"chunk of another backup"
+
+        def forbidden_list(prefix: str) -> list[str]:
+            raise AssertionError(f"{prefix} is listed")
+
+        data = make_dump(range(5000))
+        first_store = ChunkStore(S3ChunkBackend(prefix="chunk-store"))
+        monkeypatch.setattr(first_store.backend, "list", forbidden_list)
+        first = backup(first_store, data, filename="2024-01-01-000000.test-db.backup")
+        # chunks which are stored by another process (instance) are found by HEAD requests
+        second_store = ChunkStore(S3ChunkBackend(prefix="chunk-store"))
+        monkeypatch.setattr(second_store.backend, "list", forbidden_list)
+        second = backup(second_store, data, filename="2024-01-02-000000.test-db.backup")
+        assert first.new_chunks == len(first.chunks) > 1
+        assert second.new_chunks == 0
+        assert Manifest.loads(second_store.backend.get(second.key)).chunks == first.chunks
+
+
+class TestBackupCommand:
+    def test_encryption_is_rejected_before_dump(self, monkeypatch):
+        monkeypatch.setattr("src.jobs.run_jobs", lambda *args: pytest.fail("dump is started"))
+        args = ["app", "--from", "PG", "--to", "CHUNKS", "--encrypt"]
+        result = CliRunner().invoke(backup_cli, args)
+        assert result.exit_code == 1
+        assert "doesn't support '--encrypt'" in result.output
@@ -0,0 +1,106 @@
+import gzip
+import shutil
+import tarfile
+import dataclasses
+from pathlib import Path
+
+import pytest
+
+from src.compression import CODECS, compress_path, decompress_path, detect_file_codec
+from src.constants import Compression
+from src.process import ProcessError
+
+DUMP_CONTENT = b"-- PostgreSQL database dump\n" + b"INSERT INTO t VALUES (1);\n" * 1000
+
+
+def codec_params() -> list:
+    return [
+        pytest.param(
+            compression,
+            marks=pytest.mark.skipif(
+                not shutil.which(CODECS[compression].compress_command()[0]),
+                reason=f"{compression} isn't installed",
+            ),
+        )
+        for compression in Compression
+    ]
+
+
+@pytest.fixture
+def dump_file(tmp_path: Path) -> Path:
+    dump_path = tmp_path / "test-db.backup.sql"
+    dump_path.write_bytes(DUMP_CONTENT)
+    return dump_path
+
+
+class TestCompressDecompress:
+    @pytest.mark.parametrize("compression", codec_params())
+    def test_file_roundtrip_detects_codec_by_magic_bytes(self, tmp_path, dump_file, compression):
+        codec = CODECS[compression]
+        # extension doesn't matter for detection
+        compressed_path = compress_path(dump_file, tmp_path / "backup.bin", codec=codec)
+        assert detect_file_codec(compressed_path).name == compression
+
+        restore_dir = tmp_path / "restore"
+        restore_dir.mkdir()
+        result_path = decompress_path(compressed_path, restore_dir, dump_name="test-db.sql")
+        assert result_path.read_bytes() == DUMP_CONTENT
+
+    @pytest.mark.parametrize("compression", codec_params())
+    def test_directory_roundtrip(self, tmp_path, compression):
+        dump_dir = tmp_path / "test-db.backup.dir"
+        dump_dir.mkdir()
+        (dump_dir / "toc.dat").write_bytes(b"PGDMP")
+        (dump_dir / "3001.dat").write_bytes(DUMP_CONTENT)
+
+        compressed_path = compress_path(
+            dump_dir, tmp_path / "backup.tar", codec=CODECS[compression]
+        )
+        shutil.rmtree(dump_dir)
+
+        result_path = decompress_path(compressed_path, tmp_path, dump_name="unused")
+        assert result_path.name == "test-db.backup.dir"
+        assert (result_path / "3001.dat").read_bytes() == DUMP_CONTENT
+
+    def test_legacy_tar_gz_archive(self, tmp_path, dump_file):
+        archive_path = tmp_path / "2024-01-01-000000.test-db.backup.tar.gz"
+        with tarfile.open(archive_path, "w:gz") as archive:
+            archive.add(dump_file, arcname=dump_file.name)
+
+        restore_dir = tmp_path / "restore"
+        restore_dir.mkdir()
+        result_path = decompress_path(archive_path, restore_dir, dump_name="unused")
+        assert result_path.name == "test-db.backup.sql"
+        assert result_path.read_bytes() == DUMP_CONTENT
+
+    def test_uncompressed_file_is_returned_as_is(self, tmp_path, dump_file):
+        assert decompress_path(dump_file, tmp_path, dump_name="unused") == dump_file
+
+    def test_lines_are_consumed_while_file_is_compressed(self, tmp_path, dump_file):
+        lines = []
+        compressed_path = compress_path(
+            dump_file,
+            tmp_path / "backup.gz",
+            codec=CODECS[Compression.GZIP],
+            lines_consumer=lines.extend,
+        )
+        assert b"".join(lines) == DUMP_CONTENT
+        assert gzip.decompress(compressed_path.read_bytes()) == DUMP_CONTENT
+
+    def test_failed_lines_consumer(self, tmp_path, dump_file):
+        def consumer(lines):
+            next(lines)
+            raise ValueError("broken TOC")
+
+        with pytest.raises(ValueError, match="broken TOC"):
+            compress_path(
+                dump_file,
+                tmp_path / "backup.gz",
+                codec=CODECS[Compression.GZIP],
+                lines_consumer=consumer,
+            )
+
+    def test_failed_compression__lines_consumer(self, tmp_path, dump_file):
+        codec = dataclasses.replace(CODECS[Compression.GZIP], compress_args=lambda *_: ["false"])
+        with pytest.raises(ProcessError):
+            compress_path(dump_file, tmp_path / "backup.gz", codec=codec, lines_consumer=list)
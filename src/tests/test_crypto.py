@@ -0,0 +1,100 @@
+import subprocess
+
+import pytest
+
+from src import crypto
+from src.crypto import StreamDecryptor, StreamEncryptor
+from src.exceptions import EncryptBackupError
+from src.utils import decrypt_file, encrypt_file
+
+DATA = b"INSERT INTO t VALUES (1);\n" * 1000
+
+
+def encrypt(data: bytes, chunk_size: int = 1000) -> bytes:
+    encryptor = StreamEncryptor(password="test-password", chunk_size=chunk_size)
+    return encryptor.update(data) + encryptor.finalize()
+
+
+def decrypt(data: bytes, password: str = "test-password", read_size: int = 333) -> bytes:
+    decryptor = StreamDecryptor(password=password)
+    result = b"".join(
+        decryptor.update(data[start : start + read_size])
+        for start in range(0, len(data), read_size)
+    )
+    decryptor.finalize()
+    return result
+
+
+@pytest.fixture
+def encrypt_pass(monkeypatch) -> str:
+    monkeypatch.setenv("ENCRYPT_PASS", "test-password")
+    return "test-password"
+
+
+class TestStreamEncryption:
+    @pytest.mark.parametrize("data", [b"", b"x", DATA, DATA[:3000]])
+    def test_encrypt_decrypt(self, data):
+        encrypted = encrypt(data)
+        assert encrypted.startswith(crypto.MAGIC)
+        assert decrypt(encrypted) == data
+
+    def test_master_key_is_derived_once(self):
+        crypto.derive_master_key.cache_clear()
+        decrypt(encrypt(DATA))
+        decrypt(encrypt(DATA))
+        assert crypto.derive_master_key.cache_info().misses == 1
+
+    def test_wrong_password(self):
+        with pytest.raises(EncryptBackupError, match="wrong ENCRYPT_PASS"):
+            decrypt(encrypt(DATA), password="wrong-password")
+
+    def test_corrupted_frame_is_detected_early(self):
+        encrypted = bytearray(encrypt(DATA))
+        encrypted[crypto.HEADER_SIZE + crypto.FRAME_HEADER_SIZE + 10] ^= 0xFF
+        decryptor = StreamDecryptor(password="test-password")
+        with pytest.raises(EncryptBackupError, match="frame #0"):
+            decryptor.update(bytes(encrypted[:2000]))
+
+    @pytest.mark.parametrize("tail", [-1, -1000, -1017])
+    def test_truncated_data(self, tail):
+        with pytest.raises(EncryptBackupError):
+            decrypt(encrypt(DATA)[:tail])
+
+    def test_dropped_frame(self):
+        encrypted = encrypt(DATA)
+        frame_size = crypto.FRAME_HEADER_SIZE + 1000 + crypto.TAG_SIZE
+        start = crypto.HEADER_SIZE
+        with pytest.raises(EncryptBackupError):
+            decrypt(encrypted[:start] + encrypted[start + frame_size :])
+
+
+class TestEncryptFile:
+    def test_encrypt_decrypt_file(self, tmp_path, encrypt_pass):
+        file_path = tmp_path / "backup.sql.gz"
+        file_path.write_bytes(DATA)
+
+        encrypted_path = encrypt_file("test-db", file_path)
+        assert encrypted_path.name == "backup.sql.gz.enc"
+        assert not file_path.exists()
+        assert decrypt_file("test-db", encrypted_path).read_bytes() == DATA
+
+    def test_legacy_file_is_decrypted_by_openssl(self, tmp_path, encrypt_pass):
+        encrypted_path = tmp_path / "backup.sql.gz.enc"
+        subprocess.run(
+            [
+                *("openssl", "enc", "-aes-256-cbc", "-e", "-pbkdf2", "-pass", "env:ENCRYPT_PASS"),
+                *("-out", str(encrypted_path)),
+            ],
+            input=DATA,
+            check=True,
+        )
+        assert decrypt_file("test-db", encrypted_path).read_bytes() == DATA
+
+    def test_corrupted_file(self, tmp_path, encrypt_pass):
+        encrypted_path = tmp_path / "backup.sql.gz.enc"
+        encrypted_path.write_bytes(encrypt(DATA)[:-1])
+
+        with pytest.raises(EncryptBackupError):
+            decrypt_file("test-db", encrypted_path)
+
+        assert not (tmp_path / "backup.sql.gz").exists()
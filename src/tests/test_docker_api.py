@@ -0,0 +1,157 @@
+import os
+import gzip
+import time
+import signal
+import threading
+
+import pytest
+
+from src import docker_api, handlers
+from src.process import ContainerCommand, ProcessError, run_command
+
+DUMP = b"CREATE TABLE test (id INT);\n" + bytes(range(256)) * 4096
+
+
+@pytest.fixture
+def pg_bin(fake_docker, tmp_path):
+    """Fake pg_dump / psql in the container (psql writes its stdin to `restored.sql`)"""
+    (tmp_path / "dump.sql").write_bytes(DUMP)
+    scripts = {
+        "pg_dump": f'#!/bin/sh\nexec cat "{tmp_path / "dump.sql"}"\n',
+        "psql": (
+            "#!/bin/sh\n"
+            'case "$*" in *"-c SELECT 1"*) echo 1; exit 0;; *"-c "*) exit 0;; esac\n'
+            f'exec cat > "{tmp_path / "restored.sql"}"\n'
+        ),
+    }
+    for name, content in scripts.items():
+        path = fake_docker.bin_dir / name
+        path.write_text(content)
+        path.chmod(0o755)
+
+    return tmp_path
+
+
+class TestExecProcess:
+    def test_output(self, fake_docker):
+        command = ContainerCommand("postgres", ["sh", "-c", "echo test; echo warning >&2"])
+        assert command == ["docker", "exec", "-i", "postgres", "sh", "-c", command.argv[-1]]
+
+        result = run_command(command)
+        assert (result.stdout, result.returncode) == ("test", 0)
+        assert result.stderr_tail == ["warning"]
+        assert fake_docker.commands == [command.argv]
+
+    def test_binary_stdin_and_stdout(self, fake_docker, tmp_path):
+        (tmp_path / "input").write_bytes(DUMP)
+        run_command(
+            ContainerCommand("postgres", ["cat"]),
+            stdin_path=tmp_path / "input",
+            stdout_path=tmp_path / "output",
+        )
+        assert (tmp_path / "output").read_bytes() == DUMP
+
+    def test_exit_code(self, fake_docker):
+        with pytest.raises(ProcessError) as exc_info:
+            run_command(ContainerCommand("postgres", ["sh", "-c", "exit 3"]))
+
+        assert exc_info.value.returncode == 3
+
+    def test_unknown_container(self, fake_docker):
+        with pytest.raises(ProcessError, match="Couldn't run"):
+            run_command(ContainerCommand("unknown", ["true"]))
+
+    def test_connections_are_reused(self, fake_docker):
+        for _ in range(3):
+            run_command(ContainerCommand("postgres", ["true"]))
+
+        client = docker_api.get_client()
+        # create / inspect requests share keep-alive connection, each exec's stream has its own
+        assert client.connections_count == fake_docker.connections_count == 4
+
+    def test_kill(self, fake_docker):
+        process = docker_api.ExecProcess(
+            ContainerCommand("postgres", ["sh", "-c", "while true; do echo y; done"])
+        )
+        assert process.stdout.read(2) == b"y\n"
+        threading.Timer(0.1, process.kill).start()
+        # stream is closed: the rest of output is read till EOF
+        process.stdout.read()
+        assert process.wait(timeout=5) < 0
+        process.stdout.close()
+        process.stderr.close()
+
+    def test_terminate__command_gets_sigterm(self, fake_docker, tmp_path):
+        script = 'trap "echo terminated > $0; exit 143" TERM; while :; do sleep 0.05; done'
+        process = docker_api.ExecProcess(
+            ContainerCommand("postgres", ["sh", "-c", script, str(tmp_path / "signal")])
+        )
+        process.terminate()
+        # the command's own exit code or the one of killed session
+        assert process.wait(timeout=5) in (143, -signal.SIGKILL)
+        process.stdout.close()
+        process.stderr.close()
+        assert fake_docker.commands[-1][:2] == ["sh", "-c"]
+        assert fake_docker.commands[-1][-2:] == ["TERM", process._marker]
+        for _ in range(50):
+            if (tmp_path / "signal").exists():
+                break
+
+            time.sleep(0.1)
+
+        assert (tmp_path / "signal").read_text() == "terminated\n"
+        state = fake_docker.execs[process.exec_id]
+        assert (state["running"], state["exit_code"]) == (False, 143)
+
+    def test_terminate__ignored_sigterm_is_escalated(self, fake_docker, monkeypatch):
+        monkeypatch.setattr("src.settings.JOB_CANCEL_TIMEOUT", 0.2)
+        script = 'trap "" TERM; while :; do sleep 0.05; done'
+        process = docker_api.ExecProcess(ContainerCommand("postgres", ["sh", "-c", script]))
+        process.terminate()
+        assert process.wait(timeout=5) < 0
+        process.stdout.close()
+        process.stderr.close()
+        state = fake_docker.execs[process.exec_id]
+        for _ in range(50):
+            if not state["running"]:
+                break
+
+            time.sleep(0.1)
+
+        assert state["exit_code"] == -signal.SIGKILL
+        assert [command[-2] for command in fake_docker.commands[1:]] == ["TERM", "KILL"]
+
+
+class TestPGDockerHandler:
+    @pytest.fixture(autouse=True)
+    def tmp_backup_dir(self, monkeypatch, tmp_path):
+        monkeypatch.setattr("src.settings.TMP_BACKUP_DIR", tmp_path / "backups")
+        (tmp_path / "backups").mkdir()
+
+    def test_backup(self, pg_bin, fake_docker):
+        handler = handlers.PGDockerHandler("test-db", container_name="postgres")
+        backup_path = handler.backup()
+
+        assert gzip.decompress(backup_path.read_bytes()) == DUMP
+        # dump is streamed from pg_dump's stdout (without temp files and `docker cp`)
+        assert fake_docker.commands == [["pg_dump", "-d", "test-db", "-U", "postgres"]]
+
+    def test_restore_stream(self, pg_bin, fake_docker, monkeypatch):
+        monkeypatch.setattr(handlers.click, "confirm", lambda _: True)
+        handler = handlers.PGDockerHandler("test-db", container_name="postgres")
+        compressed = gzip.compress(DUMP)
+        handler.restore_stream(compressed[i : i + 1000] for i in range(0, len(compressed), 1000))
+
+        assert (pg_bin / "restored.sql").read_bytes() == DUMP
+        assert [command[-1] for command in fake_docker.commands[:3]] == [
+            "SELECT 1 FROM pg_database WHERE datname = 'test-db'",
+            "DROP DATABASE IF EXISTS test-db",
+            "CREATE DATABASE test-db",
+        ]
+
+    def test_cli_transport(self, monkeypatch):
+        monkeypatch.setattr("src.settings.DOCKER_TRANSPORT", "cli")
+        command = handlers.PGDockerHandler("test-db", container_name="postgres")._dump_command()
+        assert type(command) is list
+        assert command[:4] == ["docker", "exec", "-i", "postgres"]
+        assert os.path.basename(command[4]) == "pg_dump"
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from src import download_cache, s3, settings
+
+KEY = "backups/2024-02-21-065213.test-db.backup.sql.gz"
+DATA = bytes(range(256)) * 1024
+
+
+@pytest.fixture
+def cache(fake_s3, tmp_path) -> download_cache.DownloadCache:
+    fake_s3.objects[KEY] = DATA
+    return download_cache.DownloadCache(tmp_path / "cache", max_size=len(DATA) * 5 // 2)
+
+
+@pytest.fixture
+def get_calls(fake_s3, monkeypatch) -> list[dict]:
+    """Records GET requests of objects' data"""
+    client = s3.get_client()
+    method = client.get_object
+    calls = []
+
+    def wrapper(**params):
+        calls.append(params)
+        return method(**params)
+
+    monkeypatch.setattr(client, "get_object", wrapper)
+    return calls
+
+
+def entries(cache: download_cache.DownloadCache) -> list[str]:
+    return sorted(path.name for path, _ in cache._entries())
+
+
+class TestDownloadCache:
+    def test_hit_skips_download(self, cache, get_calls, tmp_path):
+        first = cache.fetch("test-db", KEY, tmp_path / "first.sql.gz")
+        assert first.read_bytes() == DATA
+        assert get_calls
+
+        get_calls.clear()
+        second = cache.fetch("test-db", KEY, tmp_path / "second.sql.gz")
+        assert second.read_bytes() == DATA
+        assert not get_calls
+        # restored file is a hard link of the cached entry (without copying)
+        (entry,) = entries(cache)
+        assert second.stat().st_ino == (cache.directory / entry).stat().st_ino
+
+    def test_changed_object(self, cache, fake_s3, tmp_path):
+        cache.fetch("test-db", KEY, tmp_path / "first.sql.gz")
+        (stale_entry,) = entries(cache)
+
+        fake_s3.objects[KEY] = DATA[::-1]
+        result = cache.fetch("test-db", KEY, tmp_path / "second.sql.gz")
+        assert result.read_bytes() == DATA[::-1]
+        # new ETag: previous version's entry is removed
+        (entry,) = entries(cache)
+        assert entry != stale_entry
+        assert (tmp_path / "first.sql.gz").read_bytes() == DATA
+
+    def test_lru_eviction(self, cache, fake_s3, tmp_path):
+        keys = [f"backups/{name}.backup.sql.gz" for name in ("a", "b", "c")]
+        for key in keys:
+            fake_s3.objects[key] = DATA + key.encode()
+
+        cache.fetch("test-db", keys[0], tmp_path / "a")
+        cache.fetch("test-db", keys[1], tmp_path / "b")
+        os.utime(cache.entry_path(keys[0], _etag(keys[0])), (0, 0))
+        os.utime(cache.entry_path(keys[1], _etag(keys[1])), (1, 1))
+        # "a" is used again: "b" is the least recently used one
+        cache.fetch("test-db", keys[0], tmp_path / "a")
+        cache.fetch("test-db", keys[2], tmp_path / "c")
+
+        assert entries(cache) == sorted(
+            cache.entry_path(key, _etag(key)).name for key in (keys[0], keys[2])
+        )
+
+    def test_locked_entry_is_not_evicted(self, cache, tmp_path):
+        cache.fetch("test-db", KEY, tmp_path / "first.sql.gz")
+        entry = cache.directory / entries(cache)[0]
+        cache.max_size = 0
+
+        # the entry is used by another process
+        with download_cache.file_lock(download_cache._lock_path(entry)):
+            assert not cache.evict()
+
+        assert cache.evict() == [entry]
+        assert not list(cache.directory.glob("*-*"))
+
+    def test_too_big_object_is_not_cached(self, cache, tmp_path):
+        cache.max_size = len(DATA) - 1
+        assert cache.fetch("test-db", KEY, tmp_path / "backup.sql.gz").read_bytes() == DATA
+        assert not cache.directory.exists()
+
+
+def _etag(key: str) -> str:
+    return s3.get_client().head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)["ETag"]
@@ -0,0 +1,50 @@
+import pytest
+
+from src import fanout
+from src.constants import BackupLocation
+
+
+@pytest.fixture
+def backup_path(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.settings.LOCAL_PATH", tmp_path / "local")
+    path = tmp_path / "tmp" / "2024-01-01-120000.test-db.backup.sql.gz"
+    path.parent.mkdir()
+    path.write_bytes(b"backup" * 100_000)
+    return path
+
+
+class TestFanOut:
+    def test_all_destinations(self, fake_s3, backup_path, tmp_path):
+        result = fanout.fan_out(
+            "test-db",
+            backup_path,
+            destination=(BackupLocation.LOCAL, BackupLocation.FILE, BackupLocation.S3),
+            destination_file=str(tmp_path / "file"),
+            metadata={"checksum": "abc"},
+        )
+
+        assert not result.errors
+        assert result.targets == {
+            BackupLocation.LOCAL: str(tmp_path / "local" / backup_path.name),
+            BackupLocation.FILE: str(tmp_path / "file" / backup_path.name),
+            BackupLocation.S3: backup_path.name,
+        }
+        assert (tmp_path / "local" / backup_path.name).read_bytes() == backup_path.read_bytes()
+        assert (tmp_path / "file" / backup_path.name).read_bytes() == backup_path.read_bytes()
+        assert fake_s3.objects[backup_path.name] == backup_path.read_bytes()
+        assert fake_s3.metadata[backup_path.name] == {"checksum": "abc"}
+
+    def test_failed_destination_is_isolated(self, backup_path, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.S3_STORAGE_URL", "")
+        result = fanout.fan_out(
+            "test-db",
+            backup_path,
+            destination=(BackupLocation.LOCAL, BackupLocation.FILE, BackupLocation.S3),
+            destination_file="",
+        )
+
+        assert result.targets == {
+            BackupLocation.LOCAL: str(tmp_path / "local" / backup_path.name),
+        }
+        assert set(result.errors) == {BackupLocation.FILE, BackupLocation.S3}
+        assert (tmp_path / "local" / backup_path.name).read_bytes() == backup_path.read_bytes()
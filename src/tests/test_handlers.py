@@ -0,0 +1,168 @@
+import os
+import stat
+
+import pytest
+
+from src import handlers
+from src.exceptions import BackupError
+
+
+@pytest.fixture
+def calls(monkeypatch) -> list[dict]:
+    """Records commands which are called by handlers (DB exists for `SELECT 1 ...` queries)"""
+    calls = []
+
+    def call_with_logging(command, **kwargs):
+        defaults_file = next(
+            (arg for arg in map(str, command) if arg.startswith("--defaults-file=")), None
+        )
+        if defaults_file:
+            path = defaults_file.removeprefix("--defaults-file=")
+            kwargs["defaults"] = (open(path).read(), stat.S_IMODE(os.stat(path).st_mode))
+
+        calls.append({"command": list(command), **kwargs})
+        return "1\n" if any("SELECT 1" in str(arg) for arg in command) else ""
+
+    monkeypatch.setattr(handlers, "call_with_logging", call_with_logging)
+    monkeypatch.setattr(handlers.click, "confirm", lambda _: True)
+    monkeypatch.setattr("src.settings.MYSQL_PASSWORD", "secret-password")
+    return calls
+
+
+class TestMySQLHandler:
+    def test_dump_command(self):
+        handler = handlers.MySQLHandler("test-db")
+        command = handler._dump_command()
+
+        assert command[0] == "mysqldump"
+        assert {"--single-transaction", "--quick"} <= set(command)
+        assert command[-1] == "test-db"
+        assert handler.command_env() == {"MYSQL_PWD": handler.command_env()["MYSQL_PWD"]}
+
+    def test_directory_format__mydumper(self, calls):
+        handler = handlers.MySQLHandler("test-db", dump_format="directory", jobs=8)
+        handler._do_backup()
+
+        (call,) = calls
+        assert call["command"][0] == "mydumper"
+        assert call["command"][-3:-1] == ["--threads", "8"]
+        assert "secret-password" not in " ".join(call["command"])
+        content, mode = call["defaults"]
+        assert "password=secret-password" in content
+        assert mode == 0o600
+        assert not os.path.exists(call["command"][1].removeprefix("--defaults-file="))
+
+    def test_custom_format__not_supported(self):
+        with pytest.raises(BackupError):
+            handlers.MySQLHandler("test-db", dump_format="custom")
+
+    def test_restore__existing_db_is_recreated(self, calls, tmp_path):
+        handler = handlers.MySQLHandler("test-db")
+        handler.backup_path = tmp_path / "test-db.backup.sql"
+        handler.backup_path.write_text("CREATE TABLE test (id INT);")
+        handler._do_restore(handler.backup_path)
+
+        queries = [call["command"][-1] for call in calls[:3]]
+        assert "SELECT 1" in queries[0]
+        assert queries[1:] == ["DROP DATABASE IF EXISTS `test-db`", "CREATE DATABASE `test-db`"]
+        assert calls[3]["command"][-1] == "test-db"
+        assert calls[3]["stdin_path"] == handler.backup_path
+
+    def test_restore__directory_via_myloader(self, calls, tmp_path):
+        handler = handlers.MySQLHandler("test-db", jobs=4)
+        handler.backup_path = tmp_path / "test-db.backup.dir"
+        handler.backup_path.mkdir()
+        handler._restore_db()
+
+        (call,) = calls
+        assert call["command"][0] == "myloader"
+        assert call["command"][-6:] == [
+            *("--database", "test-db"),
+            *("--directory", str(handler.backup_path)),
+            *("--threads", "4"),
+        ]
+
+
+class TestMySQLDockerHandler:
+    def test_commands_are_wrapped(self, calls):
+        handler = handlers.MySQLDockerHandler("test-db", container_name="mysql")
+        command = handler._dump_command()
+
+        assert command[:5] == ["docker", "exec", "-i", "mysql", "sh"]
+        assert command[command.index("mysqldump") - 1] == "sh"
+        assert "--single-transaction" in command
+        assert "MYSQL_ROOT_PASSWORD" in " ".join(command)
+        assert handler.command_env() == {}
+
+    def test_directory_format__not_supported(self):
+        with pytest.raises(BackupError):
+            handlers.MySQLDockerHandler("test-db", container_name="mysql", dump_format="directory")
+
+    def test_container_is_required(self):
+        with pytest.raises(RuntimeError):
+            handlers.MySQLDockerHandler("test-db")
+
+
+class TestPGServiceHandler:
+    @pytest.fixture(autouse=True)
+    def tmp_backup_dir(self, monkeypatch, tmp_path):
+        monkeypatch.setattr("src.settings.TMP_BACKUP_DIR", tmp_path / "backups")
+        (tmp_path / "backups").mkdir()
+
+    def test_directory_format__parallel_dump(self, calls):
+        handler = handlers.PGServiceHandler("test-db", dump_format="directory", jobs=4)
+        handler._do_backup()
+
+        (call,) = calls
+        assert call["command"][0] == "pg_dump"
+        assert "--format=directory" in call["command"]
+        assert call["command"][-4:] == ["-f", handler.backup_path, "-j", "4"]
+        assert handler.backup_path.name == "test-db.backup.dir"
+
+    def test_custom_format(self, calls):
+        handler = handlers.PGServiceHandler("test-db", dump_format="custom", jobs=4)
+        handler._do_backup()
+
+        (call,) = calls
+        assert "--format=custom" in call["command"]
+        # pg_dump's parallel jobs are supported by directory format only
+        assert "-j" not in call["command"]
+        assert call["command"][-2:] == ["-f", handler.backup_path]
+
+    def test_restore__archive_via_pg_restore(self, calls, tmp_path):
+        handler = handlers.PGServiceHandler("test-db", jobs=4)
+        handler.backup_path = tmp_path / "test-db.backup.dump"
+        handler.backup_path.write_bytes(b"PGDMP\x01\x0e\x00")
+        handler._restore_db()
+
+        (call,) = calls
+        assert call["command"][0] == "pg_restore"
+        assert call["command"][-6:] == [
+            *("-d", "test-db", "--exit-on-error"),
+            *("-j", "4", handler.backup_path),
+        ]
+
+    def test_is_archive_dump(self, tmp_path):
+        (tmp_path / "plain.sql").write_text("CREATE TABLE test (id INT);")
+        (tmp_path / "directory").mkdir()
+        (tmp_path / "directory" / "toc.dat").write_bytes(b"PGDMP")
+
+        assert not handlers.PGServiceHandler._is_archive_dump(tmp_path / "plain.sql")
+        assert handlers.PGServiceHandler._is_archive_dump(tmp_path / "directory")
+
+    def test_directory_dump__tar_roundtrip(self, tmp_path):
+        handler = handlers.PGServiceHandler("test-db", dump_format="directory", compression="gzip")
+        handler.backup_path.mkdir()
+        files = {"toc.dat": b"PGDMP" + os.urandom(100), "3001.dat.gz": os.urandom(10_000)}
+        for name, content in files.items():
+            (handler.backup_path / name).write_bytes(content)
+
+        compressed_path = handler._do_zip()
+        handler._do_clean()
+        assert compressed_path.name.endswith(".dir.tar.gz")
+
+        restore_handler = handlers.PGServiceHandler("test-db")
+        dump_path = restore_handler._do_unzip(compressed_path)
+        assert dump_path.name == "test-db.backup.dir"
+        assert {path.name: path.read_bytes() for path in dump_path.iterdir()} == files
+        assert restore_handler._is_archive_dump(dump_path)
@@ -0,0 +1,128 @@
+import gzip
+
+import pytest
+
+from src import integrity, s3
+from src.compression import CODECS, compress_path
+from src.constants import BackupLocation, Compression
+from src.exceptions import BackupError
+from src.integrity import Checksum, Hasher, file_checksum, manifest_path, verify_backup
+from src.retention import list_local_backups, list_s3_backups
+from src.utils import encrypt_file
+
+DATA = b"INSERT INTO t VALUES (1);\n" * 10_000
+BACKUP_NAME = "2024-02-21-065213.test-db.backup.sql.gz"
+
+
+@pytest.fixture
+def local_backup(tmp_path):
+    path = tmp_path / BACKUP_NAME
+    path.write_bytes(gzip.compress(DATA))
+    file_checksum(path).save(manifest_path(path))
+    return path
+
+
+class TestChecksum:
+    def test_manifest_roundtrip(self, tmp_path):
+        hasher = Hasher("blake2b")
+        hasher.update(b"abc")
+        hasher.update(b"def")
+        checksum = hasher.result()
+        (tmp_path / "data").write_bytes(b"abcdef")
+        assert checksum == file_checksum(tmp_path / "data", "blake2b")
+        assert Checksum.load(checksum.save(tmp_path / "manifest.json")) == checksum
+        assert checksum.metadata == {"checksum-algorithm": "blake2b", "checksum": checksum.digest}
+
+    def test_invalid_manifest(self, tmp_path):
+        (tmp_path / "manifest.json").write_text('{"digest": "abc"}')
+        with pytest.raises(BackupError):
+            Checksum.load(tmp_path / "manifest.json")
+
+    def test_calculated_on_the_fly(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("ENCRYPT_PASS", "test-password")
+        dump_path = tmp_path / "dump.sql"
+        dump_path.write_bytes(DATA)
+
+        hasher = Hasher()
+        compressed_path = compress_path(
+            dump_path, tmp_path / "dump.sql.gz", codec=CODECS[Compression.GZIP], hasher=hasher
+        )
+        assert hasher.result() == file_checksum(compressed_path)
+
+        hasher = Hasher()
+        encrypted_path = encrypt_file("test-db", compressed_path, hasher=hasher)
+        assert hasher.result() == file_checksum(encrypted_path)
+
+
+class TestVerifyLocal:
+    def test_ok(self, local_backup):
+        (backup,) = list_local_backups(local_backup.parent)
+        assert backup.sidecars == [str(manifest_path(local_backup).resolve())]
+        assert verify_backup(backup).status == "ok"
+        assert verify_backup(backup, fast=True).status == "ok"
+
+    def test_corrupted_content(self, local_backup):
+        content = bytearray(local_backup.read_bytes())
+        content[100] ^= 0xFF
+        local_backup.write_bytes(bytes(content))
+
+        (backup,) = list_local_backups(local_backup.parent)
+        result = verify_backup(backup)
+        assert result.failed
+        assert "checksum mismatch" in result.message
+        # fast mode checks only size and header
+        assert verify_backup(backup, fast=True).status == "ok"
+
+    def test_truncated(self, local_backup):
+        local_backup.write_bytes(local_backup.read_bytes()[:-10])
+        (backup,) = list_local_backups(local_backup.parent)
+        assert "size mismatch" in verify_backup(backup, fast=True).message
+
+    def test_invalid_header(self, tmp_path):
+        (tmp_path / BACKUP_NAME).write_bytes(DATA)
+        (backup,) = list_local_backups(tmp_path)
+        result = verify_backup(backup)
+        assert (result.status, result.message) == (
+            "failed",
+            "compression header doesn't match extension 'gz'",
+        )
+
+    def test_without_manifest(self, local_backup):
+        manifest_path(local_backup).unlink()
+        (backup,) = list_local_backups(local_backup.parent)
+        assert verify_backup(backup).status == "unverified"
+        assert verify_backup(backup, fast=True).status == "unverified"
+
+
+class TestVerifyS3:
+    @pytest.fixture
+    def s3_backup(self, fake_s3, local_backup):
+        checksum = Checksum.load(manifest_path(local_backup))
+        s3.upload_file("test-db", local_backup, metadata=checksum.metadata)
+        return checksum
+
+    def test_metadata(self, fake_s3, s3_backup):
+        (backup,) = list_s3_backups()
+        assert not backup.sidecars
+        assert fake_s3.metadata[BACKUP_NAME] == s3_backup.metadata
+        assert verify_backup(backup).status == "ok"
+        assert verify_backup(backup, fast=True).status == "ok"
+
+    def test_corrupted_object(self, fake_s3, s3_backup):
+        content = bytearray(fake_s3.objects[BACKUP_NAME])
+        content[-20] ^= 0xFF
+        fake_s3.objects[BACKUP_NAME] = bytes(content)
+
+        (backup,) = list_s3_backups()
+        assert verify_backup(backup, fast=True).status == "ok"
+        assert verify_backup(backup).failed
+
+    def test_manifest_sidecar(self, fake_s3, local_backup, s3_backup, monkeypatch):
+        s3.upload_file("test-db", manifest_path(local_backup))
+        (backup,) = list_s3_backups()
+        assert backup.location == BackupLocation.S3
+        assert backup.sidecars == [f"{BACKUP_NAME}.checksum.json"]
+
+        fake_s3.metadata[BACKUP_NAME] = {integrity.METADATA_CHECKSUM: "0" * 64}
+        result = verify_backup(backup, fast=True)
+        assert (result.status, result.message) == ("failed", "checksum in S3 metadata mismatch")
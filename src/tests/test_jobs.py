@@ -0,0 +1,107 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from src.jobs import run_jobs
+from src.utils import filter_names
+from src.process import ProcessError, call_with_logging
+
+
+class TestRunJobs:
+    def test_returns_results_in_the_same_order(self):
+        results = run_jobs(["db1", "db2", "db3"], lambda name: name.upper(), workers=3)
+        assert [result.name for result in results] == ["db1", "db2", "db3"]
+        assert [result.result for result in results] == ["DB1", "DB2", "DB3"]
+        assert all(result.success for result in results)
+
+    def test_collects_errors_without_stopping_other_jobs(self):
+        def func(name: str) -> str:
+            if name == "broken":
+                raise ValueError("dump failed")
+            return name
+
+        results = run_jobs(["db1", "broken", "db2"], func, workers=2)
+        assert [result.success for result in results] == [True, False, True]
+        assert results[1].error == "dump failed"
+
+    @pytest.mark.parametrize("per_key_limit, expected_max", [(1, 1), (2, 2), (0, 4)])
+    def test_limits_concurrency_per_key(self, per_key_limit, expected_max):
+        lock = threading.Lock()
+        running, max_running = 0, 0
+
+        def func(_: str) -> None:
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+
+        run_jobs(
+            [f"db{i}" for i in range(8)],
+            func,
+            workers=4,
+            key_func=lambda _: "localhost:5432",
+            per_key_limit=per_key_limit,
+        )
+        assert max_running == expected_max
+
+    def test_timeout_terminates_job_processes(self):
+        started_at = time.monotonic()
+        results = run_jobs(
+            ["slow", "fast"],
+            lambda name: call_with_logging(["sleep", "30" if name == "slow" else "0"]),
+            workers=2,
+            timeout=0.5,
+        )
+        assert [result.success for result in results] == [False, True]
+        assert results[0].error == "Job is timed out (0.5s)"
+        assert time.monotonic() - started_at < 10
+
+    def test_sigterm_cancels_running_and_waiting_jobs(self):
+        started = []
+        continued = []
+
+        def func(name: str) -> None:
+            started.append(name)
+            threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM)).start()
+            call_with_logging(["sleep", "30"])
+            continued.append(name)
+
+        results = run_jobs(["db1", "db2"], func, workers=1)
+        assert started == ["db1"]
+        assert continued == []
+        assert [result.error for result in results] == [
+            "Job is cancelled",
+            "Job is cancelled (not started)",
+        ]
+
+    def test_cancelled_job_does_not_start_new_processes(self):
+        errors = []
+
+        def func(_: str) -> None:
+            with pytest.raises(ProcessError):
+                call_with_logging(["sleep", "30"])
+            try:
+                call_with_logging(["true"])
+            except ProcessError as exc:
+                errors.append(str(exc))
+
+        (result,) = run_jobs(["db1"], func, timeout=0.2)
+        assert not result.success
+        assert len(errors) == 1
+        assert "Job is cancelled: command true isn't started" in errors[0]
+
+
+class TestFilterNames:
+    def test_filters_by_patterns_and_exclude(self):
+        names = ["app", "app_test", "billing", "logs"]
+        result = filter_names(names, patterns=["app*", "billing"], exclude=["*_test"])
+        assert result == ["app", "billing"]
+
+    def test_returns_empty_list_when_nothing_matched(self):
+        assert filter_names(["app"], patterns=["prod_*"]) == []
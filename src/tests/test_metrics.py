@@ -0,0 +1,114 @@
+import json
+import threading
+
+import pytest
+
+from src import metrics
+from src.metrics import RunMetrics
+from src.utils import copy_file
+
+
+@pytest.fixture
+def run_metrics(monkeypatch) -> RunMetrics:
+    run_metrics = RunMetrics("backup")
+    monkeypatch.setattr(metrics, "run_metrics", run_metrics)
+    return run_metrics
+
+
+class TestRunMetrics:
+    def test_stage_is_measured(self, run_metrics):
+        with metrics.stage("compress", "test-db", bytes_in=1000) as stage:
+            stage.bytes_out = 100
+
+        assert run_metrics.stages == [stage]
+        assert stage.success
+        assert stage.wall_time > 0
+        assert stage.peak_rss > 0
+        assert stage.throughput == 1000 / stage.wall_time
+
+    def test_failed_stage(self, run_metrics):
+        with pytest.raises(ValueError):
+            with metrics.stage("dump", "test-db"):
+                raise ValueError("dump failed")
+
+        assert not run_metrics.stages[0].success
+
+    def test_stream_is_counted(self, run_metrics):
+        with metrics.stage("stream_restore", "test-db") as stage:
+            assert b"".join(stage.count_in([b"abc", b"de"])) == b"abcde"
+
+        assert stage.bytes_in == 5
+
+    def test_copy_file_is_measured(self, run_metrics, tmp_path):
+        source = tmp_path / "backup.sql.gz"
+        source.write_bytes(b"backup")
+        copy_file("test-db", source, tmp_path / "copies")
+        assert [(stage.stage, stage.bytes_in) for stage in run_metrics.stages] == [("copy", 6)]
+
+    def test_prometheus_metrics(self, run_metrics):
+        for _ in range(2):
+            with metrics.stage("copy", "test-db", bytes_in=10):
+                pass
+
+        run_metrics.finish(success=True)
+        text = run_metrics.prometheus_metrics()
+        assert 'db_backups_stage_bytes_in{command="backup",db="test-db",stage="copy"} 20' in text
+        assert 'db_backups_run_success{command="backup"} 1' in text
+        assert text.count("# TYPE db_backups_stage_duration_seconds gauge") == 1
+
+
+class TestTrackRun:
+    def test_reports_are_saved(self, run_metrics, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.METRICS_REPORT_PATH", str(tmp_path))
+        monkeypatch.setattr("src.settings.METRICS_TEXTFILE_DIR", str(tmp_path / "textfile"))
+
+        @metrics.track_run("backup")
+        def command():
+            with metrics.stage("dump", "test-db") as stage:
+                stage.bytes_out = 42
+
+            raise SystemExit(2)
+
+        with pytest.raises(SystemExit):
+            command()
+
+        (report_path,) = tmp_path.glob("backup-*.json")
+        report = json.loads(report_path.read_text())
+        assert report["success"] is False
+        assert [(stage["stage"], stage["bytes_out"]) for stage in report["stages"]] == [
+            ("dump", 42)
+        ]
+        assert (tmp_path / "textfile" / "db_backups_backup.prom").exists()
+
+
+class TestTrackJob:
+    def test_job_has_own_metrics(self, run_metrics, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.METRICS_TEXTFILE_DIR", str(tmp_path))
+
+        def job(name: str) -> None:
+            with metrics.track_job(f"daemon-{name}"):
+                with metrics.stage("dump", name) as stage:
+                    stage.bytes_out = 42
+
+        threads = [threading.Thread(target=job, args=(name,)) for name in ("app", "logs")]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # stages of jobs aren't accumulated by the long-running process's metrics
+        assert not run_metrics.stages
+        for name in ("app", "logs"):
+            text = (tmp_path / f"db_backups_daemon-{name}.prom").read_text()
+            assert f'db_backups_run_success{{command="daemon-{name}"}} 1' in text
+            assert f'db="{name}",stage="dump"}} 42' in text
+
+    def test_failed_job(self, run_metrics, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.METRICS_REPORT_PATH", str(tmp_path / "report.json"))
+        with pytest.raises(ValueError):
+            with metrics.track_job("daemon-app"):
+                raise ValueError("dump failed")
+
+        assert json.loads((tmp_path / "report.json").read_text())["success"] is False
+        assert metrics.current_run() is run_metrics
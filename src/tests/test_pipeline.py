@@ -0,0 +1,207 @@
+import gzip
+import time
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from src import s3
+from src.constants import BackupLocation
+from src.exceptions import BackupError
+from src.pipeline import (
+    BackupSink,
+    DigestSink,
+    FileSink,
+    S3MultipartSink,
+    build_sinks,
+    run_pipeline,
+)
+from src.process import ProcessError
+
+DUMP_CONTENT = b"-- PostgreSQL database dump\n" + b"INSERT INTO t VALUES (1);\n" * 10000
+FILENAME = "2024-02-21-065213.test-db.backup.sql.gz"
+
+
+@pytest.fixture
+def dump_command(tmp_path: Path) -> list[str]:
+    """Fake dump: prints the dump's file to stdout"""
+    (tmp_path / "dump.sql").write_bytes(DUMP_CONTENT)
+    return ["cat", str(tmp_path / "dump.sql")]
+
+
+# compression's stage which fails after the part of data is written
+FAILED_STAGE = ["sh", "-c", "head -c 1000; exit 3"]
+
+
+class TestFileSink:
+    def test_dump_is_compressed_to_file(self, tmp_path, dump_command):
+        sink = FileSink("test-db", FILENAME, directory=tmp_path / "backups")
+        result = run_pipeline("test-db", [dump_command, ["gzip", "-c"]], sinks=[sink])
+
+        result_path = tmp_path / "backups" / FILENAME
+        assert gzip.decompress(result_path.read_bytes()) == DUMP_CONTENT
+        assert result.size == result_path.stat().st_size
+        assert result.targets == {BackupLocation.LOCAL: sink.target}
+        assert sink.target == str(result_path.resolve())
+        assert not sink.part_path.exists()
+
+    def test_failed_stage__partial_file_is_removed(self, tmp_path, dump_command):
+        sink = FileSink("test-db", FILENAME, directory=tmp_path / "backups")
+        with pytest.raises(ProcessError, match="stage"):
+            run_pipeline("test-db", [dump_command, FAILED_STAGE], sinks=[sink])
+
+        assert not list((tmp_path / "backups").iterdir())
+
+    def test_build_sinks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.LOCAL_PATH", tmp_path / "local")
+        sinks = build_sinks(
+            "test-db",
+            FILENAME,
+            destination=[BackupLocation.LOCAL, BackupLocation.FILE],
+            destination_file=str(tmp_path / "file"),
+        )
+        assert [(sink.location, sink.directory) for sink in sinks] == [
+            (BackupLocation.LOCAL, tmp_path / "local"),
+            (BackupLocation.FILE, tmp_path / "file"),
+        ]
+        for sink in sinks:
+            sink.abort()
+
+
+class FakeS3Sink(BackupSink):
+    location = BackupLocation.S3
+
+    def __init__(self, on_write: Callable[[bytes], None]):
+        super().__init__("test-db", FILENAME)
+        self.on_write = on_write
+        self.aborted = False
+
+    @property
+    def target(self) -> str:
+        return f"backups/{FILENAME}"
+
+    def write(self, chunk: bytes) -> None:
+        self.on_write(chunk)
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        self.aborted = True
+
+
+class TestSinksIsolation:
+    def test_failed_sink_does_not_stop_others(self, tmp_path, dump_command):
+        def broken_write(chunk: bytes) -> None:
+            raise ConnectionError("connection lost")
+
+        file_sink = FileSink("test-db", FILENAME, directory=tmp_path / "backups")
+        s3_sink = FakeS3Sink(broken_write)
+        result = run_pipeline("test-db", [dump_command], sinks=[s3_sink, file_sink])
+
+        assert (tmp_path / "backups" / FILENAME).read_bytes() == DUMP_CONTENT
+        assert result.targets == {BackupLocation.LOCAL: file_sink.target}
+        assert list(result.errors) == [BackupLocation.S3]
+        assert s3_sink.aborted
+
+    def test_slow_sink_does_not_delay_others(self, tmp_path, dump_command, monkeypatch):
+        monkeypatch.setattr("src.settings.STREAM_QUEUE_SIZE", 100)
+        monkeypatch.setattr("src.settings.STREAM_CHUNK_SIZE", 64 * 1024)
+        result_path = tmp_path / "backups" / FILENAME
+        local_is_done = []
+
+        def slow_write(chunk: bytes) -> None:
+            # the first chunk is written only after the end of the local copy
+            deadline = time.monotonic() + 5
+            while not local_is_done and not result_path.exists() and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            local_is_done.append(result_path.exists())
+
+        sinks = [
+            FakeS3Sink(slow_write),
+            FileSink("test-db", FILENAME, directory=result_path.parent),
+        ]
+        result = run_pipeline("test-db", [dump_command], sinks=sinks)
+        assert local_is_done[0]
+        assert set(result.targets) == {BackupLocation.S3, BackupLocation.LOCAL}
+
+    def test_all_destinations_failed(self, dump_command):
+        def broken_write(chunk: bytes) -> None:
+            raise ConnectionError("connection lost")
+
+        sink = FakeS3Sink(broken_write)
+        with pytest.raises(BackupError, match="connection lost"):
+            run_pipeline("test-db", [dump_command], sinks=[sink, DigestSink("test-db", FILENAME)])
+
+        assert sink.aborted
+
+
+class TestS3MultipartSink:
+    @pytest.fixture(autouse=True)
+    def small_parts(self, fake_s3, monkeypatch):
+        monkeypatch.setattr("src.settings.S3_PATH", "backups")
+        monkeypatch.setattr(s3, "transfer_options", s3.TransferOptions(chunk_size=5 * s3.MB))
+
+    def test_dump_is_uploaded_by_parts(self, fake_s3, tmp_path):
+        dump_path = tmp_path / "dump.sql"
+        dump_path.write_bytes(bytes(range(256)) * (12 * s3.MB // 256))
+
+        sink = S3MultipartSink("test-db", FILENAME)
+        run_pipeline("test-db", [["cat", str(dump_path)]], sinks=[sink])
+
+        assert sink.target == f"backups/{FILENAME}"
+        assert fake_s3.objects[sink.target] == dump_path.read_bytes()
+        assert sink.uploader._next_part_number == 4  # 3 parts: 5MB + 5MB + 2MB
+        assert not fake_s3.uploads
+
+    def test_failed_stage__upload_is_aborted(self, fake_s3, tmp_path):
+        dump_path = tmp_path / "dump.sql"
+        dump_path.write_bytes(bytes(range(256)) * (12 * s3.MB // 256))
+        sinks = [
+            S3MultipartSink("test-db", FILENAME),
+            FileSink("test-db", FILENAME, directory=tmp_path / "backups"),
+        ]
+        # the first part is uploaded before the failure
+        failed_stage = ["sh", "-c", f"head -c {6 * s3.MB}; exit 3"]
+        with pytest.raises(ProcessError):
+            run_pipeline("test-db", [["cat", str(dump_path)], failed_stage], sinks=sinks)
+
+        assert sinks[0].uploader._next_part_number == 2
+
+        assert not fake_s3.objects
+        assert not fake_s3.uploads
+        assert not list((tmp_path / "backups").iterdir())
+
+
+class TestMultipartUploader:
+    def test_part_size_grows_for_big_streams(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(s3, "MAX_PARTS_COUNT", 20)
+        monkeypatch.setattr(s3, "MIN_PART_SIZE", 1024)
+        monkeypatch.setattr(s3, "transfer_options", s3.TransferOptions(chunk_size=1024))
+        data = bytes(range(256)) * 4096  # ~1000 parts of the initial size
+
+        uploader = s3.MultipartUploader("test-db", key="backups/stream.sql.gz")
+        for start in range(0, len(data), 10_000):
+            uploader.write(data[start : start + 10_000])
+
+        uploader.complete()
+        assert fake_s3.objects["backups/stream.sql.gz"] == data
+        assert len(uploader._parts) <= 20
+        assert uploader.part_size > 1024
+
+    def test_failed_part_stops_upload(self, fake_s3, monkeypatch):
+        monkeypatch.setattr(s3, "MIN_PART_SIZE", 1024)
+        monkeypatch.setattr(s3, "transfer_options", s3.TransferOptions(chunk_size=1024))
+        uploader = s3.MultipartUploader("test-db", key="backups/stream.sql.gz")
+
+        def broken_upload(**params):
+            raise ConnectionError("connection lost")
+
+        monkeypatch.setattr(uploader.s3, "upload_part", broken_upload)
+        with pytest.raises(ConnectionError):
+            uploader.write(b"x" * 1024 * 100)
+            uploader.complete()
+
+        uploader.abort()
+        assert not fake_s3.uploads
@@ -0,0 +1,74 @@
+import sys
+import subprocess
+
+import pytest
+
+from src.process import run_command, Pipeline, ProcessError
+
+PYTHON = sys.executable
+
+
+class TestRunCommand:
+    def test_captures_stdout_of_argv_command(self):
+        result = run_command([PYTHON, "-c", "print('hello')"])
+        assert result.returncode == 0
+        assert result.stdout == "hello"
+
+    def test_large_output_on_both_streams_does_not_deadlock(self):
+        script = (
+            "import sys\n"
+            "for i in range(20000):\n"
+            "    sys.stderr.write('e' * 100 + '\\n')\n"
+            "    sys.stdout.write('o' * 100 + '\\n')\n"
+        )
+        result = run_command([PYTHON, "-c", script])
+        assert len(result.stdout.splitlines()) == 20000
+        assert len(result.stderr_tail) <= 50
+
+    def test_raises_error_with_stderr_tail_on_non_zero_code(self):
+        script = "import sys; sys.stderr.write('line1\\nfatal: broken\\n'); sys.exit(3)"
+        with pytest.raises(ProcessError) as exc_info:
+            run_command([PYTHON, "-c", script])
+
+        assert exc_info.value.returncode == 3
+        assert exc_info.value.tail == ["line1", "fatal: broken"]
+
+    def test_allowed_codes_are_not_errors(self):
+        result = run_command([PYTHON, "-c", "import sys; sys.exit(1)"], allowed_codes=(0, 1))
+        assert result.returncode == 1
+
+    def test_error_word_in_output_is_not_an_error(self):
+        result = run_command([PYTHON, "-c", "print('no errors, 0 failed')"])
+        assert result.stdout == "no errors, 0 failed"
+
+    def test_writes_stdout_to_file(self, tmp_path):
+        result_path = tmp_path / "out.txt"
+        run_command([PYTHON, "-c", "print('data')"], stdout_path=result_path)
+        assert result_path.read_text() == "data\n"
+
+
+class TestPipeline:
+    def test_chains_stdout_to_stdin(self):
+        pipeline = Pipeline(
+            [
+                [PYTHON, "-c", "print('a\\nb\\nc')"],
+                [PYTHON, "-c", "import sys; print(sys.stdin.read().upper(), end='')"],
+            ]
+        ).start()
+        output = pipeline.stdout.read()
+        pipeline.wait()
+        assert output == b"A\nB\nC\n"
+
+    def test_reports_failed_stage(self):
+        pipeline = Pipeline(
+            [
+                [PYTHON, "-c", "import sys; sys.stderr.write('dump failed'); sys.exit(2)"],
+                [PYTHON, "-c", "import sys; sys.stdin.read()"],
+            ],
+            stdout=subprocess.DEVNULL,
+        ).start()
+        with pytest.raises(ProcessError) as exc_info:
+            pipeline.wait()
+
+        assert "#0" in exc_info.value.message
+        assert exc_info.value.tail == ["[stage-0: 2] dump failed"]
@@ -0,0 +1,149 @@
+import gzip
+import io
+import subprocess
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from src import s3
+from src.crypto import StreamEncryptor
+from src.exceptions import EncryptBackupError
+from src.pipeline import iter_file, run_restore_pipeline
+from src.process import ProcessError
+
+DUMP_CONTENT = b"-- PostgreSQL database dump\n" + b"INSERT INTO t VALUES (1);\n" * 10000
+# encryption of legacy backups
+LEGACY_ENCRYPT_COMMAND = [
+    *("openssl", "enc", "-aes-256-cbc", "-e", "-pbkdf2", "-pass", "env:ENCRYPT_PASS")
+]
+
+
+def split(data: bytes, size: int = 1000) -> list[bytes]:
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+class RestoreCommand:
+    """Fake restore command: writes its stdin to the file (and remembers dump's header)"""
+
+    def __init__(self, result_path: Path):
+        self.result_path = result_path
+        self.header = b""
+
+    def __call__(self, header: bytes) -> list[str]:
+        self.header = header
+        return ["sh", "-c", 'cat > "$0"', str(self.result_path)]
+
+
+@pytest.fixture
+def restore_command(tmp_path: Path) -> RestoreCommand:
+    return RestoreCommand(tmp_path / "restored.sql")
+
+
+@pytest.fixture
+def encrypt_pass(monkeypatch) -> str:
+    monkeypatch.setenv("ENCRYPT_PASS", "test-password")
+    return "test-password"
+
+
+class TestRunRestorePipeline:
+    def test_compressed_and_encrypted_backup(self, restore_command, encrypt_pass):
+        encryptor = StreamEncryptor(chunk_size=4096)
+        encrypted = encryptor.update(gzip.compress(DUMP_CONTENT)) + encryptor.finalize()
+
+        run_restore_pipeline("test-db", split(encrypted), restore_command)
+        assert restore_command.result_path.read_bytes() == DUMP_CONTENT
+        assert DUMP_CONTENT.startswith(restore_command.header)
+
+    def test_legacy_encrypted_backup(self, restore_command, encrypt_pass):
+        encrypted = subprocess.run(
+            LEGACY_ENCRYPT_COMMAND,
+            input=gzip.compress(DUMP_CONTENT),
+            capture_output=True,
+            check=True,
+        ).stdout
+
+        run_restore_pipeline("test-db", split(encrypted), restore_command)
+        assert restore_command.result_path.read_bytes() == DUMP_CONTENT
+
+    def test_corrupted_encrypted_backup(self, restore_command, encrypt_pass):
+        encryptor = StreamEncryptor(chunk_size=4096)
+        encrypted = bytearray(encryptor.update(DUMP_CONTENT) + encryptor.finalize())
+        encrypted[len(encrypted) // 2] ^= 0xFF
+
+        with pytest.raises(ProcessError) as exc_info:
+            run_restore_pipeline("test-db", split(bytes(encrypted)), restore_command)
+
+        assert "corrupted data" in str(exc_info.value)
+
+    def test_legacy_tar_archive(self, tmp_path, restore_command):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            info = tarfile.TarInfo("test-db.backup.sql")
+            info.size = len(DUMP_CONTENT)
+            tar.addfile(info, io.BytesIO(DUMP_CONTENT))
+
+        backup_path = tmp_path / "2024-02-21-065213.test-db.backup.tar.gz"
+        backup_path.write_bytes(archive.getvalue())
+
+        run_restore_pipeline("test-db", iter_file(backup_path), restore_command)
+        assert restore_command.result_path.read_bytes() == DUMP_CONTENT
+
+    def test_failed_restore_command(self):
+        with pytest.raises(ProcessError) as exc_info:
+            run_restore_pipeline(
+                "test-db",
+                split(gzip.compress(DUMP_CONTENT)),
+                lambda header: ["sh", "-c", "head -c 10 > /dev/null; echo 'broken' >&2; exit 3"],
+            )
+
+        assert "broken" in str(exc_info.value)
+
+    def test_wrong_encrypt_password(self, restore_command, encrypt_pass, monkeypatch):
+        encryptor = StreamEncryptor()
+        encrypted = encryptor.update(DUMP_CONTENT) + encryptor.finalize()
+        monkeypatch.setenv("ENCRYPT_PASS", "wrong-password")
+
+        with pytest.raises(EncryptBackupError):
+            run_restore_pipeline("test-db", split(encrypted), restore_command)
+
+    def test_wrong_legacy_encrypt_password(self, restore_command, encrypt_pass, monkeypatch):
+        encrypted = subprocess.run(
+            LEGACY_ENCRYPT_COMMAND, input=DUMP_CONTENT, capture_output=True, check=True
+        ).stdout
+        monkeypatch.setenv("ENCRYPT_PASS", "wrong-password")
+
+        with pytest.raises(ProcessError):
+            run_restore_pipeline("test-db", split(encrypted), restore_command)
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+
+class FakeS3Client:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges: list[str] = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        self.ranges.append(Range)
+        start, end = map(int, Range.removeprefix("bytes=").split("-"))
+        return {"Body": FakeBody(self.data[start : end + 1])}
+
+
+class TestS3IterObject:
+    def test_ranges_are_yielded_in_order(self, monkeypatch):
+        client = FakeS3Client(DUMP_CONTENT)
+        monkeypatch.setattr(s3, "get_client", lambda: client)
+        monkeypatch.setattr(s3, "transfer_options", s3.TransferOptions(chunk_size=1000))
+
+        assert b"".join(s3.iter_object("test-db", key="backup.sql")) == DUMP_CONTENT
+        assert len(client.ranges) == len(DUMP_CONTENT) // 1000 + 1
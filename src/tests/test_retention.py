@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src import s3
+from src.constants import BackupLocation
+from src.retention import (
+    RetentionPolicy,
+    StoredBackup,
+    delete_backups,
+    list_local_backups,
+    list_s3_backups,
+    select_backups_to_delete,
+)
+
+
+def make_backups(days: int, db_name: str = "db1", location=BackupLocation.LOCAL):
+    started_at = datetime(2024, 3, 31, 6, 0)
+    return [
+        StoredBackup(
+            db_name=db_name,
+            created_at=started_at - timedelta(days=day),
+            location=location,
+            path=f"{started_at - timedelta(days=day):%Y-%m-%d-%H%M%S}.{db_name}.backup.sql.gz",
+        )
+        for day in range(days)
+    ]
+
+
+class FakeS3Client:
+    def __init__(self, keys: list[str]):
+        self.keys = keys
+        self.delete_requests: list[list[str]] = []
+
+    def get_paginator(self, _):
+        return self
+
+    def paginate(self, **params):
+        assert params.get("Delimiter") == "/"
+        for start in range(0, len(self.keys), 1000):
+            yield {"Contents": [{"Key": key, "Size": 1} for key in self.keys[start : start + 1000]]}
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [obj["Key"] for obj in Delete["Objects"]]
+        self.delete_requests.append(keys)
+        return {}
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    def install(keys: list[str]) -> FakeS3Client:
+        client = FakeS3Client(keys)
+        monkeypatch.setattr(s3, "get_client", lambda: client)
+        monkeypatch.setattr("src.catalog.push_s3_manifest", lambda *args, **kwargs: None)
+        return client
+
+    return install
+
+
+class TestSelectBackupsToDelete:
+    def test_gfs_policy(self):
+        backups = make_backups(days=90)
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=7, weekly=4, monthly=3))
+        kept = sorted({backup.created_at for backup in backups} - {b.created_at for b in to_delete})
+        # 7 days + sundays of previous weeks + the last days of previous months
+        assert [created_at.strftime("%m-%d") for created_at in kept] == [
+            "01-31",
+            "02-29",
+            "03-10",
+            "03-17",
+            "03-24",
+            "03-25",
+            "03-26",
+            "03-27",
+            "03-28",
+            "03-29",
+            "03-30",
+            "03-31",
+        ]
+
+    def test_only_the_newest_backup_of_the_day_is_kept(self):
+        backups = make_backups(days=1) + [
+            StoredBackup("db1", datetime(2024, 3, 31, 1, 0), BackupLocation.LOCAL, "earlier")
+        ]
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=1, weekly=0, monthly=0))
+        assert [backup.path for backup in to_delete] == ["earlier"]
+
+    def test_latest_backup_is_always_kept(self):
+        backups = make_backups(days=3)
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=0, weekly=0, monthly=0))
+        assert backups[0] not in to_delete
+        assert len(to_delete) == 2
+
+    def test_policy_is_applied_to_each_db_and_location(self):
+        backups = (
+            make_backups(days=3)
+            + make_backups(days=3, db_name="db2")
+            + make_backups(days=3, location=BackupLocation.S3)
+        )
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=2, weekly=0, monthly=0))
+        assert len(to_delete) == 3
+
+
+class TestPruneStorages:
+    def test_local_backups_are_listed_and_deleted(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.CATALOG_PATH", tmp_path / "missing.sqlite3")
+        for backup in make_backups(days=3):
+            (tmp_path / backup.path).write_bytes(b"backup")
+
+        (tmp_path / "2024-03-31-070000.db1.backup.sql.gz.part").write_bytes(b"partial")
+        (tmp_path / "catalog.sqlite3").write_bytes(b"")
+        (tmp_path / "chunks").mkdir()
+
+        backups = list_local_backups(tmp_path)
+        assert len(backups) == 3
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=1, weekly=0, monthly=0))
+        assert len(delete_backups(to_delete)) == 2
+        assert sorted(path.name for path in tmp_path.glob("*.gz")) == [
+            "2024-03-31-060000.db1.backup.sql.gz"
+        ]
+
+    def test_s3_objects_are_deleted_by_batches(self, fake_s3, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.CATALOG_PATH", tmp_path / "missing.sqlite3")
+        monkeypatch.setattr("src.settings.S3_PATH", "backups")
+        keys = [f"backups/{backup.path}" for backup in make_backups(days=2500)]
+        client = fake_s3(keys + ["backups/catalog.sqlite3"])
+
+        backups = list_s3_backups()
+        assert len(backups) == 2500
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=1, weekly=0, monthly=0))
+        deleted = delete_backups(to_delete)
+        assert len(deleted) == 2499
+        assert [len(request) for request in client.delete_requests] == [1000, 1000, 499]
+
+    def test_failed_batch__deleted_backups_are_unregistered(self, fake_s3, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.CATALOG_PATH", tmp_path / "missing.sqlite3")
+        monkeypatch.setattr("src.settings.S3_PATH", "backups")
+        keys = [f"backups/{backup.path}" for backup in make_backups(days=1500)]
+        client = fake_s3(keys)
+        unregistered = []
+        monkeypatch.setattr(
+            "src.catalog.unregister_backups",
+            lambda db_name, location, paths: unregistered.extend(paths),
+        )
+        method = client.delete_objects
+
+        def delete_objects(Bucket, Delete):
+            if client.delete_requests:
+                raise ConnectionError("connection lost")
+
+            return method(Bucket=Bucket, Delete=Delete)
+
+        monkeypatch.setattr(client, "delete_objects", delete_objects)
+        with pytest.raises(ConnectionError):
+            delete_backups(list_s3_backups())
+
+        assert unregistered == client.delete_requests[0]
+
+    def test_sidecars_are_deleted_with_their_backups(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.CATALOG_PATH", tmp_path / "missing.sqlite3")
+        for backup in make_backups(days=2):
+            (tmp_path / backup.path).write_bytes(b"backup")
+            (tmp_path / f"{backup.path}.toc.json").write_text("{}")
+
+        backups = list_local_backups(tmp_path)
+        assert [len(backup.sidecars) for backup in backups] == [1, 1]
+        to_delete = select_backups_to_delete(backups, RetentionPolicy(daily=1, weekly=0, monthly=0))
+        delete_backups(to_delete)
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "2024-03-31-060000.db1.backup.sql.gz",
+            "2024-03-31-060000.db1.backup.sql.gz.toc.json",
+        ]
@@ -0,0 +1,132 @@
+import time
+
+import pytest
+
+from src import s3, utils
+
+FILE_SIZE = 12 * s3.MB  # 3 parts (min part's size is 5MB)
+
+
+@pytest.fixture
+def backup_path(fake_s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        s3, "transfer_options", s3.TransferOptions(chunk_size=s3.MB, threshold=s3.MB)
+    )
+    path = tmp_path / "2024-01-01-120000.test-db.backup.sql.gz"
+    path.write_bytes(bytes(range(256)) * (FILE_SIZE // 256))
+    return path
+
+
+def spy_calls(monkeypatch, method_name: str, fail_on=None) -> list[dict]:
+    """Records calls of the S3 client's method (call with `fail_on(params)` is failed)"""
+    client = s3.get_client()
+    method = getattr(client, method_name)
+    calls = []
+
+    def wrapper(**params):
+        calls.append(params)
+        if fail_on and fail_on(params):
+            raise ConnectionError("connection lost")
+
+        return method(**params)
+
+    monkeypatch.setattr(client, method_name, wrapper)
+    return calls
+
+
+class TestResumableUpload:
+    def test_interrupted_upload_is_resumed(self, fake_s3, backup_path, monkeypatch):
+        with monkeypatch.context() as patch:
+            spy_calls(patch, "upload_part", fail_on=lambda params: params["PartNumber"] == 3)
+            with pytest.raises(ConnectionError):
+                s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+
+        (state,) = s3.pending_uploads("test-db")
+        assert sorted(state.parts) == [1, 2]
+        assert not fake_s3.objects
+
+        calls = spy_calls(monkeypatch, "upload_part")
+        assert s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+        assert [call["PartNumber"] for call in calls] == [3]
+        assert fake_s3.objects["backups/backup.sql.gz"] == backup_path.read_bytes()
+        assert not s3.pending_uploads("test-db")
+        assert not fake_s3.uploads
+
+    def test_changed_file__upload_is_restarted(self, fake_s3, backup_path, monkeypatch):
+        with monkeypatch.context() as patch:
+            spy_calls(patch, "upload_part", fail_on=lambda params: params["PartNumber"] == 3)
+            with pytest.raises(ConnectionError):
+                s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+
+        backup_path.write_bytes(b"changed" * s3.MB)
+        calls = spy_calls(monkeypatch, "upload_part")
+        s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+
+        assert sorted(call["PartNumber"] for call in calls) == [1, 2]
+        assert fake_s3.objects["backups/backup.sql.gz"] == backup_path.read_bytes()
+        assert not fake_s3.uploads
+
+    def test_unknown_upload__upload_is_restarted(self, fake_s3, backup_path, monkeypatch):
+        with monkeypatch.context() as patch:
+            spy_calls(patch, "upload_part", fail_on=lambda params: params["PartNumber"] == 3)
+            with pytest.raises(ConnectionError):
+                s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+
+        fake_s3.uploads.clear()  # ex.: upload was aborted by bucket's lifecycle rule
+        s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+        assert fake_s3.objects["backups/backup.sql.gz"] == backup_path.read_bytes()
+
+    def test_find_resumable_upload(self, fake_s3, backup_path, monkeypatch):
+        with monkeypatch.context() as patch:
+            spy_calls(patch, "upload_part", fail_on=lambda params: params["PartNumber"] == 3)
+            with pytest.raises(ConnectionError):
+                s3.upload_file("test-db", backup_path, key="backups/backup.sql.gz")
+
+        assert utils.find_resumable_s3_upload("test-db", file_suffix=".sql.gz") == backup_path
+        assert utils.find_resumable_s3_upload("test-db", file_suffix=".sql.zst") is None
+        assert utils.find_resumable_s3_upload("another-db", file_suffix=".sql.gz") is None
+
+        (state,) = s3.pending_uploads("test-db")
+        state.created_at = time.time() - 25 * 3600
+        state.save()
+        assert utils.find_resumable_s3_upload("test-db", file_suffix=".sql.gz") is None
+        assert not s3.pending_uploads("test-db")
+        assert not fake_s3.uploads
+
+
+class TestResumableDownload:
+    def test_interrupted_download_is_resumed(self, fake_s3, backup_path, tmp_path, monkeypatch):
+        fake_s3.objects["backups/backup.sql.gz"] = backup_path.read_bytes()
+        result_path = tmp_path / "downloaded.sql.gz"
+        fail_on_range = f"bytes={4 * s3.MB}-{5 * s3.MB - 1}"
+        with monkeypatch.context() as patch:
+            spy_calls(patch, "get_object", fail_on=lambda params: params["Range"] == fail_on_range)
+            with pytest.raises(ConnectionError):
+                s3.download_file("test-db", "backups/backup.sql.gz", result_path)
+
+        assert not result_path.exists()
+        calls = spy_calls(monkeypatch, "get_object")
+        s3.download_file("test-db", "backups/backup.sql.gz", result_path)
+
+        assert calls[0]["Range"] == f"bytes={4 * s3.MB}-{5 * s3.MB - 1}"
+        assert calls[0]["IfMatch"]
+        assert result_path.read_bytes() == backup_path.read_bytes()
+        assert not list((tmp_path / "resume").iterdir())
+
+    def test_changed_object__download_is_restarted(
+        self, fake_s3, backup_path, tmp_path, monkeypatch
+    ):
+        fake_s3.objects["backups/backup.sql.gz"] = backup_path.read_bytes()
+        result_path = tmp_path / "downloaded.sql.gz"
+        fail_on_range = f"bytes={4 * s3.MB}-{5 * s3.MB - 1}"
+        with monkeypatch.context() as patch:
+            spy_calls(patch, "get_object", fail_on=lambda params: params["Range"] == fail_on_range)
+            with pytest.raises(ConnectionError):
+                s3.download_file("test-db", "backups/backup.sql.gz", result_path)
+
+        fake_s3.objects["backups/backup.sql.gz"] = b"changed" * s3.MB
+        calls = spy_calls(monkeypatch, "get_object")
+        s3.download_file("test-db", "backups/backup.sql.gz", result_path)
+
+        assert calls[0]["Range"].startswith("bytes=0-")
+        assert result_path.read_bytes() == b"changed" * s3.MB
@@ -0,0 +1,234 @@
+import json
+import socket
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from src import settings
+from src.constants import BackupHandler, BackupLocation
+from src.exceptions import ScheduleError
+from src.scheduler import CronSchedule, Scheduler, load_schedule, parse_job
+
+SCHEDULE_CONFIG = """
+[defaults]
+from = "PG"
+to = ["LOCAL", "S3"]
+jitter = 120
+
+[[jobs]]
+db = "billing"
+schedule = "0 3 * * *"
+encrypt = true
+
+[[jobs]]
+name = "podcast-hourly"
+db = "podcast"
+schedule = "@hourly"
+from = "PG_CONTAINER"
+docker_container = "postgres"
+to = "LOCAL"
+jitter = 0
+"""
+
+
+class TestCronSchedule:
+    @pytest.mark.parametrize(
+        "expression, moment, expected",
+        [
+            ("*/15 * * * *", datetime(2024, 3, 1, 12, 7), datetime(2024, 3, 1, 12, 15)),
+            ("0 3 * * *", datetime(2024, 3, 1, 3, 0), datetime(2024, 3, 2, 3, 0)),
+            ("0 0 1 jan,jul *", datetime(2024, 3, 1), datetime(2024, 7, 1)),
+            ("0 0 29 2 *", datetime(2024, 3, 1), datetime(2028, 2, 29)),
+            ("0 0 * * 7", datetime(2024, 3, 1), datetime(2024, 3, 3)),
+            # both day and weekday are restricted: any of them matches
+            ("0 0 15 * mon", datetime(2024, 3, 1), datetime(2024, 3, 4)),
+            ("0 0 1 * *", datetime(2024, 12, 31, 23, 59), datetime(2025, 1, 1)),
+        ],
+    )
+    def test_next_after(self, expression, moment, expected):
+        assert CronSchedule.parse(expression).next_after(moment) == expected
+
+    @pytest.mark.parametrize(
+        "expression", ["* * * *", "60 * * * *", "* * * * foo", "5-1 * * * *", "*/0 * * * *"]
+    )
+    def test_invalid(self, expression):
+        with pytest.raises(ScheduleError):
+            CronSchedule.parse(expression)
+
+    def test_never_matches(self):
+        with pytest.raises(ScheduleError):
+            CronSchedule.parse("0 0 31 2 *").next_after(datetime(2024, 3, 1))
+
+
+class TestLoadSchedule:
+    def test_defaults_are_applied(self, tmp_path):
+        config = tmp_path / "schedule.toml"
+        config.write_text(SCHEDULE_CONFIG)
+
+        billing, podcast = load_schedule(config)
+        assert (billing.name, billing.handler, billing.destination) == (
+            "billing",
+            BackupHandler.PG_SERVICE,
+            (BackupLocation.LOCAL, BackupLocation.S3),
+        )
+        assert (billing.encrypt, billing.jitter) == (True, 120)
+        assert (podcast.name, podcast.destination, podcast.jitter) == (
+            "podcast-hourly",
+            (BackupLocation.LOCAL,),
+            0,
+        )
+        assert podcast.handler_kwargs["container_name"] == "postgres"
+        assert podcast.concurrency_key == "container:postgres"
+
+    @pytest.mark.parametrize(
+        "job_config",
+        [
+            {"db": "app", "schedule": "@daily", "from": "PG", "to": "S3", "unknown": 1},
+            {"db": "app", "schedule": "@daily", "from": "PG"},
+            {"db": "app", "schedule": "@daily", "from": "PG_CONTAINER", "to": "S3"},
+            {"db": "app", "schedule": "@daily", "from": "PG", "to": "FILE"},
+            {"db": "app", "schedule": "@daily", "from": "ORACLE", "to": "S3"},
+            {"db": "app", "schedule": "@daily", "from": "PG", "to": "S3", "compression": "xz"},
+            {"db": "app", "schedule": "@daily", "from": "PG", "to": "CHUNKS", "encrypt": True},
+            {
+                "db": "app",
+                "schedule": "@daily",
+                "from": "MYSQL",
+                "to": "S3",
+                "dump_format": "custom",
+            },
+            {
+                "db": "app",
+                "schedule": "@daily",
+                "from": "MYSQL_CONTAINER",
+                "docker_container": "mysql",
+                "to": "S3",
+                "dump_format": "directory",
+            },
+        ],
+    )
+    def test_invalid_job(self, job_config):
+        with pytest.raises(ScheduleError):
+            parse_job(job_config)
+
+    def test_duplicated_names(self, tmp_path):
+        config = tmp_path / "schedule.toml"
+        config.write_text(SCHEDULE_CONFIG + '\n[[jobs]]\ndb = "billing"\nschedule = "@daily"\n')
+        with pytest.raises(ScheduleError, match="unique"):
+            load_schedule(config)
+
+    def test_template_is_valid(self):
+        jobs = load_schedule(settings.BASE_DIR / "schedule.toml.template")
+        assert [job.name for job in jobs] == ["my_db", "my_db-local-hourly", "shop"]
+
+    def test_chunk_store_on_s3(self, monkeypatch):
+        job = parse_job({"db": "app", "schedule": "@daily", "from": "PG", "to": "CHUNKS"})
+        assert not job.uses_s3
+        monkeypatch.setattr("src.settings.CHUNK_STORE_BACKEND", BackupLocation.S3)
+        assert job.uses_s3
+
+
+class FakeClock:
+    def __init__(self, now: datetime):
+        self.moment = now
+
+    def __call__(self) -> datetime:
+        return self.moment
+
+
+class TestScheduler:
+    @pytest.fixture
+    def jobs(self):
+        return [
+            parse_job({"db": "app", "schedule": "0 * * * *", "from": "PG", "to": "LOCAL"}),
+            parse_job(
+                {"db": "logs", "schedule": "30 * * * *", "from": "PG", "to": "S3", "jitter": 600}
+            ),
+        ]
+
+    def test_dispatch(self, jobs, tmp_path):
+        clock = FakeClock(datetime(2024, 3, 1, 12, 10))
+        started = []
+        release = threading.Event()
+
+        def runner(job):
+            started.append(job.name)
+            release.wait(timeout=5)
+
+        async def main():
+            scheduler = Scheduler(
+                jobs, runner=runner, status_path=tmp_path / "status.json", now=clock
+            )
+            async with scheduler.orchestrator:
+                assert 20 * 60 <= scheduler.dispatch() <= 30 * 60
+                logs_next_run = scheduler.statuses["logs"].next_run_at
+                assert datetime(2024, 3, 1, 12, 30) <= logs_next_run <= datetime(2024, 3, 1, 12, 40)
+
+                clock.moment = datetime(2024, 3, 1, 13, 0)
+                scheduler.dispatch()
+                await asyncio.sleep(0.1)
+                assert scheduler.statuses["app"].state == "running"
+
+                # the previous run is still active: the next one is skipped
+                clock.moment = datetime(2024, 3, 1, 14, 0)
+                scheduler.dispatch()
+                assert scheduler.statuses["app"].skipped == 1
+
+                release.set()
+                await asyncio.gather(*scheduler._tasks)
+                return scheduler
+
+        scheduler = asyncio.run(main())
+        assert started == ["app", "logs"]
+        status = json.loads((tmp_path / "status.json").read_text())
+        assert [job["name"] for job in status["jobs"]] == ["app", "logs"]
+        assert status["jobs"][0]["runs"] == 1
+        assert status["jobs"][0]["last_success"] is True
+        assert status["jobs"][0]["next_run_at"] == "2024-03-01T15:00:00"
+        assert scheduler.statuses["app"].state == "idle"
+
+    def test_run_serves_status(self, jobs, tmp_path):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        def runner(job):
+            if job.name == "logs":
+                raise ValueError("dump failed")
+
+        async def request(path: str) -> tuple[bytes, dict]:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+            headers, _, body = response.partition(b"\r\n\r\n")
+            return headers.split(b"\r\n")[0], json.loads(body)
+
+        async def main():
+            scheduler = Scheduler(
+                jobs, runner=runner, status_path=tmp_path / "status.json", status_port=port
+            )
+            for job in jobs:
+                scheduler.statuses[job.name].next_run_at = datetime.now() - timedelta(seconds=1)
+
+            task = asyncio.create_task(scheduler.run())
+            while sum(status.runs for status in scheduler.statuses.values()) < 2:
+                await asyncio.sleep(0.05)
+
+            status_line, status = await request("/status")
+            not_found_line, _ = await request("/unknown")
+            scheduler.orchestrator.stop()
+            await task
+            return status_line, status, not_found_line
+
+        status_line, status, not_found_line = asyncio.run(main())
+        assert status_line == b"HTTP/1.1 200 OK"
+        assert not_found_line == b"HTTP/1.1 404 Not Found"
+        assert status["state"] == "running"
+        assert [(job["name"], job["last_success"]) for job in status["jobs"]] == [
+            ("app", True),
+            ("logs", False),
+        ]
+        assert "dump failed" in status["jobs"][1]["last_error"]
@@ -0,0 +1,217 @@
+import os
+import gzip
+import datetime
+import subprocess
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from src import catalog, scratch
+from src.commands.backup import backup_job
+from src.commands.restore import restore_db
+from src.constants import BackupLocation
+from src.exceptions import ScratchSpaceError
+from src.handlers import BaseHandler
+
+GB = 1024**3
+DATA = b"INSERT INTO t VALUES (1);\n" * 1000
+
+
+class FakeHandler(BaseHandler):
+    """Writes the same dump (to file or stdout), DB's size is set by the test"""
+
+    service = "fake"
+    required_variables = ()
+    db_size: int | None = None
+    workspaces: list[Path] = []
+
+    @classmethod
+    def estimate_db_size(cls, db_name: str, **extra_kwargs) -> int | None:
+        if cls.db_size is None:
+            raise RuntimeError("DB's size is unknown")
+
+        return cls.db_size
+
+    def _do_backup(self) -> str:
+        self.workspaces.append(self.backup_path.parent)
+        self.backup_path.write_bytes(DATA)
+        return ""
+
+    def _do_restore(self, file_path: Path) -> None:
+        self.restored = (self.backup_path, self.backup_path.read_bytes())
+
+    def _dump_command(self) -> list[str]:
+        return ["printf", DATA.decode().replace("%", "%%")]
+
+
+@pytest.fixture
+def volumes(tmp_path, monkeypatch) -> dict[Path, int]:
+    """Two scratch volumes with fake free space (can be changed by the test)"""
+    free = {tmp_path / "small": 10 * GB, tmp_path / "big": 50 * GB}
+    monkeypatch.setattr("src.settings.SCRATCH_DIRS", list(free))
+    monkeypatch.setattr("src.settings.SCRATCH_RESERVE", GB)
+    monkeypatch.setattr("src.settings.TMP_BACKUP_DIR", tmp_path / "process")
+    monkeypatch.setattr(
+        scratch.shutil, "disk_usage", lambda path: SimpleNamespace(free=free[Path(path)])
+    )
+    scratch.get_scratch_space.cache_clear()
+    yield free
+    scratch.get_scratch_space.cache_clear()
+
+
+@pytest.fixture
+def fake_handler(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.settings.LOCAL_PATH", tmp_path / "local")
+    monkeypatch.setattr("src.settings.CATALOG_PATH", tmp_path / "catalog.sqlite3")
+    monkeypatch.setattr(FakeHandler, "db_size", 1024)
+    monkeypatch.setattr(FakeHandler, "workspaces", [])
+    catalog.get_catalog.cache_clear()
+    yield FakeHandler
+    catalog.get_catalog.cache_clear()
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+class TestScratchSpace:
+    def test_volume_with_most_space(self, volumes, tmp_path):
+        space = scratch.get_scratch_space()
+        first = space.allocate("db1", required=20 * GB)
+        second = space.allocate("db2", required=20 * GB)
+        assert first.path.parent == second.path.parent == tmp_path / "big"
+
+        # 9 GB are available on each volume: the space is reserved by running jobs
+        with pytest.raises(ScratchSpaceError, match="Not enough scratch space for db3"):
+            space.allocate("db3", required=10 * GB)
+
+        first.cleanup()
+        assert space.allocate("db3", required=10 * GB).path.parent == tmp_path / "big"
+        # size is unknown: any volume is used
+        volumes[tmp_path / "big"] = 0
+        assert space.allocate("db4").path.parent == tmp_path / "small"
+
+    def test_workspace_is_removed(self, volumes, tmp_path):
+        with pytest.raises(RuntimeError):
+            with scratch.get_scratch_space().allocate("db") as workspace:
+                assert scratch.current_dir() == workspace.path
+                (workspace.path / "dump.sql").write_bytes(DATA)
+                raise RuntimeError("dump failed")
+
+        assert not workspace.path.exists()
+        assert scratch.current_dir() == tmp_path / "process"
+
+    def test_kept_files(self, volumes, monkeypatch):
+        space = scratch.get_scratch_space()
+        with space.allocate("db") as workspace:
+            (workspace.path / "dump.sql").write_bytes(DATA)
+            (workspace.path / "backup.sql.gz").write_bytes(DATA)
+            scratch.keep(workspace.path / "backup.sql.gz")
+
+        assert sorted(path.name for path in workspace.path.iterdir()) == [
+            scratch.KEEP_MARKER,
+            "backup.sql.gz",
+        ]
+        assert not space.sweep()
+
+        # the upload isn't resumable anymore
+        monkeypatch.setattr("src.settings.S3_RESUME_MAX_AGE", 0)
+        assert space.sweep() == [workspace.path]
+
+    def test_sweep(self, volumes, tmp_path):
+        prefix = f"{scratch.WORKSPACE_PREFIX}{scratch.HOSTNAME}"
+        stale = tmp_path / "small" / f"{prefix}-{dead_pid()}-abc_123"
+        running = tmp_path / "small" / f"{prefix}-{os.getppid()}-abc_123"
+        other_host = tmp_path / "small" / f"{scratch.WORKSPACE_PREFIX}other-{dead_pid()}-abc_123"
+        for path in (stale, running, other_host):
+            path.mkdir(parents=True)
+
+        space = scratch.get_scratch_space()
+        workspace = space.allocate("db")
+        assert not stale.exists()
+        assert running.exists() and other_host.exists() and workspace.path.exists()
+
+
+class TestEstimate:
+    def test_db_size(self, fake_handler, monkeypatch):
+        monkeypatch.setattr("src.settings.SCRATCH_SIZE_FACTOR", 2)
+        estimate = scratch.estimate_dump_size("test-db", fake_handler)
+        assert (estimate.db_size, estimate.previous_size, estimate.required) == (1024, None, 2048)
+
+    def test_previous_backup(self, fake_handler, monkeypatch):
+        monkeypatch.setattr(fake_handler, "db_size", None)
+        catalog.register_backup(
+            "test-db",
+            file_name="2024-02-21-065213.test-db.backup.sql.gz",
+            targets={BackupLocation.LOCAL: "/backups/2024-02-21-065213.test-db.backup.sql.gz"},
+            size=3000,
+        )
+        estimate = scratch.estimate_dump_size("test-db", fake_handler)
+        assert (estimate.db_size, estimate.previous_size) == (None, 3000)
+
+
+class TestBackupJob:
+    @staticmethod
+    def run_backup(handler_class) -> None:
+        backup_job(
+            "test-db",
+            handler_class=handler_class,
+            handler_kwargs={"compression": "gzip"},
+            destination=(BackupLocation.LOCAL,),
+            destination_file=None,
+        )
+
+    def test_dump_in_workspace(self, volumes, fake_handler, tmp_path):
+        self.run_backup(fake_handler)
+
+        (workspace,) = fake_handler.workspaces
+        assert workspace.parent == tmp_path / "big"
+        assert not workspace.exists()
+        (backup_path,) = (tmp_path / "local").glob("*.sql.gz")
+        assert gzip.decompress(backup_path.read_bytes()) == DATA
+
+    def test_stream_fallback(self, volumes, fake_handler, tmp_path, monkeypatch):
+        monkeypatch.setattr(fake_handler, "db_size", 100 * GB)
+        self.run_backup(fake_handler)
+
+        # dump wasn't written to the scratch volume
+        assert not fake_handler.workspaces
+        (backup_path,) = (tmp_path / "local").glob("*.sql.gz")
+        assert gzip.decompress(backup_path.read_bytes()) == DATA
+        assert not list((tmp_path / "big").iterdir())
+
+    def test_not_enough_space(self, volumes, fake_handler, monkeypatch):
+        monkeypatch.setattr(fake_handler, "db_size", 100 * GB)
+        monkeypatch.setattr("src.settings.SCRATCH_FALLBACK", "fail")
+        with pytest.raises(ScratchSpaceError):
+            self.run_backup(fake_handler)
+
+
+class TestRestoreInPlace:
+    def test_local_backup(self, volumes, fake_handler, tmp_path):
+        TestBackupJob.run_backup(fake_handler)
+        (backup_path,) = (tmp_path / "local").glob("*.sql.gz")
+        stored = backup_path.read_bytes()
+
+        handler = fake_handler("test-db")
+        with scratch.get_scratch_space().allocate("test-db") as workspace:
+            restore_db("test-db", handler, BackupLocation.LOCAL, None, datetime.date.today(), {})
+            # compressed backup is read in place: only decompressed dump is in the workspace
+            assert handler.restored == (workspace.path / "test-db.backup.sql", DATA)
+            assert not list(workspace.path.iterdir())
+
+        assert backup_path.read_bytes() == stored
+
+    def test_uncompressed_file(self, volumes, fake_handler, tmp_path):
+        source_file = tmp_path / "dump.sql"
+        source_file.write_bytes(DATA)
+
+        handler = fake_handler("test-db")
+        with scratch.get_scratch_space().allocate("test-db"):
+            restore_db("test-db", handler, "FILE", str(source_file), datetime.date.today(), {})
+
+        assert handler.restored == (source_file, DATA)
+        assert source_file.read_bytes() == DATA
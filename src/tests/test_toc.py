@@ -0,0 +1,278 @@
+import gzip
+
+import pytest
+
+from src import handlers, toc
+from src.exceptions import RestoreBackupError
+
+PLAIN_DUMP = """--
+-- PostgreSQL database dump
+--
+
+SET statement_timeout = 0;
+SELECT pg_catalog.set_config('search_path', '', false);
+
+--
+-- Name: audit; Type: SCHEMA; Schema: -; Owner: postgres
+--
+
+CREATE SCHEMA audit;
+
+--
+-- Name: touch(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.touch() RETURNS trigger AS $$ SELECT 1 FROM x JOIN y ON y.id $$;
+
+--
+-- Name: users; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.users (id integer NOT NULL, email text);
+
+--
+-- Name: users_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.users_id_seq;
+
+--
+-- Name: users_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
+--
+
+ALTER SEQUENCE public.users_id_seq OWNED BY public.users.id;
+
+--
+-- Name: logs; Type: TABLE; Schema: audit; Owner: postgres
+--
+
+CREATE TABLE audit.logs (id integer, user_id integer);
+
+--
+-- Name: users id; Type: DEFAULT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.users ALTER COLUMN id SET DEFAULT nextval('public.users_id_seq');
+
+--
+-- Data for Name: users; Type: TABLE DATA; Schema: public; Owner: postgres
+--
+
+COPY public.users (id, email) FROM stdin;
+1\tuser@example.com
+\\.
+
+--
+-- Data for Name: logs; Type: TABLE DATA; Schema: audit; Owner: postgres
+--
+
+COPY audit.logs (id, user_id) FROM stdin;
+1\t1
+\\.
+
+--
+-- Name: users_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+--
+
+SELECT pg_catalog.setval('public.users_id_seq', 1, true);
+
+--
+-- Name: users users_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.users
+    ADD CONSTRAINT users_pkey PRIMARY KEY (id);
+
+--
+-- Name: users_email_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX users_email_idx ON public.users USING btree (email);
+
+--
+-- Name: logs logs_user_fk; Type: FK CONSTRAINT; Schema: audit; Owner: postgres
+--
+
+ALTER TABLE ONLY audit.logs
+    ADD CONSTRAINT logs_user_fk FOREIGN KEY (user_id) REFERENCES public.users(id);
+
+--
+-- Name: TABLE users; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT SELECT ON TABLE public.users TO readonly;
+
+--
+-- PostgreSQL database dump complete
+--
+"""
+
+
+@pytest.fixture
+def dump_path(tmp_path):
+    path = tmp_path / "test-db.backup.sql"
+    path.write_text(PLAIN_DUMP)
+    return path
+
+
+def names(entries: list[toc.TocEntry]) -> list[tuple[str, str]]:
+    return [(entry.type, entry.name) for entry in entries]
+
+
+class TestBuildPlainToc:
+    def test_entries(self, dump_path):
+        dump_toc = toc.build_plain_toc(dump_path)
+
+        assert [(entry.type, entry.table, entry.section) for entry in dump_toc.entries] == [
+            ("SCHEMA", None, "pre-data"),
+            ("FUNCTION", None, "pre-data"),
+            ("TABLE", "users", "pre-data"),
+            ("SEQUENCE", "users", "pre-data"),
+            ("SEQUENCE OWNED BY", "users", "pre-data"),
+            ("TABLE", "logs", "pre-data"),
+            ("DEFAULT", "users", "pre-data"),
+            ("TABLE DATA", "users", "data"),
+            ("TABLE DATA", "logs", "data"),
+            ("SEQUENCE SET", "users", "data"),
+            ("CONSTRAINT", "users", "post-data"),
+            ("INDEX", "users", "post-data"),
+            ("FK CONSTRAINT", "logs", "post-data"),
+            ("ACL", "users", "post-data"),
+        ]
+
+    def test_ranges_cover_the_dump(self, dump_path):
+        dump_toc = toc.build_plain_toc(dump_path)
+
+        content = b"".join(toc.iter_ranges(dump_path, dump_toc, dump_toc.entries))
+        assert content == dump_path.read_bytes()
+        assert dump_path.read_bytes()[: dump_toc.preamble_size].endswith(b"false);\n\n")
+
+        (users_data,) = [entry for entry in dump_toc.entries if entry.type == "TABLE DATA"][:1]
+        chunk = dump_path.read_bytes()[users_data.offset : users_data.offset + users_data.size]
+        assert chunk.startswith(b"--\n-- Data for Name: users;")
+        assert chunk.endswith(b"\\.\n\n")
+
+    def test_save_and_load(self, dump_path, tmp_path):
+        dump_toc = toc.build_plain_toc(dump_path)
+        toc_path = dump_toc.save(toc.sidecar_path(dump_path))
+
+        assert toc_path.name == "test-db.backup.sql.toc.json"
+        assert toc.load_or_build(dump_path, toc_path) == dump_toc
+
+
+class TestTocFilter:
+    def test_tables(self, dump_path):
+        dump_toc = toc.build_plain_toc(dump_path)
+        entries = dump_toc.select(toc.TocFilter(tables=["public.users"]))
+
+        assert {entry.table for entry in entries} == {"users"}
+        assert len(entries) == 9
+
+    def test_schemas(self, dump_path):
+        dump_toc = toc.build_plain_toc(dump_path)
+        entries = dump_toc.select(toc.TocFilter(schemas=["audit"]))
+
+        assert names(entries) == [
+            ("SCHEMA", "audit"),
+            ("TABLE", "logs"),
+            ("TABLE DATA", "logs"),
+            ("FK CONSTRAINT", "logs logs_user_fk"),
+        ]
+
+    def test_exclusions_keep_other_objects(self, dump_path):
+        dump_toc = toc.build_plain_toc(dump_path)
+        entries = dump_toc.select(toc.TocFilter(exclude_tables=["logs"]))
+
+        assert ("FUNCTION", "touch()") in names(entries)
+        assert ("SCHEMA", "audit") in names(entries)
+        assert not [entry for entry in entries if entry.table == "logs"]
+
+
+class TestArchiveToc:
+    def test_split_archive_line(self):
+        assert toc._split_archive_line("FK CONSTRAINT public orders orders_fk postgres") == (
+            "FK CONSTRAINT",
+            "public",
+            "orders orders_fk",
+        )
+        assert toc._split_archive_line("TABLE DATA public users postgres") == (
+            "TABLE DATA",
+            "public",
+            "users",
+        )
+        assert toc._split_archive_line("SCHEMA - audit postgres") == ("SCHEMA", "-", "audit")
+
+    def test_build(self, monkeypatch, dump_path):
+        listing = (
+            ";\n; Archive created at 2024-02-21 06:52:13 UTC\n;\n"
+            "215; 1259 16386 TABLE public users postgres\n"
+            "3345; 0 16386 TABLE DATA public users postgres\n"
+            "3201; 1259 16393 INDEX public users_email_idx postgres\n"
+        )
+        outputs = {"-l": listing, "--schema-only": PLAIN_DUMP}
+        monkeypatch.setattr(toc, "call_with_logging", lambda command: outputs[command[1]])
+
+        dump_toc = toc.build_archive_toc(dump_path)
+        assert [(entry.type, entry.table, entry.section) for entry in dump_toc.entries] == [
+            ("TABLE", "users", "pre-data"),
+            ("TABLE DATA", "users", "data"),
+            ("INDEX", "users", "post-data"),
+        ]
+        assert dump_toc.entries[0].line == "215; 1259 16386 TABLE public users postgres"
+
+
+class TestPGSelectiveRestore:
+    @pytest.fixture
+    def handler(self, dump_path, monkeypatch):
+        handler = handlers.PGServiceHandler(
+            "test-db", jobs=4, restore_filter=toc.TocFilter(tables=["users"])
+        )
+        handler.backup_path = dump_path
+        batches = []
+        monkeypatch.setattr(handler, "_restore_batch", lambda _, batch: batches.append(batch))
+        handler.batches = batches
+        return handler
+
+    def test_plain_dump__phases(self, handler):
+        handler._restore_db()
+
+        restored = [names(batch) for batch in handler.batches]
+        assert restored[0][0] == ("TABLE", "users")
+        assert ("TABLE DATA", "users") in [batch[0] for batch in restored[1:3]]
+        assert [("CONSTRAINT", "users users_pkey")] in restored
+        assert restored[-1] == [("ACL", "TABLE users")]
+        assert not [entry for batch in handler.batches for entry in batch if entry.table != "users"]
+
+    def test_nothing_matches(self, handler):
+        handler.restore_filter = toc.TocFilter(tables=["missing"])
+        with pytest.raises(RestoreBackupError):
+            handler._restore_db()
+
+    def test_not_supported_handler(self, tmp_path):
+        handler = handlers.MySQLHandler("test-db", restore_filter=toc.TocFilter(tables=["users"]))
+        with pytest.raises(RestoreBackupError):
+            handler.restore(tmp_path / "backup.sql")
+
+
+class TestPGBackupToc:
+    @pytest.fixture
+    def handler(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("src.settings.TMP_BACKUP_DIR", tmp_path)
+        handler = handlers.PGServiceHandler("test-db", compression="gzip")
+        handler.required_variables = ()
+        monkeypatch.setattr(
+            handler, "_do_backup", lambda: handler.backup_path.write_text(PLAIN_DUMP)
+        )
+        return handler
+
+    def test_plain_toc_is_parsed_while_dump_is_compressed(self, handler, monkeypatch):
+        expected_toc = toc.parse_plain_toc(PLAIN_DUMP.encode().splitlines(keepends=True))
+        monkeypatch.setattr(toc, "build_plain_toc", lambda _: pytest.fail("dump is read again"))
+
+        backup_path = handler.backup()
+        assert gzip.decompress(backup_path.read_bytes()) == PLAIN_DUMP.encode()
+        assert toc.Toc.load(toc.sidecar_path(backup_path)) == expected_toc
+
+    def test_without_toc(self, handler):
+        backup_path = handler.backup(with_toc=False)
+        assert not toc.sidecar_path(backup_path).exists()
@@ -1,9 +1,12 @@
+import os
+import errno
+import fcntl
 import tempfile
 from pathlib import Path
 
 import pytest
 
-from src.utils import get_latest_file
+from src.utils import copy_file, copy_file_data, get_latest_file
 
 
 @pytest.fixture
@@ -52,3 +55,56 @@ class TestGetLatestFileByMask:
     def test_returns_none_when_directory_is_empty(self, temp_dir):
         result = get_latest_file("test-db", temp_dir, "*.sql")
         assert result is None
+
+
+class TestCopyFileData:
+    @pytest.mark.parametrize(
+        "unsupported",
+        [
+            (),
+            ("ioctl",),
+            ("ioctl", "copy_file_range"),
+            ("ioctl", "copy_file_range", "sendfile"),
+        ],
+    )
+    def test_copies_content(self, temp_dir, monkeypatch, unsupported):
+        def not_supported(*_):
+            raise OSError(errno.EXDEV, "not supported")
+
+        for name in unsupported:
+            monkeypatch.setattr(fcntl if name == "ioctl" else os, name, not_supported)
+
+        source = temp_dir / "backup.sql.gz"
+        source.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+
+        assert copy_file_data(source, temp_dir / "copy.sql.gz") == source.stat().st_size
+        assert (temp_dir / "copy.sql.gz").read_bytes() == source.read_bytes()
+
+    def test_hard_link(self, temp_dir):
+        source = temp_dir / "backup.sql.gz"
+        source.write_bytes(b"backup")
+
+        result = copy_file("test-db", source, temp_dir / "copies", link=True)
+        assert result.read_bytes() == b"backup"
+        assert result.stat().st_ino == source.stat().st_ino
+        assert source.stat().st_nlink == 2
+
+    def test_hard_link__other_filesystem(self, temp_dir, monkeypatch):
+        def cross_device(*_):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        monkeypatch.setattr(os, "link", cross_device)
+        source = temp_dir / "backup.sql.gz"
+        source.write_bytes(b"backup")
+
+        assert copy_file_data(source, temp_dir / "copy.sql.gz", link=True) == 6
+        assert (temp_dir / "copy.sql.gz").read_bytes() == b"backup"
+        assert source.stat().st_nlink == 1
+
+    def test_copy_file__no_partial_file_left(self, temp_dir):
+        source = temp_dir / "backup.sql.gz"
+        source.write_bytes(b"backup")
+
+        result = copy_file("test-db", source, temp_dir / "copies")
+        assert result.read_bytes() == b"backup"
+        assert list((temp_dir / "copies").iterdir()) == [result]
@@ -0,0 +1,404 @@
+"""
+Table of contents (TOC) of PG's dump: its entries (tables, tables' data, indexes, constraints,
+...) with their sections and tables. TOC is built at backup time and is saved next to the
+backup (sidecar `<backup>.toc.json`), so selective / parallel restore doesn't scan the whole dump.
+Entries of plain dumps have byte ranges in the dump, entries of archives (custom / directory
+formats) have lines of pg_restore's TOC (for `pg_restore -L`).
+"""
+
+import re
+import json
+import fnmatch
+import logging
+import dataclasses
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from src import settings
+from src.constants import PG_CUSTOM_DUMP_MAGIC
+from src.process import call_with_logging
+from src.run import logger_ctx
+from src.utils import TOC_SUFFIX
+
+module_logger = logging.getLogger(__name__)
+
+PRE_DATA, DATA, POST_DATA = "pre-data", "data", "post-data"
+DATA_TYPES = frozenset({"TABLE DATA", "SEQUENCE SET", "BLOBS", "BLOB DATA", "LARGE OBJECT"})
+POST_DATA_TYPES = frozenset(
+    {
+        "INDEX",
+        "INDEX ATTACH",
+        "CONSTRAINT",
+        "CHECK CONSTRAINT",
+        "FK CONSTRAINT",
+        "TRIGGER",
+        "EVENT TRIGGER",
+        "RULE",
+        "POLICY",
+        "ROW SECURITY",
+        "STATISTICS",
+        "MATERIALIZED VIEW DATA",
+        "PUBLICATION TABLE",
+    }
+)
+# post-data entries which don't depend on each other (they are built concurrently)
+CONCURRENT_POST_DATA_TYPES = frozenset({"INDEX", "CONSTRAINT"})
+# entries which are tables themselves (entry's name is table's name)
+TABLE_TYPES = frozenset(
+    {"TABLE", "TABLE DATA", "VIEW", "MATERIALIZED VIEW", "MATERIALIZED VIEW DATA", "FOREIGN TABLE"}
+)
+# pg_restore -l: "<id>; <catalog oid> <oid> <type> <schema> <name> <owner>"
+ARCHIVE_LINE_PATTERN = re.compile(r"^(?P<id>\d+); \d+ \d+ (?P<rest>.+)$")
+ENTRY_HEADER_PATTERN = re.compile(
+    rb"^-- (?:Data for )?Name: (?P<name>.*); Type: (?P<type>[A-Z ]+); Schema: (?P<schema>[^;]*);"
+)
+# entries which belong to tables (their table is detected by the statement)
+TABLE_OBJECT_TYPES = POST_DATA_TYPES | {"DEFAULT", "SEQUENCE OWNED BY", "TABLE ATTACH"}
+# entries which describe other objects (ex.: "TABLE users", "COLUMN users.email")
+DESCRIPTION_TYPES = frozenset({"COMMENT", "ACL", "SECURITY LABEL"})
+NAME = r'(?:"(?:[^"]|"")+"|[\w$]+)'
+TABLE_PATTERNS = (
+    re.compile(rf"\bALTER TABLE (?:ONLY )?(?:{NAME}\.)?(?P<table>{NAME})"),
+    re.compile(rf"\bOWNED BY (?:{NAME}\.)?(?P<table>{NAME})\.{NAME}"),
+    re.compile(rf"\bAS\s+ON\s+\w+\s+TO\s+(?:ONLY )?(?:{NAME}\.)?(?P<table>{NAME})"),
+    re.compile(rf"\bON (?:ONLY )?(?:{NAME}\.)?(?P<table>{NAME})"),
+)
+MULTI_WORD_TYPES = sorted(
+    (
+        entry_type
+        for entry_type in {
+            *DATA_TYPES,
+            *TABLE_OBJECT_TYPES,
+            *TABLE_TYPES,
+            *DESCRIPTION_TYPES,
+            "DEFAULT ACL",
+        }
+        if " " in entry_type
+    ),
+    key=len,
+    reverse=True,
+)
+# statement's beginning which is enough for detecting entry's table
+MAX_BODY_SIZE = 4096
+
+
+@dataclasses.dataclass
+class TocEntry:
+    """Single object of the dump"""
+
+    type: str
+    schema: str
+    name: str
+    section: str
+    table: str | None = None
+    offset: int = 0
+    size: int = 0
+    line: str | None = None
+
+
+@dataclasses.dataclass
+class Toc:
+    """Entries of the dump (in dump's order)"""
+
+    format: str
+    entries: list[TocEntry] = dataclasses.field(default_factory=list)
+    # plain dumps: size of the header (session's settings) which each restore's session needs
+    preamble_size: int = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "Toc":
+        data = json.loads(Path(path).read_text())
+        data["entries"] = [TocEntry(**entry) for entry in data["entries"]]
+        return cls(**data)
+
+    def save(self, path: Path) -> Path:
+        Path(path).write_text(json.dumps(dataclasses.asdict(self)))
+        return path
+
+    def select(self, toc_filter: "TocFilter | None" = None) -> list[TocEntry]:
+        """Entries which should be restored (all of them for empty filter)"""
+        if not toc_filter:
+            return list(self.entries)
+
+        return [entry for entry in self.entries if toc_filter.matches(entry)]
+
+
+@dataclasses.dataclass
+class TocFilter:
+    """
+    Glob-like patterns of tables / schemas for selective restore. Table's pattern with a dot
+    is matched with the qualified name (ex.: 'public.users'), otherwise - with table's name.
+    Objects outside tables (schemas, types, functions, ...) are restored only when the filter
+    has exclusions only.
+    """
+
+    tables: list[str] = dataclasses.field(default_factory=list)
+    exclude_tables: list[str] = dataclasses.field(default_factory=list)
+    schemas: list[str] = dataclasses.field(default_factory=list)
+    exclude_schemas: list[str] = dataclasses.field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return any((self.tables, self.exclude_tables, self.schemas, self.exclude_schemas))
+
+    def matches(self, entry: TocEntry) -> bool:
+        if entry.type == "SCHEMA":
+            # schema itself is restored when its objects are requested
+            return not self.tables and self._matches_schema(entry.name)
+
+        if not self._matches_schema(entry.schema):
+            return False
+
+        if entry.table is None:
+            return not self.tables and not self.schemas
+
+        return (not self.tables or self._matches_table(entry, self.tables)) and not (
+            self._matches_table(entry, self.exclude_tables)
+        )
+
+    def _matches_schema(self, schema: str) -> bool:
+        if self.schemas and not _matches(schema, self.schemas):
+            return False
+
+        return not _matches(schema, self.exclude_schemas)
+
+    @staticmethod
+    def _matches_table(entry: TocEntry, patterns: list[str]) -> bool:
+        qualified_name = f"{entry.schema}.{entry.table}"
+        return any(
+            fnmatch.fnmatchcase(qualified_name if "." in pattern else entry.table, pattern)
+            for pattern in patterns
+        )
+
+
+def _matches(name: str, patterns: list[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def sidecar_path(backup_path: Path) -> Path:
+    """Path of the backup's TOC (next to the backup's file)"""
+    return backup_path.with_name(f"{backup_path.name}{TOC_SUFFIX}")
+
+
+def build_plain_toc(dump_path: Path) -> Toc:
+    """Builds TOC of plain SQL dump by pg_dump's comments (single pass through the file)"""
+    with open(dump_path, "rb") as file:
+        return parse_plain_toc(file)
+
+
+def parse_plain_toc(lines: Iterable[bytes]) -> Toc:
+    """Builds TOC of plain SQL dump by its lines (ex.: while the dump is compressed)"""
+    toc = Toc(format="plain")
+    toc.entries, toc.preamble_size = _parse_entries(lines, with_ranges=True)
+    return toc
+
+
+def build_archive_toc(dump_path: Path) -> Toc:
+    """
+    Builds TOC of pg_dump's archive (custom / directory format): entries are taken from
+    `pg_restore -l` (archive's TOC, data isn't read), their tables - from the schema's DDL
+    """
+    listing = call_with_logging([settings.PG_RESTORE_BIN, "-l", dump_path])
+    schema_sql = call_with_logging([settings.PG_RESTORE_BIN, "--schema-only", "-f", "-", dump_path])
+    ddl_entries, _ = _parse_entries(schema_sql.encode().splitlines(keepends=True))
+    tables = {(entry.type, entry.schema, entry.name): entry.table for entry in ddl_entries}
+
+    toc = Toc(format="archive")
+    section = PRE_DATA
+    for line in listing.splitlines():
+        if not (match := ARCHIVE_LINE_PATTERN.match(line)):
+            continue  # comments of the listing
+
+        entry_type, schema, name = _split_archive_line(match.group("rest"))
+        section = _get_section(entry_type, previous_section=section)
+        if entry_type in TABLE_TYPES:
+            table = name
+        else:
+            table = tables.get((entry_type, schema, name)) or _detect_table(entry_type, name, "")
+        toc.entries.append(
+            TocEntry(entry_type, schema, name, section=section, table=table, line=line)
+        )
+
+    _link_sequences(toc.entries)
+    return toc
+
+
+def load_or_build(dump_path: Path, toc_path: Path | None = None) -> Toc:
+    """Loads TOC from the sidecar (if it exists) or builds it by the dump itself"""
+    logger = logger_ctx.get(module_logger)
+    if toc_path and toc_path.exists():
+        try:
+            return Toc.load(toc_path)
+        except (OSError, ValueError, TypeError) as exc:
+            logger.warning("Couldn't load dump's TOC %s: %r", toc_path, exc)
+
+    logger.debug("Building TOC of the dump %s ...", dump_path)
+    if dump_path.is_dir() or _is_archive(dump_path):
+        return build_archive_toc(dump_path)
+
+    return build_plain_toc(dump_path)
+
+
+def _is_archive(dump_path: Path) -> bool:
+    with open(dump_path, "rb") as file:
+        return file.read(len(PG_CUSTOM_DUMP_MAGIC)) == PG_CUSTOM_DUMP_MAGIC
+
+
+def restore_phases(entries: list[TocEntry]) -> list[list[list[TocEntry]]]:
+    """
+    Splits entries of plain dump into restore's phases: each phase is a list of batches which
+    can be restored concurrently (each batch - in its own session, in dump's order):
+    pre-data -> tables' data -> indexes / constraints -> the rest of post-data (FKs, triggers...)
+
+    >>> entries = [
+    ...     TocEntry("TABLE", "public", "users", PRE_DATA, "users"),
+    ...     TocEntry("TABLE DATA", "public", "users", DATA, "users", size=10),
+    ...     TocEntry("TABLE DATA", "public", "logs", DATA, "logs", size=20),
+    ...     TocEntry("INDEX", "public", "users_idx", POST_DATA, "users"),
+    ...     TocEntry("FK CONSTRAINT", "public", "logs logs_fk", POST_DATA, "logs"),
+    ... ]
+    >>> [[[entry.name for entry in batch] for batch in phase] for phase in restore_phases(entries)]
+    [[['users']], [['logs'], ['users']], [['users_idx']], [['logs logs_fk']]]
+    """
+    data = sorted((entry for entry in entries if entry.section == DATA), key=lambda e: -e.size)
+    post_data = [entry for entry in entries if entry.section == POST_DATA]
+    phases = [
+        [[entry for entry in entries if entry.section == PRE_DATA]],
+        [[entry] for entry in data],
+        [[entry] for entry in post_data if entry.type in CONCURRENT_POST_DATA_TYPES],
+        [[entry for entry in post_data if entry.type not in CONCURRENT_POST_DATA_TYPES]],
+    ]
+    return [[batch for batch in phase if batch] for phase in phases if any(phase)]
+
+
+def iter_ranges(dump_path: Path, toc: Toc, entries: Iterable[TocEntry]) -> Iterator[bytes]:
+    """Reads dump's preamble and provided entries (plain dump's byte ranges)"""
+    with open(dump_path, "rb") as file:
+        for offset, size in [(0, toc.preamble_size), *((e.offset, e.size) for e in entries)]:
+            file.seek(offset)
+            while size > 0 and (chunk := file.read(min(size, settings.STREAM_CHUNK_SIZE))):
+                size -= len(chunk)
+                yield chunk
+
+
+def write_archive_list(entries: Iterable[TocEntry], path: Path) -> Path:
+    """Writes archive's entries as pg_restore's list (for `pg_restore -L`)"""
+    Path(path).write_text("".join(f"{entry.line}\n" for entry in entries))
+    return path
+
+
+def _parse_entries(lines: Iterable[bytes], with_ranges: bool = False) -> tuple[list[TocEntry], int]:
+    """
+    Parses pg_dump's plain SQL: each entry starts with the comment's header
+    (--\\n-- Name: ...; Type: ...; Schema: ...; Owner: ...\\n--)
+
+    :return: entries and size of the dump's preamble
+    """
+    entries: list[TocEntry] = []
+    body = bytearray()
+    section, offset, previous_line, preamble_size = PRE_DATA, 0, b"", 0
+    for line in lines:
+        if line.startswith(b"-- ") and (match := ENTRY_HEADER_PATTERN.match(line)):
+            # entry's range starts from the header's first line ("--")
+            start = offset - len(previous_line) if previous_line == b"--\n" else offset
+            if entries:
+                _finish_entry(entries[-1], body, end=start)
+            else:
+                preamble_size = start
+
+            entry_type = match.group("type").decode()
+            section = _get_section(entry_type, previous_section=section)
+            name = match.group("name").decode(errors="replace")
+            entries.append(
+                TocEntry(
+                    type=entry_type,
+                    schema=match.group("schema").decode(errors="replace"),
+                    name=name,
+                    section=section,
+                    table=name if entry_type in TABLE_TYPES else None,
+                    offset=start,
+                )
+            )
+            body.clear()
+
+        elif entries and entries[-1].type not in DATA_TYPES and len(body) < MAX_BODY_SIZE:
+            body += line
+
+        offset += len(line)
+        previous_line = line
+
+    if entries:
+        _finish_entry(entries[-1], body, end=offset)
+    else:
+        preamble_size = offset
+
+    if not with_ranges:
+        for entry in entries:
+            entry.offset = entry.size = 0
+
+    _link_sequences(entries)
+    return entries, preamble_size
+
+
+def _finish_entry(entry: TocEntry, body: bytes, end: int) -> None:
+    entry.size = end - entry.offset
+    if entry.table is None:
+        entry.table = _detect_table(entry.type, entry.name, body.decode(errors="replace"))
+
+
+def _detect_table(entry_type: str, name: str, statement: str) -> str | None:
+    if entry_type in DESCRIPTION_TYPES:
+        object_type, _, object_name = name.partition(" ")
+        if object_type == "TABLE":
+            return object_name
+
+        return object_name.rpartition(".")[0] or None if object_type == "COLUMN" else None
+
+    if entry_type in TABLE_OBJECT_TYPES:
+        for pattern in TABLE_PATTERNS:
+            if match := pattern.search(statement):
+                return _unquote(match.group("table"))
+
+    return None
+
+
+def _link_sequences(entries: list[TocEntry]) -> None:
+    """Sequences which are owned by tables' columns belong to these tables"""
+    owners = {
+        (entry.schema, entry.name): entry.table
+        for entry in entries
+        if entry.type == "SEQUENCE OWNED BY"
+    }
+    for entry in entries:
+        if entry.type in ("SEQUENCE", "SEQUENCE SET") and entry.table is None:
+            entry.table = owners.get((entry.schema, entry.name))
+
+
+def _get_section(entry_type: str, previous_section: str) -> str:
+    if entry_type in DATA_TYPES:
+        return DATA
+
+    if entry_type in POST_DATA_TYPES:
+        return POST_DATA
+
+    # comments / ACLs follow their objects (ACLs are at the end of the dump)
+    if entry_type in ("COMMENT", "ACL", "SECURITY LABEL") and previous_section == POST_DATA:
+        return POST_DATA
+
+    return PRE_DATA
+
+
+def _split_archive_line(rest: str) -> tuple[str, str, str]:
+    """'FK CONSTRAINT public orders orders_user_id_fkey postgres' -> type, schema, name"""
+    entry_type = next(
+        (known for known in MULTI_WORD_TYPES if rest.startswith(f"{known} ")), rest.split(" ")[0]
+    )
+    schema, _, name_with_owner = rest[len(entry_type) + 1 :].partition(" ")
+    name, _, _ = name_with_owner.rpartition(" ")
+    return entry_type, schema, name
+
+
+def _unquote(name: str) -> str:
+    if name.startswith('"') and name.endswith('"'):
+        return name[1:-1].replace('""', '"')
+
+    return name
@@ -3,121 +3,169 @@ Common utils for the backup/restore logic
 """
 
 import os
-import re
 import sys
+import time
+import errno
+import fcntl
+import fnmatch
 import shutil
 import logging
-import subprocess
+import contextvars
 import dataclasses
+from concurrent.futures import Executor, Future
 from datetime import datetime
 from enum import StrEnum
-from operator import itemgetter
 from pathlib import Path
-from typing import ClassVar, TypeVar, Type
+from types import ModuleType
+from typing import TYPE_CHECKING, Callable, ClassVar, Iterable, TypeVar, Type
 from urllib.parse import urljoin
 
-import boto3
 import click
 
-from src import settings
-from src.constants import ENV_VARS_REQUIRES
+from src import catalog, crypto, metrics, run, scratch, settings
+from src.constants import ENV_VARS_REQUIRES, BackupLocation
+from src.exceptions import BackupError, EncryptBackupError, RestoreBackupError
+from src.process import call_with_logging, replace_password_with_mask
 from src.run import logger_ctx
-from src.settings import DATE_FORMAT, TMP_BACKUP_DIR
+from src.settings import DATE_FORMAT
+
+if TYPE_CHECKING:
+    from src.integrity import Hasher
 
 module_logger = logging.getLogger(__name__)
 ENCRYPT_PASS = "env:ENCRYPT_PASS"
+PARTIAL_FILE_SUFFIX = ".part"
+# dump's TOC (see `src.toc`) which is stored next to the backup
+TOC_SUFFIX = ".toc.json"
+# manifest with checksum of the backup (see `src.integrity`)
+CHECKSUM_SUFFIX = ".checksum.json"
+# suffixes of auxiliary files which are stored (and removed) together with their backups
+SIDECAR_SUFFIXES: tuple[str, ...] = (TOC_SUFFIX, CHECKSUM_SUFFIX)
+# ioctl's request for reflink (copy-on-write clone of the whole file on btrfs / xfs / ...)
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+# errors of copying's methods which aren't supported for the files (the next method is tried)
+UNSUPPORTED_COPY_ERRORS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EPERM,
+    errno.EMLINK,
+)
+# chars of glob-like patterns in DB names (ex.: "prod_*")
+GLOB_CHARS = ("*", "?", "[")
 T = TypeVar("T")
 
 
-class BackupError(Exception):
-    """Simple exception for specifying backup's error"""
-
-    def __init__(self, message: str):
-        super().__init__()
-        self.message = message
-
-    def __str__(self):
-        return f"BackupError: {self.message}"
-
-    __repr__ = __str__
+def get_s3() -> ModuleType:
+    """
+    S3 transport (`src.s3`) which is imported on the first use: boto3's import takes a big part
+    of CLI's startup time (see `src.benchmarks.startup`), so commands and jobs which don't use S3
+    don't import it at all
+    """
+    from src import s3
 
+    return s3
 
-class EncryptBackupError(BackupError):
-    """Custom exception for detecting encryption errors"""
 
+def submit_in_context(executor: Executor, function: Callable[..., T], *args) -> "Future[T]":
+    """
+    Submits the function to the executor: the worker runs it in copy of current context
+    (logger_ctx's value, current job's scratch workspace and metrics are available there)
+    """
+    return executor.submit(contextvars.copy_context().run, function, *args)
 
-class RestoreBackupError(BackupError):
-    """Custom exception for restoring logic"""
 
+def s3_upload(db_name: str, backup_path: Path, metadata: dict[str, str] | None = None) -> str:
+    """
+    Allows to upload src_filename to S3 storage
 
-def s3_upload(db_name: str, backup_path: Path) -> None:
-    """Allows to upload src_filename to S3 storage"""
+    :param metadata: object's user metadata (ex.: backup's checksum)
+    :return: key of uploaded object
+    """
+    s3 = get_s3()
     logger = logger_ctx.get(module_logger)
-    check_env_variables(
-        "S3_STORAGE_URL",
-        "S3_ACCESS_KEY_ID",
-        "S3_SECRET_ACCESS_KEY",
-        "S3_REGION_NAME",
-    )
-    session = boto3.session.Session(
-        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
-        region_name=settings.S3_REGION_NAME,
-    )
-    s3 = session.client(service_name="s3", endpoint_url=settings.S3_STORAGE_URL)
-
-    dst_path = os.path.join(settings.S3_PATH, backup_path.name)
+    dst_path = s3.get_key(backup_path.name)
     try:
         logger.debug("Executing request (upload) to S3:\n %s\n %s", backup_path, dst_path)
-        s3.upload_file(Filename=backup_path, Bucket=settings.S3_BUCKET_NAME, Key=dst_path)
+        with metrics.stage("s3_upload", db_name, bytes_in=backup_path.stat().st_size):
+            s3.upload_file(db_name, backup_path, key=dst_path, metadata=metadata)
     except Exception as exc:  # pylint: disable=broad-exception-caught
         logger.exception("Couldn't upload result backup to s3")
         raise BackupError(f"Couldn't upload result backup to s3: {exc!r}") from exc
 
     result_url = urljoin(settings.S3_STORAGE_URL, os.path.join(settings.S3_BUCKET_NAME, dst_path))
     logger.info("[%s] backup uploaded to s3: %s", db_name, result_url)
+    return dst_path
+
+
+def is_sidecar(file_name: str) -> bool:
+    """Detects auxiliary file of the backup (ex.: dump's TOC)"""
+    return file_name.endswith(SIDECAR_SUFFIXES)
+
+
+def find_resumable_s3_upload(db_name: str, file_suffix: str) -> Path | None:
+    """
+    Finds local backup's file of the DB's interrupted S3 upload (it can be resumed instead of
+    making a new dump). Outdated uploads (older than S3_RESUME_MAX_AGE hours or without
+    the local file) are aborted.
+
+    :param file_suffix: expected suffix of backup's file name (compression / encryption)
+    """
+    s3 = get_s3()
+    logger = logger_ctx.get(module_logger)
+    for state in s3.pending_uploads(db_name):
+        file_path = Path(state.file_path)
+        if time.time() - state.created_at > settings.S3_RESUME_MAX_AGE * 3600 or not (
+            file_path.exists() and state.is_actual(file_path)
+        ):
+            logger.info("[%s] Aborting outdated S3 upload: %s", db_name, state.key)
+            s3.abort_upload(state)
+            continue
+
+        if file_path.name.endswith(file_suffix):
+            return file_path
+
+    return None
+
+
+def find_s3_backup_key(db_name: str, date: datetime.date) -> str:
+    """Finds key of the latest DB's backup (by provided date) in S3 bucket"""
+    s3 = get_s3()
+    if entry := catalog.find_backup(db_name, location=BackupLocation.S3, date=date):
+        return entry.path
+
+    # backup isn't in the catalog (ex.: it was created by the previous versions)
+    prefix = date.strftime("%Y-%m-%d")
+    return s3.find_latest_key(prefix=s3.get_key(prefix), contains=f".{db_name}.backup.")
 
 
 def s3_download(db_name: str, date: datetime.date) -> Path:
-    """Allows to fetch and download backup-file (by provided date) from S3 bucket"""
+    """
+    Allows to fetch and download backup-file (by provided date) from S3 bucket
+    (via the download cache if S3_CACHE_DIR is set)
+    """
+    s3 = get_s3()
+    from src import download_cache  # imports S3 transport (see `get_s3`)
+
     logger = logger_ctx.get(module_logger)
-    check_env_variables(
-        "S3_STORAGE_URL",
-        "S3_ACCESS_KEY_ID",
-        "S3_SECRET_ACCESS_KEY",
-        "S3_REGION_NAME",
-    )
-    session = boto3.session.Session(
-        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
-        region_name=settings.S3_REGION_NAME,
-    )
-    s3 = session.client(service_name="s3", endpoint_url=settings.S3_STORAGE_URL)
-    session.get_available_resources()
     try:
-        prefix = date.strftime("%Y-%m-%d")
-        list_objects = s3.list_objects_v2(
-            Bucket=settings.S3_BUCKET_NAME,
-            Prefix=f"{settings.S3_PATH}/{prefix}",
-        )
-        found_files = list_objects.get("Contents") or []
-        objects = sorted(found_files, key=itemgetter("Key"), reverse=True)
-        if not objects:
-            raise RestoreBackupError(f"No objects in S3 bucket for requested prefix {prefix}")
-
-        s3_file_name = objects[0]["Key"]
-        result_path = settings.TMP_BACKUP_DIR / s3_file_name.replace(f"{settings.S3_PATH}/", "")
+        s3_file_name = find_s3_backup_key(db_name, date)
+        result_path = scratch.current_dir() / os.path.basename(s3_file_name)
         logger.debug(
             "[%s] Executing request (download) from S3: %s -> %s",
             db_name,
             s3_file_name,
             result_path,
         )
-        s3.download_file(
-            Bucket=settings.S3_BUCKET_NAME,
-            Key=s3_file_name,
-            Filename=result_path,
-        )
+        with metrics.stage("s3_download", db_name) as stage:
+            if cache := download_cache.get_download_cache():
+                cache.fetch(db_name, key=s3_file_name, file_path=result_path)
+            else:
+                s3.download_file(db_name, key=s3_file_name, file_path=result_path)
+
+            stage.bytes_out = result_path.stat().st_size
 
     except Exception as exc:
         logger.exception("Couldn't download result backup from s3")
@@ -127,36 +175,74 @@ def s3_download(db_name: str, date: datetime.date) -> Path:
     return result_path
 
 
-def call_with_logging(command: str, password_prefix: str | None = None) -> str:
-    """
-    Call command, detect error and logging
-
-    :param command: command that need to be called
-    :param password_prefix: specified prefix for password replacing (ex.: PG_PASSWORD)
-    :return: True - not found errors. False - errors founded
-    :raise `BackupError`
-
-    """
-    command = command.strip()
-    logger = logger_ctx.get(module_logger)
-
-    logger.debug(
-        "Call command [%s] ... ", replace_password_with_mask(command, prefix=password_prefix)
+def s3_transfer_options(function):
+    """Adds CLI options for tuning of S3 transfers (multipart chunk size, concurrency, bandwidth)"""
+    options = [
+        click.option(
+            "--s3-chunk-size",
+            metavar="MB",
+            type=click.IntRange(min=5),
+            help="Part's size (in MB) for multipart S3 transfers (env: S3_MULTIPART_CHUNK_SIZE).",
+        ),
+        click.option(
+            "--s3-concurrency",
+            metavar="THREADS",
+            type=click.IntRange(min=1),
+            help="Count of concurrent S3 part's transfers (env: S3_MAX_CONCURRENCY).",
+        ),
+        click.option(
+            "--s3-max-bandwidth",
+            metavar="MB_PER_SEC",
+            type=click.FloatRange(min=0),
+            help="Bandwidth's cap (in MB/s) for S3 transfers (env: S3_MAX_BANDWIDTH).",
+        ),
+    ]
+    for option in reversed(options):
+        function = option(function)
+
+    return function
+
+
+def configure_s3_transfer(
+    s3_chunk_size: int | None = None,
+    s3_concurrency: int | None = None,
+    s3_max_bandwidth: float | None = None,
+) -> None:
+    """Applies CLI options (see `s3_transfer_options`) to S3 transfers"""
+    s3 = get_s3()
+    mb = 1024 * 1024
+    s3.configure(
+        chunk_size=s3_chunk_size * mb if s3_chunk_size else None,
+        max_concurrency=s3_concurrency,
+        max_bandwidth=int(s3_max_bandwidth * mb) if s3_max_bandwidth is not None else None,
     )
-    po = subprocess.Popen(command, shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
 
-    output = po.stderr.read() if po.stderr else b""
-    output += po.stdout.read() if po.stdout else b""
-    output = output.decode("utf-8")
-    output_lower = output.lower().strip()
 
-    if "error" in output_lower or "fail" in output_lower:
-        raise BackupError(output.removeprefix("Error: "))
+def is_pattern(name: str) -> bool:
+    """Detects glob-like pattern (ex.: 'prod_*') in the provided DB name"""
+    return any(char in name for char in GLOB_CHARS)
+
 
-    elif output:
-        logger.debug(output)
+def filter_names(
+    names: Iterable[str],
+    patterns: Iterable[str],
+    exclude: Iterable[str] = (),
+) -> list[str]:
+    """
+    Filters names by provided glob-like patterns (and excludes by exclude-patterns)
 
-    return output
+    >>> filter_names(["app", "app_test", "logs"], patterns=["app*"], exclude=["*_test"])
+    ['app']
+    >>> filter_names(["app", "logs"], patterns=["*"])
+    ['app', 'logs']
+    """
+    patterns, exclude = list(patterns), list(exclude)
+    return [
+        name
+        for name in names
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+        and not any(fnmatch.fnmatchcase(name, pattern) for pattern in exclude)
+    ]
 
 
 def get_filename(db_name: str, suffix: str = "") -> str:
@@ -195,33 +281,50 @@ def _check_encrypt_vars(function):
 
 
 @_check_encrypt_vars
-def encrypt_file(db_name: str, file_path: Path) -> Path:
-    """Encrypts file by provided path (with openssl)"""
+def encrypt_file(db_name: str, file_path: Path, hasher: "Hasher | None" = None) -> Path:
+    """
+    Encrypts file by provided path (in-process AES-GCM, see `src.crypto`)
+
+    :param hasher: calculates checksum of the encrypted file (while it is written)
+    """
     logger = logger_ctx.get(module_logger)
     encrypted_file_path = file_path.with_suffix(f"{file_path.suffix}.enc")
 
     logger.debug("[%s] encrypting file %s ...", db_name, encrypted_file_path)
-    encrypt_command = (
-        f"openssl enc -aes-256-cbc -e -pbkdf2 -pass {ENCRYPT_PASS} -in {file_path} "
-        f"> {encrypted_file_path}"
-    )
-    call_with_logging(command=encrypt_command)
-    call_with_logging(command=f"rm {file_path}")
+    with metrics.stage("encrypt", db_name, bytes_in=file_path.stat().st_size) as stage:
+        crypto.encrypt_path(file_path, encrypted_file_path, hasher=hasher)
+        stage.bytes_out = encrypted_file_path.stat().st_size
+
+    file_path.unlink()
     logger.info("[%s] encryption: backup file encrypted %s", db_name, encrypted_file_path)
     return encrypted_file_path
 
 
 @_check_encrypt_vars
-def decrypt_file(db_name: str, file_path: Path) -> Path:
-    """Decrypts file by provided path (with openssl)"""
+def decrypt_file(db_name: str, file_path: Path, directory: Path | None = None) -> Path:
+    """
+    Decrypts file by provided path (legacy backups are decrypted with openssl)
+
+    :param directory: directory of decrypted file (the encrypted file's one by default)
+    """
     logger = logger_ctx.get(module_logger)
-    decrypted_file_path = Path(str(file_path).removesuffix(".enc"))
+    decrypted_file_path = (directory or file_path.parent) / file_path.name.removesuffix(".enc")
     logger.debug("[%s] decrypting file %s ...", db_name, decrypted_file_path)
-    decrypt_command = (
-        f"openssl enc -aes-256-cbc -d -pbkdf2 -pass {ENCRYPT_PASS} -in {file_path} "
-        f"> {decrypted_file_path}"
-    )
-    call_with_logging(decrypt_command)
+    with open(file_path, "rb") as file:
+        header = file.read(len(crypto.MAGIC))
+
+    with metrics.stage("decrypt", db_name, bytes_in=file_path.stat().st_size) as stage:
+        if crypto.is_legacy_encrypted(header):
+            decrypt_command = [
+                *("openssl", "enc", "-aes-256-cbc", "-d", "-pbkdf2", "-pass", ENCRYPT_PASS),
+                *("-in", file_path, "-out", decrypted_file_path),
+            ]
+            call_with_logging(decrypt_command)
+        else:
+            crypto.decrypt_path(file_path, decrypted_file_path)
+
+        stage.bytes_out = decrypted_file_path.stat().st_size
+
     logger.info("[%s] decryption: backup file decrypted %s", db_name, decrypted_file_path)
     return decrypted_file_path
 
@@ -241,13 +344,15 @@ def check_env_variables(*env_variables, raise_exception: bool = True) -> list[st
     return missed_variables
 
 
-def copy_file(db_name: str, src: Path, dst: Path | str) -> None:
+def copy_file(db_name: str, src: Path, dst: Path | str, link: bool = False) -> Path:
     """
     Simple copying file from src -> dst
 
     :param db_name: current DB (needed for correct logging process)
     :param src: target path
     :param dst: destination path
+    :param link: result file can be a hard link to src (see `copy_file_data`)
+    :return: path to copied file
     """
     if not dst:
         raise BackupError("Couldn't copy backup: destination path cannot be empty")
@@ -261,16 +366,78 @@ def copy_file(db_name: str, src: Path, dst: Path | str) -> None:
     if not dest_dir.is_dir():
         raise BackupError(f"Couldn't copy backup to non-dir path: '{dest_dir}'")
 
+    result_file = dest_dir / src.name
+    part_file = dest_dir / f"{src.name}{PARTIAL_FILE_SUFFIX}"
     try:
-        call_with_logging(f"cp {src} {dest_dir}")
+        with metrics.stage("copy", db_name, bytes_in=metrics.path_size(src)) as stage:
+            stage.bytes_out = copy_file_data(src, part_file, link=link)
+            os.replace(part_file, result_file)
     except Exception as exc:
+        part_file.unlink(missing_ok=True)
         raise BackupError(f"Couldn't copy backup from {src} to '{dest_dir}': {exc!r}") from exc
 
-    result_file = dest_dir / src.name
-    if not result_file.exists():
-        raise BackupError(f"Backup file wasn't copied from: {src} to '{result_file}'")
-
     logger.info("[%s] backup copied to %s", db_name, result_file)
+    return result_file
+
+
+def copy_file_data(src: Path, dst: Path, link: bool = False) -> int:
+    """
+    Copies file's content without reading data to the user space: hard link (if it is allowed)
+    -> reflink (FICLONE) -> copy_file_range -> sendfile -> read / write. Links and reflinks
+    are made only when src and dst are placed on the same filesystem.
+
+    :param link: dst can be a hard link to src (src isn't changed: ex.: temporary backup's file)
+    :return: count of copied bytes
+    """
+    if link:
+        dst.unlink(missing_ok=True)
+        try:
+            os.link(src, dst)
+            return dst.stat().st_size
+        except OSError as exc:
+            if exc.errno not in UNSUPPORTED_COPY_ERRORS:
+                raise
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        for copy_range in (_reflink, _copy_file_range, _sendfile):
+            try:
+                return copy_range(src_file.fileno(), dst_file.fileno(), size)
+            except OSError as exc:
+                # copying isn't supported for these files: the next method is tried from scratch
+                if exc.errno not in UNSUPPORTED_COPY_ERRORS:
+                    raise
+
+            src_file.seek(0)
+            dst_file.seek(0)
+            dst_file.truncate(0)
+
+        shutil.copyfileobj(src_file, dst_file, length=settings.STREAM_CHUNK_SIZE)
+        return dst_file.tell()
+
+
+def _reflink(src_fd: int, dst_fd: int, size: int) -> int:
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    return size
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> int:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range isn't available")
+
+    offset = 0
+    while offset < size and (copied := os.copy_file_range(src_fd, dst_fd, size - offset)):
+        offset += copied
+
+    return offset
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> int:
+    offset = 0
+    while offset < size and (sent := os.sendfile(dst_fd, src_fd, offset, size - offset)):
+        offset += sent
+
+    return offset
 
 
 def remove_file(file_path: Path):
@@ -285,22 +452,28 @@ def remove_file(file_path: Path):
     """
     logger = logger_ctx.get(module_logger)
     try:
-        call_with_logging(f"rm {file_path}")
-    except IOError as exc:
+        Path(file_path).unlink()
+    except OSError as exc:
         logger.warning("Couldn't remove (and skip) file with path: %s: %r ", file_path, exc)
 
 
-def local_file_search_by_date(db_name: str, date: datetime.date, directory: Path) -> Path:
+def find_local_backup(db_name: str, date: datetime.date, directory: Path) -> Path:
     """
-    Finds the last backup file in the given directory
+    Finds the last DB's backup file (by provided date) in the given directory
     """
     logger = logger_ctx.get(module_logger)
     logger.debug("[%s] Finding last backup file in provided dir: %s", db_name, directory)
+    entry = catalog.find_backup(db_name, location=BackupLocation.LOCAL, date=date)
+    if entry and Path(entry.path).is_file():
+        logger.debug("[%s] Last backup found (by catalog): %s", db_name, entry.path)
+        return Path(entry.path)
+
     date = date.strftime(DATE_FORMAT)
 
     def validate_backup_file_name(file_name: str) -> bool:
-        if file_name.startswith(date):
-            return file_name.endswith("tar.gz") or file_name.endswith("tar.gz.enc")
+        if file_name.startswith(date) and f".{db_name}.backup." in file_name:
+            # backup's name: {date-time}.{db_name}.backup.{format}[.tar][.{codec}][.enc]
+            return not file_name.endswith(PARTIAL_FILE_SUFFIX) and not is_sidecar(file_name)
 
         return False
 
@@ -308,10 +481,8 @@ def local_file_search_by_date(db_name: str, date: datetime.date, directory: Path
     if not dir_files:
         raise RestoreBackupError(f"No backup files found for date {date} in {directory}")
 
-    found_file_path = Path(directory) / dir_files[0]
-    result_path = Path(shutil.copy(found_file_path, TMP_BACKUP_DIR))
-    logger.debug("[%s] Last backup found and copied to: %s", db_name, result_path)
-    return result_path
+    logger.debug("[%s] Last backup found: %s", db_name, dir_files[0])
+    return Path(directory) / dir_files[0]
 
 
 @dataclasses.dataclass
@@ -331,6 +502,10 @@ class LoggerContext:
         logging.CRITICAL: "red",
     }
 
+    def __post_init__(self):
+        # logging is configured by the first command's context (not at import time)
+        run.setup()
+
     def debug(self, msg, *args):
         """Debug message (skip if DEBUG is disbabled for run)"""
         self._log(msg, *args, level=logging.DEBUG)
@@ -423,34 +598,3 @@ def split_option_values(
         validate_envar_option(_, param, value)
 
     return split_values
-
-
-def replace_password_with_mask(command: str, prefix: str | None = None, mask: str = "*****") -> str:
-    """
-    Allows to find password in command and replace it with provided mask
-    :param command: source command which can contain password
-    :param prefix: prefix to search password in command
-    :param mask: mask to replace password in command
-
-    >>> replace_password_with_mask("PGPASSWORD=test-password psql ... ", prefix="PGPASSWORD=")
-    'PGPASSWORD=***** psql ...'
-    >>> replace_password_with_mask('PGPASSWORD="test-password" psql ... ', prefix="PGPASSWORD=")
-    'PGPASSWORD="*****" psql ...'
-    >>> replace_password_with_mask('PGPASSWORD=""test-password" psql ... ', prefix="PGPASSWORD=")
-    'PGPASSWORD=""*****" psql ...'
-    >>> replace_password_with_mask('mysqldump -u user -ptest-password ... ', prefix="-p")
-    'mysqldump -u user -p***** ... '
-    >>> replace_password_with_mask('mysqldump -u user -p"test-password" ... ', prefix="-p")
-    'mysqldump -u user -p"*****" ... '
-
-    skip masking (no prefix provided):
-    >>> replace_password_with_mask('mysqldump -u user -p"test-password" ... ')
-    'mysqldump -u user -p"test-password" ... '
-
-    """
-    if prefix:
-        pattern = rf'({prefix}"*)(.*?)(")'  # searches string by prefix
-        if re.search(pattern, command):
-            return re.sub(pattern, rf"\1{mask}\3", command)
-
-    return command